@@ -12,16 +12,19 @@ Responsabilites :
    - Gestion des utilisateurs (superadmin)
 3. Gestion de l'authentification et des sessions
 4. Protection contre la mise en cache des reponses
+5. Journalisation structurée (identifiant de requête X-Request-ID)
 
 Structure des routes :
 - / : Page d'accueil du chatbot
-- /start, /message, /regen : Endpoints API du chatbot
+- /start, /message, /regen, /edit, /cancel : Endpoints API du chatbot
+- /bulk : Génération en masse (publipostage)
+- /metrics : Mesures des générations (format Prometheus)
 - /admin/* : Interface d'administration
 - /login, /logout : Gestion de session
 """
 
 import os
-from flask import Flask, session
+from flask import Flask, session, request
 import logic  # Module principal contenant toute la logique metier
 from logic.database import init_app  # Gestionnaire de la base de donnees SQLite
 
@@ -36,11 +39,26 @@ from logic.database import init_app  # Gestionnaire de la base de donnees SQLite
 app = Flask(__name__)
 app.secret_key = logic.SECRET_KEY  # Clé de sécurité pour chiffrer les sessions
 app.config["SESSION_PERMANENT"] = False  # Sessions temporaires pour plus de sécurité
+# Fichiers statiques conservés par le navigateur (voir logic/http_cache.py)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = logic.shared.STATIC_MAX_AGE or None
+
+# Journalisation structurée et non bloquante du module logic (voir logic/log.py)
+logic.configure_logging()
 
 # Initialisation de la base de données SQLite
 # Crée les tables si elles n'existent pas et configure la connexion
 init_app(app)
 
+# Fichiers CSS / JS regroupés et minifiés par page (voir build_assets.py)
+logic.init_assets(app)
+
+# Précharge le modèle sur les serveurs Ollama (thread de fond)
+# Évite que la première génération subisse le chargement du modèle
+logic.start_warmup()
+
+# Avertit si GUNICORN_WORKERS dépasse les créneaux de génération configurés
+logic.check_capacity()
+
 # Injecte les données de session dans tous les templates
 # Permet d'accéder à session.admin_username, session.admin_role, etc.
 # Utile pour l'affichage conditionnel des éléments selon le rôle de l'utilisateur
@@ -77,6 +95,7 @@ def message():
     """
     Traite un message de l'utilisateur.
     Reçoit les données du formulaire, les traite et retourne la réponse du bot.
+    À l'étape de génération, la réponse peut être diffusée en NDJSON (streaming).
     """
     return logic.handle_message()
 
@@ -85,14 +104,42 @@ def regenerate():
     """
     Régénère la dernière réponse.
     Permet à l'utilisateur de demander une nouvelle version de la dernière réponse du bot.
+    La réponse peut être diffusée en NDJSON (streaming).
     """
     return logic.regenerate()
 
+@app.route("/edit", methods=["POST"])
+def edit():
+    """
+    Retouche le dernier document ("plus court", "plus formel"...).
+    Le contexte déjà évalué par Ollama est repris : seule la consigne est évaluée.
+    La réponse peut être diffusée en NDJSON (streaming).
+    """
+    return logic.edit_document()
+
+@app.route("/cancel", methods=["POST"])
+def cancel():
+    """
+    Annule la génération en cours de la conversation (bouton "Arrêter"),
+    ou le lot de génération en masse désigné par batch_id.
+    Le flux vers Ollama est fermé et le texte partiel enregistré.
+    """
+    return logic.cancel_generation()
+
+@app.route("/bulk", methods=["POST"])
+def bulk():
+    """
+    Génère un type d'e-mail pour chaque destinataire d'une liste (JSON ou CSV).
+    Les résultats sont diffusés au fil de l'eau en NDJSON, CSV ou ZIP.
+    """
+    return logic.bulk_generate()
+
 @app.route("/types", methods=["GET"])
 def get_types():
     """
     Retourne la liste des types d'emails disponibles.
     Utilisé pour mettre à jour dynamiquement les options du formulaire.
+    Revalidé par ETag (version de la configuration des prompts).
     """
     return logic.get_types()
 
@@ -112,62 +159,94 @@ def admin_prompts():
     """
     return logic.admin_prompts_page()
 
-# Gestion des types d'emails
-@app.route("/admin/type/add", methods=["POST"])
+# Édition des types, champs, prompts et options (modifications groupées)
+@app.route("/admin/prompts", methods=["PATCH"])
 @logic.admin_required
-def admin_add_type():
+def admin_patch_prompts():
     """
-    Ajoute un nouveau type d'email.
-    Reçoit les données du formulaire et crée un nouveau type dans la base de données.
+    Applique les modifications en attente de l'éditeur en une seule version.
+    Corps : opérations de type JSON Patch ; If-Match : ETag de la version éditée
+    (412 si un autre administrateur a enregistré entre-temps).
     """
-    return logic.add_email_type()
+    return logic.patch_prompts()
 
-@app.route("/admin/type/delete", methods=["POST"])
+@app.route("/admin/save", methods=["POST"])
 @logic.admin_required
-def admin_delete_type():
+def save_prompts():
     """
-    Supprime un type d'email existant.
-    Vérifie les dépendances avant la suppression pour éviter les erreurs.
+    Sauvegarde les modifications des prompts (accessible aux admins).
+    Persiste les changements dans la base de données.
     """
-    return logic.delete_email_type()
+    return logic.save_prompts()
 
-# Gestion des champs de formulaire
-@app.route("/admin/field/add", methods=["POST"])
+@app.route("/admin/prompts/export", methods=["GET"])
 @logic.admin_required
-def admin_add_field():
+def admin_export_prompts():
     """
-    Ajoute un nouveau champ à un type d'email.
-    Configure les propriétés du champ (label, type, options, etc.).
+    Télécharge la configuration des prompts en vigueur au format prompts.json.
+    L'import passe par /admin/save.
     """
-    return logic.add_form_field()
+    return logic.download_prompts()
 
-@app.route("/admin/field/delete", methods=["POST"])
+# Supervision des serveurs Ollama
+@app.route("/admin/backends", methods=["GET"])
 @logic.admin_required
-def admin_delete_field():
+def admin_backends():
     """
-    Supprime un champ d'un type d'email.
-    Met à jour la structure du formulaire associé.
+    Retourne l'état des serveurs Ollama (JSON).
+    Requêtes en cours, santé et disponibilité du modèle pour chaque serveur.
     """
-    return logic.delete_form_field()
+    return logic.backends_status()
 
-# Gestion des prompts
-@app.route("/admin/prompt/update", methods=["POST"])
+# Statistiques du cache des générations
+@app.route("/admin/cache", methods=["GET"])
 @logic.admin_required
-def admin_update_prompt():
+def admin_cache():
     """
-    Met à jour le prompt d'un type d'email.
-    Modifie le template utilisé pour générer les réponses.
+    Retourne les compteurs du cache des générations (JSON).
+    Succès, échecs, évictions et invalidations pour ce worker.
     """
-    return logic.update_prompt()
+    return logic.cache_status()
 
-@app.route("/admin/save", methods=["POST"])
+# Mesures de latence des générations
+@app.route("/admin/metrics", methods=["GET"])
 @logic.admin_required
-def save_prompts():
+def admin_metrics():
     """
-    Sauvegarde les modifications des prompts (accessible aux admins).
-    Persiste les changements dans la base de données.
+    Retourne les percentiles de latence (p50/p95/p99) par type d'email et
+    par modèle (JSON), agrégés sur tous les workers.
     """
-    return logic.save_prompts()
+    return logic.metrics_status()
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Export Prometheus des compteurs et histogrammes des générations
+    (tous workers confondus). Réservé à METRICS_TOKEN et aux administrateurs.
+    """
+    return logic.prometheus_metrics()
+
+# Chargement du modèle sur les serveurs Ollama
+@app.route("/admin/model", methods=["GET"])
+@logic.admin_required
+def admin_model():
+    """
+    Retourne l'état du modèle (JSON) : chargé en mémoire ou non sur chaque
+    serveur, expiration et chargements à froid observés.
+    """
+    return logic.model_status()
+
+@app.route("/admin/model/preload", methods=["POST"])
+@logic.admin_required
+def admin_model_preload():
+    """Précharge le modèle sur tous les serveurs Ollama."""
+    return logic.preload_model()
+
+@app.route("/admin/model/unload", methods=["POST"])
+@logic.admin_required
+def admin_model_unload():
+    """Décharge le modèle de tous les serveurs Ollama."""
+    return logic.unload_model()
 
 # Gestion des comptes utilisateurs (superadmin uniquement)
 @app.route("/admin/users", methods=["GET"])
@@ -242,18 +321,42 @@ def logout():
     """
     return logic.logout()
 
+@app.before_request
+def bind_log_context():
+    """
+    Associe aux journaux de la requête son identifiant (en-tête X-Request-ID
+    du proxy, ou généré) et l'utilisateur connecté.
+    """
+    logic.bind_request(request.headers.get("X-Request-ID"),
+                       session.get("user_id") or session.get("admin_username"))
+
+@app.before_request
+def sync_prompts():
+    """
+    Installe la dernière version de la configuration des prompts si un
+    administrateur l'a modifiée (une requête SQL ; voir logic/prompt_store.py).
+    Inutile pour les fichiers statiques.
+    """
+    if request.endpoint != "static":
+        logic.sync_prompts()
+
 @app.after_request
 def add_header(response):
     """
-    Ajoute des en-têtes HTTP pour empêcher la mise en cache des réponses.
+    Ajoute des en-têtes HTTP pour empêcher la mise en cache des réponses,
+    sauf celles qui ont leur propre politique (voir logic/http_cache.py) :
+    fichiers statiques et /types (ETag, 304).
     Important pour :
     - La sécurité : empêche l'accès aux données sensibles en cache
     - La cohérence : garantit que les données sont toujours à jour
     - L'expérience utilisateur : évite les problèmes de données périmées
     """
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, private"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
+    if request.endpoint == "static":
+        logic.apply_static_policy(response, request.view_args.get("filename"))
+    logic.apply_default_policy(response)
+    request_id = logic.current_request_id()
+    if request_id:
+        response.headers["X-Request-ID"] = request_id
     return response
 
 # --------------------------------------------------------------------------------
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+asgi.py
+--------------------------------------------------------------------------------
+Point d'entrée ASGI : mode de service asynchrone de l'application.
+
+Les routes de génération (/start, /message, /regen) sont servies en asyncio
+par logic.chat_async : une génération en cours n'occupe aucun thread, un seul
+processus peut donc suivre des centaines de générations simultanées.
+Les autres routes (pages, administration, fichiers statiques) sont servies
+par l'application Flask habituelle via un adaptateur WSGI.
+
+Démarrage :
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+ou avec Gunicorn :
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+"""
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+from logic.chat_async import AsyncChatApp
+
+application = AsyncChatApp(app, fallback=WsgiToAsgi(app))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+async_concurrency.py
+--------------------------------------------------------------------------------
+Test de charge : générations simultanées en mode synchrone (Gunicorn, workers
+sync) et en mode asynchrone (Uvicorn, asgi.py), contre un faux Ollama local.
+
+Chaque utilisateur simulé parcourt le flux complet avec sa propre session :
+/start → /message (type) → /message (dest, obj) → /message (détails).
+Seule la dernière étape (génération) est chronométrée.
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/async_concurrency.py --concurrency 10 50 200 --sync-workers 4
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import FakeOllama  # noqa: E402
+
+DETAILS = {"service_demande": "Site web", "budget_estime": "5000 €", "delai_souhaite": "3 mois"}
+
+# --------------------------------------------------------------------------------
+# SERVEURS
+# --------------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, ollama_url, sync_workers):
+    """Démarre l'application dans un sous-processus et attend qu'elle réponde."""
+    env = dict(os.environ, OLLAMA_URL=ollama_url)
+    if mode == "sync":
+        # Créneaux d'admission répartis entre les workers (voir admission.py)
+        env["GUNICORN_WORKERS"] = str(sync_workers)
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(sync_workers), "-b", f"127.0.0.1:{port}",
+               "--timeout", "120", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port),
+               "--log-level", "warning", "--backlog", "4096"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return proc
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"Le serveur {mode} n'a pas démarré")
+
+# --------------------------------------------------------------------------------
+# UTILISATEURS SIMULÉS
+# --------------------------------------------------------------------------------
+
+def conversation(base_url):
+    """Parcourt le flux complet et retourne la durée de la génération (s)."""
+    http = requests.Session()
+    http.get(f"{base_url}/start", timeout=300).raise_for_status()
+    http.post(f"{base_url}/message", json={"type": "Devis"}, timeout=300).raise_for_status()
+    http.post(f"{base_url}/message", json={"dest": "Client", "obj": "Devis"}, timeout=300).raise_for_status()
+
+    start = time.perf_counter()
+    response = http.post(f"{base_url}/message", json={"details": DETAILS}, timeout=300)
+    response.raise_for_status()
+    if "error" in response.json():
+        raise RuntimeError(response.json()["error"])
+    return time.perf_counter() - start
+
+def run_level(base_url, concurrency):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(conversation, base_url) for _ in range(concurrency)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "completed": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "generations_per_sec": round(len(latencies) / wall, 2),
+        "p50_s": round(statistics.median(latencies), 2) if latencies else None,
+        "p95_s": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 2) if latencies else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--sync-workers", type=int, default=4)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    parser.add_argument("--json", help="écrit les résultats dans ce fichier")
+    args = parser.parse_args()
+
+    ollama = FakeOllama(ttft=args.ttft, tokens=args.tokens, tokens_per_sec=args.tokens_per_sec).start()
+    results = []
+    try:
+        for mode in args.modes:
+            port = free_port()
+            proc = start_server(mode, port, ollama.url, args.sync_workers)
+            try:
+                for level in args.concurrency:
+                    row = dict(mode=mode, **run_level(f"http://127.0.0.1:{port}", level))
+                    results.append(row)
+                    print(f"{mode:<5} concurrence {row['concurrency']:>4} | {row['completed']:>4} ok "
+                          f"{row['errors']:>3} err | {row['generations_per_sec']:>7.2f} gen/s | "
+                          f"p50 {row['p50_s']} s | p95 {row['p95_s']} s")
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        ollama.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+fake_ollama.py
+--------------------------------------------------------------------------------
+Faux serveur Ollama pour les mesures de performance, sans modèle réel.
+
+Endpoints simulés :
+- POST /api/chat : flux NDJSON de tokens factices (même format qu'Ollama)
+- POST /api/embed : vecteurs factices (sac de mots haché, même format qu'Ollama)
+- POST /api/generate sans prompt : chargement / déchargement (keep_alive = 0)
+- GET /api/tags : liste des modèles installés
+- GET /api/ps : liste des modèles chargés en mémoire
+
+Paramètres :
+- ttft : délai avant le premier token (secondes)
+- tokens : nombre de tokens générés par réponse
+- tokens_per_sec : débit de génération (0 = aussi vite que possible)
+- load_time : durée du chargement d'un modèle non résident (secondes)
+- prompt_eval_rate : coût d'évaluation d'un token du prompt (secondes) ;
+  comme Ollama, le serveur garde la dernière séquence (cache KV) et
+  n'évalue que ce qui suit le plus long préfixe commun
+- parallel : générations simultanées (comme OLLAMA_NUM_PARALLEL) ; les
+  suivantes attendent leur tour, attente comprise dans leur TTFT
+  (0 = illimité)
+
+Injection de pannes (modifiables à chaud via server.httpd.config) :
+- error_rate : fraction des générations en erreur HTTP 500
+- slow_rate, slow_ttft : fraction des générations dont le premier token
+  est retardé de slow_ttft secondes (traînards)
+- stall_rate, stall_time : fraction des générations qui s'interrompent
+  stall_time secondes au milieu du flux (blocage après le premier token)
+- down : connexion fermée sans réponse, comme un Ollama en redémarrage
+- hang : requête acceptée mais aucune réponse tant que hang est vrai
+  (serveur bloqué : seul le délai du client y met fin)
+
+Utilisation :
+    python bench/fake_ollama.py --port 11434 --ttft 0.2 --tokens-per-sec 40 --parallel 4
+ou en interne :
+    server = FakeOllama(ttft=0, slow_rate=0.05, slow_ttft=2).start()
+    server.httpd.config["down"] = True   # panne
+    ...
+    server.stop()
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --------------------------------------------------------------------------------
+# EMBEDDINGS FACTICES
+# --------------------------------------------------------------------------------
+
+EMBED_DIM = 256
+
+def fake_embedding(text: str) -> list:
+    """
+    Sac de mots haché : deux textes partageant les mêmes mots (à la casse et
+    aux espaces près) ont des vecteurs proches, comme avec un vrai modèle.
+    """
+    vector = [0.0] * EMBED_DIM
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % EMBED_DIM] += 1.0
+    return vector
+
+# --------------------------------------------------------------------------------
+# GESTIONNAIRE HTTP
+# --------------------------------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    """Répond comme Ollama, en HTTP/1.1 avec keep-alive et encodage chunked."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Comme le serveur Go d'Ollama : pas d'algorithme de Nagle
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _load(self, model):
+        """Simule le chargement d'un modèle non résident ; retourne sa durée."""
+        if model in self.server.loaded:
+            return 0.0
+        time.sleep(self.server.config["load_time"])
+        self.server.loaded.add(model)
+        return self.server.config["load_time"]
+
+    def _drop(self):
+        """Serveur en panne : la connexion est fermée sans réponse."""
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def do_GET(self):
+        config = self.server.config
+        if config["down"]:
+            self._drop()
+            return
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": name} for name in config["models"]]})
+        elif self.path == "/api/ps":
+            self._send_json(200, {"models": [
+                {"name": name, "model": name, "expires_at": "2099-01-01T00:00:00Z"}
+                for name in sorted(self.server.loaded)
+            ]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        while config["hang"] and not config["down"]:
+            time.sleep(0.05)
+        if config["down"]:
+            self._drop()
+            return
+
+        if self.path == "/api/embed":
+            inputs = request.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send_json(200, {
+                "model": request.get("model"),
+                "embeddings": [fake_embedding(text) for text in inputs]
+            })
+            return
+
+        if self.path == "/api/generate" and not request.get("prompt"):
+            model = request.get("model")
+            if request.get("keep_alive") == 0:
+                self.server.loaded.discard(model)
+                reason = "unload"
+            else:
+                self._load(model)
+                reason = "load"
+            self._send_json(200, {"model": model, "response": "", "done": True, "done_reason": reason})
+            return
+
+        if self.path != "/api/chat":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        with self.server.random_lock:
+            failing = self.server.random.random() < config["error_rate"]
+            slow = self.server.random.random() < config["slow_rate"]
+            stall = self.server.random.random() < config["stall_rate"]
+        if failing:
+            self._send_json(500, {"error": "panne simulée"})
+            return
+
+        started = time.perf_counter()
+        slots = self.server.slots
+        if slots is None:
+            self._chat(request, started, slow, stall)
+            return
+        # Comme Ollama : au-delà de parallel, les requêtes attendent un créneau
+        with slots:
+            self._chat(request, started, slow, stall)
+
+    def _chat(self, request, started, slow, stall):
+        """Génère la réponse en flux (créneau de génération déjà obtenu)."""
+        config = self.server.config
+        load_duration = self._load(request.get("model"))
+
+        # Cache KV : seuls les mots qui suivent le préfixe déjà évalué sont évalués
+        words = [word for message in request.get("messages") or []
+                 for word in str(message.get("content", "")).split()]
+        with self.server.kv_lock:
+            cached = self.server.kv
+        prefix = 0
+        while prefix < min(len(words), len(cached)) and words[prefix] == cached[prefix]:
+            prefix += 1
+        evaluated = max(1, len(words) - prefix)
+        prompt_eval = config["ttft"] + evaluated * config["prompt_eval_rate"]
+        if slow:
+            prompt_eval += config["slow_ttft"]
+        time.sleep(prompt_eval)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        delay = 1.0 / config["tokens_per_sec"] if config["tokens_per_sec"] else 0
+        # num_predict plafonne la longueur de la réponse, comme avec Ollama
+        tokens = config["tokens"]
+        num_predict = (request.get("options") or {}).get("num_predict")
+        if num_predict and num_predict > 0:
+            tokens = min(tokens, num_predict)
+        answer = []
+        try:
+            for i in range(tokens):
+                if stall and i == max(1, tokens // 2):
+                    time.sleep(config["stall_time"])
+                self._write_chunk({
+                    "model": request.get("model"),
+                    "message": {"role": "assistant", "content": f"mot{i} "},
+                    "done": False
+                })
+                answer.append(f"mot{i}")
+                if delay:
+                    time.sleep(delay)
+
+            total_ns = int((time.perf_counter() - started) * 1e9)
+            self._write_chunk({
+                "model": request.get("model"),
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "total_duration": total_ns,
+                "load_duration": int(load_duration * 1e9),
+                "prompt_eval_count": evaluated,
+                "prompt_eval_duration": int(prompt_eval * 1e9),
+                "eval_count": tokens,
+                "eval_duration": int(tokens * delay * 1e9)
+            })
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            with self.server.kv_lock:
+                self.server.kv = words + answer
+        except (BrokenPipeError, ConnectionResetError):
+            # Le client a fermé le flux (annulation, délai dépassé)
+            self.close_connection = True
+
+# --------------------------------------------------------------------------------
+# SERVEUR
+# --------------------------------------------------------------------------------
+
+class FakeOllama:
+    """Serveur Ollama factice démarré dans un thread du processus courant."""
+
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.0, tokens=20,
+                 tokens_per_sec=0.0, models=("qwen2.5:0.5b",), load_time=0.0,
+                 prompt_eval_rate=0.0, error_rate=0.0, slow_rate=0.0, slow_ttft=0.0,
+                 stall_rate=0.0, stall_time=0.0, parallel=0, seed=None):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = {
+            "ttft": ttft,
+            "tokens": tokens,
+            "tokens_per_sec": tokens_per_sec,
+            "models": list(models),
+            "load_time": load_time,
+            "prompt_eval_rate": prompt_eval_rate,
+            "error_rate": error_rate,
+            "slow_rate": slow_rate,
+            "slow_ttft": slow_ttft,
+            "stall_rate": stall_rate,
+            "stall_time": stall_time,
+            "down": False,
+            "hang": False
+        }
+        self.httpd.random = random.Random(seed)
+        self.httpd.random_lock = threading.Lock()
+        self.httpd.slots = threading.BoundedSemaphore(parallel) if parallel else None
+        # Dernière séquence évaluée (un seul emplacement, comme OLLAMA_NUM_PARALLEL=1)
+        self.httpd.kv = []
+        self.httpd.kv_lock = threading.Lock()
+        # Sans délai de chargement, les modèles sont résidents d'emblée
+        self.httpd.loaded = set() if load_time else set(models)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur Ollama")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft", type=float, default=0.0, help="délai avant le premier token (s)")
+    parser.add_argument("--tokens", type=int, default=20, help="tokens par réponse")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="débit (0 = illimité)")
+    parser.add_argument("--model", action="append", help="modèle annoncé par /api/tags")
+    parser.add_argument("--load-time", type=float, default=0.0, help="durée de chargement du modèle (s)")
+    parser.add_argument("--prompt-eval-rate", type=float, default=0.0,
+                        help="coût d'évaluation d'un token du prompt (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction de réponses 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction de premiers tokens retardés")
+    parser.add_argument("--slow-ttft", type=float, default=0.0, help="retard de ces premiers tokens (s)")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction de flux interrompus")
+    parser.add_argument("--stall-time", type=float, default=0.0, help="durée de ces interruptions (s)")
+    parser.add_argument("--parallel", type=int, default=0,
+                        help="générations simultanées (0 = illimité)")
+    args = parser.parse_args()
+
+    server = FakeOllama(
+        host=args.host, port=args.port, ttft=args.ttft, tokens=args.tokens,
+        tokens_per_sec=args.tokens_per_sec, models=args.model or ("qwen2.5:0.5b",),
+        load_time=args.load_time, prompt_eval_rate=args.prompt_eval_rate,
+        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_ttft=args.slow_ttft,
+        stall_rate=args.stall_rate, stall_time=args.stall_time, parallel=args.parallel
+    )
+    print(f"Faux Ollama en écoute sur {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+kv_context_reuse.py
+--------------------------------------------------------------------------------
+Mesure le temps d'évaluation du prompt économisé par la reprise du contexte
+(voir logic/kv_context.py) sur les régénérations et les retouches.
+
+Scénario, contre plusieurs faux Ollama qui simulent le cache KV d'Ollama
+(seul ce qui suit le plus long préfixe commun est évalué) :
+- une génération initiale par conversation
+- puis des régénérations et des retouches ("plus court"...)
+
+Compare :
+- avant : KV_CONTEXT_REUSE=0 (serveur quelconque, contexte complet réévalué)
+- après : KV_CONTEXT_REUSE=1 (retour au serveur qui détient le contexte)
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/kv_context_reuse.py --conversations 20 --backends 2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logic.shared as shared  # noqa: E402
+from logic.ollama_client import ollama_chat  # noqa: E402
+from logic.kv_context import KvContextStore  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+
+PROMPT = "Rédige un e-mail professionnel à {dest} au sujet de {obj}. " + "Contexte détaillé. " * 150
+EDIT = "Raccourcis cet e-mail en conservant les informations essentielles. Réponds uniquement avec le nouvel e-mail."
+
+def run(reuse, conversations, regenerations):
+    """
+    Joue le scénario et retourne les durées d'évaluation du prompt (secondes)
+    des régénérations et retouches, avec les totaux du store.
+    """
+    shared.KV_CONTEXT_REUSE = reuse
+    store = KvContextStore()
+    durations = []
+    prompts = [PROMPT.format(dest=f"client{i}", obj=f"dossier {i}") for i in range(conversations)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for key, prompt in enumerate(prompts):
+            # Messages qui suivent le prompt : document courant, retouches
+            messages = []
+            for round_ in range(regenerations + 1):
+                # Tours pairs : retouche du document, tours impairs : régénération
+                history = messages + [{"role": "user", "content": EDIT}] if round_ and round_ % 2 == 0 else []
+                kv = store.request(key, prompt, history)
+                content = ollama_chat(prompt, {}, kv)
+                kv.commit(content)
+                messages = history + [{"role": "assistant", "content": content}]
+                if round_:
+                    durations.append(kv.stats["prompt_eval_duration"])
+    return durations, store.snapshot()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--regenerations", type=int, default=4, help="régénérations et retouches par conversation")
+    parser.add_argument("--backends", type=int, default=2)
+    parser.add_argument("--prompt-eval-rate", type=float, default=0.0005, help="coût d'un token du prompt (s)")
+    parser.add_argument("--json", help="écrit les résultats dans ce fichier")
+    args = parser.parse_args()
+
+    servers = [FakeOllama(tokens=20, prompt_eval_rate=args.prompt_eval_rate).start()
+               for _ in range(args.backends)]
+    shared.OLLAMA_URL = ",".join(server.url for server in servers)
+    results = []
+    try:
+        for name, reuse in (("avant (contexte réévalué)", False), ("après (contexte repris)", True)):
+            durations, snapshot = run(reuse, args.conversations, args.regenerations)
+            results.append({
+                "variant": name,
+                "requests": len(durations),
+                "prompt_eval_mean_ms": round(statistics.mean(durations) * 1000, 3),
+                "prompt_eval_total_s": round(sum(durations), 3),
+                "store": snapshot
+            })
+    finally:
+        for server in servers:
+            server.stop()
+
+    for r in results:
+        print(f"{r['variant']:<28} évaluation du prompt : moyenne {r['prompt_eval_mean_ms']:>8.3f} ms | "
+              f"total {r['prompt_eval_total_s']:>7.3f} s | reprises {r['store']['reuses']} | "
+              f"économisé (estimé) {r['store']['saved_seconds']:.3f} s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+load_test.py
+--------------------------------------------------------------------------------
+Test de charge de bout en bout : des utilisateurs simulés parcourent le vrai
+flux du chatbot, chacun avec sa propre session (cookie), contre un faux
+Ollama local (voir fake_ollama.py) ou un Ollama existant (--ollama-url).
+
+Parcours d'un utilisateur, répété jusqu'à la fin de l'essai :
+    /start → /message (type) → /message (dest, obj) → /message (détails) → /regen
+
+Chaque étape est chronométrée séparément. Les détails portent un numéro de
+conversation : aucune génération n'est servie par le cache des réponses.
+Avec --stream, les générations sont lues en flux NDJSON et le temps jusqu'au
+premier token est aussi mesuré.
+
+Une étape est en erreur si la requête échoue (connexion, délai), si le statut
+HTTP est >= 400 (dont 429 / 503 du contrôle d'admission) ou si la réponse
+contient un champ "error".
+
+Rapport JSON (--json, par défaut bench/results/load_test-<commit>.json) :
+    meta : commit, date, paramètres de l'essai
+    summary : conversations / générations par seconde, taux d'erreur global
+    steps : par étape, nombre, erreurs, taux d'erreur, moyenne, p50, p90, p95,
+            p99 et max (secondes), erreurs par cause
+--compare ANCIEN.json affiche l'écart avec un rapport précédent.
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/load_test.py --mode async --users 50 --duration 60 \\
+        --ttft 0.2 --tokens-per-sec 40 --parallel 4 --error-rate 0.01
+    python bench/load_test.py --url http://127.0.0.1:5000 --users 20 --compare ancien.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_concurrency import free_port, start_server  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+
+STEPS = ("start", "type", "info", "details", "regen")
+GENERATION_STEPS = ("details", "regen")
+
+# --------------------------------------------------------------------------------
+# MESURES
+# --------------------------------------------------------------------------------
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+class Recorder:
+    """Durées et erreurs de chaque étape, partagées par les utilisateurs simulés."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.ttfts = {step: [] for step in GENERATION_STEPS}
+        self.errors = {step: {} for step in STEPS}
+        self.conversations = 0
+
+    def ok(self, step, duration, ttft=None):
+        with self._lock:
+            self.latencies[step].append(duration)
+            if ttft is not None:
+                self.ttfts[step].append(ttft)
+
+    def error(self, step, cause):
+        with self._lock:
+            self.errors[step][cause] = self.errors[step].get(cause, 0) + 1
+
+    def finished(self):
+        with self._lock:
+            self.conversations += 1
+
+    def step_report(self, step):
+        latencies = self.latencies[step]
+        errors = sum(self.errors[step].values())
+        total = len(latencies) + errors
+        row = {
+            "count": total,
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "error_causes": dict(sorted(self.errors[step].items()))
+        }
+        if latencies:
+            row.update({
+                "mean_s": round(sum(latencies) / len(latencies), 4),
+                "p50_s": round(percentile(latencies, 50), 4),
+                "p90_s": round(percentile(latencies, 90), 4),
+                "p95_s": round(percentile(latencies, 95), 4),
+                "p99_s": round(percentile(latencies, 99), 4),
+                "max_s": round(max(latencies), 4)
+            })
+        ttfts = self.ttfts.get(step)
+        if ttfts:
+            row.update({
+                "ttft_p50_s": round(percentile(ttfts, 50), 4),
+                "ttft_p95_s": round(percentile(ttfts, 95), 4),
+                "ttft_p99_s": round(percentile(ttfts, 99), 4)
+            })
+        return row
+
+# --------------------------------------------------------------------------------
+# UTILISATEURS SIMULÉS
+# --------------------------------------------------------------------------------
+
+class StepFailed(Exception):
+    """Étape en erreur ; cause = libellé court pour le rapport."""
+
+    def __init__(self, cause):
+        super().__init__(cause)
+        self.cause = cause
+
+def load_form_fields():
+    """Types d'e-mails et champs du formulaire de détails (prompts.json)."""
+    with open(os.path.join(ROOT, "prompts.json"), encoding="utf-8") as f:
+        prompts = json.load(f)
+    return {email_type: [field["id"] for field in prompts["form_fields"].get(email_type, [])]
+            for email_type in prompts["types"]}
+
+def _check(response):
+    if response.status_code >= 400:
+        raise StepFailed(f"http_{response.status_code}")
+
+def _read_json(response):
+    _check(response)
+    try:
+        payload = response.json()
+    except ValueError:
+        raise StepFailed("invalid_json")
+    if payload.get("error"):
+        raise StepFailed("app_error")
+    return payload
+
+def _read_stream(response, started):
+    """Lit un flux NDJSON ; retourne le temps jusqu'au premier token."""
+    _check(response)
+    ttft, last = None, None
+    for line in response.iter_lines():
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            raise StepFailed("invalid_json")
+        if ttft is None and ("token" in event or "bot" in event):
+            ttft = time.perf_counter() - started
+        last = event
+    if last is None or last.get("error"):
+        raise StepFailed("app_error")
+    if not last.get("end"):
+        raise StepFailed("truncated_stream")
+    return ttft
+
+class SimulatedUser:
+    """Un utilisateur avec sa propre session HTTP (cookie de session Flask)."""
+
+    def __init__(self, base_url, recorder, form_fields, stream, timeout, counter):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.form_fields = form_fields
+        self.stream = stream
+        self.timeout = timeout
+        self.counter = counter
+        self.http = requests.Session()
+
+    def _step(self, step, method, path, generation=False, **kwargs):
+        """Exécute et chronomètre une étape ; False si elle a échoué."""
+        headers = {"Accept": "application/x-ndjson"} if generation and self.stream else {}
+        started = time.perf_counter()
+        try:
+            response = self.http.request(
+                method, f"{self.base_url}{path}", headers=headers,
+                timeout=self.timeout, stream=generation and self.stream, **kwargs
+            )
+            with response:
+                if generation and self.stream:
+                    ttft = _read_stream(response, started)
+                else:
+                    _read_json(response)
+                    ttft = None
+        except StepFailed as e:
+            self.recorder.error(step, e.cause)
+            return False
+        except requests.exceptions.Timeout:
+            self.recorder.error(step, "timeout")
+            return False
+        except requests.exceptions.RequestException:
+            self.recorder.error(step, "connection")
+            return False
+        self.recorder.ok(step, time.perf_counter() - started, ttft)
+        return True
+
+    def conversation(self):
+        """Un parcours complet ; s'arrête à la première étape en erreur."""
+        number = next(self.counter)
+        email_type = list(self.form_fields)[number % len(self.form_fields)]
+        details = {field: f"valeur {field} {number}" for field in self.form_fields[email_type]}
+
+        if not (self._step("start", "GET", "/start")
+                and self._step("type", "POST", "/message", json={"type": email_type})
+                and self._step("info", "POST", "/message",
+                               json={"dest": "Client", "obj": f"{email_type} n°{number}"})
+                and self._step("details", "POST", "/message", generation=True, json={"details": details})
+                and self._step("regen", "GET", "/regen", generation=True)):
+            return
+        self.recorder.finished()
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            self.conversation()
+
+def run_load(base_url, users, duration, stream, timeout):
+    """Lance users utilisateurs pendant duration secondes ; retourne (mesures, durée réelle)."""
+    recorder = Recorder()
+    form_fields = load_form_fields()
+    counter = itertools.count()
+    started = time.perf_counter()
+    deadline = time.monotonic() + duration
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        for _ in range(users):
+            user = SimulatedUser(base_url, recorder, form_fields, stream, timeout, counter)
+            pool.submit(user.run, deadline)
+    return recorder, time.perf_counter() - started
+
+# --------------------------------------------------------------------------------
+# RAPPORT
+# --------------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+    return commit + ("-dirty" if dirty else "")
+
+def build_report(recorder, wall, settings):
+    steps = {step: recorder.step_report(step) for step in STEPS}
+    requests_done = sum(row["count"] for row in steps.values())
+    errors = sum(row["errors"] for row in steps.values())
+    generations = sum(len(recorder.latencies[step]) for step in GENERATION_STEPS)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "settings": settings
+        },
+        "summary": {
+            "wall_s": round(wall, 2),
+            "conversations": recorder.conversations,
+            "conversations_per_sec": round(recorder.conversations / wall, 3),
+            "generations_per_sec": round(generations / wall, 3),
+            "requests_per_sec": round(requests_done / wall, 3),
+            "error_rate": round(errors / requests_done, 4) if requests_done else 0.0
+        },
+        "steps": steps
+    }
+
+def print_report(report):
+    summary = report["summary"]
+    print(f"Commit {report['meta']['commit']} | {summary['conversations']} conversations en "
+          f"{summary['wall_s']} s | {summary['conversations_per_sec']} conv/s | "
+          f"{summary['generations_per_sec']} gen/s | erreurs {summary['error_rate']:.2%}")
+    for step, row in report["steps"].items():
+        line = f"  {step:<8} {row['count']:>6} req | erreurs {row['error_rate']:>7.2%}"
+        if "p50_s" in row:
+            line += (f" | p50 {row['p50_s'] * 1000:>8.1f} ms | p95 {row['p95_s'] * 1000:>8.1f} ms"
+                     f" | p99 {row['p99_s'] * 1000:>8.1f} ms")
+        if "ttft_p50_s" in row:
+            line += f" | TTFT p50 {row['ttft_p50_s'] * 1000:.1f} ms"
+        if row["error_causes"]:
+            line += " | " + ", ".join(f"{cause}={n}" for cause, n in row["error_causes"].items())
+        print(line)
+
+def _delta(old, new):
+    if old is None or new is None:
+        return "      n/a"
+    if not old:
+        return f"{new:>+9.3f}"
+    return f"{(new - old) / old:>+9.1%}"
+
+def print_comparison(previous, report):
+    """Écart relatif avec un rapport précédent (débit, percentiles, erreurs)."""
+    print(f"Comparaison avec {previous['meta']['commit']} :")
+    for key in ("conversations_per_sec", "generations_per_sec", "error_rate"):
+        print(f"  {key:<24} {previous['summary'].get(key)} → {report['summary'][key]} "
+              f"({_delta(previous['summary'].get(key), report['summary'][key]).strip()})")
+    for step, row in report["steps"].items():
+        old = previous["steps"].get(step, {})
+        print(f"  {step:<8} p50 {_delta(old.get('p50_s'), row.get('p50_s'))} | "
+              f"p95 {_delta(old.get('p95_s'), row.get('p95_s'))} | "
+              f"p99 {_delta(old.get('p99_s'), row.get('p99_s'))} | "
+              f"erreurs {old.get('error_rate')} → {row['error_rate']}")
+
+# --------------------------------------------------------------------------------
+# POINT D'ENTRÉE
+# --------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_argument_group("application")
+    target.add_argument("--url", help="application déjà démarrée (sinon démarrée par le script)")
+    target.add_argument("--mode", default="sync", choices=["sync", "async"],
+                        help="Gunicorn (sync) ou Uvicorn (async) si --url est absent")
+    target.add_argument("--sync-workers", type=int, default=4)
+    load = parser.add_argument_group("charge")
+    load.add_argument("--users", type=int, default=20, help="utilisateurs simultanés")
+    load.add_argument("--duration", type=float, default=30, help="durée de l'essai (s)")
+    load.add_argument("--stream", action="store_true", help="générations en flux NDJSON")
+    load.add_argument("--timeout", type=float, default=120, help="délai maximal d'une requête (s)")
+    ollama = parser.add_argument_group("faux Ollama (ignoré avec --url ou --ollama-url)")
+    ollama.add_argument("--ollama-url", help="Ollama existant au lieu du faux serveur")
+    ollama.add_argument("--ttft", type=float, default=0.2)
+    ollama.add_argument("--tokens", type=int, default=50)
+    ollama.add_argument("--tokens-per-sec", type=float, default=50)
+    ollama.add_argument("--parallel", type=int, default=0, help="générations simultanées (0 = illimité)")
+    ollama.add_argument("--error-rate", type=float, default=0.0)
+    ollama.add_argument("--slow-rate", type=float, default=0.0)
+    ollama.add_argument("--slow-ttft", type=float, default=0.0)
+    ollama.add_argument("--stall-rate", type=float, default=0.0)
+    ollama.add_argument("--stall-time", type=float, default=0.0)
+    parser.add_argument("--json", help="fichier du rapport (défaut : bench/results/load_test-<commit>.json)")
+    parser.add_argument("--compare", help="rapport précédent à comparer")
+    args = parser.parse_args()
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+    fake, proc = None, None
+    try:
+        base_url = args.url
+        if base_url is None:
+            ollama_url = args.ollama_url
+            if ollama_url is None:
+                fake = FakeOllama(
+                    ttft=args.ttft, tokens=args.tokens, tokens_per_sec=args.tokens_per_sec,
+                    parallel=args.parallel, error_rate=args.error_rate, slow_rate=args.slow_rate,
+                    slow_ttft=args.slow_ttft, stall_rate=args.stall_rate, stall_time=args.stall_time
+                ).start()
+                ollama_url = fake.url
+            port = free_port()
+            proc = start_server(args.mode, port, ollama_url, args.sync_workers)
+            base_url = f"http://127.0.0.1:{port}"
+        recorder, wall = run_load(base_url.rstrip("/"), args.users, args.duration, args.stream, args.timeout)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if fake is not None:
+            fake.stop()
+
+    report = build_report(recorder, wall, settings)
+    print_report(report)
+
+    path = args.json or os.path.join(ROOT, "bench", "results", f"load_test-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Rapport écrit dans {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+micro.py
+--------------------------------------------------------------------------------
+Micro-benchmarks des chemins chauds d'une requête, sans modèle de langage.
+
+Hors génération, chaque requête paie :
+- sync_prompts() : la vérification de la version de la configuration des
+  prompts en base, avant chaque requête (voir logic/prompt_store.py)
+- find_user / find_user_by_id : à chaque message, et à chaque rendu de
+  template (inject_user_role)
+- l'insertion et le commit d'un ChatLog
+- l'encodage JSON des réponses
+- la signature du cookie de session Flask (dict answers)
+et chaque étape de handle_message (type, destinataire / objet, détails,
+régénération), mesurée isolément avec Ollama remplacé par un générateur
+immédiat (stub_chat_stream).
+
+L'application est créée sur une base SQLite temporaire : la base de
+l'instance n'est pas modifiée. Chaque mesure est répétée (--rounds) après
+calibrage automatique du nombre d'appels (timeit.Timer.autorange).
+
+Résultats (--json, par défaut bench/results/micro-<commit>.json) : commit,
+versions de Python / Flask / Werkzeug / SQLAlchemy, et par mesure le temps
+médian, minimal et maximal d'un appel (µs). --compare ANCIEN.json signale
+les mesures dont la médiane a augmenté de plus de --threshold (code de
+sortie 1), par exemple après une mise à jour de Flask ou de SQLAlchemy.
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/micro.py
+    python bench/micro.py --filter step_ --compare bench/results/micro-abc1234.json
+"""
+
+import argparse
+import importlib.metadata
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Avant l'import de logic : ni préchargement, ni sondes, métriques hors de l'instance
+TMP = tempfile.mkdtemp(prefix="micro-bench-")
+os.environ.setdefault("OLLAMA_WARMUP", "0")
+os.environ.setdefault("OLLAMA_HEALTH_INTERVAL", "0")
+os.environ.setdefault("METRICS_DB_PATH", os.path.join(TMP, "metrics.db"))
+
+from flask import Flask, jsonify, session  # noqa: E402
+
+import logic  # noqa: E402
+import logic.chat as chat  # noqa: E402
+import logic.shared as shared  # noqa: E402
+from logic.database import db, init_app  # noqa: E402
+from logic.models import ChatLog, User  # noqa: E402
+from logic.shared import STEP_GENERATION, STEP_INFO, STEP_PRECISIONS, STEP_TYPE  # noqa: E402
+from logic.prompt_store import sync_prompts  # noqa: E402
+from logic.users import find_user, find_user_by_id  # noqa: E402
+from load_test import git_commit  # noqa: E402
+
+USERNAME = "bench"
+EMAIL_TYPE = "Devis"
+DETAILS = {"service_demande": "Site web", "budget_estime": "5000 €", "delai_souhaite": "3 mois"}
+STUB_TOKENS = ["Bonjour, ", "veuillez ", "trouver ", "ci-joint ", "notre ", "devis."]
+
+PACKAGES = ("flask", "werkzeug", "sqlalchemy", "flask-sqlalchemy")
+
+# --------------------------------------------------------------------------------
+# APPLICATION ET OLLAMA FACTICE
+# --------------------------------------------------------------------------------
+
+def stub_chat_stream(prompt, options=None, kv=None, metrics=None):
+    """Remplace ollama_chat_stream : tokens immédiats, statistiques comme Ollama."""
+    if metrics is not None:
+        metrics.first_token()
+    yield from STUB_TOKENS
+    chunk = {"done": True, "prompt_eval_count": len(prompt.split()), "eval_count": len(STUB_TOKENS)}
+    if metrics is not None:
+        metrics.record_chunk("stub://", chunk)
+    if kv is not None:
+        kv.record("stub://", chunk)
+
+def create_app():
+    """Application Flask sur une base SQLite temporaire, avec un utilisateur."""
+    app = Flask("micro_bench", root_path=ROOT, instance_path=TMP)
+    app.secret_key = logic.SECRET_KEY
+    app.config["SESSION_PERMANENT"] = False
+    init_app(app)
+    with app.app_context():
+        db.session.add(User(username=USERNAME, password="bench", role="user"))
+        db.session.commit()
+    chat.ollama_chat_stream = stub_chat_stream
+    return app
+
+def conversation_session(user_id, step, answers):
+    """Session d'une conversation arrivée à l'étape step."""
+    session.update(user_id=user_id, conversation_id="bench", step=step, answers=answers)
+
+# --------------------------------------------------------------------------------
+# MESURES
+# --------------------------------------------------------------------------------
+
+BENCHMARKS = []
+
+def benchmark(func):
+    """Enregistre une mesure : func(app, user_id) prépare et retourne l'appel à chronométrer."""
+    BENCHMARKS.append((func.__name__.removeprefix("bench_"), func))
+    return func
+
+@benchmark
+def bench_get_prompts(app, user_id):
+    shared.get_prompts()
+    return shared.get_prompts
+
+@benchmark
+def bench_sync_prompts(app, user_id):
+    return sync_prompts
+
+@benchmark
+def bench_load_prompts(app, user_id):
+    return shared.load_prompts
+
+@benchmark
+def bench_render_prompt(app, user_id):
+    answers = {"type": EMAIL_TYPE, "dest": "Client", "obj": "Devis", "details": DETAILS}
+    return lambda: chat._render_prompt(answers)
+
+@benchmark
+def bench_find_user(app, user_id):
+    return lambda: find_user(USERNAME)
+
+@benchmark
+def bench_find_user_by_id(app, user_id):
+    return lambda: find_user_by_id(user_id)
+
+@benchmark
+def bench_chatlog_insert_commit(app, user_id):
+    def insert():
+        db.session.add(ChatLog(user_id=user_id, sender="bot", message="Bonjour, voici le document."))
+        db.session.commit()
+    return insert
+
+@benchmark
+def bench_json_dumps_message(app, user_id):
+    data = {"details": DETAILS}
+    return lambda: json.dumps(data, ensure_ascii=False)
+
+@benchmark
+def bench_jsonify_response(app, user_id):
+    payload = {
+        "bot": "Merci de compléter les informations suivantes :",
+        "fields": shared.get_prompts()["form_fields"][EMAIL_TYPE],
+        "end": False
+    }
+    return lambda: jsonify(payload)
+
+@benchmark
+def bench_session_sign(app, user_id):
+    serializer = app.session_interface.get_signing_serializer(app)
+    data = {"user_id": user_id, "conversation_id": "bench", "step": STEP_PRECISIONS,
+            "answers": {"type": EMAIL_TYPE, "dest": "Client", "obj": "Devis", "details": DETAILS}}
+    return lambda: serializer.dumps(data)
+
+@benchmark
+def bench_session_verify(app, user_id):
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie = serializer.dumps({"user_id": user_id, "step": STEP_PRECISIONS,
+                               "answers": {"type": EMAIL_TYPE, "dest": "Client", "obj": "Devis",
+                                           "details": DETAILS}})
+    return lambda: serializer.loads(cookie)
+
+@benchmark
+def bench_request_context(app, user_id):
+    """Référence : coût du contexte de requête inclus dans les mesures step_*."""
+    def push():
+        with app.test_request_context("/message", method="POST", json={"type": EMAIL_TYPE}):
+            conversation_session(user_id, STEP_TYPE, {})
+    return push
+
+@benchmark
+def bench_step_start(app, user_id):
+    def step():
+        with app.test_request_context("/start"):
+            session.update(user_id=user_id)
+            chat.start()
+    return step
+
+@benchmark
+def bench_step_type(app, user_id):
+    def step():
+        with app.test_request_context("/message", method="POST", json={"type": EMAIL_TYPE}):
+            conversation_session(user_id, STEP_TYPE, {})
+            chat.handle_message()
+    return step
+
+@benchmark
+def bench_step_info(app, user_id):
+    def step():
+        with app.test_request_context("/message", method="POST", json={"dest": "Client", "obj": "Devis"}):
+            conversation_session(user_id, STEP_INFO, {"type": EMAIL_TYPE})
+            chat.handle_message()
+    return step
+
+@benchmark
+def bench_step_details(app, user_id):
+    """Génération complète (file d'admission, métriques, ChatLog) avec Ollama factice."""
+    counter = itertools.count()
+
+    def step():
+        # Détails différents à chaque appel : ni cache ni génération partagée
+        details = dict(DETAILS, delai_souhaite=f"{next(counter)} jours")
+        with app.test_request_context("/message", method="POST", json={"details": details}):
+            conversation_session(user_id, STEP_PRECISIONS,
+                                 {"type": EMAIL_TYPE, "dest": "Client", "obj": "Devis"})
+            chat.handle_message()
+    return step
+
+@benchmark
+def bench_step_regen(app, user_id):
+    answers = {"type": EMAIL_TYPE, "dest": "Client", "obj": "Devis", "details": DETAILS}
+
+    def step():
+        with app.test_request_context("/regen"):
+            conversation_session(user_id, STEP_GENERATION, answers)
+            chat.regenerate()
+    return step
+
+def measure(func, rounds):
+    """Temps d'un appel (secondes) pour chaque série, après calibrage (≥ 0,2 s par série)."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return [total / number for total in timer.repeat(repeat=rounds, number=number)], number
+
+def run(app, rounds, name_filter=None):
+    results = {}
+    with app.app_context():
+        user_id = find_user(USERNAME).id
+        for name, factory in BENCHMARKS:
+            if name_filter and name_filter not in name:
+                continue
+            timings, number = measure(factory(app, user_id), rounds)
+            results[name] = {
+                "median_us": round(statistics.median(timings) * 1e6, 2),
+                "min_us": round(min(timings) * 1e6, 2),
+                "max_us": round(max(timings) * 1e6, 2),
+                "calls_per_round": number
+            }
+            row = results[name]
+            print(f"  {name:<24} médiane {row['median_us']:>10.2f} µs | min {row['min_us']:>10.2f} µs | "
+                  f"max {row['max_us']:>10.2f} µs")
+    return results
+
+# --------------------------------------------------------------------------------
+# RAPPORT
+# --------------------------------------------------------------------------------
+
+def versions():
+    found = {"python": platform.python_version()}
+    for package in PACKAGES:
+        try:
+            found[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            found[package] = None
+    return found
+
+def compare(previous, results, threshold):
+    """Affiche l'écart de médiane avec un rapport précédent ; retourne les régressions."""
+    print(f"Comparaison avec {previous['meta']['commit']} :")
+    changed = {key: (previous["meta"]["versions"].get(key), value)
+               for key, value in versions().items() if previous["meta"]["versions"].get(key) != value}
+    for key, (old, new) in changed.items():
+        print(f"  {key} : {old} → {new}")
+    regressions = []
+    for name, row in results.items():
+        old = previous["benchmarks"].get(name)
+        if old is None:
+            continue
+        delta = (row["median_us"] - old["median_us"]) / old["median_us"]
+        flag = ""
+        if delta > threshold:
+            regressions.append(name)
+            flag = "  ← régression"
+        print(f"  {name:<24} {old['median_us']:>10.2f} → {row['median_us']:>10.2f} µs ({delta:+.1%}){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5, help="séries par mesure")
+    parser.add_argument("--filter", help="ne lance que les mesures dont le nom contient ce texte")
+    parser.add_argument("--json", help="fichier des résultats (défaut : bench/results/micro-<commit>.json)")
+    parser.add_argument("--compare", help="résultats précédents à comparer")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="hausse de la médiane signalée comme régression (0.15 = 15 %%)")
+    args = parser.parse_args()
+
+    app = create_app()
+    print(f"Micro-benchmarks (base temporaire {TMP}) :")
+    results = run(app, args.rounds, args.filter)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "versions": versions(),
+            "rounds": args.rounds
+        },
+        "benchmarks": results
+    }
+    path = args.json or os.path.join(ROOT, "bench", "results", f"micro-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} régression(s) : {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+ollama_client_overhead.py
+--------------------------------------------------------------------------------
+Mesure le coût fixe d'un appel à Ollama, hors temps de génération.
+
+Compare, contre un faux Ollama local qui répond instantanément :
+- avant : requests.post nu (nouvelle connexion TCP à chaque appel)
+- après : ollama_chat avec la session mutualisée (keep-alive)
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/ollama_client_overhead.py --requests 500 --threads 1
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logic.shared as shared  # noqa: E402
+from logic.ollama_client import ollama_chat  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+
+PROMPT = "Rédige un e-mail de test."
+
+def chat_without_pool(prompt):
+    """Reproduit l'ancien appel : requests.post sans session ni délai."""
+    response = requests.post(
+        f"{shared.OLLAMA_URL}/api/chat",
+        json={"model": shared.MODEL_NAME, "messages": [{"role": "user", "content": prompt}]},
+        stream=True
+    )
+    response.raise_for_status()
+    parts = []
+    for line in response.iter_lines():
+        if line:
+            chunk = json.loads(line)
+            parts.append(chunk.get("message", {}).get("content", ""))
+    return "".join(parts).strip()
+
+def measure(func, count, threads):
+    """Exécute func count fois sur threads threads et retourne les latences (ms)."""
+    def timed(_):
+        start = time.perf_counter()
+        func(PROMPT)
+        return (time.perf_counter() - start) * 1000
+
+    # Les impressions de ollama_chat faussent la mesure : on les neutralise
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            latencies = list(pool.map(timed, range(count)))
+            wall = time.perf_counter() - start
+    return latencies, wall
+
+def summarize(name, latencies, wall):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return {
+        "variant": name,
+        "requests": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(p95, 3),
+        "req_per_sec": round(len(latencies) / wall, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--tokens", type=int, default=5)
+    parser.add_argument("--json", help="écrit les résultats dans ce fichier")
+    args = parser.parse_args()
+
+    server = FakeOllama(tokens=args.tokens).start()
+    shared.OLLAMA_URL = server.url
+    try:
+        # Préchauffage (imports paresseux, résolution DNS, etc.)
+        measure(chat_without_pool, 20, 1)
+        measure(ollama_chat, 20, 1)
+
+        results = [
+            summarize("avant (requests.post)", *measure(chat_without_pool, args.requests, args.threads)),
+            summarize("après (session mutualisée)", *measure(ollama_chat, args.requests, args.threads))
+        ]
+    finally:
+        server.stop()
+
+    for r in results:
+        print(f"{r['variant']:<28} moyenne {r['mean_ms']:>7.3f} ms | p50 {r['p50_ms']:>7.3f} ms | "
+              f"p95 {r['p95_ms']:>7.3f} ms | {r['req_per_sec']:>7.1f} req/s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
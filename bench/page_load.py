@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+page_load.py
+--------------------------------------------------------------------------------
+Mesure le temps de chargement des pages (HTML + CSS + JS) à travers une
+liaison lente simulée, comme celles des agences : latence et débit limités,
+partagés par les connexions du navigateur.
+
+Variantes comparées :
+1. avant : fichiers sources séparés, non compressés, "no-store"
+   (comportement d'origine : tout est retéléchargé à chaque page)
+2. cache : fichiers sources, public max-age=STATIC_MAX_AGE puis revalidation
+   (ETag / Last-Modified, 304)
+3. après : un fichier CSS et un fichier JS par page (build_assets.py),
+   minifiés, précompressés (brotli, comme gzip_static / brotli_static de
+   Nginx), immutable
+
+Pour chaque page et chaque variante :
+- froid : premier chargement, cache du navigateur vide
+- retour : chargement suivant, cache encore valide
+- lendemain : cache présent mais max-age écoulé (revalidation)
+
+Le navigateur simulé ouvre jusqu'à --connections connexions HTTP/1.1
+persistantes (6 comme les navigateurs) ; chaque nouvelle connexion paie
+un aller-retour (établissement TCP). Le temps mesuré va de la demande de la
+page à la réception du dernier fichier (les images et l'exécution des
+scripts ne sont pas comptées).
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/page_load.py --rtt 0.08 --down 2000 --up 512
+    python bench/page_load.py --json bench/results/page_load.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Aucun service de fond : seuls les templates et les fichiers statiques servent
+os.environ.setdefault("OLLAMA_WARMUP", "0")
+os.environ.setdefault("OLLAMA_HEALTH_INTERVAL", "0")
+os.environ.setdefault("METRICS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="page_load-"), "metrics.db"))
+
+from flask import Flask, render_template, request, send_from_directory  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import logic.shared as shared  # noqa: E402
+import logic.assets as assets  # noqa: E402
+from logic.http_cache import NO_STORE, IMMUTABLE  # noqa: E402
+from build_assets import build  # noqa: E402
+from async_concurrency import free_port  # noqa: E402
+
+PAGES = ("/", "/login", "/admin")
+VARIANTS = ("avant", "cache", "après")
+VISITS = ("froid", "retour", "lendemain")
+
+# --------------------------------------------------------------------------------
+# SERVEUR (pages et fichiers statiques, politique de cache de la variante)
+# --------------------------------------------------------------------------------
+
+def create_app(settings):
+    """Application qui rend les pages et sert static/ selon settings["variant"]."""
+    app = Flask("page_load", root_path=ROOT, static_folder=None)
+    assets.init_assets(app)
+    prompts = shared.get_prompts()
+
+    @app.route("/")
+    def index():
+        return render_template("index.html", session={}, user_info={"username": "agence"})
+
+    @app.route("/login")
+    def login():
+        return render_template("login.html", session={})
+
+    @app.route("/admin")
+    def admin():
+        return render_template(
+            "admin_prompts.html",
+            prompts_data={key: prompts[key] for key in ("types", "form_fields", "prompts")},
+            prompts_etag='"prompts-1"',
+            current="admin",
+            session={"admin_role": "super"}
+        )
+
+    @app.route("/static/<path:filename>", endpoint="static")
+    def static_file(filename):
+        variant = settings["variant"]
+        encoding = None
+        if variant == "après":
+            # Comme gzip_static / brotli_static : variante précompressée si acceptée
+            accepted = request.headers.get("Accept-Encoding", "")
+            for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if candidate in accepted and os.path.exists(os.path.join(assets.STATIC_DIR, filename + suffix)):
+                    encoding, filename = candidate, filename + suffix
+                    break
+        response = send_from_directory(assets.STATIC_DIR, filename, max_age=settings["max_age"])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if variant == "avant":
+            response.headers["Cache-Control"] = NO_STORE
+        elif assets.is_fingerprinted(filename):
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+    @app.after_request
+    def no_store(response):
+        # Pages : liées à la session dans l'application (voir http_cache.py)
+        response.headers.setdefault("Cache-Control", NO_STORE)
+        return response
+
+    return app
+
+def use_variant(settings, variant):
+    settings["variant"] = variant
+    shared.ASSETS_BUNDLES = variant == "après"
+    assets.load_manifest()
+
+# --------------------------------------------------------------------------------
+# LIAISON SIMULÉE
+# --------------------------------------------------------------------------------
+
+class Direction:
+    """Un sens de la liaison : latence fixe, débit partagé par les connexions."""
+
+    def __init__(self, delay, kbps):
+        self.delay = delay
+        self.bytes_per_s = kbps * 1000 / 8
+        self.free_at = 0.0
+        self.lock = threading.Lock()
+
+    def schedule(self, arrival, size):
+        """Instant de remise d'un fragment arrivé à arrival (file d'attente du lien)."""
+        with self.lock:
+            start = max(arrival, self.free_at)
+            self.free_at = start + size / self.bytes_per_s
+            return self.free_at + self.delay
+
+class Link:
+    """Proxy TCP local entre le navigateur simulé et le serveur."""
+
+    def __init__(self, target_port, rtt, down_kbps, up_kbps):
+        self.target_port = target_port
+        self.rtt = rtt
+        self.down = Direction(rtt / 2, down_kbps)
+        self.up = Direction(rtt / 2, up_kbps)
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            threading.Thread(target=self._connect, args=(client,), daemon=True).start()
+
+    def _connect(self, client):
+        time.sleep(self.rtt)  # Établissement de la connexion TCP
+        server = socket.create_connection(("127.0.0.1", self.target_port))
+        for src, dst, direction in ((client, server, self.up), (server, client, self.down)):
+            chunks = queue.Queue()
+            threading.Thread(target=self._read, args=(src, chunks, direction), daemon=True).start()
+            threading.Thread(target=self._write, args=(dst, chunks), daemon=True).start()
+
+    @staticmethod
+    def _read(src, chunks, direction):
+        while True:
+            try:
+                data = src.recv(16384)
+            except OSError:
+                data = b""
+            if not data:
+                chunks.put((0, b""))
+                return
+            chunks.put((direction.schedule(time.perf_counter(), len(data)), data))
+
+    @staticmethod
+    def _write(dst, chunks):
+        while True:
+            deliver_at, data = chunks.get()
+            if not data:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            pause = deliver_at - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+            try:
+                dst.sendall(data)
+            except OSError:
+                return
+
+# --------------------------------------------------------------------------------
+# NAVIGATEUR SIMULÉ
+# --------------------------------------------------------------------------------
+
+ASSET_PATTERN = re.compile(r'<(?:link[^>]+href|script[^>]+src)="(/static/[^"]+)"')
+
+class Browser:
+    """Chargement d'une page : HTML puis CSS / JS en parallèle, avec cache HTTP."""
+
+    def __init__(self, port, connections):
+        self.port = port
+        self.connections = connections
+        self.cache = {}  # url -> {"expires", "etag", "last_modified"}
+        self.clock_offset = 0.0  # Avance de l'horloge (visite du lendemain)
+
+    def _fetch(self, conn, url, totals):
+        headers = {"Accept-Encoding": "br, gzip"}
+        entry = self.cache.get(url)
+        now = time.time() + self.clock_offset
+        if entry and entry["expires"] > now:
+            return  # Copie valide : aucune requête
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        conn.request("GET", url, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        totals["requests"] += 1
+        totals["bytes"] += len(body)
+        if response.status == 304 and entry:
+            totals["revalidated"] += 1
+            self._store(url, response, now, entry)
+        elif response.status == 200:
+            self._store(url, response, now, None)
+
+    def _store(self, url, response, now, previous):
+        control = response.getheader("Cache-Control", "")
+        if "no-store" in control:
+            self.cache.pop(url, None)
+            return
+        match = re.search(r"max-age=(\d+)", control)
+        max_age = 0 if "no-cache" in control or not match else int(match.group(1))
+        self.cache[url] = {
+            "expires": now + max_age,
+            "etag": response.getheader("ETag") or (previous or {}).get("etag"),
+            "last_modified": response.getheader("Last-Modified") or (previous or {}).get("last_modified"),
+        }
+
+    def load(self, page):
+        totals = {"requests": 0, "bytes": 0, "revalidated": 0}
+        started = time.perf_counter()
+        first = http.client.HTTPConnection("127.0.0.1", self.port)
+        first.request("GET", page, headers={"Accept-Encoding": "br, gzip"})
+        html = first.getresponse().read()
+        totals["requests"] += 1
+        totals["bytes"] += len(html)
+
+        urls = queue.Queue()
+        for url in ASSET_PATTERN.findall(html.decode("utf-8")):
+            urls.put(url)
+
+        def worker(conn):
+            while True:
+                try:
+                    url = urls.get_nowait()
+                except queue.Empty:
+                    break
+                if conn is None:
+                    conn = http.client.HTTPConnection("127.0.0.1", self.port)
+                self._fetch(conn, url, totals)
+            if conn is not None:
+                conn.close()
+
+        threads = [threading.Thread(target=worker, args=(first if i == 0 else None,))
+                   for i in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        totals["seconds"] = time.perf_counter() - started
+        return totals
+
+# --------------------------------------------------------------------------------
+# MESURES
+# --------------------------------------------------------------------------------
+
+def measure(link_port, settings, variant, page, connections):
+    """Chargements froid, retour et lendemain d'une page pour une variante."""
+    use_variant(settings, variant)
+    browser = Browser(link_port, connections)
+    results = {}
+    for visit in VISITS:
+        if visit == "lendemain":
+            browser.clock_offset = 86400
+        results[visit] = browser.load(page)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, default=0.08, help="aller-retour de la liaison (s)")
+    parser.add_argument("--down", type=float, default=2000, help="débit descendant (kbit/s)")
+    parser.add_argument("--up", type=float, default=512, help="débit montant (kbit/s)")
+    parser.add_argument("--connections", type=int, default=6, help="connexions parallèles du navigateur")
+    parser.add_argument("--max-age", type=int, default=shared.STATIC_MAX_AGE,
+                        help="max-age des fichiers sources (variante cache)")
+    parser.add_argument("--json", help="écrit les résultats dans ce fichier")
+    args = parser.parse_args()
+
+    build()
+    shared.load_prompts()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    settings = {"variant": "avant", "max_age": args.max_age or None}
+    server_port = free_port()
+    server = make_server("127.0.0.1", server_port, create_app(settings), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    link = Link(server_port, args.rtt, args.down, args.up)
+
+    results = {
+        "link": {"rtt_s": args.rtt, "down_kbps": args.down, "up_kbps": args.up,
+                 "connections": args.connections},
+        "pages": {}
+    }
+    try:
+        for page in PAGES:
+            results["pages"][page] = {
+                variant: measure(link.port, settings, variant, page, args.connections)
+                for variant in VARIANTS
+            }
+    finally:
+        server.shutdown()
+
+    print(f"Liaison : RTT {args.rtt * 1000:.0f} ms, {args.down:.0f} / {args.up:.0f} kbit/s, "
+          f"{args.connections} connexions")
+    for page, variants in results["pages"].items():
+        print(f"Page {page}")
+        for variant, visits in variants.items():
+            cells = " | ".join(
+                f"{visit} {r['seconds'] * 1000:>6.0f} ms {r['requests']:>2} req {r['bytes'] / 1024:>6.1f} Ko"
+                for visit, r in visits.items()
+            )
+            print(f"  {variant:<6} {cells}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+resilience.py
+--------------------------------------------------------------------------------
+Mesure l'effet du disjoncteur et des générations doublées (voir
+logic/backends.py et logic/ollama_client.py) contre des faux Ollama qui
+injectent des pannes et des retards.
+
+Scénarios :
+1. Serveur bloqué (Ollama en redémarrage) : délai avant l'erreur de chaque
+   génération, sans disjoncteur (seuil inatteignable) puis avec
+2. Traînards : un premier token sur 50 retardé de --slow-ttft secondes sur
+   deux serveurs ; TTFT p50 / p95 / p99 sans puis avec OLLAMA_HEDGE_PERCENTILE
+
+Utilisation (depuis la racine du dépôt) :
+    python bench/resilience.py --requests 200 --slow-ttft 2
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logic.shared as shared  # noqa: E402
+import logic.backends as backends  # noqa: E402
+from logic.ollama_client import ollama_chat_stream  # noqa: E402
+from fake_ollama import FakeOllama  # noqa: E402
+
+PROMPT = "Rédige un e-mail de relance pour une facture impayée."
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def use_servers(servers):
+    """Nouveau pool (compteurs, circuits et délais remis à zéro) sur ces serveurs."""
+    shared.OLLAMA_URL = ",".join(server.url for server in servers)
+    backends._reset_pool()
+
+def blocked_server(requests, timeout, circuit):
+    """Délais avant l'erreur de chaque génération vers un serveur bloqué."""
+    server = FakeOllama(tokens=5).start()
+    shared.OLLAMA_FIRST_BYTE_TIMEOUT = timeout
+    shared.OLLAMA_FAILURE_THRESHOLD = 3 if circuit else 10 ** 9
+    use_servers([server])
+    server.httpd.config["hang"] = True
+    delays = []
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            try:
+                list(ollama_chat_stream(PROMPT))
+            except ValueError:
+                pass
+            delays.append(time.perf_counter() - started)
+    finally:
+        server.httpd.config["down"] = True
+        server.stop()
+    return delays
+
+def stragglers(requests, slow_ttft, percentile_setting):
+    """TTFT de chaque génération avec des traînards sur deux serveurs."""
+    servers = [FakeOllama(tokens=5, ttft=0.02, slow_rate=0.02, slow_ttft=slow_ttft, seed=i).start()
+               for i in range(2)]
+    shared.OLLAMA_HEDGE_PERCENTILE = percentile_setting
+    use_servers(servers)
+    ttfts = []
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            tokens = ollama_chat_stream(PROMPT)
+            next(tokens)
+            ttfts.append(time.perf_counter() - started)
+            tokens.close()
+        snapshot = backends.get_pool().snapshot()
+    finally:
+        for server in servers:
+            server.stop()
+    return ttfts, snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="générations par variante (traînards)")
+    parser.add_argument("--blocked-requests", type=int, default=10, help="générations vers le serveur bloqué")
+    parser.add_argument("--timeout", type=float, default=2.0, help="OLLAMA_FIRST_BYTE_TIMEOUT (s)")
+    parser.add_argument("--slow-ttft", type=float, default=2.0, help="retard des traînards (s)")
+    parser.add_argument("--json", help="écrit les résultats dans ce fichier")
+    args = parser.parse_args()
+
+    # Sondes désactivées : seules les générations font évoluer les circuits
+    shared.OLLAMA_HEALTH_INTERVAL = 0
+    shared.OLLAMA_CIRCUIT_COOLDOWN = 60
+    results = {"blocked": [], "stragglers": []}
+
+    for name, circuit in (("sans disjoncteur", False), ("avec disjoncteur", True)):
+        delays = blocked_server(args.blocked_requests, args.timeout, circuit)
+        results["blocked"].append({
+            "variant": name,
+            "total_s": round(sum(delays), 3),
+            "mean_ms": round(statistics.mean(delays) * 1000, 1),
+            "last_ms": round(delays[-1] * 1000, 1)
+        })
+
+    for name, setting in (("sans doublement", 0), ("doublement au p95", 95)):
+        ttfts, snapshot = stragglers(args.requests, args.slow_ttft, setting)
+        results["stragglers"].append({
+            "variant": name,
+            "p50_ms": round(percentile(ttfts, 50) * 1000, 1),
+            "p95_ms": round(percentile(ttfts, 95) * 1000, 1),
+            "p99_ms": round(percentile(ttfts, 99) * 1000, 1),
+            "hedged": snapshot["hedged"],
+            "hedge_wins": snapshot["hedge_wins"]
+        })
+
+    print("Serveur bloqué (délai avant l'erreur) :")
+    for r in results["blocked"]:
+        print(f"  {r['variant']:<20} total {r['total_s']:>7.3f} s | moyenne {r['mean_ms']:>8.1f} ms | "
+              f"dernière {r['last_ms']:>8.1f} ms")
+    print("Traînards (temps jusqu'au premier token) :")
+    for r in results["stragglers"]:
+        print(f"  {r['variant']:<20} p50 {r['p50_ms']:>7.1f} ms | p95 {r['p95_ms']:>7.1f} ms | "
+              f"p99 {r['p99_ms']:>7.1f} ms | doublées {r['hedged']} (gagnées {r['hedge_wins']})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+# build_assets.py
+"""
+build_assets.py
+──────────────────────────────────────────────────────────────
+Script de construction des fichiers statiques, à exécuter à chaque
+déploiement (avant de démarrer Gunicorn) :
+- Regroupe les fichiers CSS / JS de chaque page (logic/assets.py : BUNDLES),
+- Les minifie (commentaires et espaces superflus, chaînes intactes),
+- Les écrit sous un nom dérivé du contenu (static/dist/index.<empreinte>.js),
+- Écrit les variantes précompressées .gz et .br,
+- Écrit static/dist/manifest.json, lu par les templates (asset_urls).
+
+Utilisation (depuis la racine du dépôt) :
+    python build_assets.py
+    python build_assets.py --no-minify   # regroupe sans minifier (mise au point)
+
+Un fichier construit ne change jamais de contenu : Nginx peut le servir
+directement, précompressé, avec un cache d'un an :
+
+    location /static/dist/ {
+        alias /app/static/dist/;
+        gzip_static on;
+        brotli_static on;   # module ngx_brotli
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+
+Les anciens fichiers construits sont supprimés : les pages déjà ouvertes
+chargent encore les leurs depuis le cache du navigateur.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import brotli
+
+from logic.assets import BUNDLES, STATIC_DIR, DIST
+
+# --------------------------------------------------------------------------------
+# MINIFICATION CSS
+# --------------------------------------------------------------------------------
+
+# Espaces inutiles autour de ces caractères (":" : seulement après, "a :hover" ≠ "a:hover")
+CSS_TIGHT_BEFORE = set("{};,>")
+CSS_TIGHT_AFTER = set("{};,>:")
+
+def _skip_string(source: str, start: int) -> int:
+    """Position qui suit la chaîne commençant en start (' ou ")."""
+    quote = source[start]
+    i = start + 1
+    while i < len(source):
+        if source[i] == "\\":
+            i += 2
+            continue
+        if source[i] == quote or source[i] == "\n":
+            return i + 1
+        i += 1
+    return i
+
+def minify_css(source: str) -> str:
+    """Retire commentaires et espaces superflus d'une feuille de style."""
+    out = []
+    i, n = 0, len(source)
+    pending_space = False
+    while i < n:
+        c = source[i]
+        if c == "/" and source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            pending_space = True
+            continue
+        if c.isspace():
+            pending_space = True
+            i += 1
+            continue
+        if pending_space and out and out[-1][-1] not in CSS_TIGHT_AFTER and c not in CSS_TIGHT_BEFORE:
+            out.append(" ")
+        pending_space = False
+        if c in "'\"":
+            end = _skip_string(source, i)
+            out.append(source[i:end])
+            i = end
+            continue
+        if c == "}" and out and out[-1] == ";":
+            out.pop()  # Dernier ";" d'un bloc
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+# --------------------------------------------------------------------------------
+# MINIFICATION JAVASCRIPT
+# --------------------------------------------------------------------------------
+# Minification prudente, sans renommage : les fins de ligne sont conservées
+# là où l'insertion automatique de ";" pourrait en dépendre.
+
+# Mots après lesquels "/" ouvre une expression régulière
+JS_REGEX_KEYWORDS = {
+    "return", "typeof", "case", "do", "else", "in", "of", "new",
+    "delete", "void", "throw", "yield", "await", "instanceof"
+}
+# Fin de ligne inutile après / avant ces caractères
+JS_NEWLINE_AFTER = set("{([,;")
+JS_NEWLINE_BEFORE = set("})],;.")
+
+def _is_word(c: str) -> bool:
+    return c.isalnum() or c in "_$" or ord(c) > 127
+
+def _skip_template(source: str, start: int) -> int:
+    """Position qui suit le gabarit `...` commençant en start (${...} imbriqués)."""
+    i = start + 1
+    while i < len(source):
+        c = source[i]
+        if c == "\\":
+            i += 2
+        elif c == "`":
+            return i + 1
+        elif source.startswith("${", i):
+            i = _skip_braces(source, i + 2)
+        else:
+            i += 1
+    return i
+
+def _skip_braces(source: str, start: int) -> int:
+    """Position qui suit le "}" fermant une expression ${ de gabarit."""
+    depth = 1
+    i = start
+    while i < len(source):
+        c = source[i]
+        if c in "'\"":
+            i = _skip_string(source, i)
+        elif c == "`":
+            i = _skip_template(source, i)
+        elif c == "{":
+            depth += 1
+            i += 1
+        elif c == "}":
+            depth -= 1
+            i += 1
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    return i
+
+def _skip_regex(source: str, start: int) -> int:
+    """Position qui suit l'expression régulière /.../drapeaux commençant en start."""
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        c = source[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "\n":
+            return i
+        if c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            i += 1
+            while i < len(source) and _is_word(source[i]):
+                i += 1
+            return i
+        i += 1
+    return i
+
+def _regex_allowed(out: list) -> bool:
+    """Un "/" ouvre-t-il ici une expression régulière (et non une division) ?"""
+    text = "".join(out[-20:]).rstrip()
+    if not text:
+        return True
+    last = text[-1]
+    if last in ")]" or last in "'\"`":
+        return False
+    if _is_word(last):
+        word = re.search(r"[\w$]+$", text).group()
+        return word in JS_REGEX_KEYWORDS
+    return True
+
+def minify_js(source: str) -> str:
+    """Retire commentaires, indentation et espaces superflus d'un script."""
+    out = []
+    i, n = 0, len(source)
+    space = ""  # Espace en attente : "", " " ou "\n"
+    while i < n:
+        c = source[i]
+
+        # Espaces et commentaires : au plus un séparateur
+        if c.isspace():
+            if c == "\n":
+                space = "\n"
+            elif not space:
+                space = " "
+            i += 1
+            continue
+        if source.startswith("//", i):
+            end = source.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        if source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            comment = source[i:n if end < 0 else end]
+            i = n if end < 0 else end + 2
+            space = "\n" if "\n" in comment or space == "\n" else (space or " ")
+            continue
+
+        # Séparateur nécessaire ?
+        if space and out:
+            prev = out[-1][-1]
+            if space == "\n":
+                if prev not in JS_NEWLINE_AFTER and c not in JS_NEWLINE_BEFORE:
+                    out.append("\n")
+                elif _is_word(prev) and _is_word(c):
+                    out.append(" ")
+            elif (_is_word(prev) and _is_word(c)) or (prev in "+-" and c == prev):
+                out.append(" ")
+        space = ""
+
+        if c in "'\"":
+            end = _skip_string(source, i)
+        elif c == "`":
+            end = _skip_template(source, i)
+        elif c == "/" and _regex_allowed(out):
+            end = _skip_regex(source, i)
+        else:
+            end = i + 1
+        out.append(source[i:end])
+        i = end
+    return "".join(out).strip() + "\n"
+
+# --------------------------------------------------------------------------------
+# CONSTRUCTION
+# --------------------------------------------------------------------------------
+
+def _read(name: str) -> str:
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        return f.read().replace("\r\n", "\n")
+
+def build_bundle(bundle: str, sources: list, minify=True) -> str:
+    """Contenu d'un regroupement (scripts séparés par ";" : fichiers sans ";" final)."""
+    css = bundle.endswith(".css")
+    parts = []
+    for name in sources:
+        text = _read(name)
+        if minify:
+            text = minify_css(text) if css else minify_js(text)
+        parts.append(text.strip() if css else text.strip() + "\n;")
+    return "\n".join(parts) + "\n"
+
+def build(minify=True) -> dict:
+    """
+    Construit tous les regroupements dans static/dist (vidé au préalable).
+
+    Returns:
+        dict: Manifeste écrit dans static/dist/manifest.json
+    """
+    dist_dir = os.path.join(STATIC_DIR, DIST)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.makedirs(dist_dir)
+
+    manifest = {"bundles": {}, "files": {}}
+    for bundle, sources in BUNDLES.items():
+        data = build_bundle(bundle, sources, minify).encode("utf-8")
+        stem, ext = os.path.splitext(bundle)
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        filename = f"{DIST}/{stem}.{digest}{ext}"
+        variants = {
+            "": data,
+            ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+            ".br": brotli.compress(data, quality=11),
+        }
+        for suffix, content in variants.items():
+            with open(os.path.join(STATIC_DIR, filename + suffix), "wb") as f:
+                f.write(content)
+        manifest["bundles"][bundle] = filename
+        manifest["files"][filename] = {
+            "sources": sources,
+            "source_bytes": sum(len(_read(name).encode("utf-8")) for name in sources),
+            "bytes": len(data),
+            "gzip_bytes": len(variants[".gz"]),
+            "brotli_bytes": len(variants[".br"]),
+        }
+
+    with open(os.path.join(dist_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-minify", action="store_true", help="regroupe sans minifier")
+    args = parser.parse_args()
+
+    manifest = build(minify=not args.no_minify)
+    print(f"{'Fichier':<36} {'sources':>8} {'minifié':>8} {'gzip':>8} {'brotli':>8}")
+    for filename, info in manifest["files"].items():
+        print(f"{filename:<36} {info['source_bytes']:>8} {info['bytes']:>8} "
+              f"{info['gzip_bytes']:>8} {info['brotli_bytes']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -9,16 +9,20 @@ Organisation du module :
    - start : Démarrage d'une conversation
    - handle_message : Traitement des messages
    - regenerate : Régénération de réponse
+   - edit_document : Retouche du dernier document
+   - cancel_generation : Annulation de la génération en cours
+   - get_types : Liste des types d'emails
+   - bulk_generate : Génération en masse (bulk.py)
 
 2. Interface admin (admin_ui.py) :
    - admin_prompts_page : Gestion des prompts
    - admin_users_page : Gestion des utilisateurs
-   - save_prompts : Sauvegarde des modifications
-   - add_email_type : Ajout d'un type d'email
-   - delete_email_type : Suppression d'un type d'email
-   - add_form_field : Ajout d'un champ de formulaire
-   - delete_form_field : Suppression d'un champ
-   - update_prompt : Mise à jour d'un prompt
+   - save_prompts : Sauvegarde des modifications (import au format prompts.json)
+   - download_prompts : Export au format prompts.json
+   - patch_prompts : Modifications groupées (types, champs, prompts, options)
+   - backends_status : État des serveurs Ollama
+   - cache_status : Statistiques du cache des générations
+   - model_status, preload_model, unload_model : Chargement du modèle
 
 3. Authentification (users.py) :
    - login_page, logout : Gestion des sessions
@@ -27,8 +31,15 @@ Organisation du module :
    - Gestion des comptes : add_user, delete_user, update_password
    - Utilitaires : load_users, render_users_table
 
-4. Configuration (shared.py) :
+4. Modèle Ollama (warmup.py) :
+   - start_warmup : Préchargement du modèle au démarrage
+   - check_capacity : Créneaux de génération suffisants pour les workers (admission.py)
+
+5. Configuration (shared.py, prompt_store.py) :
    - SECRET_KEY : Clé de chiffrement des sessions
+   - sync_prompts : Dernière version de la configuration des prompts
+   - apply_default_policy : Cache HTTP (no-store sauf politique propre à la route)
+   - init_assets : Fichiers CSS / JS regroupés par page (assets.py, build_assets.py)
    - Autres constantes et configurations partagées
 
 Note d'architecture :
@@ -46,7 +57,14 @@ from logic.chat import (
     index,          # GET / : Page d'accueil
     start,          # GET /start : Nouvelle conversation
     handle_message, # POST /message : Traitement des messages
-    regenerate      # GET /regen : Régénération de réponse
+    regenerate,     # GET /regen : Régénération de réponse
+    edit_document,  # POST /edit : Retouche du dernier document
+    cancel_generation, # POST /cancel : Annulation de la génération
+    get_types       # GET /types : Types d'emails (ETag, 304)
+)
+
+from logic.bulk import (
+    bulk_generate   # POST /bulk : Génération en masse (publipostage)
 )
 
 # --------------------------------------------------------------------------------
@@ -57,11 +75,15 @@ from logic.admin_ui import (
     admin_prompts_page,  # GET /admin : Interface prompts
     admin_users_page,    # GET /admin/users : Interface utilisateurs
     save_prompts,        # POST /admin/save : Sauvegarde des prompts
-    add_email_type,      # POST /admin/type/add : Ajout d'un type
-    delete_email_type,   # POST /admin/type/delete : Suppression d'un type
-    add_form_field,      # POST /admin/field/add : Ajout d'un champ
-    delete_form_field,   # POST /admin/field/delete : Suppression d'un champ
-    update_prompt        # POST /admin/prompt/update : Mise à jour d'un prompt
+    download_prompts,    # GET /admin/prompts/export : Export de prompts.json
+    patch_prompts,       # PATCH /admin/prompts : Modifications groupées (If-Match)
+    backends_status,     # GET /admin/backends : État des serveurs Ollama
+    cache_status,        # GET /admin/cache : Statistiques du cache
+    metrics_status,      # GET /admin/metrics : Percentiles de latence
+    prometheus_metrics,  # GET /metrics : Export Prometheus
+    model_status,        # GET /admin/model : Résidence du modèle
+    preload_model,       # POST /admin/model/preload : Préchargement
+    unload_model         # POST /admin/model/unload : Déchargement
 )
 
 # --------------------------------------------------------------------------------
@@ -92,12 +114,48 @@ from logic.users import (
     render_users_table  # Génère le HTML du tableau
 )
 
+# --------------------------------------------------------------------------------
+# MODÈLE OLLAMA
+# --------------------------------------------------------------------------------
+
+from logic.warmup import (
+    start_warmup  # Préchargement du modèle au démarrage
+)
+
+from logic.admission import (
+    check_capacity  # Avertit si les workers dépassent les créneaux configurés
+)
+
+# --------------------------------------------------------------------------------
+# JOURNALISATION
+# --------------------------------------------------------------------------------
+
+from logic.log import (
+    configure_logging,  # Journaux JSON non bloquants (au démarrage)
+    bind_request,       # Contexte de la requête (request_id, user_id)
+    current_request_id  # Identifiant renvoyé dans X-Request-ID
+)
+
 # --------------------------------------------------------------------------------
 # CONFIGURATION PARTAGÉE
 # --------------------------------------------------------------------------------
 
 from logic.shared import (
     SECRET_KEY,  # Clé de chiffrement des sessions
-    PROMPTS,     # Dictionnaire des prompts
+    get_prompts, # Configuration des prompts en vigueur
+    get_snapshot, # Configuration, templates et version (instantané)
     load_prompts # Fonction de chargement des prompts
 )
+
+from logic.prompt_store import (
+    sync_prompts  # Avant chaque requête : version en base de la configuration
+)
+
+from logic.http_cache import (
+    apply_static_policy,  # Fichiers construits : cache immuable
+    apply_default_policy  # Après chaque requête : no-store sauf politique de la route
+)
+
+from logic.assets import (
+    init_assets  # Fichiers CSS / JS construits (manifeste, asset_urls)
+)
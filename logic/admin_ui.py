@@ -4,15 +4,36 @@ admin_ui.py
 ──────────────────────────────────────────────────────────────
 Gère l'affichage de la page admin et la sauvegarde du fichier prompts.json :
 - Affiche les sections (prompts + utilisateurs),
-- Sauvegarde du fichier JSON,
-- Affichage de message d'erreur si besoin.
+- Enregistrement de la configuration des prompts (versions en base,
+  modifications de l'éditeur groupées en une requête PATCH avec If-Match,
+  import / export au format prompts.json),
+- Affichage de message d'erreur si besoin,
+- État des serveurs Ollama (répartition de charge),
+- Invalidation et statistiques du cache des générations,
+- Mesures de latence des générations (percentiles, export Prometheus),
+- Préchargement / déchargement du modèle sur les serveurs Ollama.
 """
 
 import json
-from flask import request, session, redirect, render_template, jsonify
+import hmac
+from flask import request, session, redirect, render_template, jsonify, Response
+from werkzeug.http import quote_etag
 import logic.shared as shared
 from logic.models import User
 from logic.database import db
+from logic.backends import get_pool
+from logic.cache import get_cache, invalidate_types, changed_types
+from logic.semantic_cache import get_semantic_cache
+from logic.dedup import get_flights, get_idempotency_store
+from logic.cancellation import get_cancellations
+from logic.kv_context import get_kv_contexts
+from logic.routing import get_router
+from logic.metrics import get_metrics
+from logic.prompt_store import (
+    PromptConflict, export_prompts, patch_prompt_config, prompts_etag, etag_version,
+    sync_prompts
+)
+from logic import warmup
 
 # ──────────────────────────────────────────────────────────────────────────────
 # INTERFACE D'ADMINISTRATION
@@ -20,18 +41,20 @@ from logic.database import db
 
 def admin_prompts_page():
     """Affiche la section prompts de l'interface d'administration avec la nouvelle interface interactive."""
-    # Recharge les prompts depuis le fichier à chaque affichage
-    shared.load_prompts()
-    
+    # Dernière version déjà installée par sync_prompts avant la requête
+    prompts = shared.get_prompts()
+
     # Structure les données pour le template
     prompts_data = {
-        "types": shared.PROMPTS["types"],
-        "form_fields": shared.PROMPTS["form_fields"],
-        "prompts": shared.PROMPTS["prompts"]
+        "types": prompts["types"],
+        "form_fields": prompts["form_fields"],
+        "prompts": prompts["prompts"],
+        "options": prompts.get("options", {})
     }
     
     return render_template("admin_prompts.html",
         prompts_data=prompts_data,
+        prompts_etag=quote_etag(prompts_etag()),
         current=session.get("admin_username")
     )
 
@@ -46,202 +69,230 @@ def admin_users_page():
     )
 
 # ──────────────────────────────────────────────────────────────────────────────
-# GESTION DES TYPES D'EMAILS
+# ÉDITION DE LA CONFIGURATION (PATCH /admin/prompts)
 # ──────────────────────────────────────────────────────────────────────────────
 
-def add_email_type():
-    """Ajoute un nouveau type d'email."""
-    try:
-        new_type = request.form.get("type_name")
-        if not new_type:
-            return jsonify({"success": False, "message": "Le nom du type est requis"})
-            
-        # Vérifie que le type n'existe pas déjà
-        if new_type in shared.PROMPTS["types"]:
-            return jsonify({"success": False, "message": "Ce type existe déjà"})
-            
-        # Ajoute le nouveau type
-        shared.PROMPTS["types"].append(new_type)
-        shared.PROMPTS["form_fields"][new_type] = []
-        shared.PROMPTS["prompts"][new_type] = ""
-        
-        # Sauvegarde les modifications
-        shared.update_prompts(shared.PROMPTS)
-        
-        return jsonify({
-            "success": True,
-            "message": f"Type '{new_type}' ajouté avec succès"
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Erreur lors de l'ajout du type : {str(e)}"
-        })
+def _patch_error(message, status, **extra):
+    """Réponse d'erreur de l'éditeur, avec l'ETag de la version installée."""
+    response = jsonify({"success": False, "message": message, **extra})
+    response.status_code = status
+    response.set_etag(prompts_etag())
+    return response
 
-def delete_email_type():
-    """Supprime un type d'email existant."""
-    try:
-        type_name = request.form.get("type_name")
-        if not type_name:
-            return jsonify({"success": False, "message": "Le nom du type est requis"})
-            
-        # Vérifie que le type existe
-        if type_name not in shared.PROMPTS["types"]:
-            return jsonify({"success": False, "message": "Ce type n'existe pas"})
-            
-        # Supprime le type et ses données associées
-        shared.PROMPTS["types"].remove(type_name)
-        del shared.PROMPTS["form_fields"][type_name]
-        del shared.PROMPTS["prompts"][type_name]
-        
-        # Sauvegarde les modifications
-        shared.update_prompts(shared.PROMPTS)
-        
-        return jsonify({
-            "success": True,
-            "message": f"Type '{type_name}' supprimé avec succès"
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Erreur lors de la suppression du type : {str(e)}"
-        })
+def patch_prompts():
+    """
+    Applique en une seule version les modifications en attente de l'éditeur
+    (types, champs, prompts, options de génération).
 
-# ──────────────────────────────────────────────────────────────────────────────
-# GESTION DES CHAMPS DE FORMULAIRE
-# ──────────────────────────────────────────────────────────────────────────────
+    Requête :
+    - Corps : liste d'opérations de type JSON Patch (voir prompt_patch.py)
+    - En-tête If-Match : ETag de la version sur laquelle portent les
+      modifications (obligatoire)
 
-def add_form_field():
-    """Ajoute un nouveau champ à un type d'email."""
-    try:
-        type_name = request.form.get("type_name")
-        field_id = request.form.get("field_id")
-        field_label = request.form.get("field_label")
-        field_type = request.form.get("field_type", "text")
-        
-        if not all([type_name, field_id, field_label]):
-            return jsonify({"success": False, "message": "Tous les champs sont requis"})
-            
-        # Vérifie que le type existe
-        if type_name not in shared.PROMPTS["types"]:
-            return jsonify({"success": False, "message": "Ce type n'existe pas"})
-            
-        # Vérifie que l'ID n'est pas déjà utilisé
-        if any(f["id"] == field_id for f in shared.PROMPTS["form_fields"][type_name]):
-            return jsonify({"success": False, "message": "Cet ID est déjà utilisé"})
-            
-        # Ajoute le nouveau champ
-        shared.PROMPTS["form_fields"][type_name].append({
-            "id": field_id,
-            "label": field_label,
-            "type": field_type
-        })
-        
-        # Sauvegarde les modifications
-        shared.update_prompts(shared.PROMPTS)
-        
-        return jsonify({
-            "success": True,
-            "message": f"Champ '{field_label}' ajouté avec succès"
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Erreur lors de l'ajout du champ : {str(e)}"
-        })
+    Réponses :
+    - 200 : nouvelle configuration (normalisée), nouvel ETag
+    - 400 : opération ou configuration obtenue invalide (rien n'est écrit)
+    - 412 : un autre administrateur a enregistré une version entre-temps
+    - 428 : If-Match absent
+    """
+    if not request.if_match:
+        return _patch_error("En-tête If-Match requis (ETag de la configuration éditée)", 428)
+    if request.if_match.star_tag:
+        expected = shared.get_prompts_version()
+    else:
+        versions = [etag_version(tag) for tag in request.if_match.as_set()]
+        versions = [v for v in versions if v is not None]
+        if len(versions) != 1:
+            return _patch_error("If-Match doit désigner une seule version de la configuration", 412)
+        expected = versions[0]
 
-def delete_form_field():
-    """Supprime un champ d'un type d'email."""
     try:
-        type_name = request.form.get("type_name")
-        field_id = request.form.get("field_id")
-        
-        if not all([type_name, field_id]):
-            return jsonify({"success": False, "message": "Tous les champs sont requis"})
-            
-        # Vérifie que le type existe
-        if type_name not in shared.PROMPTS["types"]:
-            return jsonify({"success": False, "message": "Ce type n'existe pas"})
-            
-        # Trouve et supprime le champ
-        fields = shared.PROMPTS["form_fields"][type_name]
-        field = next((f for f in fields if f["id"] == field_id), None)
-        
-        if not field:
-            return jsonify({"success": False, "message": "Ce champ n'existe pas"})
-            
-        fields.remove(field)
-        
-        # Sauvegarde les modifications
-        shared.update_prompts(shared.PROMPTS)
-        
-        return jsonify({
-            "success": True,
-            "message": f"Champ '{field['label']}' supprimé avec succès"
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Erreur lors de la suppression du champ : {str(e)}"
-        })
+        previous = _generation_settings(shared.get_prompts())
+        version = patch_prompt_config(
+            request.get_json(force=True, silent=True),
+            expected,
+            author=session.get("admin_username")
+        )
+    except PromptConflict:
+        sync_prompts(force=True)
+        return _patch_error(
+            "La configuration a été modifiée par un autre administrateur : "
+            "rechargez la page pour repartir de la dernière version",
+            412,
+            prompts=shared.get_prompts()
+        )
+    except ValueError as e:
+        return _patch_error(str(e), 400)
 
-# ──────────────────────────────────────────────────────────────────────────────
-# GESTION DES PROMPTS
-# ──────────────────────────────────────────────────────────────────────────────
+    # Les générations produites avec un prompt ou des options modifiés ne sont plus valables
+    invalidate_types(changed_types(previous, _generation_settings(shared.get_prompts())))
 
-def update_prompt():
-    """Met à jour le prompt d'un type d'email."""
-    try:
-        type_name = request.form.get("type_name")
-        prompt_text = request.form.get("prompt_text")
-        
-        if not all([type_name, prompt_text]):
-            return jsonify({"success": False, "message": "Tous les champs sont requis"})
-            
-        # Vérifie que le type existe
-        if type_name not in shared.PROMPTS["types"]:
-            return jsonify({"success": False, "message": "Ce type n'existe pas"})
-            
-        # Met à jour le prompt
-        shared.PROMPTS["prompts"][type_name] = prompt_text
-        
-        # Sauvegarde les modifications
-        shared.update_prompts(shared.PROMPTS)
-        
-        return jsonify({
-            "success": True,
-            "message": "Prompt mis à jour avec succès"
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Erreur lors de la mise à jour du prompt : {str(e)}"
-        })
+    response = jsonify({
+        "success": True,
+        "message": "Modifications enregistrées",
+        "version": version,
+        "prompts": shared.get_prompts()
+    })
+    response.set_etag(prompts_etag(version))
+    return response
 
 # ──────────────────────────────────────────────────────────────────────────────
-# SAUVEGARDE DU FICHIER PROMPTS.JSON
+# IMPORT / EXPORT AU FORMAT PROMPTS.JSON
 # ──────────────────────────────────────────────────────────────────────────────
 
+def _generation_settings(data: dict) -> dict:
+    """Prompt et options de chaque type : ce qui détermine le texte généré."""
+    options = data.get("options") or {}
+    return {
+        email_type: [prompt, options.get(email_type)]
+        for email_type, prompt in (data.get("prompts") or {}).items()
+    }
+
 def save_prompts():
     """
-    Sauvegarde les modifications apportées à prompts.json.
+    Remplace toute la configuration (import d'un fichier au format prompts.json).
     Fonction appelée par requête AJAX : retourne un message sans redirection.
     """
     try:
         new_data = request.form.get("prompts_json", "")
         parsed = json.loads(new_data)
+        previous = _generation_settings(shared.get_prompts())
 
-        # Écriture dans le fichier
-        with open(shared.PROMPTS_PATH, "w", encoding="utf-8") as f:
-            json.dump(parsed, f, indent=2, ensure_ascii=False)
+        # Validation (structure, options, templates) puis nouvelle version en base
+        shared.update_prompts(parsed, author=session.get("admin_username"))
 
-        # Recharge immédiate en mémoire
-        shared.update_prompts(parsed)
+        # Invalide le cache des types dont le prompt ou les options ont changé
+        invalidate_types(changed_types(previous, _generation_settings(shared.get_prompts())))
 
         # Maintient la session active
         session.modified = True
 
         return "OK", 200
 
+    except PromptConflict as e:
+        return str(e), 409
     except Exception as e:
         return f"Erreur lors de la sauvegarde : {e}", 400
+
+def download_prompts():
+    """Télécharge la configuration en vigueur au format prompts.json."""
+    response = Response(
+        export_prompts(),
+        mimetype="application/json",
+        headers={
+            "Content-Disposition": "attachment; filename=prompts.json",
+            "X-Prompts-Version": str(shared.get_prompts_version())
+        }
+    )
+    response.set_etag(prompts_etag())
+    return response
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ÉTAT DES SERVEURS OLLAMA
+# ──────────────────────────────────────────────────────────────────────────────
+
+def backends_status():
+    """
+    Retourne l'état du routage vers les serveurs Ollama pour ce worker :
+    requêtes en cours, santé, présence du modèle et dernières erreurs,
+    ainsi que le choix des modèles (repli sous charge ou sur erreur).
+    """
+    return jsonify({**get_pool().snapshot(), "routing": get_router().snapshot()})
+
+# ──────────────────────────────────────────────────────────────────────────────
+# CACHE DES GÉNÉRATIONS
+# ──────────────────────────────────────────────────────────────────────────────
+
+def cache_status():
+    """
+    Retourne les compteurs des caches de génération pour ce worker :
+    - exact : succès (mémoire / SQLite), échecs, évictions et invalidations
+    - semantic : taux de succès et temps de génération économisé
+    - dedup : générations partagées et requêtes rejouées (Idempotency-Key)
+    - cancellation : générations annulées (bouton Stop, /start, déconnexion)
+    - kv_context : reprises du contexte évalué et temps d'évaluation du prompt économisé
+    """
+    cache = get_cache()
+    semantic = get_semantic_cache()
+    return jsonify({
+        "exact": cache.stats() if cache is not None else {"enabled": False},
+        "semantic": semantic.stats() if semantic is not None else {"enabled": False},
+        "dedup": {**get_flights().snapshot(), "replays": get_idempotency_store().replays},
+        "cancellation": get_cancellations().snapshot(),
+        "kv_context": get_kv_contexts().snapshot()
+    })
+
+# ──────────────────────────────────────────────────────────────────────────────
+# MESURES DE LATENCE
+# ──────────────────────────────────────────────────────────────────────────────
+
+def metrics_status():
+    """
+    Retourne les percentiles (p50, p95, p99) de latence des générations par
+    type d'email et par modèle, tous workers confondus :
+    attente dans la file, premier token, durée totale et débit (tokens/s).
+
+    Paramètre optionnel : ?window=secondes (METRICS_RETENTION par défaut).
+    """
+    try:
+        window = float(request.args.get("window") or 0) or None
+    except ValueError:
+        window = None
+    return jsonify({
+        "window": window or shared.METRICS_RETENTION,
+        "generations": get_metrics().summary(window)
+    })
+
+def prometheus_metrics():
+    """
+    Exporte les compteurs et histogrammes des générations au format texte
+    Prometheus. Accès fermé par défaut : session administrateur, ou en-tête
+    "Authorization: Bearer <jeton>" si METRICS_TOKEN est défini (404 sans
+    jeton configuré, 401 si le jeton est absent ou faux).
+    """
+    if not session.get("admin_logged_in"):
+        if not shared.METRICS_TOKEN:
+            return Response("Introuvable\n", status=404, mimetype="text/plain")
+        expected = f"Bearer {shared.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return Response("Non autorisé\n", status=401, mimetype="text/plain")
+    return Response(get_metrics().prometheus(), mimetype="text/plain; version=0.0.4")
+
+# ──────────────────────────────────────────────────────────────────────────────
+# CHARGEMENT DU MODÈLE
+# ──────────────────────────────────────────────────────────────────────────────
+
+def model_status():
+    """
+    Retourne l'état du modèle sur chaque serveur Ollama :
+    résidence en mémoire, expiration et chargements à froid observés.
+    """
+    return jsonify(warmup.model_status())
+
+def _model_action_response(results, verb):
+    """Réponse commune au préchargement et au déchargement."""
+    failed = [r for r in results if not r["success"]]
+    if failed:
+        return jsonify({
+            "success": False,
+            "message": "; ".join(r["error"] for r in failed),
+            "results": results
+        })
+    return jsonify({
+        "success": True,
+        "message": f"Modèle {shared.MODEL_NAME} {verb} sur {len(results)} serveur(s)",
+        "results": results
+    })
+
+def preload_model():
+    """Précharge le modèle sur tous les serveurs Ollama (reprend le maintien à chaud)."""
+    warmup.resume_keep_warm()
+    return _model_action_response(warmup.preload_all(), "préchargé")
+
+def unload_model():
+    """
+    Décharge le modèle de tous les serveurs Ollama (libère la mémoire) et
+    suspend le maintien à chaud de tous les workers jusqu'au lendemain.
+    """
+    warmup.pause_keep_warm()
+    return _model_action_response(warmup.unload_all(), "déchargé")
@@ -0,0 +1,350 @@
+# logic/admission.py
+"""
+admission.py
+--------------------------------------------------------------------------------
+Contrôle d'admission des générations vers Ollama.
+
+Problème résolu :
+Sans limite, toutes les générations arrivent simultanément sur Ollama qui,
+une fois saturé, ralentit tout le monde en même temps.
+
+Fonctionnement :
+1. Capacité :
+   - OLLAMA_SLOTS_PER_BACKEND générations simultanées par serveur disponible,
+     tous workers confondus
+   - Les compteurs sont tenus par processus (par worker Gunicorn) : chaque
+     worker reçoit sa part, OLLAMA_SLOTS_PER_BACKEND × serveurs / GUNICORN_WORKERS
+     (au moins une génération). Un worker ne prête pas ses créneaux libres
+     aux autres
+   - La limite porte sur le total des générations, pas sur chaque serveur :
+     la répartition entre serveurs est celle de backends.py (le moins chargé)
+   - Avec plus de workers que de créneaux, chaque worker garde une génération :
+     le total admis (GUNICORN_WORKERS) dépasse alors la limite voulue
+     (avertissement au démarrage, voir check_capacity)
+   - La capacité suit le nombre de serveurs sains (voir backends.py)
+
+2. File d'attente à priorités :
+   - PRIORITY_INTERACTIVE : chat des utilisateurs
+   - PRIORITY_ADMIN : tests effectués par les administrateurs
+   - PRIORITY_BULK : générations en masse
+   - À priorité égale, premier arrivé, premier servi
+
+3. Délestage :
+   - File pleine (GENERATION_QUEUE_MAX) : refus immédiat (HTTP 429)
+   - Attente trop longue (GENERATION_QUEUE_TIMEOUT) : abandon (HTTP 503)
+   - Retry-After estimé à partir de la durée moyenne des générations
+
+Usage :
+    ticket = get_admission().enqueue(PRIORITY_INTERACTIVE)   # peut lever Overloaded
+    with ticket:
+        while not ticket.wait(1.0):                          # peut lever Overloaded
+            ... ticket.position() ...
+        ... génération ...
+
+    En asyncio, ticket.subscribe() signale admission et changements de
+    position : l'attente ne sonde pas la file (voir chat_async.py).
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+
+import logic.shared as shared
+from logic.backends import get_pool
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------------
+# PRIORITÉS
+# --------------------------------------------------------------------------------
+
+PRIORITY_INTERACTIVE = 0  # Chat des utilisateurs
+PRIORITY_ADMIN = 1        # Tests des administrateurs
+PRIORITY_BULK = 2         # Générations en masse
+
+# --------------------------------------------------------------------------------
+# EXCEPTIONS
+# --------------------------------------------------------------------------------
+
+class Overloaded(Exception):
+    """
+    Génération refusée faute de capacité.
+
+    Attributs :
+        status (int) : 429 (file pleine) ou 503 (attente trop longue)
+        retry_after (int) : Délai conseillé avant une nouvelle tentative (secondes)
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+# --------------------------------------------------------------------------------
+# TICKET D'ADMISSION
+# --------------------------------------------------------------------------------
+
+class Ticket:
+    """Place réservée dans la file d'attente, puis créneau de génération."""
+
+    def __init__(self, controller, priority, seq):
+        self.controller = controller
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.released = False
+        self._listeners = []
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def admitted(self):
+        return self.admitted_at is not None
+
+    @property
+    def queue_time(self):
+        """Temps passé dans la file (secondes)."""
+        end = self.admitted_at if self.admitted else time.monotonic()
+        return end - self.enqueued_at
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Attend l'admission au plus timeout secondes.
+
+        Returns:
+            bool: True si le ticket est admis, False s'il est toujours en file
+
+        Raises:
+            Overloaded: Si l'attente totale dépasse GENERATION_QUEUE_TIMEOUT
+        """
+        return self.controller._wait(self, timeout)
+
+    def position(self) -> int:
+        """Position dans la file (1 = prochain servi, 0 = admis)."""
+        return self.controller._position(self)
+
+    def time_left(self) -> float:
+        """Attente restante avant GENERATION_QUEUE_TIMEOUT (secondes)."""
+        return max(0.0, self.enqueued_at + self.controller.max_wait - time.monotonic())
+
+    def subscribe(self, callback):
+        """
+        Appelle callback à chaque évolution de la file : admission du ticket,
+        libération, ou changement de position. Appelé sous le verrou du
+        contrôleur, depuis n'importe quel thread : callback doit être immédiat
+        (ex. loop.call_soon_threadsafe(event.set)).
+        """
+        self.controller._subscribe(self, callback)
+
+    def release(self):
+        """Libère le créneau (ou la place dans la file). Idempotent."""
+        self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+# --------------------------------------------------------------------------------
+# CONTRÔLEUR
+# --------------------------------------------------------------------------------
+
+class AdmissionController:
+    """File d'attente à priorités bornant les générations simultanées."""
+
+    def __init__(self, slots_per_backend, max_queue, max_wait, backend_count=None, workers=1):
+        self.slots_per_backend = slots_per_backend
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._backend_count = backend_count or (lambda: get_pool().available_count())
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self.in_flight = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Durée moyenne d'une génération (moyenne mobile exponentielle)
+        self.avg_service_time = 10.0
+
+    def capacity(self):
+        """Générations simultanées admises par ce worker (sa part des créneaux)."""
+        return max(1, self.slots_per_backend * self._backend_count() // self.workers)
+
+    def retry_after(self):
+        """Estimation du délai avant qu'une place se libère (secondes)."""
+        waiting = len(self._queue) + 1
+        return max(1, math.ceil(waiting * self.avg_service_time / self.capacity()))
+
+    def enqueue(self, priority=PRIORITY_INTERACTIVE) -> Ticket:
+        """
+        Réserve une place dans la file.
+
+        Raises:
+            Overloaded: (429) Si la file est déjà pleine
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queue and self.in_flight >= self.capacity():
+                self.rejected += 1
+                raise Overloaded(
+                    "Trop de générations en attente",
+                    status=429,
+                    retry_after=self.retry_after()
+                )
+            ticket = Ticket(self, priority, next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            # Les tickets de priorité inférieure reculent d'une place
+            self._notify_locked(*(other for other in self._queue if ticket < other))
+            self._admit_locked()
+            return ticket
+
+    def _admit_locked(self):
+        """Admet les premiers tickets de la file tant qu'il reste de la capacité."""
+        capacity = self.capacity()
+        admitted = False
+        while self._queue and self.in_flight < capacity:
+            ticket = heapq.heappop(self._queue)
+            ticket.admitted_at = time.monotonic()
+            self.in_flight += 1
+            self._notify_locked(ticket)
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+            self._notify_locked(*self._queue)
+
+    def _subscribe(self, ticket, callback):
+        with self._cond:
+            ticket._listeners.append(callback)
+            if ticket.admitted or ticket.released:
+                callback()
+
+    def _notify_locked(self, *tickets):
+        """Prévient les abonnés (attente asynchrone, voir Ticket.subscribe)."""
+        for ticket in tickets:
+            for callback in ticket._listeners:
+                callback()
+
+    def _wait(self, ticket, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not ticket.admitted:
+                if ticket.released:
+                    return False
+                expires = ticket.enqueued_at + self.max_wait
+                now = time.monotonic()
+                if now >= expires:
+                    self._remove_locked(ticket)
+                    self.timed_out += 1
+                    raise Overloaded(
+                        "Délai d'attente dépassé dans la file de génération",
+                        status=503,
+                        retry_after=self.retry_after()
+                    )
+                if deadline is not None and now >= deadline:
+                    return False
+                # Réveil au plus tard toutes les secondes : la capacité peut
+                # augmenter sans notification (serveur réintégré)
+                limit = min(expires, deadline if deadline is not None else expires, now + 1.0)
+                self._cond.wait(max(0.0, limit - now))
+                self._admit_locked()
+            return True
+
+    def _position(self, ticket):
+        with self._cond:
+            if ticket.admitted:
+                return 0
+            return 1 + sum(1 for other in self._queue if other < ticket)
+
+    def _remove_locked(self, ticket):
+        ticket.released = True
+        self._notify_locked(ticket)
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._notify_locked(*self._queue)
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket.released:
+                return
+            if ticket.admitted:
+                duration = time.monotonic() - ticket.admitted_at
+                self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * duration
+                self.in_flight -= 1
+            self._remove_locked(ticket)
+            self._admit_locked()
+
+    def queued(self):
+        """Générations en attente d'admission."""
+        with self._cond:
+            return len(self._queue)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "capacity": self.capacity(),
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_service_time": round(self.avg_service_time, 2)
+            }
+
+# --------------------------------------------------------------------------------
+# CONTRÔLEUR DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_admission() -> AdmissionController:
+    """Retourne le contrôleur d'admission du processus."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    shared.OLLAMA_SLOTS_PER_BACKEND,
+                    shared.GENERATION_QUEUE_MAX,
+                    shared.GENERATION_QUEUE_TIMEOUT,
+                    workers=shared.GUNICORN_WORKERS
+                )
+    return _controller
+
+def check_capacity(backend_count=None):
+    """
+    Signale au démarrage une configuration où la part minimale d'un worker
+    (une génération) fait dépasser OLLAMA_SLOTS_PER_BACKEND × serveurs.
+
+    Returns:
+        bool: True si la limite configurée peut être respectée
+    """
+    if backend_count is None:
+        backend_count = len(get_pool().backends)
+    slots = shared.OLLAMA_SLOTS_PER_BACKEND * backend_count
+    if shared.GUNICORN_WORKERS <= slots:
+        return True
+    logger.warning(
+        "Plus de workers que de créneaux de génération : augmenter "
+        "OLLAMA_SLOTS_PER_BACKEND ou réduire GUNICORN_WORKERS",
+        extra={"workers": shared.GUNICORN_WORKERS, "slots": slots}
+    )
+    return False
+
+def _reset_controller():
+    """Après un fork, chaque worker repart avec sa propre file vide."""
+    global _controller, _controller_lock
+    _controller = None
+    _controller_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_controller)
@@ -0,0 +1,97 @@
+# logic/assets.py
+"""
+assets.py
+--------------------------------------------------------------------------------
+Fichiers CSS / JS de chaque page : regroupés, minifiés et nommés d'après
+leur contenu par build_assets.py.
+
+Problème résolu :
+Chaque page chargeait jusqu'à dix fichiers séparés, non minifiés et non
+compressés : autant d'allers-retours sur les liaisons lentes des agences,
+et une revalidation de chacun une fois le délai de cache écoulé.
+
+Fonctionnement :
+1. Regroupements (BUNDLES) :
+   - Un fichier CSS et un fichier JS par page, dans l'ordre de chargement
+     d'origine des fichiers de static/
+2. Construction (python build_assets.py, à chaque déploiement) :
+   - static/dist/<regroupement>.<empreinte>.<ext>, variantes .gz et .br
+   - static/dist/manifest.json : nom du regroupement → fichier construit
+3. Templates :
+   - {% for url in asset_urls("index.js") %} : le fichier construit si le
+     manifeste existe (et ASSETS_BUNDLES=1), sinon les fichiers sources
+   - Les fichiers construits ne changent jamais de contenu : mis en cache
+     un an, "immutable" (voir http_cache.py et la configuration Nginx de
+     build_assets.py)
+
+Le manifeste est lu au démarrage : relancer les workers après une construction.
+"""
+
+import json
+import logging
+import os
+import re
+
+from flask import url_for
+
+import logic.shared as shared
+
+logger = logging.getLogger(__name__)
+
+# Répertoires (relatifs à static/ pour les URL)
+STATIC_DIR = os.path.join(shared.BASE_DIR, "../static")
+DIST = "dist"
+MANIFEST_PATH = os.path.join(STATIC_DIR, DIST, "manifest.json")
+
+# Regroupements par page, fichiers dans l'ordre de chargement
+BUNDLES = {
+    # index.html
+    "index.css": ["base.css", "animations.css", "chat.css", "forms.css"],
+    "index.js": ["ui.js", "forms.js", "chat.js", "particles.js"],
+    # login.html, login_user.html, signup.html
+    "login.css": ["base.css", "forms.css", "login.css", "animations.css"],
+    "login.js": ["particles.js"],
+    # admin_prompts.html, admin_users.html
+    "admin.css": ["base.css", "admin.css", "animations.css"],
+    "admin_prompts.js": [
+        "admin.js", "admin_prompts_data.js", "admin_prompts.js",
+        "admin_model.js", "admin_metrics.js", "particles.js"
+    ],
+    "admin_users.js": ["admin.js", "admin_users.js", "particles.js"],
+}
+
+# Fichier construit : nom.<empreinte hexadécimale>.ext
+FINGERPRINTED = re.compile(rf"^{DIST}/[\w.-]+\.[0-9a-f]{{12}}\.(css|js)(\.gz|\.br)?$")
+
+# Regroupement → chemin du fichier construit (relatif à static/), None = sources
+_manifest = None
+
+def load_manifest():
+    """Lit le manifeste produit par build_assets.py (absent : fichiers sources)."""
+    global _manifest
+    _manifest = None
+    if not shared.ASSETS_BUNDLES:
+        return
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            _manifest = json.load(f)["bundles"]
+    except FileNotFoundError:
+        logger.info("Fichiers statiques non construits : chargement des sources "
+                    "(python build_assets.py)")
+    except (ValueError, KeyError) as e:
+        logger.warning("Manifeste des fichiers statiques illisible", extra={"error": str(e)})
+
+def asset_urls(bundle: str) -> list:
+    """URL à charger pour un regroupement : le fichier construit, ou ses sources."""
+    if _manifest and bundle in _manifest:
+        return [url_for("static", filename=_manifest[bundle])]
+    return [url_for("static", filename=name) for name in BUNDLES[bundle]]
+
+def is_fingerprinted(filename: str) -> bool:
+    """Fichier construit, dont le nom change avec le contenu (cache immuable)."""
+    return bool(filename and FINGERPRINTED.match(filename))
+
+def init_assets(app):
+    """Lit le manifeste et rend asset_urls() disponible dans les templates."""
+    load_manifest()
+    app.jinja_env.globals["asset_urls"] = asset_urls
@@ -0,0 +1,440 @@
+# logic/backends.py
+"""
+backends.py
+--------------------------------------------------------------------------------
+Répartition des générations entre plusieurs serveurs Ollama.
+
+Responsabilités :
+1. Configuration :
+   - shared.OLLAMA_URL peut contenir plusieurs URLs séparées par des virgules
+   - Le pool est reconstruit si la configuration change à chaud
+
+2. Répartition de charge :
+   - Chaque génération est envoyée au serveur disponible ayant
+     le moins de requêtes en cours (least outstanding requests)
+   - Sauf reprise d'un contexte : la génération retourne au serveur qui
+     le détient (voir kv_context.py)
+   - Les compteurs sont tenus par processus (un pool par worker Gunicorn)
+
+3. Surveillance et disjoncteur (circuit breaker) par serveur :
+   - Sonde périodique de /api/tags (thread de fond)
+   - Vérifie que MODEL_NAME est présent sur le serveur
+   - Fermé : le serveur reçoit des générations
+   - Ouvert : après OLLAMA_FAILURE_THRESHOLD échecs consécutifs (sonde ou
+     génération), le serveur est écarté pendant OLLAMA_CIRCUIT_COOLDOWN
+     secondes (doublées à chaque essai manqué, jusqu'à OLLAMA_CIRCUIT_MAX_COOLDOWN)
+   - Semi-ouvert : le délai écoulé, une seule génération d'essai est
+     envoyée ; son succès (ou celui d'une sonde) referme le circuit
+   - Tous les circuits ouverts : échec immédiat (BackendsUnavailable) au
+     lieu d'attendre le délai de connexion d'un serveur en redémarrage
+
+4. Chargement du modèle :
+   - record_load() comptabilise les chargements à froid (load_duration)
+   - État de résidence du modèle tenu à jour par warmup.py
+
+5. Inspection :
+   - snapshot() expose l'état de chaque serveur (voir /admin/backends)
+
+6. Premier token (requêtes doublées, voir ollama_client.py) :
+   - record_ttft() retient les délais récents avant le premier token
+   - hedge_delay() : délai au-delà duquel une génération est doublée vers un
+     second serveur (percentile OLLAMA_HEDGE_PERCENTILE de ces délais)
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+import logic.shared as shared
+
+# --------------------------------------------------------------------------------
+# OUTILS
+# --------------------------------------------------------------------------------
+
+def parse_backend_urls(value: str) -> list:
+    """Découpe la valeur de OLLAMA_URL en liste d'URLs normalisées."""
+    return [url.strip().rstrip("/") for url in (value or "").split(",") if url.strip()]
+
+def model_matches(available: str, wanted: str) -> bool:
+    """
+    Compare un nom de modèle renvoyé par /api/tags au modèle configuré.
+    Ollama ajoute le tag ":latest" quand aucun tag n'est précisé.
+    """
+    if available == wanted:
+        return True
+    if ":" not in wanted:
+        return available == f"{wanted}:latest"
+    return False
+
+# --------------------------------------------------------------------------------
+# EXCEPTIONS
+# --------------------------------------------------------------------------------
+
+class BackendsUnavailable(ValueError):
+    """
+    Tous les circuits sont ouverts : la génération échoue sans attendre.
+
+    Attributs :
+        retry_after (int) : Délai avant le prochain essai d'un serveur (secondes)
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(
+            f"Serveurs Ollama indisponibles, nouvel essai dans {retry_after} s"
+        )
+        self.retry_after = retry_after
+
+# --------------------------------------------------------------------------------
+# SERVEUR OLLAMA
+# --------------------------------------------------------------------------------
+
+# États du disjoncteur d'un serveur
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+class Backend:
+    """
+    État d'un serveur Ollama vu par ce processus.
+
+    Attributs :
+        url (str) : URL de base du serveur
+        in_flight (int) : Générations en cours sur ce serveur
+        circuit (str) : État du disjoncteur (closed, open, half_open)
+        open_until (float|None) : Fin de l'ouverture du circuit (time.monotonic)
+        trips (int) : Ouvertures successives sans succès (allonge le délai)
+        healthy (bool) : False si le serveur est écarté (circuit non fermé)
+        model_available (bool|None) : MODEL_NAME présent (None = pas encore sondé)
+        consecutive_failures (int) : Échecs consécutifs depuis le dernier succès
+        total_requests (int) : Générations envoyées depuis le démarrage
+        last_error (str|None) : Dernière erreur observée
+        last_check (float|None) : Horodatage de la dernière sonde
+        model_resident (bool|None) : Modèle chargé en mémoire (None = inconnu)
+        resident_until (str|None) : Expiration du maintien en mémoire (selon Ollama)
+        cold_loads (int) : Générations ayant subi un chargement du modèle
+        last_load_duration (float|None) : Dernier temps de chargement observé (secondes)
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.in_flight = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.open_until = None
+        self.trips = 0
+        self.model_available = None
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.last_error = None
+        self.last_check = None
+        self.model_resident = None
+        self.resident_until = None
+        self.cold_loads = 0
+        self.last_load_duration = None
+
+    @property
+    def healthy(self):
+        return self.circuit == CIRCUIT_CLOSED
+
+    @property
+    def available(self):
+        """Serveur utilisable : sain et disposant du modèle (ou pas encore sondé)."""
+        return self.healthy and self.model_available is not False
+
+    def snapshot(self):
+        return {
+            "url": self.url,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "open_for": round(max(0.0, self.open_until - time.monotonic()), 1)
+                        if self.circuit == CIRCUIT_OPEN else None,
+            "model_available": self.model_available,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "last_error": self.last_error,
+            "last_check": self.last_check,
+            "model_resident": self.model_resident,
+            "resident_until": self.resident_until,
+            "cold_loads": self.cold_loads,
+            "last_load_duration": self.last_load_duration
+        }
+
+# --------------------------------------------------------------------------------
+# POOL DE SERVEURS
+# --------------------------------------------------------------------------------
+
+class BackendPool:
+    """Ensemble des serveurs Ollama configurés, avec répartition et surveillance."""
+
+    def __init__(self, urls, model, failure_threshold=3, health_interval=15.0):
+        self.backends = [Backend(url) for url in urls]
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._prober = None
+        self._stopped = threading.Event()
+        self._ttfts = deque(maxlen=200)  # Délais récents avant le premier token
+        self.fast_failures = 0           # Générations refusées, tous circuits ouverts
+        self.hedged = 0                  # Générations doublées
+        self.hedge_wins = 0              # ... dont la copie a répondu la première
+
+    # ---- Répartition --------------------------------------------------------
+
+    def choose(self) -> Backend:
+        """
+        Choisit le serveur disponible ayant le moins de requêtes en cours.
+
+        Raises:
+            BackendsUnavailable: Si tous les circuits sont ouverts
+        """
+        with self._lock:
+            return self._choose_locked()
+
+    def _choose_locked(self, exclude=()):
+        if not self.backends:
+            raise ValueError("Aucun serveur Ollama configuré (OLLAMA_URL)")
+        candidates = [b for b in self.backends if b.available and b not in exclude]
+        if not candidates:
+            # Circuit ouvert dont le délai est écoulé : une génération d'essai
+            now = time.monotonic()
+            due = [b for b in self.backends
+                   if b.circuit == CIRCUIT_OPEN and b.open_until <= now and b not in exclude]
+            if due:
+                backend = min(due, key=lambda b: b.open_until)
+                backend.circuit = CIRCUIT_HALF_OPEN
+                return backend
+            # Circuit fermé mais modèle absent (ou non sondé) : on tente quand même
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+        if not candidates:
+            self.fast_failures += 1
+            raise BackendsUnavailable(self._retry_after_locked())
+        return min(candidates, key=lambda b: (b.in_flight, b.total_requests))
+
+    def _retry_after_locked(self):
+        """Délai avant la fin de la première ouverture de circuit (secondes)."""
+        now = time.monotonic()
+        waits = [b.open_until - now for b in self.backends if b.circuit == CIRCUIT_OPEN]
+        return max(1, math.ceil(min(waits))) if waits else 1
+
+    @contextmanager
+    def acquire(self, prefer=None, exclude=()):
+        """
+        Réserve un serveur pour la durée d'une génération.
+
+        prefer : URL du serveur qui détient déjà le contexte de la conversation
+        (voir kv_context.py), retenu tant qu'il est disponible.
+        exclude : serveurs à éviter (copie d'une génération doublée).
+
+        Usage :
+            with pool.acquire() as backend:
+                ... requête vers backend.url ...
+
+        Raises:
+            BackendsUnavailable: Si tous les circuits sont ouverts
+        """
+        with self._lock:
+            preferred = [b for b in self.backends
+                         if b.url == prefer and b.available and b not in exclude]
+            backend = preferred[0] if preferred else self._choose_locked(exclude)
+            backend.in_flight += 1
+            backend.total_requests += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.in_flight -= 1
+                if backend.circuit == CIRCUIT_HALF_OPEN:
+                    # Essai interrompu sans verdict (annulation) : prochain essai possible
+                    backend.circuit = CIRCUIT_OPEN
+
+    def mark_success(self, backend):
+        """Referme le circuit et réinitialise le compteur d'échecs après un succès."""
+        with self._lock:
+            backend.consecutive_failures = 0
+            backend.trips = 0
+            backend.circuit = CIRCUIT_CLOSED
+            backend.open_until = None
+
+    def mark_failure(self, backend, error):
+        """
+        Comptabilise un échec : ouvre le circuit au-delà du seuil, ou le
+        rouvre (délai doublé) si c'était la génération d'essai.
+        """
+        with self._lock:
+            backend.consecutive_failures += 1
+            backend.last_error = str(error)
+            if backend.circuit == CIRCUIT_HALF_OPEN or (
+                    backend.circuit == CIRCUIT_CLOSED
+                    and backend.consecutive_failures >= self.failure_threshold):
+                self._open_locked(backend)
+
+    def _open_locked(self, backend):
+        cooldown = min(
+            shared.OLLAMA_CIRCUIT_COOLDOWN * 2 ** backend.trips,
+            shared.OLLAMA_CIRCUIT_MAX_COOLDOWN
+        )
+        backend.trips += 1
+        backend.circuit = CIRCUIT_OPEN
+        backend.open_until = time.monotonic() + cooldown
+
+    # ---- Premier token et requêtes doublées ---------------------------------
+
+    def record_ttft(self, seconds):
+        """Délai avant le premier token d'une génération (depuis l'envoi)."""
+        with self._lock:
+            self._ttfts.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Délai après lequel une génération sans premier token est doublée
+        vers un second serveur, ou None (désactivé, un seul serveur
+        disponible ou moins de 20 mesures).
+        """
+        if shared.OLLAMA_HEDGE_PERCENTILE <= 0:
+            return None
+        with self._lock:
+            if sum(1 for b in self.backends if b.available) < 2 or len(self._ttfts) < 20:
+                return None
+            ttfts = sorted(self._ttfts)
+        index = min(len(ttfts) - 1, int(shared.OLLAMA_HEDGE_PERCENTILE / 100 * len(ttfts)))
+        return max(shared.OLLAMA_HEDGE_MIN_DELAY, ttfts[index])
+
+    def record_hedge(self, won):
+        """Comptabilise une génération doublée (won : la copie a répondu la première)."""
+        with self._lock:
+            self.hedged += 1
+            if won:
+                self.hedge_wins += 1
+
+    def record_load(self, backend, load_duration, count_cold=True):
+        """
+        Enregistre le temps de chargement du modèle rapporté par Ollama
+        (load_duration, en secondes) à la fin d'une requête.
+        Au-delà de OLLAMA_COLD_LOAD_THRESHOLD, la requête a subi un chargement à froid.
+        """
+        with self._lock:
+            backend.model_resident = True
+            backend.last_load_duration = round(load_duration, 3)
+            if count_cold and load_duration >= shared.OLLAMA_COLD_LOAD_THRESHOLD:
+                backend.cold_loads += 1
+                return True
+            return False
+
+    # ---- Surveillance -------------------------------------------------------
+
+    def probe(self, backend, http=requests):
+        """
+        Sonde /api/tags : vérifie que le serveur répond et dispose du modèle.
+        Retourne True si le serveur est utilisable.
+        """
+        try:
+            response = http.get(
+                f"{backend.url}/api/tags",
+                timeout=(shared.OLLAMA_CONNECT_TIMEOUT, shared.OLLAMA_CONNECT_TIMEOUT)
+            )
+            response.raise_for_status()
+            names = [m.get("name", "") for m in response.json().get("models", [])]
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.mark_failure(backend, e)
+            backend.last_check = time.time()
+            return False
+
+        with self._lock:
+            backend.last_check = time.time()
+            backend.model_available = any(model_matches(n, self.model) for n in names)
+            if backend.model_available:
+                # Le serveur répond de nouveau : circuit refermé sans attendre l'essai
+                backend.consecutive_failures = 0
+                backend.trips = 0
+                backend.circuit = CIRCUIT_CLOSED
+                backend.open_until = None
+                backend.last_error = None
+            else:
+                backend.last_error = f"Modèle {self.model} absent du serveur"
+        return backend.model_available
+
+    def probe_all(self, http=requests):
+        for backend in list(self.backends):
+            self.probe(backend, http)
+
+    def start_health_checks(self):
+        """Démarre la sonde périodique (une seule fois par processus)."""
+        with self._lock:
+            if self._prober is not None or self.health_interval <= 0:
+                return
+            self._prober = threading.Thread(
+                target=self._health_loop, name="ollama-health", daemon=True
+            )
+        self._prober.start()
+
+    def stop_health_checks(self):
+        self._stopped.set()
+
+    def _health_loop(self):
+        http = requests.Session()
+        while not self._stopped.is_set():
+            self.probe_all(http)
+            self._stopped.wait(self.health_interval)
+
+    def available_count(self):
+        """Nombre de serveurs utilisables (au moins 1 pour ne jamais bloquer)."""
+        with self._lock:
+            return max(1, sum(1 for b in self.backends if b.available))
+
+    # ---- Inspection ---------------------------------------------------------
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "model": self.model,
+                "pid": os.getpid(),
+                "strategy": "least_outstanding_requests",
+                "fast_failures": self.fast_failures,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "backends": [b.snapshot() for b in self.backends]
+            }
+
+# --------------------------------------------------------------------------------
+# POOL DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_pool = None
+_pool_config = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> BackendPool:
+    """
+    Retourne le pool de serveurs du processus.
+    Le pool est reconstruit si OLLAMA_URL ou MODEL_NAME ont changé.
+    """
+    global _pool, _pool_config
+    config = (shared.OLLAMA_URL, shared.MODEL_NAME)
+    if _pool is None or _pool_config != config:
+        with _pool_lock:
+            if _pool is None or _pool_config != config:
+                if _pool is not None:
+                    _pool.stop_health_checks()
+                pool = BackendPool(
+                    parse_backend_urls(shared.OLLAMA_URL),
+                    shared.MODEL_NAME,
+                    failure_threshold=shared.OLLAMA_FAILURE_THRESHOLD,
+                    health_interval=shared.OLLAMA_HEALTH_INTERVAL
+                )
+                pool.start_health_checks()
+                _pool, _pool_config = pool, config
+    return _pool
+
+def _reset_pool():
+    """Après un fork, le thread de sonde du parent n'existe plus : on repart de zéro."""
+    global _pool, _pool_config, _pool_lock
+    _pool = None
+    _pool_config = None
+    _pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_pool)
@@ -0,0 +1,417 @@
+# logic/bulk.py
+"""
+bulk.py
+--------------------------------------------------------------------------------
+Génération en masse (publipostage) : un même type d'e-mail personnalisé pour
+une liste de destinataires.
+
+Problème résolu :
+Envoyer le même "Devis" à 500 destinataires imposait 500 passages par les
+quatre étapes du chatbot.
+
+Fonctionnement :
+1. Demande (POST /bulk) :
+   - JSON : {"type": ..., "rows": [{"dest", "obj", <champs du type>}...],
+     "concurrency": n, "format": "ndjson" | "csv" | "zip"}
+   - ou formulaire multipart : type, file (CSV avec en-têtes dest, obj et
+     les identifiants des champs du type), concurrency, format
+   - Au plus BULK_MAX_ROWS lignes
+
+2. Génération :
+   - Chaque ligne est rendue avec le template du type (prompts[type]) et
+     ses options de génération, comme une génération du chatbot
+   - Au plus "concurrency" générations simultanées (BULK_CONCURRENCY par
+     défaut, plafonné par BULK_MAX_CONCURRENCY), réparties entre les
+     serveurs Ollama par le pool
+   - Priorité PRIORITY_BULK dans la file d'admission : le chat des
+     utilisateurs passe devant ; une ligne refusée faute de capacité est
+     retentée (BULK_RETRIES)
+   - Les lignes identiques à une génération déjà en cache sont servies par le cache
+
+3. Résultats, envoyés au fil de l'eau (ordre d'achèvement) :
+   - ndjson : {"total": n} puis une ligne par destinataire ({"row", "bot"}
+     ou {"row", "error"}) et un bilan final ({"end": true, ...})
+   - csv : une ligne par destinataire (séparateur ";", compatible Excel)
+   - zip : un fichier texte par destinataire, puis rapport.csv
+   - Une ligne en erreur (champ manquant, échec d'Ollama) n'interrompt pas le lot
+
+4. Annulation :
+   - Chaque lot reçoit un identifiant, renvoyé dans l'en-tête X-Batch-ID
+     (et dans la première ligne NDJSON : {"batch_id": ...})
+   - POST /cancel avec cet identifiant ({"batch_id": ...} ou ?batch_id=...),
+     ou la déconnexion du client, arrêtent le lot (générations en cours
+     fermées, lignes restantes abandonnées) ; l'annulation du chat ne le
+     concerne pas
+"""
+
+import contextvars
+import csv
+import io
+import re
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+from flask import request, session, jsonify, Response, current_app, stream_with_context
+
+import logic.shared as shared
+from logic.admission import get_admission, Overloaded, PRIORITY_BULK
+from logic.cancellation import get_cancellations, batch_key, GenerationCancelled, REASON_DISCONNECT
+from logic.chat import (
+    _current_user_id,
+    _log_user_message,
+    _log_bot_message,
+    _prepare_generation,
+    _cache_lookup,
+    _cache_store,
+    _wait_admission,
+    _ndjson,
+)
+from logic.ollama_client import ollama_chat_stream
+from logic.metrics import GenerationSample
+from logic import log
+
+# Formats de sortie et types MIME associés
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "zip": "application/zip"
+}
+
+# --------------------------------------------------------------------------------
+# LECTURE DE LA DEMANDE
+# --------------------------------------------------------------------------------
+
+class BulkRequestError(ValueError):
+    """Demande invalide dans son ensemble (type inconnu, fichier illisible...)."""
+
+def read_csv_rows(raw: bytes) -> list:
+    """
+    Lit un fichier CSV (en-têtes en première ligne) en liste de dictionnaires.
+    Le séparateur (",", ";" ou tabulation) est détecté automatiquement.
+    """
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # Export Excel en Windows-1252
+        text = raw.decode("cp1252")
+    if not text.strip():
+        return []
+    try:
+        dialect = csv.Sniffer().sniff(text.splitlines()[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return [
+        {(key or "").strip(): value for key, value in row.items()}
+        for row in csv.DictReader(io.StringIO(text), dialect=dialect)
+    ]
+
+def _read_request():
+    """
+    Extrait le type, les lignes, la concurrence et le format de la demande.
+
+    Raises:
+        BulkRequestError: Si la demande est invalide dans son ensemble
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise BulkRequestError("Le corps de la requête doit être un objet JSON")
+        rows = data.get("rows")
+        if not isinstance(rows, list):
+            raise BulkRequestError("La liste des destinataires (rows) est requise")
+    else:
+        data = request.form
+        upload = request.files.get("file")
+        if upload is None:
+            raise BulkRequestError("Le fichier CSV des destinataires (file) est requis")
+        try:
+            rows = read_csv_rows(upload.read())
+        except csv.Error as e:
+            raise BulkRequestError(f"Fichier CSV illisible : {e}")
+
+    email_type = data.get("type")
+    if email_type not in shared.get_prompts()["types"]:
+        raise BulkRequestError(f"Type d'e-mail non valide : {email_type}")
+    if not rows:
+        raise BulkRequestError("Aucun destinataire fourni")
+    if len(rows) > shared.BULK_MAX_ROWS:
+        raise BulkRequestError(f"Trop de destinataires (maximum {shared.BULK_MAX_ROWS})")
+
+    output = request.args.get("format") or data.get("format") or "ndjson"
+    if output not in FORMATS:
+        raise BulkRequestError(f"Format inconnu : {output} (ndjson, csv ou zip)")
+
+    try:
+        concurrency = int(data.get("concurrency") or shared.BULK_CONCURRENCY)
+    except (TypeError, ValueError):
+        raise BulkRequestError("concurrency doit être un nombre entier")
+    concurrency = max(1, min(concurrency, shared.BULK_MAX_CONCURRENCY))
+
+    return email_type, rows, concurrency, output
+
+def row_answers(email_type: str, row, fields: list) -> dict:
+    """
+    Construit les réponses d'une ligne, au format de session["answers"].
+
+    Les précisions peuvent être à plat dans la ligne ou sous la clé "details".
+
+    Raises:
+        ValueError: Si la ligne est incomplète
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Ligne invalide (objet attendu)")
+    details = row.get("details") if isinstance(row.get("details"), dict) else row
+    answers = {
+        "type": email_type,
+        "dest": str(row.get("dest") or "").strip(),
+        "obj": str(row.get("obj") or "").strip(),
+        "details": {
+            field["id"]: str(details.get(field["id"]) or "").strip()
+            for field in fields
+        }
+    }
+    missing = [name for name in ("dest", "obj") if not answers[name]]
+    missing += [name for name, value in answers["details"].items() if not value]
+    if missing:
+        raise ValueError("Champs manquants : " + ", ".join(missing))
+    return answers
+
+# --------------------------------------------------------------------------------
+# GÉNÉRATION D'UNE LIGNE
+# --------------------------------------------------------------------------------
+
+def _generate_row(app, answers: dict, cancel) -> dict:
+    """
+    Génère l'e-mail d'une ligne (thread du lot).
+
+    Returns:
+        dict: {"bot": texte, "cached": bool, "model": modèle ou None (cache)}
+
+    Raises:
+        GenerationCancelled: Si le lot est annulé
+        Overloaded: Si la capacité manque encore après BULK_RETRIES tentatives
+        Exception: Toute autre erreur de la ligne
+    """
+    log.bind(email_type=answers["type"])
+    with app.app_context():
+        prompt, options, template, error = _prepare_generation(answers)
+        if error is not None:
+            raise ValueError(error["bot"])
+
+        lookup, cached = _cache_lookup(answers, prompt, options, template)
+        if cached is not None:
+            return {"bot": cached, "cached": True, "model": None}
+
+        for attempt in range(shared.BULK_RETRIES + 1):
+            cancel.check()
+            try:
+                ticket = get_admission().enqueue(PRIORITY_BULK)
+                with ticket, GenerationSample(answers["type"]) as sample:
+                    _wait_admission(ticket, cancel)
+                    sample.admitted(ticket.queue_time)
+                    started = time.perf_counter()
+                    parts = []
+                    # La fermeture du flux amont arrête la génération côté Ollama
+                    with closing(ollama_chat_stream(prompt, options, metrics=sample)) as tokens:
+                        for token in tokens:
+                            cancel.check()
+                            parts.append(token)
+                    generation_time = time.perf_counter() - started
+                break
+            except Overloaded as e:
+                if attempt == shared.BULK_RETRIES:
+                    raise
+                # Attente conseillée par le contrôleur (interrompue par l'annulation)
+                cancel.wait(min(e.retry_after, 30))
+
+        content = "".join(parts).strip()
+        _cache_store(lookup, answers, content, generation_time, sample.model)
+        return {"bot": content, "cached": False, "model": sample.model}
+
+# --------------------------------------------------------------------------------
+# FORMATS DE SORTIE
+# --------------------------------------------------------------------------------
+
+CSV_COLUMNS = ["ligne", "destinataire", "objet", "statut", "erreur", "contenu"]
+
+def _csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=";").writerow(values)
+    return buffer.getvalue()
+
+def _result_csv(result: dict) -> str:
+    return _csv_line([
+        result["row"],
+        result.get("dest", ""),
+        result.get("obj", ""),
+        "erreur" if "error" in result else "ok",
+        result.get("error", ""),
+        result.get("bot", "")
+    ])
+
+def _file_name(result: dict) -> str:
+    """Nom du fichier d'une ligne dans l'archive : numéro et destinataire."""
+    slug = re.sub(r"[^\w.@-]+", "_", result.get("dest", ""), flags=re.UNICODE).strip("_")
+    return f"{result['row']:04d}_{slug[:60] or 'email'}.txt"
+
+class _ChunkWriter:
+    """
+    Flux non positionnable pour zipfile : conserve les octets écrits
+    jusqu'à ce qu'ils soient envoyés au client (archive construite au fil de l'eau).
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+class _NdjsonOutput:
+    """Une ligne JSON par destinataire, encadrée par le total et le bilan."""
+
+    def start(self, total, concurrency, batch_id):
+        return _ndjson({"total": total, "concurrency": concurrency, "batch_id": batch_id})
+
+    def result(self, result):
+        return _ndjson(result)
+
+    def end(self, summary, results):
+        return _ndjson(summary)
+
+class _CsvOutput:
+    """Une ligne CSV par destinataire (le bilan n'y figure pas)."""
+
+    def start(self, total, concurrency, batch_id):
+        # BOM : Excel reconnaît alors l'UTF-8
+        return "\ufeff" + _csv_line(CSV_COLUMNS)
+
+    def result(self, result):
+        return _result_csv(result)
+
+    def end(self, summary, results):
+        return ""
+
+class _ZipOutput:
+    """Un fichier texte par e-mail généré, puis rapport.csv (statut de chaque ligne)."""
+
+    def __init__(self):
+        self._writer = _ChunkWriter()
+        self._zip = zipfile.ZipFile(self._writer, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def start(self, total, concurrency, batch_id):
+        return b""
+
+    def result(self, result):
+        if "bot" in result:
+            self._zip.writestr(_file_name(result), result["bot"])
+        return self._writer.drain()
+
+    def end(self, summary, results):
+        report = "\ufeff" + _csv_line(CSV_COLUMNS[:5]) + "".join(
+            _csv_line([r["row"], r.get("dest", ""), r.get("obj", ""),
+                       "erreur" if "error" in r else "ok", r.get("error", "")])
+            for r in sorted(results, key=lambda r: r["row"])
+        )
+        self._zip.writestr("rapport.csv", report)
+        self._zip.close()
+        return self._writer.drain()
+
+def _output(name):
+    return {"ndjson": _NdjsonOutput, "csv": _CsvOutput, "zip": _ZipOutput}[name]()
+
+# --------------------------------------------------------------------------------
+# ROUTE
+# --------------------------------------------------------------------------------
+
+def bulk_generate():
+    """
+    Génère un type d'e-mail pour chaque destinataire d'une liste (POST /bulk).
+    Les résultats sont envoyés au fil de l'eau, dans le format demandé.
+    """
+    if not session.get("user_id") and not session.get("admin_logged_in"):
+        return jsonify({"error": "Authentification requise"}), 401
+
+    try:
+        email_type, rows, concurrency, output_name = _read_request()
+    except BulkRequestError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user_id = _current_user_id()
+    _log_user_message(user_id, {"bulk": email_type, "rows": len(rows), "format": output_name})
+
+    fields = shared.get_prompts()["form_fields"].get(email_type, [])
+    app = current_app._get_current_object()
+    # Identifiant du lot : seul un /cancel qui le donne arrête le lot
+    batch_id = uuid.uuid4().hex
+    cancel = get_cancellations().register(batch_key(batch_id))
+
+    def generate():
+        output = _output(output_name)
+        results = []
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk")
+        try:
+            yield output.start(len(rows), concurrency, batch_id)
+
+            futures = {}
+            for index, row in enumerate(rows, start=1):
+                result = {"row": index}
+                try:
+                    answers = row_answers(email_type, row, fields)
+                except ValueError as e:
+                    result.update(error=str(e))
+                    if isinstance(row, dict):
+                        result.update(dest=str(row.get("dest") or ""), obj=str(row.get("obj") or ""))
+                    results.append(result)
+                    yield output.result(result)
+                    continue
+                result.update(dest=answers["dest"], obj=answers["obj"])
+                # Chaque ligne garde le contexte de journal de la requête (request_id)
+                futures[executor.submit(contextvars.copy_context().run, _generate_row, app, answers, cancel)] = result
+
+            for future in as_completed(futures):
+                result = futures[future]
+                try:
+                    result.update(future.result())
+                    _log_bot_message(user_id, result["bot"], model=result.pop("model"))
+                except GenerationCancelled:
+                    result.update(error="Génération annulée")
+                except Overloaded as e:
+                    result.update(error=f"Service saturé : {e}")
+                except Exception as e:
+                    result.update(error=str(e))
+                results.append(result)
+                yield output.result(result)
+
+            failed = sum(1 for r in results if "error" in r)
+            summary = {
+                "end": True,
+                "total": len(rows),
+                "done": len(results) - failed,
+                "failed": failed,
+                "cancelled": cancel.cancelled
+            }
+            yield output.end(summary, results)
+        except GeneratorExit:
+            # Client parti : les générations en cours sont fermées
+            if cancel.cancel(REASON_DISCONNECT):
+                get_cancellations().record(REASON_DISCONNECT)
+            raise
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            get_cancellations().unregister(cancel)
+
+    headers = {"X-Accel-Buffering": "no", "X-Batch-ID": batch_id}
+    if output_name != "ndjson":
+        headers["Content-Disposition"] = f'attachment; filename="publipostage.{output_name}"'
+    return Response(stream_with_context(generate()), content_type=FORMATS[output_name], headers=headers)
@@ -0,0 +1,237 @@
+# logic/cache.py
+"""
+cache.py
+--------------------------------------------------------------------------------
+Cache des générations à correspondance exacte (optionnel).
+
+Problème résolu :
+Beaucoup d'utilisateurs produisent des e-mails identiques (même type, même
+destinataire, même objet, mêmes détails). Chacun coûte une génération complète.
+
+Fonctionnement :
+1. Clé :
+   - Empreinte SHA-256 de (MODEL_NAME, prompt final, options de génération,
+     version du template du type)
+   - La version du template est l'empreinte de son texte : une modification
+     du prompt par un admin rend les anciennes entrées inaccessibles dans
+     tous les workers
+
+2. Niveaux :
+   - Mémoire : LRU par worker, borné en taille (GENERATION_CACHE_SIZE)
+     et en durée de vie (GENERATION_CACHE_TTL)
+   - SQLite (GENERATION_CACHE_PERSISTENT=1) : table generation_cache
+     partagée entre les workers Gunicorn
+
+3. Invalidation :
+   - invalidate_types() lors des modifications de prompts par les admins
+     (cache exact et cache sémantique)
+   - /regen ignore le cache et remplace l'entrée
+
+4. Compteurs :
+   - Succès (mémoire / SQLite), échecs, évictions, invalidations
+   - Exposés aux admins via /admin/cache
+
+Le cache ne doit jamais empêcher une génération : toute erreur du niveau
+SQLite est comptabilisée puis ignorée.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import logic.shared as shared
+from logic.database import db
+from logic.models import CachedGeneration
+from logic.semantic_cache import get_semantic_cache
+
+# --------------------------------------------------------------------------------
+# CLÉS
+# --------------------------------------------------------------------------------
+
+def template_version(template: str) -> str:
+    """Version d'un template de prompt : empreinte courte de son texte."""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+def generation_key(model: str, prompt: str, options=None, version="") -> str:
+    """Clé de cache d'une génération."""
+    raw = json.dumps([model, prompt, options or {}, version], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# --------------------------------------------------------------------------------
+# CACHE
+# --------------------------------------------------------------------------------
+
+class GenerationCache:
+    """Cache LRU en mémoire, doublé d'un niveau SQLite optionnel."""
+
+    def __init__(self, max_entries, ttl, persistent=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self._entries = OrderedDict()  # clé -> (contenu, type, expiration)
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions_size": 0,
+            "evictions_ttl": 0,
+            "invalidations": 0,
+            "persistent_errors": 0
+        }
+
+    # ---- Lecture ------------------------------------------------------------
+
+    def get(self, key):
+        """Retourne le texte en cache pour cette clé, ou None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                content, email_type, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return content
+                del self._entries[key]
+                self.counters["evictions_ttl"] += 1
+
+        content = self._persistent_get(key)
+        with self._lock:
+            if content is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["persistent_hits"] += 1
+        return content
+
+    def _persistent_get(self, key):
+        if not self.persistent:
+            return None
+        try:
+            row = db.session.get(CachedGeneration, key)
+            if row is None:
+                return None
+            if row.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+                db.session.delete(row)
+                db.session.commit()
+                return None
+            # Remonte l'entrée dans le niveau mémoire du worker
+            self._memory_put(key, row.content, row.email_type)
+            return row.content
+        except Exception:
+            db.session.rollback()
+            self.counters["persistent_errors"] += 1
+            return None
+
+    # ---- Écriture -----------------------------------------------------------
+
+    def put(self, key, content, email_type):
+        """Enregistre (ou remplace) une génération dans les deux niveaux."""
+        if not content:
+            return
+        self._memory_put(key, content, email_type)
+        with self._lock:
+            self.counters["stores"] += 1
+        if self.persistent:
+            try:
+                db.session.merge(CachedGeneration(
+                    key=key,
+                    email_type=email_type,
+                    model=shared.MODEL_NAME,
+                    content=content,
+                    created_at=datetime.utcnow()
+                ))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.counters["persistent_errors"] += 1
+
+    def _memory_put(self, key, content, email_type):
+        with self._lock:
+            self._entries[key] = (content, email_type, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions_size"] += 1
+
+    # ---- Invalidation -------------------------------------------------------
+
+    def invalidate_type(self, email_type):
+        """Supprime toutes les entrées d'un type d'email (prompt modifié)."""
+        with self._lock:
+            stale = [k for k, (_, t, _) in self._entries.items() if t == email_type]
+            for key in stale:
+                del self._entries[key]
+            self.counters["invalidations"] += len(stale)
+        if self.persistent:
+            try:
+                removed = CachedGeneration.query.filter_by(email_type=email_type).delete()
+                db.session.commit()
+                with self._lock:
+                    self.counters["invalidations"] += removed
+            except Exception:
+                db.session.rollback()
+                self.counters["persistent_errors"] += 1
+
+    # ---- Inspection ---------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._entries)
+        lookups = counters["memory_hits"] + counters["persistent_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["persistent_hits"]
+        return {
+            "enabled": True,
+            "pid": os.getpid(),
+            "persistent": self.persistent,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            **counters
+        }
+
+# --------------------------------------------------------------------------------
+# CACHE DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Retourne le cache du processus, ou None si le cache est désactivé."""
+    global _cache
+    if not shared.GENERATION_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GenerationCache(
+                    shared.GENERATION_CACHE_SIZE,
+                    shared.GENERATION_CACHE_TTL,
+                    persistent=shared.GENERATION_CACHE_PERSISTENT
+                )
+    return _cache
+
+def invalidate_types(email_types):
+    """Invalide les caches des types indiqués (appelé par l'interface admin)."""
+    for cache in (get_cache(), get_semantic_cache()):
+        if cache is None:
+            continue
+        for email_type in email_types:
+            cache.invalidate_type(email_type)
+
+def changed_types(old_prompts: dict, new_prompts: dict) -> set:
+    """Types dont le template a été modifié, ajouté ou supprimé."""
+    old_prompts = old_prompts or {}
+    new_prompts = new_prompts or {}
+    return {
+        t for t in set(old_prompts) | set(new_prompts)
+        if old_prompts.get(t) != new_prompts.get(t)
+    }
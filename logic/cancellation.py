@@ -0,0 +1,317 @@
+# logic/cancellation.py
+"""
+cancellation.py
+--------------------------------------------------------------------------------
+Annulation des générations en cours.
+
+Problème résolu :
+Quand l'utilisateur ferme l'onglet, clique sur "Arrêter" ou recommence la
+conversation (/start), la génération continuait jusqu'au bout : Ollama
+produisait un e-mail que personne ne lirait.
+
+Fonctionnement :
+1. Jeton d'annulation :
+   - Chaque génération enregistre un CancelToken associé à la conversation
+     (session["conversation_id"], attribué par /start ou, à défaut, par la
+     première génération de la session)
+   - La génération vérifie le jeton entre deux fragments et pendant
+     l'attente dans la file d'admission
+   - En mode asynchrone, le jeton interrompt immédiatement la tâche
+     (y compris pendant l'attente du premier token)
+
+2. Déclencheurs :
+   - POST /cancel : bouton "Arrêter" (ou fermeture de l'onglet via sendBeacon)
+   - POST /cancel avec batch_id : lot de génération en masse (bulk.py),
+     enregistré sous sa propre clé (batch_key) et non sous la conversation
+   - GET /start : la conversation précédente est abandonnée
+   - Déconnexion du client détectée pendant le flux
+
+3. Effet :
+   - La connexion vers Ollama est fermée, ce qui arrête la génération
+     et libère le créneau d'admission
+   - Le texte partiel est enregistré dans ChatLog avec le statut "cancelled"
+
+4. Plusieurs workers (Gunicorn) :
+   - /cancel ou /start peut être servi par un autre worker que la génération
+   - Chaque annulation est publiée dans une base SQLite partagée
+     (CANCEL_DB_PATH, table cancel_request : conversation, motif, date)
+   - Tant qu'il a des générations en cours, chaque worker lit les demandes
+     toutes les CANCEL_POLL_INTERVAL secondes et annule les générations de
+     la conversation enregistrées avant la demande
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import logic.shared as shared
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------------
+# MOTIFS D'ANNULATION
+# --------------------------------------------------------------------------------
+
+REASON_STOP = "stop"              # Bouton "Arrêter" (POST /cancel)
+REASON_RESTART = "restart"        # Nouvelle conversation (GET /start)
+REASON_DISCONNECT = "disconnect"  # Client parti en cours de flux
+
+def batch_key(batch_id) -> str:
+    """Clé d'annulation d'un lot de génération en masse (distincte des conversations)."""
+    return f"bulk:{batch_id}"
+
+# --------------------------------------------------------------------------------
+# EXCEPTIONS
+# --------------------------------------------------------------------------------
+
+class GenerationCancelled(Exception):
+    """
+    Génération interrompue à la demande du client.
+
+    Attributs :
+        reason (str) : REASON_STOP, REASON_RESTART ou REASON_DISCONNECT
+    """
+
+    def __init__(self, reason=REASON_STOP):
+        super().__init__("La génération a été annulée")
+        self.reason = reason
+
+# --------------------------------------------------------------------------------
+# JETON D'ANNULATION
+# --------------------------------------------------------------------------------
+
+class CancelToken:
+    """
+    Jeton d'une génération : annulé une seule fois, vérifié par la génération.
+
+    Les fonctions enregistrées avec on_cancel() sont appelées au moment de
+    l'annulation, depuis le thread qui annule.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.reason = None
+        self.created = time.time()  # Comparé à la date des demandes publiées
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason=REASON_STOP) -> bool:
+        """Annule la génération. Retourne False si elle l'était déjà."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def on_cancel(self, callback):
+        """Appelle callback à l'annulation (immédiatement si elle a déjà eu lieu)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout) -> bool:
+        """Attend au plus timeout secondes. Retourne True si la génération est annulée."""
+        return self._event.wait(timeout)
+
+    def check(self):
+        """
+        Raises:
+            GenerationCancelled: Si la génération a été annulée
+        """
+        if self._event.is_set():
+            raise GenerationCancelled(self.reason)
+
+# --------------------------------------------------------------------------------
+# GÉNÉRATIONS EN COURS
+# --------------------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cancel_request (
+    key TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+
+class CancelRegistry:
+    """
+    Jetons des générations en cours du processus, indexés par conversation.
+
+    Args:
+        path (str): Base SQLite partagée par les workers (vide : annulation
+            limitée au processus)
+        poll_interval (float): Délai entre deux lectures des demandes publiées
+        ttl (float): Conservation des demandes publiées (secondes)
+    """
+
+    def __init__(self, path="", poll_interval=0.5, ttl=60.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self._tokens = {}  # conversation -> set(CancelToken)
+        self._lock = threading.Lock()
+        self._poller = None
+        self._schema_ready = False
+        self.errors = 0
+        self.cancelled = {REASON_STOP: 0, REASON_RESTART: 0, REASON_DISCONNECT: 0}
+
+    def register(self, key) -> CancelToken:
+        """Crée le jeton d'une génération de la conversation key."""
+        token = CancelToken(key)
+        if key is not None:
+            with self._lock:
+                self._tokens.setdefault(key, set()).add(token)
+                if self.path and self._poller is None:
+                    self._poller = threading.Thread(target=self._poll_loop, name="cancel-poll", daemon=True)
+                    self._poller.start()
+        return token
+
+    def unregister(self, token):
+        """Oublie le jeton d'une génération terminée. Idempotent."""
+        with self._lock:
+            tokens = self._tokens.get(token.key)
+            if tokens is None:
+                return
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[token.key]
+
+    def cancel(self, key, reason=REASON_STOP) -> int:
+        """
+        Annule les générations en cours de la conversation key, dans ce
+        processus et (par la base partagée) dans les autres workers.
+
+        Returns:
+            int: Nombre de générations annulées dans ce processus
+        """
+        if key is None:
+            return 0
+        self._publish(key, reason)
+        with self._lock:
+            tokens = list(self._tokens.pop(key, ()))
+        count = sum(1 for token in tokens if token.cancel(reason))
+        self.record(reason, count)
+        return count
+
+    def record(self, reason, count=1):
+        """Comptabilise des annulations (déconnexions détectées par la génération)."""
+        with self._lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + count
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "in_flight": sum(len(tokens) for tokens in self._tokens.values()),
+                "cancelled": dict(self.cancelled),
+                "shared": bool(self.path),
+                "errors": self.errors
+            }
+
+    # ---- Demandes partagées entre workers -----------------------------------
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        if not self._schema_ready:
+            # WAL : les lectures des workers ne bloquent pas les publications
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            self._schema_ready = True
+        return connection
+
+    def _publish(self, key, reason):
+        """Publie la demande pour les autres workers (et oublie les anciennes)."""
+        if not self.path:
+            return
+        now = time.time()
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT INTO cancel_request (key, reason, ts) VALUES (?, ?, ?) "
+                        "ON CONFLICT (key) DO UPDATE SET reason = excluded.reason, ts = excluded.ts",
+                        (key, reason, now)
+                    )
+                    connection.execute("DELETE FROM cancel_request WHERE ts < ?", (now - self.ttl,))
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            # L'annulation reste appliquée dans ce processus
+            self.errors += 1
+            logger.warning("Erreur de publication d'une annulation", extra={"error": str(e)})
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                keys = list(self._tokens)
+            if keys:
+                self.poll(keys)
+
+    def poll(self, keys):
+        """
+        Applique les demandes publiées pour les conversations keys : seules
+        les générations enregistrées avant la demande sont annulées.
+        """
+        rows = []
+        try:
+            connection = self._connect()
+            try:
+                # Limite SQLite du nombre de paramètres d'une requête
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    rows += connection.execute(
+                        "SELECT key, reason, ts FROM cancel_request WHERE key IN (%s)"
+                        % ",".join("?" * len(chunk)), chunk
+                    ).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("Erreur de lecture des annulations", extra={"error": str(e)})
+            return
+        for key, reason, ts in rows:
+            with self._lock:
+                tokens = self._tokens.get(key, set())
+                targets = [token for token in tokens if token.created <= ts]
+                tokens.difference_update(targets)
+                if key in self._tokens and not tokens:
+                    del self._tokens[key]
+            count = sum(1 for token in targets if token.cancel(reason))
+            if count:
+                self.record(reason, count)
+
+# --------------------------------------------------------------------------------
+# REGISTRE DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+def _new_registry():
+    return CancelRegistry(shared.CANCEL_DB_PATH, shared.CANCEL_POLL_INTERVAL, shared.CANCEL_TTL)
+
+_registry = _new_registry()
+
+def get_cancellations() -> CancelRegistry:
+    return _registry
+
+def _reset():
+    """Après un fork, les générations du parent ne concernent pas ce worker."""
+    global _registry
+    _registry = _new_registry()
+
+os.register_at_fork(after_in_child=_reset)
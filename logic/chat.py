@@ -23,16 +23,83 @@ Fonctionnement :
 4. Intégration avec Ollama :
    - Génération du contenu final uniquement
    - Possibilité de régénération en cas d'erreur
+
+5. Streaming :
+   - /message (STEP_PRECISIONS) et /regen renvoient les tokens au fil de l'eau
+     en NDJSON lorsque le client le demande (Accept: application/x-ndjson
+     ou ?stream=1)
+   - Une ligne {"token": ...} par fragment, puis {"bot": ..., "end": true}
+   - Le message du bot est enregistré dans ChatLog une fois le flux terminé
+
+6. Contrôle d'admission (voir admission.py) :
+   - Chaque génération réserve un créneau auprès du contrôleur d'admission
+   - En streaming, la position dans la file est envoyée ({"queue": n})
+   - File pleine ou attente trop longue : réponse 429/503 avec Retry-After
+
+7. Cache des générations (voir cache.py et semantic_cache.py, optionnels) :
+   - Une génération identique (modèle, prompt, options, version du template)
+     est servie depuis le cache sans passer par la file ni par Ollama
+   - À défaut, une génération proche (similarité des embeddings) est
+     réutilisée après substitution du destinataire et des dates (même objet)
+   - /regen ignore le cache et remplace l'entrée existante
+
+8. Annulation (voir cancellation.py) :
+   - POST /cancel arrête la génération en cours de la conversation,
+     /start abandonne celle de la conversation précédente
+   - Un client qui se déconnecte en cours de flux arrête aussi la génération
+   - Une génération partagée par des demandes identiques (voir dedup.py)
+     continue tant qu'une autre demande la suit ; sinon, le flux amont vers
+     Ollama est fermé aussitôt et le créneau d'admission libéré
+   - Le texte partiel est enregistré dans ChatLog avec le statut "cancelled"
+
+9. Variantes :
+   - /regen?n=3 (ou "n" à l'étape des précisions) génère plusieurs versions
+     en parallèle, chacune avec sa graine (option seed d'Ollama)
+   - Chaque version occupe son propre créneau d'admission : la durée totale
+     reste proche d'une génération unique quand les serveurs ont de la marge
+   - En streaming, chaque fragment indique sa version ({"variant": i, "token": ...}),
+     la réponse finale contient {"variants": [...]}
+
+10. Reprise du contexte (voir kv_context.py) :
+   - Le serveur et les messages de la dernière génération sont retenus par
+     conversation : /regen retourne au même serveur, qui n'a pas à réévaluer
+     le prompt
+   - POST /edit retouche le document ("plus court", "plus formel") en
+     ajoutant la consigne à la suite du contexte déjà évalué
 """
 
+import contextvars
 import json
-from flask import render_template, request, jsonify, session, redirect
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import closing
+from flask import (
+    render_template, request, jsonify, session, redirect, Response, stream_with_context, current_app
+)
 import logic.shared as shared
 from logic.shared import STEP_TYPE, STEP_INFO, STEP_PRECISIONS, STEP_GENERATION
-from logic.ollama_client import ollama_chat
+from logic.ollama_client import ollama_chat_stream
+from logic.admission import get_admission, Overloaded, PRIORITY_INTERACTIVE, PRIORITY_ADMIN
+from logic.cache import get_cache, generation_key, template_version
+from logic.dedup import get_flights, get_idempotency_store
+from logic.cancellation import (
+    get_cancellations, batch_key, GenerationCancelled, REASON_STOP, REASON_RESTART, REASON_DISCONNECT
+)
+from logic.semantic_cache import get_semantic_cache, semantic_text
+from logic.kv_context import get_kv_contexts
+from logic.metrics import GenerationSample
 from logic.database import db
 from logic.models import ChatLog
+from logic.http_cache import conditional_json
+from logic.prompt_store import prompts_etag
 from logic.users import find_user_by_id, find_user
+from logic import log
+
+logger = logging.getLogger(__name__)
 
 # --------------------------------------------------------------------------------
 # ROUTES UTILISATEUR : CHATBOT
@@ -61,14 +128,8 @@ def start():
     - Retourne le premier message et les champs du formulaire
     """
     try:
-        prompts = shared.get_prompts()
-        session["step"] = STEP_TYPE
-        session["answers"] = {}
-        return jsonify({
-            "bot": prompts["select_type"],
-            "fields": [{"id": "type", "label": "Type d'e-mail", "type": "select", "options": prompts["types"]}],
-            "end": False
-        })
+        # Réinitialise la session : jamais servi depuis un cache (no-store par défaut)
+        return jsonify(_start_conversation())
     except Exception as e:
         return jsonify({
             "bot": "Une erreur est survenue lors du démarrage de la conversation.",
@@ -93,10 +154,6 @@ def handle_message():
     - end : True si c'est la fin de la conversation
     """
     try:
-        step = session.get("step", STEP_TYPE)
-        answers = session.get("answers", {})
-        prompts = shared.get_prompts()
-        
         # Vérification que request.json est bien présent
         if not request.is_json:
             return jsonify({
@@ -105,180 +162,961 @@ def handle_message():
             })
             
         data = request.json or {}
+
+        # Requête rejouée (même Idempotency-Key) : résultat de l'originale
+        idempotency = _idempotency()
+        replay = _replay(idempotency, _wants_stream())
+        if replay is not None:
+            return replay
         
         # Récupère l'utilisateur connecté (admin ou user)
-        user_id = None
-        if session.get("admin_logged_in"):
-            user = find_user(session.get("admin_username"))
-            if user:
-                user_id = user.id
-        elif session.get("user_id"):
-            user = find_user_by_id(session.get("user_id"))
-            if user:
-                user_id = user.id
+        user_id = _current_user_id()
 
         # Enregistre le message de l'utilisateur
-        if data and user_id:
-            chat_log = ChatLog(
-                user_id=user_id,
-                sender='user',
-                message=json.dumps(data, ensure_ascii=False)
-            )
-            db.session.add(chat_log)
-            db.session.commit()
+        _log_user_message(user_id, data)
 
         # Étapes du chatbot
-        if step == STEP_TYPE:
-            if "type" not in data:
-                return jsonify({
-                    "bot": prompts["select_type"],
-                    "fields": [{"id": "type", "label": "Type d'e-mail", "type": "select", "options": prompts["types"]}],
-                    "end": False
-                })
-                
-            email_type = data["type"]
-            if email_type not in prompts["types"]:
-                return jsonify({
-                    "bot": "Type d'e-mail non valide. Veuillez choisir parmi : " + ", ".join(prompts["types"]),
-                    "fields": [{"id": "type", "label": "Type d'e-mail", "type": "select", "options": prompts["types"]}],
-                    "end": False
-                })
-                
-            answers["type"] = email_type
-            session["answers"] = answers
-            session["step"] = STEP_INFO
-            return jsonify({
-                "bot": prompts["initial"],
-                "fields": [
-                    {"id": "dest", "label": "Destinataire", "type": "text"},
-                    {"id": "obj", "label": "Objet", "type": "text"}
-                ],
-                "end": False
-            })
+        reply = _advance_conversation(data)
+        if reply is not None:
+            _remember(idempotency, reply)
+            return jsonify(reply)
+        count = _variant_count(data)
+        if count > 1:
+            return _generate_variants(
+                session["answers"], user_id, count, stream=_wants_stream(), idempotency=idempotency
+            )
+        return _generate_doc(session["answers"], user_id, stream=_wants_stream(), idempotency=idempotency)
+        
+    except Exception as e:
+        logger.exception("Erreur dans handle_message")
+        return jsonify({
+            "bot": "Une erreur est survenue lors du traitement de votre message. Veuillez réessayer.",
+            "error": str(e),
+            "end": False
+        })
+
+def regenerate():
+    """
+    Régénère le document avec les mêmes données.
+    Utile en cas de résultat non satisfaisant.
+    """
+    try:
+        # Double clic ou requête rejouée (même Idempotency-Key) : résultat de l'originale
+        idempotency = _idempotency()
+        replay = _replay(idempotency, _wants_stream())
+        if replay is not None:
+            return replay
 
-        if step == STEP_INFO:
-            dest = data.get("dest", "").strip()
-            obj = data.get("obj", "").strip()
-            if not dest or not obj:
-                return jsonify({"bot": "Merci de remplir les deux champs.", "end": False})
-            answers.update(dest=dest, obj=obj)
-            session["answers"] = answers
-            session["step"] = STEP_PRECISIONS
+        answers, error = _regeneration_answers()
+        if error is not None:
+            return jsonify(error)
 
-            email_type = answers["type"]
-            fields = prompts["form_fields"].get(email_type, [])
+        user_id = _current_user_id()
 
-            return jsonify({
-                "bot": "Merci de compléter les informations suivantes :",
-                "fields": fields,
-                "end": False
-            })
+        # Plusieurs versions demandées (/regen?n=3) : générées en parallèle
+        count = _variant_count()
+        if count > 1:
+            return _generate_variants(
+                answers, user_id, count, stream=_wants_stream(), idempotency=idempotency
+            )
 
-        if step == STEP_PRECISIONS:
-            details = data.get("details", {})
-            if not isinstance(details, dict) or not details:
-                return jsonify({"bot": "Merci de répondre à toutes les questions.", "end": False})
-            answers["details"] = details
-            session["answers"] = answers
-            session["step"] = STEP_GENERATION
-            return _generate_doc(answers, user_id)
+        # Une régénération doit produire un nouveau texte : le cache est ignoré
+        return _generate_doc(
+            answers, user_id, stream=_wants_stream(), use_cache=False, idempotency=idempotency
+        )
+    except Exception as e:
+        return jsonify({
+            "bot": "Une erreur est survenue lors de la régénération du document.",
+            "error": str(e),
+            "end": True
+        })
 
-        return jsonify({"bot": "Erreur interne : étape inconnue.", "end": True})
-        
+def edit_document():
+    """
+    Retouche le dernier document de la conversation selon une consigne
+    ("plus court", "plus formel" ou texte libre).
+
+    Corps JSON : {"instruction": ..., "draft": document affiché (optionnel)}.
+    Le contexte déjà évalué par Ollama est repris : seule la consigne est évaluée.
+    """
+    try:
+        idempotency = _idempotency()
+        replay = _replay(idempotency, _wants_stream())
+        if replay is not None:
+            return replay
+
+        answers, error = _regeneration_answers()
+        if error is not None:
+            return jsonify(error)
+
+        data = request.get_json(silent=True) or {}
+        history, error = _edit_history(answers, data.get("instruction"), data.get("draft"))
+        if error is not None:
+            return jsonify(error)
+
+        user_id = _current_user_id()
+        _log_user_message(user_id, {"edit": data.get("instruction")})
+        return _generate_doc(
+            answers, user_id, stream=_wants_stream(), use_cache=False,
+            idempotency=idempotency, history=history
+        )
     except Exception as e:
-        print(f"Erreur dans handle_message: {str(e)}")
         return jsonify({
-            "bot": "Une erreur est survenue lors du traitement de votre message. Veuillez réessayer.",
+            "bot": "Une erreur est survenue lors de la retouche du document.",
             "error": str(e),
-            "end": False
+            "end": True
         })
 
-def _generate_doc(ans: dict, user_id=None):
+def cancel_generation():
+    """
+    Annule la génération en cours de la conversation (bouton "Arrêter",
+    fermeture de l'onglet). Le flux concerné se termine par {"cancelled": true}.
+
+    Avec un identifiant de lot ({"batch_id": ...} ou ?batch_id=..., voir
+    bulk.py), seul ce lot de génération en masse est annulé.
+    """
+    data = request.get_json(silent=True)
+    batch_id = (data.get("batch_id") if isinstance(data, dict) else None) or request.args.get("batch_id")
+    key = batch_key(batch_id) if batch_id else session.get("conversation_id")
+    count = get_cancellations().cancel(key, REASON_STOP)
+    return jsonify({"cancelled": count > 0, "count": count})
+
+# --------------------------------------------------------------------------------
+# LOGIQUE DE CONVERSATION (partagée avec chat_async.py)
+# --------------------------------------------------------------------------------
+
+def _type_field(prompts: dict) -> dict:
+    """Champ de sélection du type d'e-mail."""
+    return {"id": "type", "label": "Type d'e-mail", "type": "select", "options": prompts["types"]}
+
+def _start_conversation() -> dict:
+    """Réinitialise l'état de la conversation en session et retourne le premier message."""
+    prompts = shared.get_prompts()
+
+    # La génération de la conversation précédente n'a plus de lecteur
+    get_cancellations().cancel(session.get("conversation_id"), REASON_RESTART)
+    get_kv_contexts().discard(session.get("conversation_id"))
+    session["conversation_id"] = uuid.uuid4().hex
+
+    session["step"] = STEP_TYPE
+    session["answers"] = {}
+    return {
+        "bot": prompts["select_type"],
+        "fields": [_type_field(prompts)],
+        "end": False
+    }
+
+def _advance_conversation(data: dict):
+    """
+    Fait avancer la conversation d'une étape à partir des données reçues.
+
+    Met à jour session["step"] et session["answers"].
+
+    Returns:
+        dict|None: La réponse à renvoyer au client,
+        ou None si toutes les réponses sont réunies et que la génération doit démarrer
+    """
+    step = session.get("step", STEP_TYPE)
+    answers = session.get("answers", {})
+    prompts = shared.get_prompts()
+
+    if step == STEP_TYPE:
+        if "type" not in data:
+            return {
+                "bot": prompts["select_type"],
+                "fields": [_type_field(prompts)],
+                "end": False
+            }
+            
+        email_type = data["type"]
+        if email_type not in prompts["types"]:
+            return {
+                "bot": "Type d'e-mail non valide. Veuillez choisir parmi : " + ", ".join(prompts["types"]),
+                "fields": [_type_field(prompts)],
+                "end": False
+            }
+            
+        answers["type"] = email_type
+        session["answers"] = answers
+        session["step"] = STEP_INFO
+        return {
+            "bot": prompts["initial"],
+            "fields": [
+                {"id": "dest", "label": "Destinataire", "type": "text"},
+                {"id": "obj", "label": "Objet", "type": "text"}
+            ],
+            "end": False
+        }
+
+    if step == STEP_INFO:
+        dest = data.get("dest", "").strip()
+        obj = data.get("obj", "").strip()
+        if not dest or not obj:
+            return {"bot": "Merci de remplir les deux champs.", "end": False}
+        answers.update(dest=dest, obj=obj)
+        session["answers"] = answers
+        session["step"] = STEP_PRECISIONS
+
+        email_type = answers["type"]
+        fields = prompts["form_fields"].get(email_type, [])
+
+        return {
+            "bot": "Merci de compléter les informations suivantes :",
+            "fields": fields,
+            "end": False
+        }
+
+    if step == STEP_PRECISIONS:
+        details = data.get("details", {})
+        if not isinstance(details, dict) or not details:
+            return {"bot": "Merci de répondre à toutes les questions.", "end": False}
+        answers["details"] = details
+        session["answers"] = answers
+        session["step"] = STEP_GENERATION
+        return None
+
+    return {"bot": "Erreur interne : étape inconnue.", "end": True}
+
+def _regeneration_answers():
+    """
+    Vérifie qu'une régénération est possible avec les réponses en session.
+
+    Returns:
+        tuple: (answers, None) si la régénération est possible,
+        (None, réponse d'erreur) sinon
+    """
+    answers = session.get("answers")
+    if not answers:
+        return None, {"bot": "Impossible de régénérer : aucune donnée disponible.", "end": True}
+
+    prompts = shared.get_prompts()
+    email_type = answers.get("type")
+    if not email_type or email_type not in prompts["types"]:
+        return None, {
+            "bot": "Ce type d'email n'est plus disponible. Veuillez recommencer avec un nouveau type.",
+            "end": True
+        }
+    return answers, None
+
+# Consignes de retouche proposées par l'interface (texte libre également accepté)
+EDIT_INSTRUCTIONS = {
+    "plus court": "Raccourcis cet e-mail en conservant les informations essentielles.",
+    "plus formel": "Réécris cet e-mail dans un registre plus formel.",
+    "moins formel": "Réécris cet e-mail dans un registre plus simple et plus direct."
+}
+
+# Longueur maximale d'une consigne libre
+EDIT_MAX_LENGTH = 300
+
+def _edit_history(ans: dict, instruction, draft=None):
+    """
+    Messages à ajouter après le prompt pour retoucher le document.
+
+    Le contexte retenu de la conversation (kv_context.py) est repris s'il
+    correspond au document affiché ; sinon le document envoyé par le client
+    sert de point de départ (nouvelle évaluation complète).
+
+    Returns:
+        tuple: (messages, None) ou (None, réponse d'erreur)
+    """
+    instruction = (instruction or "").strip()
+    if not instruction:
+        return None, {"bot": "Indiquez la retouche souhaitée.", "end": True}
+    if len(instruction) > EDIT_MAX_LENGTH:
+        return None, {"bot": "La consigne de retouche est trop longue.", "end": True}
+    consigne = EDIT_INSTRUCTIONS.get(instruction.lower(), instruction)
+
+    prompt, _, _, error = _prepare_generation(ans)
+    if error is not None:
+        return None, error
+    handle = get_kv_contexts().get(session.get("conversation_id"), prompt)
+    draft = (draft or "").strip() or None
+    if handle is not None and (draft is None or handle.draft == draft):
+        history = list(handle.history)
+    elif draft is not None:
+        history = [{"role": "assistant", "content": draft}]
+    else:
+        return None, {"bot": "Aucun document à retoucher : générez d'abord un document.", "end": True}
+
+    history.append({
+        "role": "user",
+        "content": f"{consigne} Réponds uniquement avec le nouvel e-mail."
+    })
+    return history, None
+
+def _conversation_id():
+    """
+    Identifiant de la conversation, attribué s'il manque (session ouverte
+    avant /start) : toute génération doit pouvoir être annulée.
+    """
+    if not session.get("conversation_id"):
+        session["conversation_id"] = uuid.uuid4().hex
+    return session["conversation_id"]
+
+def _kv_request(prompt: str, history=None):
+    """Génération de la conversation courante, avec reprise de son contexte (kv_context.py)."""
+    return get_kv_contexts().request(session.get("conversation_id"), prompt, history or ())
+
+def _current_user_id():
+    """Retourne l'identifiant de l'utilisateur connecté (admin ou user), ou None."""
+    user = None
+    if session.get("admin_logged_in"):
+        user = find_user(session.get("admin_username"))
+    elif session.get("user_id"):
+        user = find_user_by_id(session.get("user_id"))
+    return user.id if user else None
+
+def _log_user_message(user_id, data):
+    """Enregistre le message de l'utilisateur dans l'historique."""
+    if data and user_id:
+        chat_log = ChatLog(
+            user_id=user_id,
+            sender='user',
+            message=json.dumps(data, ensure_ascii=False)
+        )
+        db.session.add(chat_log)
+        db.session.commit()
+
+def _log_bot_message(user_id, content, status=None, model=None):
+    """
+    Enregistre le message généré par le bot dans l'historique.
+    status="cancelled" marque le texte partiel d'une génération annulée.
+    model : modèle qui a produit le texte (voir routing.py).
+    """
+    if user_id:
+        chat_log = ChatLog(
+            user_id=user_id,
+            sender='bot',
+            message=content,
+            status=status,
+            model=model
+        )
+        db.session.add(chat_log)
+        db.session.commit()
+
+def _render_prompt(ans: dict, snapshot=None) -> str:
+    """Construit le prompt final à partir du template compilé du type et des réponses."""
+    return shared.get_template(ans["type"], snapshot).render(_prompt_values(ans))
+
+def _prompt_values(ans: dict) -> dict:
+    """Valeurs injectées dans le template (destinataire, objet, précisions)."""
+    return {"dest": ans["dest"], "obj": ans["obj"], **ans["details"]}
+
+def _prepare_generation(ans: dict):
+    """
+    Construit le prompt de génération à partir des réponses, avec les
+    options de génération du type (num_predict, stop...).
+
+    Returns:
+        tuple: (prompt, options, template, None) ou (None, None, None, réponse
+        d'erreur) si le type n'existe plus. template : texte du template qui a
+        servi, pour la version du cache (voir _cache_lookup)
+    """
+    # Type, template et options lus dans la même version de la configuration
+    snapshot = shared.get_snapshot()
+    if ans["type"] not in snapshot.prompts["types"]:
+        return None, None, None, {
+            "bot": "Ce type d'email n'est plus disponible. Veuillez recommencer avec un nouveau type.",
+            "end": True
+        }
+    return (
+        _render_prompt(ans, snapshot),
+        shared.get_generation_options(ans["type"], snapshot),
+        snapshot.prompts["prompts"].get(ans["type"], ""),
+        None
+    )
+
+def _cache_lookup(ans: dict, prompt: str, options: dict, template: str, use_cache=True):
+    """
+    Cherche un résultat existant : d'abord le cache exact, puis le cache
+    sémantique (génération proche adaptée à la demande).
+
+    template : texte du template rendu dans prompt (voir _prepare_generation),
+    pour que la version de l'entrée corresponde au texte généré.
+
+    Returns:
+        tuple: (recherche, texte en cache ou None). La recherche (clé exacte,
+        vecteur...) est à transmettre à _cache_store après la génération.
+    """
+    cache = get_cache()
+    semantic = get_semantic_cache()
+    if cache is None and semantic is None:
+        return None, None
+
+    # La version couvre le template et les options : les deux modifient le texte produit
+    version = template_version(template + json.dumps(options, sort_keys=True))
+    lookup = {
+        "key": generation_key(shared.MODEL_NAME, prompt, options, version),
+        "version": version,
+        "vector": None,
+        # Modèle attendu : un texte du modèle de repli n'est pas mis en cache
+        "model": options.get("model") or shared.MODEL_NAME
+    }
+    if cache is not None and use_cache:
+        cached = cache.get(lookup["key"])
+        if cached is not None:
+            return lookup, cached
+
+    if semantic is not None:
+        values = _prompt_values(ans)
+        text = semantic_text(ans["type"], values, semantic.placeholders)
+        lookup["vector"] = semantic.embed(text)
+        if lookup["vector"] is not None and use_cache:
+            cached = semantic.lookup(ans["type"], version, lookup["vector"], values)
+            if cached is not None:
+                # Les demandes identiques suivantes sont servies par le cache exact
+                if cache is not None:
+                    cache.put(lookup["key"], cached, ans["type"])
+                return lookup, cached
+    return lookup, None
+
+def _cache_store(lookup, ans: dict, content: str, generation_time=None, model=None):
+    """
+    Enregistre une génération terminée dans les caches activés, sauf si elle
+    a été servie par un autre modèle que celui attendu (repli, voir routing.py).
+    """
+    if lookup is None or (model is not None and model != lookup["model"]):
+        return
+    cache = get_cache()
+    if cache is not None:
+        cache.put(lookup["key"], content, ans["type"])
+    semantic = get_semantic_cache()
+    if semantic is not None and lookup["vector"] is not None:
+        semantic.store(
+            ans["type"], lookup["version"], lookup["vector"],
+            _prompt_values(ans), content, generation_time
+        )
+
+# --------------------------------------------------------------------------------
+# GÉNÉRATION DU DOCUMENT
+# --------------------------------------------------------------------------------
+
+def _wants_stream():
+    """Indique si le client a demandé une réponse en streaming (NDJSON)."""
+    if request.args.get("stream") == "1":
+        return True
+    return "application/x-ndjson" in request.headers.get("Accept", "")
+
+def _ndjson(payload: dict) -> str:
+    """Sérialise un évènement du flux sur une ligne NDJSON."""
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+def _generation_priority():
+    """Les tests des administrateurs passent après le chat des utilisateurs."""
+    return PRIORITY_ADMIN if session.get("admin_logged_in") else PRIORITY_INTERACTIVE
+
+def _overloaded_payload(error: Overloaded) -> dict:
+    """Message renvoyé quand la génération est refusée faute de capacité."""
+    return {
+        "bot": f"Le service est très sollicité. Veuillez réessayer dans {error.retry_after} secondes.",
+        "error": str(error),
+        "retry_after": error.retry_after,
+        "end": True
+    }
+
+def _overloaded_response(error: Overloaded):
+    """Réponse HTTP 429/503 avec l'en-tête Retry-After."""
+    response = jsonify(_overloaded_payload(error))
+    response.status_code = error.status
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+def _wait_admission(ticket, cancel):
+    """
+    Attend l'admission du ticket en vérifiant l'annulation chaque seconde.
+
+    Raises:
+        Overloaded: Si l'attente dépasse GENERATION_QUEUE_TIMEOUT
+        GenerationCancelled: Si la génération est annulée pendant l'attente
+    """
+    while not ticket.wait(1.0):
+        cancel.check()
+    cancel.check()
+
+def _cancelled_payload(user_id, content: str, idempotency=None) -> dict:
+    """
+    Termine une génération annulée : le texte partiel est enregistré dans
+    ChatLog avec le statut "cancelled" et n'est jamais mis en cache.
+    """
+    _forget(idempotency)
+    _log_bot_message(user_id, content, status="cancelled")
+    return {"bot": content or "Génération annulée.", "end": True, "cancelled": True}
+
+def _final_response(payload: dict, stream=False):
+    """Réponse finale, en NDJSON (une seule ligne) si le client l'a demandé."""
+    if stream:
+        return Response(_ndjson(payload), mimetype="application/x-ndjson")
+    return jsonify(payload)
+
+def _generate_doc(ans: dict, user_id=None, stream=False, use_cache=True, idempotency=None,
+                  history=None):
     """
     Génère le document final en utilisant Ollama.
     
     Args:
         ans (dict): Dictionnaire contenant toutes les réponses de l'utilisateur
         user_id (int|None): Identifiant de l'utilisateur pour sauvegarde
+        stream (bool): Renvoie les tokens au fil de l'eau (NDJSON)
+        use_cache (bool): Sert une génération identique depuis le cache
+            (False pour /regen : le résultat remplace alors l'entrée)
+        idempotency (tuple|None): (portée, clé) de l'en-tête Idempotency-Key
+        history (list|None): Messages ajoutés après le prompt (retouche du
+            document, voir edit_document) ; le cache est alors ignoré
 
     Returns:
-        JSON avec le contenu généré et end=True
+        JSON avec le contenu généré et end=True,
+        ou flux NDJSON si stream=True
     """
+    log.bind(email_type=ans.get("type"))
     try:
-        email_type = ans["type"]
-        prompts = shared.get_prompts()
-        
-        if email_type not in prompts["types"]:
-            return jsonify({
-                "bot": "Ce type d'email n'est plus disponible. Veuillez recommencer avec un nouveau type.",
-                "end": True
-            })
-            
-        prompt = prompts["prompts"][email_type].format(
-            dest=ans["dest"],
-            obj=ans["obj"],
-            **ans["details"]
-        )
-        content = ollama_chat(prompt)
-
-        # Log du message généré par le bot
-        if user_id:
-            chat_log = ChatLog(
-                user_id=user_id,
-                sender='bot',
-                message=content
-            )
-            db.session.add(chat_log)
-            db.session.commit()
+        prompt, options, template, error = _prepare_generation(ans)
+        if error is not None:
+            return jsonify(error)
+
+        # Génération identique (ou proche) déjà produite : ni file d'attente ni appel à Ollama
+        lookup, cached = (None, None) if history else _cache_lookup(ans, prompt, options, template, use_cache)
+        if cached is not None:
+            _log_bot_message(user_id, cached)
+            payload = {"bot": cached, "end": True, "cached": True}
+            _remember(idempotency, payload)
+            return _final_response(payload, stream)
 
-        return jsonify({"bot": content, "end": True})
+        # Génération identique déjà en cours dans ce processus : on la suit
+        flight_prompt = json.dumps([prompt, history], ensure_ascii=False) if history else prompt
+        subscription, leader = get_flights().join(
+            generation_key(shared.MODEL_NAME, flight_prompt, options)
+        )
+        flight = subscription.flight
+        if idempotency is not None:
+            get_idempotency_store().begin(*idempotency, flight)
+        ticket = None
+        if leader:
+            # Réservation d'une place dans la file (refus immédiat si elle est pleine)
+            try:
+                ticket = get_admission().enqueue(_generation_priority())
+            except Overloaded as e:
+                flight.finish(e)
+                subscription.close()
+                raise
+            # Contexte déjà évalué par un serveur pour cette conversation
+            kv = _kv_request(prompt, history)
+            _start_flight(flight, ticket, prompt, options, kv, ans, lookup)
+        return _follow_flight(subscription, user_id, stream, idempotency, ticket)
+    except Overloaded as e:
+        _forget(idempotency)
+        return _overloaded_response(e)
     except Exception as e:
+        _forget(idempotency)
         return jsonify({
             "bot": "Une erreur est survenue lors de la génération du document.",
             "error": str(e),
             "end": True
         })
 
-def regenerate():
+def _start_flight(flight, ticket, prompt: str, options: dict, kv, ans: dict, cache_lookup=None):
     """
-    Régénère le document avec les mêmes données.
-    Utile en cas de résultat non satisfaisant.
+    Lance la génération partagée dans un thread : elle ne dépend d'aucune
+    des demandes qui la suivent (voir _follow_flight).
+
+    Quand plus aucune demande ne la suit (arrêt, /start, déconnexion), le
+    créneau d'admission est libéré aussitôt et le flux vers Ollama fermé
+    au fragment suivant. Le cache et le contexte de la conversation ne sont
+    mis à jour que pour une génération complète.
     """
+    app = current_app._get_current_object()
+    flight.on_abandon(ticket.release)
+
+    def produce():
+        with app.app_context():
+            try:
+                with ticket, flight, GenerationSample(ans["type"]) as sample:
+                    while not ticket.wait(1.0):
+                        if flight.abandoned:
+                            raise GenerationCancelled()
+                    if flight.abandoned:
+                        raise GenerationCancelled()
+                    sample.admitted(ticket.queue_time)
+                    started = time.perf_counter()
+                    # La fermeture du flux amont arrête la génération côté Ollama
+                    with closing(ollama_chat_stream(prompt, options, kv, sample)) as tokens:
+                        for token in tokens:
+                            if flight.abandoned:
+                                raise GenerationCancelled()
+                            flight.publish(token)
+                    generation_time = time.perf_counter() - started
+                    flight.model = sample.model
+            except Exception:
+                return  # Erreur transmise aux demandes par flight.finish
+            content = flight.content
+            _cache_store(cache_lookup, ans, content, generation_time, flight.model)
+            kv.commit(content)
+
+    # Le thread reprend le contexte de journal de la requête (request_id, email_type)
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(produce,), name="generation", daemon=True
+    ).start()
+
+# --------------------------------------------------------------------------------
+# VARIANTES
+# --------------------------------------------------------------------------------
+
+def _variant_count(data=None) -> int:
+    """Nombre de versions demandées (paramètre n), borné par MAX_VARIANTS."""
+    raw = request.args.get("n")
+    if raw is None and isinstance(data, dict):
+        raw = data.get("n")
     try:
-        answers = session.get("answers")
-        if not answers:
-            return jsonify({"bot": "Impossible de régénérer : aucune donnée disponible.", "end": True})
-        
-        prompts = shared.get_prompts()
-        email_type = answers.get("type")
-        if not email_type or email_type not in prompts["types"]:
-            return jsonify({
-                "bot": "Ce type d'email n'est plus disponible. Veuillez recommencer avec un nouveau type.",
-                "end": True
-            })
+        count = int(raw or 1)
+    except (TypeError, ValueError):
+        return 1
+    return max(1, min(count, shared.MAX_VARIANTS))
+
+def _variant_options(options: dict, count: int) -> list:
+    """
+    Options de chaque version : une graine différente, et une température
+    suffisante pour que les graines donnent des textes différents.
+    """
+    variants = []
+    for _ in range(count):
+        variant = dict(options, seed=random.randrange(1, 2 ** 31))
+        if variant.get("temperature", shared.VARIANT_MIN_TEMPERATURE) < shared.VARIANT_MIN_TEMPERATURE:
+            variant["temperature"] = shared.VARIANT_MIN_TEMPERATURE
+        variants.append(variant)
+    return variants
+
+def _enqueue_variants(count: int) -> list:
+    """
+    Réserve un créneau par version.
+
+    Raises:
+        Overloaded: Si la file est pleine (les places déjà réservées sont libérées)
+    """
+    tickets = []
+    try:
+        for _ in range(count):
+            tickets.append(get_admission().enqueue(_generation_priority()))
+    except Overloaded:
+        for ticket in tickets:
+            ticket.release()
+        raise
+    return tickets
+
+def _variants_payload(user_id, parts: list, errors: list, cancel, idempotency=None, models=None) -> dict:
+    """
+    Réponse finale des variantes ; chaque version est enregistrée dans ChatLog
+    avec le modèle qui l'a produite (statut "cancelled" si la demande a été annulée).
+    """
+    models = models or [None] * len(parts)
+    contents = ["".join(tokens).strip() for tokens in parts]
+    if cancel.cancelled:
+        _forget(idempotency)
+        for content in contents:
+            _log_bot_message(user_id, content, status="cancelled")
+        return {
+            "bot": contents[0] or "Génération annulée.",
+            "variants": contents,
+            "end": True,
+            "cancelled": True
+        }
+
+    if all(error is not None for error in errors):
+        _forget(idempotency)
+        return {
+            "bot": "Une erreur est survenue lors de la génération du document.",
+            "error": str(errors[0]),
+            "end": True
+        }
+
+    for content, error, model in zip(contents, errors, models):
+        if error is None:
+            _log_bot_message(user_id, content, model=model)
+    payload = {"bot": contents[0], "variants": contents, "end": True}
+    if any(error is not None for error in errors):
+        payload["errors"] = [None if error is None else str(error) for error in errors]
+    _remember(idempotency, payload)
+    return payload
+
+def _run_variants(prompt: str, variant_options: list, tickets: list, cancel, parts: list, errors: list,
+                  models: list, email_type=None):
+    """
+    Génère les versions en parallèle (un thread et un créneau chacune).
+
+    Les fragments sont accumulés dans parts[i], l'erreur éventuelle de
+    chaque version dans errors[i] et le modèle qui l'a servie dans models[i].
+
+    Yields:
+        tuple: ("token", i, fragment) au fil de l'eau,
+        ou ("queue", None, position) pendant l'attente dans la file
+    """
+    events = queue.Queue()
+
+    def worker(index, ticket):
+        error = None
+        try:
+            with ticket, GenerationSample(email_type) as sample:
+                _wait_admission(ticket, cancel)
+                sample.admitted(ticket.queue_time)
+                # La fermeture du flux amont arrête la génération côté Ollama
+                with closing(ollama_chat_stream(prompt, variant_options[index], metrics=sample)) as tokens:
+                    for token in tokens:
+                        cancel.check()
+                        events.put((index, token))
+                models[index] = sample.model
+        except Exception as e:
+            error = e
+        events.put((index, error if error is not None else StopIteration()))
 
-        user_id = None
-        if session.get("admin_logged_in"):
-            user = find_user(session.get("admin_username"))
-            if user:
-                user_id = user.id
-        elif session.get("user_id"):
-            user = find_user_by_id(session.get("user_id"))
-            if user:
-                user_id = user.id
-
-        return _generate_doc(answers, user_id)
+    for index, ticket in enumerate(tickets):
+        cancel.on_cancel(ticket.release)
+        # Le thread reprend le contexte de journal de la requête (request_id, email_type)
+        threading.Thread(target=contextvars.copy_context().run, args=(worker, index, ticket), daemon=True).start()
+
+    running = len(tickets)
+    position = None
+    try:
+        while running:
+            try:
+                index, event = events.get(timeout=1.0)
+            except queue.Empty:
+                waiting = [ticket.position() for ticket in tickets if not ticket.admitted]
+                current = max(waiting) if waiting else 0
+                if current != position:
+                    position = current
+                    yield ("queue", None, position)
+                continue
+            if isinstance(event, str):
+                parts[index].append(event)
+                yield ("token", index, event)
+            else:
+                running -= 1
+                if not isinstance(event, StopIteration):
+                    errors[index] = event
+    finally:
+        if running:
+            # Consommateur parti (client déconnecté) : les versions restantes s'arrêtent
+            if cancel.cancel(REASON_DISCONNECT):
+                get_cancellations().record(REASON_DISCONNECT)
+
+def _generate_variants(ans: dict, user_id, count: int, stream=False, idempotency=None):
+    """
+    Génère plusieurs versions du document en parallèle (régénération ou étape
+    finale avec n > 1). Les caches et le regroupement des demandes identiques
+    sont ignorés : chaque version doit être différente.
+
+    Returns:
+        JSON {"bot": première version, "variants": [...], "end": True},
+        ou flux NDJSON si stream=True
+    """
+    log.bind(email_type=ans.get("type"))
+    try:
+        prompt, options, _, error = _prepare_generation(ans)
+        if error is not None:
+            return jsonify(error)
+
+        tickets = _enqueue_variants(count)
+        cancel = get_cancellations().register(_conversation_id())
+        parts = [[] for _ in range(count)]
+        errors = [None] * count
+        models = [None] * count
+        events = _run_variants(
+            prompt, _variant_options(options, count), tickets, cancel, parts, errors, models, ans["type"]
+        )
+
+        if not stream:
+            try:
+                for _ in events:
+                    pass
+            finally:
+                get_cancellations().unregister(cancel)
+            return jsonify(_variants_payload(user_id, parts, errors, cancel, idempotency, models))
+
+        def generate():
+            finished = False
+            try:
+                yield _ndjson({"variants": count})
+                for kind, index, value in events:
+                    if kind == "queue":
+                        yield _ndjson({"queue": value})
+                    else:
+                        yield _ndjson({"variant": index, "token": value})
+                finished = True
+                yield _ndjson(_variants_payload(user_id, parts, errors, cancel, idempotency, models))
+            except GeneratorExit:
+                events.close()
+                if not finished:
+                    _variants_payload(user_id, parts, errors, cancel, idempotency, models)
+                raise
+
+        def close():
+            events.close()
+            # Flux jamais lu : les créneaux réservés n'ont pas été confiés aux threads
+            for ticket in tickets:
+                ticket.release()
+            get_cancellations().unregister(cancel)
+
+        response = Response(
+            stream_with_context(generate()),
+            mimetype="application/x-ndjson",
+            headers={"X-Accel-Buffering": "no"}
+        )
+        response.call_on_close(close)
+        return response
+    except Overloaded as e:
+        _forget(idempotency)
+        return _overloaded_response(e)
     except Exception as e:
+        _forget(idempotency)
         return jsonify({
-            "bot": "Une erreur est survenue lors de la régénération du document.",
+            "bot": "Une erreur est survenue lors de la génération du document.",
             "error": str(e),
             "end": True
         })
 
+# --------------------------------------------------------------------------------
+# DÉDUPLICATION (voir dedup.py)
+# --------------------------------------------------------------------------------
+
+def _follow_timeout():
+    """Silence maximal toléré en suivant une génération partagée."""
+    return shared.GENERATION_QUEUE_TIMEOUT + shared.OLLAMA_FIRST_BYTE_TIMEOUT
+
+def _follow_flight(subscription, user_id, stream=False, idempotency=None, ticket=None):
+    """
+    Suit une génération partagée (lancée par cette demande ou une demande
+    identique) : mêmes fragments, même résultat, sans appel supplémentaire
+    à Ollama.
+
+    L'arrêt de cette demande (/cancel, /start, déconnexion) la détache de la
+    génération : elle se termine par {"cancelled": true} et son texte partiel
+    est enregistré, la génération continue pour les autres demandes.
+
+    ticket : place dans la file de la génération lancée par cette demande
+    (en streaming, sa position est envoyée : {"queue": n}).
+    """
+    flight = subscription.flight
+    cancel = get_cancellations().register(_conversation_id())
+
+    def finish():
+        content = flight.content
+        _log_bot_message(user_id, content, model=flight.model)
+        payload = {"bot": content, "end": True}
+        _remember(idempotency, payload)
+        return payload
+
+    if not stream:
+        try:
+            for _ in subscription.follow(_follow_timeout(), cancel):
+                pass
+        except GenerationCancelled:
+            return jsonify(_cancelled_payload(user_id, flight.content, idempotency))
+        except Overloaded as e:
+            _forget(idempotency)
+            return _overloaded_response(e)
+        except Exception as e:
+            _forget(idempotency)
+            return jsonify({
+                "bot": "Une erreur est survenue lors de la génération du document.",
+                "error": str(e),
+                "end": True
+            })
+        finally:
+            get_cancellations().unregister(cancel)
+        return jsonify(finish())
+
+    def generate():
+        finished = False
+        try:
+            position = None
+            tick = 1.0 if ticket is not None else None
+            for token in subscription.follow(_follow_timeout(), cancel, tick):
+                if token is None:
+                    current = ticket.position()
+                    if current and current != position:
+                        position = current
+                        yield _ndjson({"queue": position})
+                    continue
+                yield _ndjson({"token": token})
+            payload = finish()
+            finished = True
+            yield _ndjson(payload)
+        except GenerationCancelled:
+            finished = True
+            yield _ndjson(_cancelled_payload(user_id, flight.content, idempotency))
+        except GeneratorExit:
+            # Client parti en cours de flux : cette demande ne suit plus la génération
+            if not finished:
+                if cancel.cancel(REASON_DISCONNECT):
+                    get_cancellations().record(REASON_DISCONNECT)
+                _cancelled_payload(user_id, flight.content, idempotency)
+            raise
+        except Overloaded as e:
+            _forget(idempotency)
+            yield _ndjson(_overloaded_payload(e))
+        except Exception as e:
+            _forget(idempotency)
+            yield _ndjson({
+                "bot": "Une erreur est survenue lors de la génération du document.",
+                "error": str(e),
+                "end": True
+            })
+
+    def close():
+        # Flux jamais lu (client parti avant le début) : désinscription quand même
+        subscription.close()
+        get_cancellations().unregister(cancel)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        # Désactive la mise en tampon de Nginx pour ce flux
+        headers={"X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(close)
+    return response
+
+def _idempotency():
+    """
+    (portée, clé) de l'en-tête Idempotency-Key, ou None.
+    La portée (utilisateur connecté) empêche de rejouer la requête d'un autre.
+    """
+    key = request.headers.get("Idempotency-Key", "").strip()
+    if not key:
+        return None
+    if session.get("admin_logged_in"):
+        scope = f"admin:{session.get('admin_username')}"
+    else:
+        scope = f"user:{session.get('user_id')}"
+    return scope, key[:128]
+
+def _replay(idempotency, stream=False):
+    """
+    Réponse d'une requête déjà reçue avec la même clé d'idempotence,
+    ou None si la clé est inconnue.
+    """
+    if idempotency is None:
+        return None
+    entry = get_idempotency_store().get(*idempotency)
+    if entry is None:
+        return None
+    if "payload" in entry:
+        return _final_response({**entry["payload"], "replayed": True}, stream)
+    # Génération encore en cours : on la suit (déjà enregistrée dans ChatLog)
+    return _follow_flight(entry["flight"].listen(), None, stream)
+
+def _remember(idempotency, payload: dict):
+    """Associe la réponse finale à la clé d'idempotence."""
+    if idempotency is not None:
+        get_idempotency_store().complete(*idempotency, payload)
+
+def _forget(idempotency):
+    """En cas d'échec, une nouvelle tentative doit relancer la génération."""
+    if idempotency is not None:
+        get_idempotency_store().discard(*idempotency)
+
 def get_types():
     """
-    Retourne la liste à jour des types d'emails disponibles.
-    Recharge les prompts depuis le fichier pour avoir les dernières modifications.
+    Retourne la liste à jour des types d'emails disponibles
+    (dernière version installée par sync_prompts avant la requête).
+    ETag : version de la configuration (304 si le client l'a déjà).
     """
-    shared.load_prompts()
-    return jsonify({"types": shared.get_prompts()["types"]})
+    return conditional_json({"types": shared.get_prompts()["types"]}, prompts_etag())
@@ -0,0 +1,661 @@
+# logic/chat_async.py
+"""
+chat_async.py
+--------------------------------------------------------------------------------
+Mode de service asynchrone (ASGI) pour les routes de génération du chatbot.
+
+Problème résolu :
+Avec des workers WSGI synchrones, chaque génération occupe un thread pendant
+toute la durée de l'appel à Ollama (souvent plusieurs dizaines de secondes).
+La concurrence est alors limitée au nombre de threads alors que le CPU est inactif.
+
+Fonctionnement :
+1. Routes traitées en asyncio :
+   - GET /start, POST /message, GET /regen
+   - Même logique de conversation que chat.py (fonctions partagées)
+   - L'appel à Ollama passe par ollama_chat_stream_async : aucun thread bloqué
+
+2. Routes déléguées :
+   - Toutes les autres routes sont servies par l'application Flask (WSGI)
+
+3. Contexte Flask :
+   - Un contexte de requête Flask est poussé pour chaque appel : la session,
+     les after_request (en-têtes) et la configuration restent ceux de Flask
+   - Les accès SQLAlchemy (synchrones) sont exécutés via asyncio.to_thread
+
+4. Contrôle d'admission :
+   - Même file d'attente que le mode synchrone (admission.py)
+   - L'attente se fait sur un asyncio.Event signalé par le contrôleur
+     (admission, libération, changement de position), sans bloquer la boucle
+
+5. Cache des générations :
+   - Mêmes caches que le mode synchrone (cache.py, semantic_cache.py),
+     /regen les ignore
+
+6. Déduplication :
+   - Mêmes générations partagées et clés d'idempotence que le mode
+     synchrone (dedup.py) : la génération tourne dans une tâche détachée
+     de la requête qui l'a lancée, chaque requête la suit par sondage asynchrone
+
+7. Annulation (voir cancellation.py) :
+   - L'annulation du jeton (/cancel, /start) ou la déconnexion du client
+     (message http.disconnect) arrête aussitôt le suivi de la requête
+   - Quand plus aucune requête ne suit la génération, sa tâche est annulée :
+     le flux vers Ollama est fermé immédiatement, même pendant l'attente
+     du premier token
+
+8. Reprise du contexte (voir kv_context.py) :
+   - /regen retourne au serveur qui détient le contexte de la conversation ;
+     POST /edit reste servi par Flask
+
+9. Variantes (voir chat.py) :
+   - Les versions demandées par n > 1 sont générées par des tâches
+     concurrentes, une par créneau d'admission
+
+Démarrage : voir asgi.py
+"""
+
+import io
+import sys
+import time
+import logging
+import asyncio
+from flask import request, session, jsonify
+
+from logic.chat import (
+    _start_conversation,
+    _advance_conversation,
+    _regeneration_answers,
+    _current_user_id,
+    _conversation_id,
+    _log_user_message,
+    _log_bot_message,
+    _prepare_generation,
+    _cache_lookup,
+    _cache_store,
+    _wants_stream,
+    _ndjson,
+    _generation_priority,
+    _overloaded_payload,
+    _follow_timeout,
+    _cancelled_payload,
+    _kv_request,
+    _variant_count,
+    _variant_options,
+    _enqueue_variants,
+    _variants_payload,
+    _idempotency,
+    _remember,
+    _forget,
+)
+import logic.shared as shared
+from logic.cache import generation_key
+from logic.dedup import get_flights, get_idempotency_store
+from logic.ollama_client import ollama_chat_stream_async
+from logic.admission import get_admission, Overloaded
+from logic.cancellation import get_cancellations, GenerationCancelled, REASON_DISCONNECT
+from logic.metrics import GenerationSample
+from logic.log import bind, bind_request
+from logic.prompt_store import sync_prompts
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------------
+# OUTILS ASGI
+# --------------------------------------------------------------------------------
+
+async def _read_body(receive) -> bytes:
+    """Lit le corps complet de la requête ASGI."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+def _build_environ(scope, body: bytes) -> dict:
+    """Construit un environnement WSGI à partir du scope ASGI (pour Flask)."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            key = "CONTENT_TYPE"
+        elif name == "CONTENT_LENGTH":
+            key = "CONTENT_LENGTH"
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def _asgi_headers(response, streaming=False) -> list:
+    """
+    Convertit les en-têtes d'une réponse Flask au format ASGI.
+    Pour un flux, la longueur n'est pas connue : Content-Length est retiré.
+    """
+    return [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in response.headers.items()
+        if not (streaming and name.lower() == "content-length")
+    ]
+
+# --------------------------------------------------------------------------------
+# APPLICATION ASGI
+# --------------------------------------------------------------------------------
+
+class AsyncChatApp:
+    """
+    Application ASGI servant les routes de génération en asyncio.
+
+    Args:
+        flask_app (Flask): Application Flask (session, configuration, after_request)
+        fallback: Application ASGI pour les autres routes (Flask via WsgiToAsgi)
+    """
+
+    def __init__(self, flask_app, fallback):
+        self.app = flask_app
+        self.fallback = fallback
+        self._producers = set()  # Tâches de génération en cours (référence forte)
+        self.routes = {
+            ("GET", "/start"): self._start,
+            ("POST", "/message"): self._message,
+            ("GET", "/regen"): self._regen,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        handler = None
+        if scope["type"] == "http":
+            handler = self.routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            await self.fallback(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        ctx = self.app.request_context(_build_environ(scope, body))
+        ctx.push()
+        # Routes servies sans before_request : contexte de journal posé ici
+        bind_request(request.headers.get("X-Request-ID"),
+                     session.get("user_id") or session.get("admin_username"))
+        # Comme le before_request de app.py : dernière version des prompts
+        # (requête SQL : hors de la boucle d'évènements)
+        await asyncio.to_thread(sync_prompts)
+        try:
+            await handler(send, receive)
+        finally:
+            ctx.pop()
+
+    async def _lifespan(self, receive, send):
+        """Protocole lifespan minimal (aucune ressource à initialiser)."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # ---- Réponses -----------------------------------------------------------
+
+    async def _send_response(self, send, response):
+        """Finalise une réponse Flask (after_request, cookie de session) et l'envoie."""
+        response = self.app.process_response(response)
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": _asgi_headers(response)
+        })
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+    async def _send_json(self, send, payload: dict):
+        await self._send_response(send, jsonify(payload))
+
+    async def _send_overloaded(self, send, error: Overloaded):
+        """Réponse 429/503 avec l'en-tête Retry-After."""
+        response = jsonify(_overloaded_payload(error))
+        response.status_code = error.status
+        response.headers["Retry-After"] = str(error.retry_after)
+        await self._send_response(send, response)
+
+    async def _wait_admission(self, ticket, on_position=None):
+        """
+        Attend l'admission du ticket sans bloquer la boucle d'évènements :
+        réveil seulement quand la file évolue (voir Ticket.subscribe), ou à
+        l'expiration de GENERATION_QUEUE_TIMEOUT (Overloaded levé par wait).
+        """
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        ticket.subscribe(lambda: loop.call_soon_threadsafe(changed.set))
+        position = None
+        while True:
+            changed.clear()
+            if ticket.wait(0):
+                return
+            if ticket.released:
+                # Créneau libéré par une annulation (jeton des variantes,
+                # abandon de la génération partagée) : la tâche est annulée
+                raise asyncio.CancelledError()
+            if on_position is not None:
+                current = ticket.position()
+                if current != position:
+                    position = current
+                    await on_position(position)
+            try:
+                await asyncio.wait_for(changed.wait(), ticket.time_left())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _watch_disconnect(self, receive, cancel):
+        """Annule la génération dès que le client se déconnecte (corps déjà lu)."""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                if cancel.cancel(REASON_DISCONNECT):
+                    get_cancellations().record(REASON_DISCONNECT)
+                return
+
+    async def _run_cancellable(self, coro, cancel):
+        """
+        Exécute coro dans une tâche interrompue dès l'annulation du jeton.
+
+        Raises:
+            GenerationCancelled: Si le jeton a été annulé avant la fin
+        """
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(coro)
+        # Le jeton peut être annulé depuis un autre thread (/cancel servi par Flask)
+        cancel.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task.cancelled() and cancel.cancelled:
+                raise GenerationCancelled(cancel.reason)
+            raise
+
+    async def _produce(self, ticket, flight, prompt: str, options: dict, kv, ans: dict,
+                       cache_lookup=None):
+        """
+        Génération partagée, détachée de la requête qui l'a lancée : attend
+        l'admission puis publie chaque fragment d'Ollama. Le cache et le
+        contexte de la conversation ne sont mis à jour que pour une
+        génération complète (tâche annulée quand plus personne ne la suit).
+        """
+        with self.app.app_context():
+            try:
+                with ticket, flight, GenerationSample(ans["type"]) as sample:
+                    await self._wait_admission(ticket)
+                    sample.admitted(ticket.queue_time)
+                    started = time.perf_counter()
+                    async for token in ollama_chat_stream_async(prompt, options, kv, sample):
+                        # Annulation de la tâche perdue si elle coïncide avec un
+                        # fragment (asyncio.wait_for) : l'abandon est revérifié ici
+                        if flight.abandoned:
+                            raise asyncio.CancelledError()
+                        flight.publish(token)
+                    flight.model = sample.model
+                    generation_time = time.perf_counter() - started
+            except (Exception, asyncio.CancelledError):
+                return  # Erreur transmise aux requêtes par flight.finish
+            content = flight.content
+            kv.commit(content)
+            await asyncio.to_thread(_cache_store, cache_lookup, ans, content, generation_time, flight.model)
+
+    def _start_flight(self, ticket, flight, prompt: str, options: dict, kv, ans: dict,
+                      cache_lookup=None):
+        """Lance _produce dans une tâche annulée à l'abandon de la génération."""
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(self._produce(ticket, flight, prompt, options, kv, ans, cache_lookup))
+        self._producers.add(task)
+        task.add_done_callback(self._producers.discard)
+        flight.on_abandon(ticket.release)
+        # Abandon possible depuis un autre thread (/cancel servi par Flask)
+        flight.on_abandon(lambda: loop.call_soon_threadsafe(task.cancel))
+
+    async def _send_final(self, send, payload: dict):
+        """Réponse finale, en NDJSON (une seule ligne) si le client l'a demandé."""
+        if _wants_stream():
+            await self._send_response(send, self.app.response_class(
+                _ndjson(payload), mimetype="application/x-ndjson"
+            ))
+        else:
+            await self._send_json(send, payload)
+
+    async def _send_generation_error(self, send, error_message: str, error: Exception, idempotency=None):
+        """Erreur avant le lancement de la génération (voir chat._generate_doc)."""
+        logger.exception("Erreur lors de la préparation de la génération")
+        _forget(idempotency)
+        await self._send_json(send, {"bot": error_message, "error": str(error), "end": True})
+
+    async def _start_stream(self, send):
+        """
+        Envoie les en-têtes d'un flux NDJSON (session déjà à jour)
+        et retourne la fonction d'émission des lignes.
+        """
+        response = self.app.response_class(
+            mimetype="application/x-ndjson",
+            headers={"X-Accel-Buffering": "no"}
+        )
+        response = self.app.process_response(response)
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": _asgi_headers(response, streaming=True)
+        })
+
+        async def emit(payload, more=True):
+            await send({
+                "type": "http.response.body",
+                "body": _ndjson(payload).encode("utf-8"),
+                "more_body": more
+            })
+        return emit
+
+    async def _send_generation(self, send, receive, ans: dict, user_id, error_message: str,
+                               use_cache=True, idempotency=None):
+        """
+        Lance la génération et renvoie le résultat, en NDJSON si demandé.
+        Le message du bot est enregistré dans ChatLog une fois terminé.
+        """
+        bind(email_type=ans.get("type"))
+        try:
+            prompt, options, template, error = _prepare_generation(ans)
+            if error is None:
+                lookup, cached = await asyncio.to_thread(
+                    _cache_lookup, ans, prompt, options, template, use_cache
+                )
+        except Exception as e:
+            # Prompt impossible à construire (champ manquant...) : même réponse qu'en WSGI
+            await self._send_generation_error(send, error_message, e, idempotency)
+            return
+        if error is not None:
+            await self._send_json(send, error)
+            return
+
+        if cached is not None:
+            await asyncio.to_thread(_log_bot_message, user_id, cached)
+            payload = {"bot": cached, "end": True, "cached": True}
+            _remember(idempotency, payload)
+            await self._send_final(send, payload)
+            return
+
+        # Génération identique déjà en cours dans ce processus : on la suit
+        subscription, leader = get_flights().join(generation_key(shared.MODEL_NAME, prompt, options))
+        flight = subscription.flight
+        if idempotency is not None:
+            get_idempotency_store().begin(*idempotency, flight)
+        ticket = None
+        if leader:
+            try:
+                ticket = get_admission().enqueue(_generation_priority())
+            except Overloaded as e:
+                flight.finish(e)
+                subscription.close()
+                _forget(idempotency)
+                await self._send_overloaded(send, e)
+                return
+            self._start_flight(ticket, flight, prompt, options, _kv_request(prompt), ans, lookup)
+        await self._send_followed(send, receive, subscription, user_id, error_message, idempotency, ticket)
+
+    async def _send_variants(self, send, receive, ans: dict, user_id, count: int, idempotency=None):
+        """
+        Génère count versions du document en parallèle (voir chat._generate_variants),
+        en NDJSON si demandé ({"variant": i, "token": ...}).
+        """
+        bind(email_type=ans.get("type"))
+        try:
+            prompt, options, _, error = _prepare_generation(ans)
+        except Exception as e:
+            await self._send_generation_error(
+                send, "Une erreur est survenue lors de la génération du document.", e, idempotency
+            )
+            return
+        if error is not None:
+            await self._send_json(send, error)
+            return
+
+        try:
+            tickets = _enqueue_variants(count)
+        except Overloaded as e:
+            _forget(idempotency)
+            await self._send_overloaded(send, e)
+            return
+
+        cancel = get_cancellations().register(_conversation_id())
+        for ticket in tickets:
+            cancel.on_cancel(ticket.release)
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, cancel))
+        parts = [[] for _ in range(count)]
+        errors = [None] * count
+        models = [None] * count
+
+        async def produce(index, ticket, variant_options):
+            with ticket, GenerationSample(ans["type"]) as sample:
+                await self._wait_admission(ticket)
+                sample.admitted(ticket.queue_time)
+                async for token in ollama_chat_stream_async(prompt, variant_options, metrics=sample):
+                    parts[index].append(token)
+                    if emit is not None:
+                        await emit({"variant": index, "token": token})
+                models[index] = sample.model
+
+        try:
+            emit = await self._start_stream(send) if _wants_stream() else None
+            if emit is not None:
+                await emit({"variants": count})
+            results = await asyncio.gather(*(
+                self._run_cancellable(produce(index, ticket, variant_options), cancel)
+                for index, (ticket, variant_options)
+                in enumerate(zip(tickets, _variant_options(options, count)))
+            ), return_exceptions=True)
+            for index, result in enumerate(results):
+                if isinstance(result, Exception):
+                    errors[index] = result
+
+            payload = await asyncio.to_thread(
+                _variants_payload, user_id, parts, errors, cancel, idempotency, models
+            )
+            if cancel.reason == REASON_DISCONNECT:
+                # Plus personne pour lire la réponse
+                return
+            if emit is None:
+                await self._send_json(send, payload)
+            else:
+                await emit(payload, more=False)
+        finally:
+            for ticket in tickets:
+                ticket.release()
+            watcher.cancel()
+            get_cancellations().unregister(cancel)
+
+    async def _send_followed(self, send, receive, subscription, user_id, error_message: str,
+                             idempotency=None, ticket=None):
+        """
+        Suit une génération partagée (voir chat._follow_flight).
+        user_id=None : le message est déjà enregistré (requête rejouée).
+        ticket : place dans la file de la génération lancée par cette requête
+        (en streaming, sa position est envoyée : {"queue": n}).
+        """
+        flight = subscription.flight
+        # Jeton d'annulation (/cancel, /start, déconnexion) : arrête le suivi
+        cancel = get_cancellations().register(_conversation_id())
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, cancel))
+        try:
+            emit = await self._start_stream(send) if _wants_stream() else None
+            tick = 1.0 if ticket is not None and emit is not None else None
+            position = None
+            try:
+                async for token in subscription.follow_async(_follow_timeout(), cancel, tick):
+                    if token is None:
+                        current = ticket.position()
+                        if current and current != position:
+                            position = current
+                            await emit({"queue": position})
+                    elif emit is not None:
+                        await emit({"token": token})
+            except GenerationCancelled as e:
+                payload = await asyncio.to_thread(
+                    _cancelled_payload, user_id, flight.content, idempotency
+                )
+                if e.reason == REASON_DISCONNECT:
+                    # Plus personne pour lire la réponse
+                    return
+            except Overloaded as e:
+                _forget(idempotency)
+                if emit is None:
+                    await self._send_overloaded(send, e)
+                else:
+                    await emit(_overloaded_payload(e), more=False)
+                return
+            except Exception as e:
+                _forget(idempotency)
+                payload = {"bot": error_message, "error": str(e), "end": True}
+            else:
+                content = flight.content
+                await asyncio.to_thread(_log_bot_message, user_id, content, None, flight.model)
+                payload = {"bot": content, "end": True}
+                _remember(idempotency, payload)
+
+            if emit is None:
+                await self._send_json(send, payload)
+            else:
+                await emit(payload, more=False)
+        finally:
+            subscription.close()
+            watcher.cancel()
+            get_cancellations().unregister(cancel)
+
+    async def _send_replay(self, send, receive, idempotency) -> bool:
+        """
+        Rejoue une requête déjà reçue (même Idempotency-Key).
+
+        Returns:
+            bool: True si une réponse a été envoyée
+        """
+        if idempotency is None:
+            return False
+        entry = get_idempotency_store().get(*idempotency)
+        if entry is None:
+            return False
+        if "payload" in entry:
+            await self._send_final(send, {**entry["payload"], "replayed": True})
+        else:
+            await self._send_followed(
+                send, receive, entry["flight"].listen(), None,
+                "Une erreur est survenue lors de la génération du document."
+            )
+        return True
+
+    # ---- Routes -------------------------------------------------------------
+
+    async def _start(self, send, receive):
+        """GET /start : identique à chat.start()."""
+        try:
+            # Annulation publiée dans la base partagée : hors de la boucle d'évènements
+            response = jsonify(await asyncio.to_thread(_start_conversation))
+        except Exception as e:
+            response = jsonify({
+                "bot": "Une erreur est survenue lors du démarrage de la conversation.",
+                "error": str(e),
+                "end": True
+            })
+        await self._send_response(send, response)
+
+    async def _message(self, send, receive):
+        """POST /message : identique à chat.handle_message(), génération en asyncio."""
+        try:
+            if not request.is_json:
+                await self._send_json(send, {
+                    "bot": "Erreur : Les données doivent être envoyées au format JSON",
+                    "end": False
+                })
+                return
+
+            data = request.json or {}
+
+            # Requête rejouée (même Idempotency-Key) : résultat de l'originale
+            idempotency = _idempotency()
+            if await self._send_replay(send, receive, idempotency):
+                return
+
+            user_id = await asyncio.to_thread(_current_user_id)
+            await asyncio.to_thread(_log_user_message, user_id, data)
+
+            reply = _advance_conversation(data)
+        except Exception as e:
+            logger.exception("Erreur dans handle_message")
+            await self._send_json(send, {
+                "bot": "Une erreur est survenue lors du traitement de votre message. Veuillez réessayer.",
+                "error": str(e),
+                "end": False
+            })
+            return
+
+        if reply is not None:
+            _remember(idempotency, reply)
+            await self._send_json(send, reply)
+            return
+
+        count = _variant_count(data)
+        if count > 1:
+            await self._send_variants(send, receive, session["answers"], user_id, count, idempotency)
+            return
+
+        await self._send_generation(
+            send, receive, session["answers"], user_id,
+            "Une erreur est survenue lors de la génération du document.",
+            idempotency=idempotency
+        )
+
+    async def _regen(self, send, receive):
+        """GET /regen : identique à chat.regenerate(), génération en asyncio."""
+        try:
+            idempotency = _idempotency()
+            if await self._send_replay(send, receive, idempotency):
+                return
+
+            answers, error = _regeneration_answers()
+            if error is not None:
+                await self._send_json(send, error)
+                return
+            user_id = await asyncio.to_thread(_current_user_id)
+            count = _variant_count()
+        except Exception as e:
+            await self._send_json(send, {
+                "bot": "Une erreur est survenue lors de la régénération du document.",
+                "error": str(e),
+                "end": True
+            })
+            return
+
+        if count > 1:
+            await self._send_variants(send, receive, answers, user_id, count, idempotency)
+            return
+
+        await self._send_generation(
+            send, receive, answers, user_id,
+            "Une erreur est survenue lors de la génération du document.",
+            use_cache=False,
+            idempotency=idempotency
+        )
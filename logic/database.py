@@ -29,6 +29,7 @@ de l'application Flask. Pour la production, considérer :
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 
 # --------------------------------------------------------------------------------
 # INSTANCE SQLALCHEMY
@@ -65,3 +66,36 @@ def init_app(app):
 
     # Initialise l'extension SQLAlchemy avec notre application
     db.init_app(app)
+
+    # Crée les tables ajoutées depuis l'installation, puis les colonnes
+    # ajoutées aux tables existantes (create_all ne les modifie pas)
+    from logic import models  # noqa: F401 (enregistre les modèles)
+    with app.app_context():
+        db.create_all()
+        add_missing_columns()
+
+        # Configuration des prompts : import de prompts.json si la base est vide
+        from logic.prompt_store import bootstrap_prompts
+        bootstrap_prompts()
+
+def add_missing_columns():
+    """
+    Ajoute aux tables existantes les colonnes déclarées depuis leur création.
+
+    Seules les colonnes facultatives (nullable) sont concernées : SQLite
+    n'accepte ALTER TABLE ADD COLUMN que pour elles. Les colonnes existantes
+    ne sont jamais modifiées.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                ))
@@ -0,0 +1,404 @@
+# logic/dedup.py
+"""
+dedup.py
+--------------------------------------------------------------------------------
+Déduplication des générations : regroupement des demandes identiques en cours
+et clés d'idempotence.
+
+Problème résolu :
+Un double clic sur "Régénérer" ou une requête renvoyée par le navigateur
+lance une seconde génération complète alors que la première est en cours.
+
+Fonctionnement :
+1. Regroupement (single-flight) :
+   - Les générations identiques (modèle, prompt, options) en cours dans le
+     processus partagent un seul appel à Ollama
+   - La génération est produite en arrière-plan (thread ou tâche asyncio,
+     voir chat.py) et publie chaque fragment
+   - Chaque demande, y compris celle qui l'a lancée, la suit (Subscription) :
+     mêmes fragments, sans passer par la file d'admission ni appeler Ollama
+   - Une demande qui s'arrête (bouton "Arrêter", /start, déconnexion) cesse
+     seulement de la suivre ; la génération n'est abandonnée, et le flux
+     vers Ollama fermé, que quand plus aucune demande ne la suit
+
+2. Idempotence :
+   - /message et /regen acceptent l'en-tête Idempotency-Key
+   - Une requête rejouée avec la même clé reçoit le résultat de l'originale
+     (ou suit la génération si elle est encore en cours)
+   - Les résultats sont conservés IDEMPOTENCY_TTL secondes, par utilisateur
+
+Les deux mécanismes sont tenus par processus (par worker Gunicorn).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import logic.shared as shared
+
+# --------------------------------------------------------------------------------
+# GÉNÉRATION PARTAGÉE
+# --------------------------------------------------------------------------------
+
+class Flight:
+    """
+    Génération en cours, partagée entre toutes les demandes identiques.
+
+    Le producteur publie les fragments (publish) puis termine la génération
+    (finish), en utilisant de préférence le gestionnaire de contexte :
+
+        with flight:
+            for token in ollama_chat_stream(prompt):
+                if flight.abandoned:
+                    raise GenerationCancelled()
+                flight.publish(token)
+
+    Les demandes la suivent par une Subscription (FlightGroup.join ou
+    listen). Quand la dernière se désinscrit avant la fin, la génération est
+    abandonnée : abandoned passe à True et les fonctions on_abandon sont appelées.
+    """
+
+    def __init__(self, key, on_done=None):
+        self.key = key
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.listeners = 0  # Demandes qui suivent la génération
+        self.abandoned = False
+        self.model = None  # Modèle qui a servi (renseigné par le producteur)
+        self._cond = threading.Condition()
+        self._on_done = on_done
+        self._on_abandon = []
+        self._subscribers = []  # Suivis asynchrones (voir subscribe)
+
+    def publish(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._notify_locked()
+
+    def finish(self, error=None):
+        """Termine la génération (avec l'erreur éventuelle du producteur). Idempotent."""
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._notify_locked()
+        if self._on_done is not None:
+            self._on_done(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, Exception):
+            # CancelledError : la tâche du producteur a été interrompue
+            exc = ValueError("La génération d'origine a été interrompue")
+        self.finish(exc)
+        return False
+
+    @property
+    def content(self):
+        return "".join(self.tokens).strip()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    # ---- Demandes qui suivent la génération ---------------------------------
+
+    def listen(self, joining=False):
+        """
+        Inscrit une demande qui suivra la génération.
+
+        Returns:
+            Subscription|None: None si joining=True et que la génération est
+            déjà abandonnée (FlightGroup.join en démarre alors une autre)
+        """
+        with self._cond:
+            if joining and self.abandoned:
+                return None
+            self.listeners += 1
+        return Subscription(self)
+
+    def on_abandon(self, callback):
+        """Appelle callback à l'abandon (immédiatement s'il a déjà eu lieu)."""
+        with self._cond:
+            if not self.abandoned:
+                self._on_abandon.append(callback)
+                return
+        callback()
+
+    def _leave(self):
+        with self._cond:
+            self.listeners -= 1
+            if self.listeners > 0 or self.done or self.abandoned:
+                return
+            self.abandoned = True
+            callbacks, self._on_abandon = self._on_abandon, []
+        for callback in callbacks:
+            callback()
+
+    def subscribe(self, callback):
+        """
+        Appelle callback à chaque évolution de la génération : fragment,
+        fin, ou réveil (annulation d'une demande). Appelé sous le verrou,
+        depuis n'importe quel thread : callback doit être immédiat
+        (ex. loop.call_soon_threadsafe(event.set)).
+
+        Returns:
+            La fonction qui désinscrit callback
+        """
+        with self._cond:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._cond:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _notify_locked(self):
+        self._cond.notify_all()
+        for callback in self._subscribers:
+            callback()
+
+    def _wake(self):
+        """Réveille les demandes en attente (annulation de l'une d'elles)."""
+        with self._cond:
+            self._notify_locked()
+
+class Subscription:
+    """
+    Une demande qui suit une génération partagée : fragments publiés depuis
+    le début, puis les suivants. La demande est désinscrite à la fin du
+    suivi, à son annulation ou par close() (flux jamais lu). Idempotent.
+    """
+
+    def __init__(self, flight):
+        self.flight = flight
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight._leave()
+
+    def follow(self, timeout=None, cancel=None, tick=None):
+        """
+        Renvoie les fragments de la génération.
+
+        Args:
+            timeout (float|None): Silence maximal toléré (secondes)
+            cancel (CancelToken|None): Jeton de la demande ; son annulation
+                interrompt le suivi (la génération continue pour les autres)
+            tick (float|None): Sans nouveau fragment, None est renvoyé toutes
+                les tick secondes (position dans la file d'admission)
+
+        Raises:
+            GenerationCancelled: Si le jeton de la demande est annulé
+            Exception: L'erreur rencontrée par le producteur
+            ValueError: Si aucun fragment n'arrive pendant timeout secondes
+        """
+        flight = self.flight
+        if cancel is not None:
+            cancel.on_cancel(flight._wake)
+        index = 0
+        last = time.monotonic()
+        try:
+            while True:
+                with flight._cond:
+                    if cancel is not None:
+                        cancel.check()
+                    if index >= len(flight.tokens) and not flight.done:
+                        waits = [w for w in (tick, timeout) if w is not None]
+                        if timeout is not None:
+                            waits.append(max(0.0, last + timeout - time.monotonic()))
+                        flight._cond.wait(min(waits) if waits else None)
+                        if cancel is not None:
+                            cancel.check()
+                    new = flight.tokens[index:]
+                    finished = flight.done
+                if new:
+                    last = time.monotonic()
+                elif not finished:
+                    if timeout is not None and time.monotonic() - last >= timeout:
+                        raise ValueError("La génération partagée ne répond plus")
+                    if tick is not None:
+                        yield None
+                index += len(new)
+                yield from new
+                if finished and index >= len(flight.tokens):
+                    flight._check()
+                    return
+        finally:
+            self.close()
+
+    async def follow_async(self, timeout=None, cancel=None, tick=None):
+        """
+        Variante asynchrone de follow() : réveil à chaque évolution de la
+        génération (Flight.subscribe), sans sondage ni blocage de la boucle.
+        """
+        flight = self.flight
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        # Un seul réveil en attente suffit : la boucle relit tous les fragments
+        unsubscribe = flight.subscribe(
+            lambda: changed.is_set() or loop.call_soon_threadsafe(changed.set)
+        )
+        if cancel is not None:
+            cancel.on_cancel(flight._wake)
+        index = 0
+        last = last_tick = time.monotonic()
+        try:
+            while True:
+                changed.clear()
+                if cancel is not None:
+                    cancel.check()
+                with flight._cond:
+                    new = flight.tokens[index:]
+                    finished = flight.done
+                index += len(new)
+                for token in new:
+                    yield token
+                now = time.monotonic()
+                if new:
+                    last = last_tick = now
+                if finished and index >= len(flight.tokens):
+                    flight._check()
+                    return
+                if timeout is not None and now - last >= timeout:
+                    raise ValueError("La génération partagée ne répond plus")
+                if tick is not None and now - last_tick >= tick:
+                    last_tick = now
+                    yield None
+                waits = []
+                if timeout is not None:
+                    waits.append(last + timeout - now)
+                if tick is not None:
+                    waits.append(last_tick + tick - now)
+                try:
+                    await asyncio.wait_for(changed.wait(), max(0.0, min(waits)) if waits else None)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            unsubscribe()
+            self.close()
+
+class FlightGroup:
+    """Générations en cours du processus, indexées par clé."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.led = 0
+        self.joined = 0
+
+    def join(self, key):
+        """
+        Rejoint la génération en cours pour cette clé, ou en démarre une
+        (génération abandonnée par toutes ses demandes : remplacée).
+
+        Returns:
+            tuple: (subscription, leader) ; leader=True si l'appelant doit
+            lancer la génération (subscription.flight)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.done:
+                subscription = flight.listen(joining=True)
+                if subscription is not None:
+                    self.joined += 1
+                    return subscription, False
+            flight = self._flights[key] = Flight(key, on_done=self._remove)
+            self.led += 1
+            return flight.listen(), True
+
+    def _remove(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "listeners": sum(flight.listeners for flight in self._flights.values()),
+                "led": self.led,
+                "coalesced": self.joined
+            }
+
+# --------------------------------------------------------------------------------
+# CLÉS D'IDEMPOTENCE
+# --------------------------------------------------------------------------------
+
+class IdempotencyStore:
+    """
+    Résultats des requêtes portant une clé d'idempotence.
+
+    Une entrée contient soit la génération en cours ("flight"),
+    soit la réponse finale ("payload").
+    """
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (portée, clé) -> (entrée, expiration)
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    def get(self, scope, key):
+        """Entrée associée à la clé, ou None (clé inconnue ou expirée)."""
+        with self._lock:
+            item = self._entries.get((scope, key))
+            if item is None:
+                return None
+            entry, expires = item
+            if expires <= time.monotonic():
+                del self._entries[(scope, key)]
+                return None
+            self.replays += 1
+            return entry
+
+    def _set(self, scope, key, entry):
+        with self._lock:
+            self._entries[(scope, key)] = (entry, time.monotonic() + self.ttl)
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def begin(self, scope, key, flight):
+        """Associe la clé à la génération en cours."""
+        self._set(scope, key, {"flight": flight})
+
+    def complete(self, scope, key, payload):
+        """Associe la clé à la réponse finale."""
+        self._set(scope, key, {"payload": payload})
+
+    def discard(self, scope, key):
+        """Oublie la clé (échec : une nouvelle tentative doit regénérer)."""
+        with self._lock:
+            self._entries.pop((scope, key), None)
+
+# --------------------------------------------------------------------------------
+# INSTANCES DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_flights = FlightGroup()
+_idempotency = IdempotencyStore(shared.IDEMPOTENCY_TTL)
+
+def get_flights() -> FlightGroup:
+    return _flights
+
+def get_idempotency_store() -> IdempotencyStore:
+    return _idempotency
+
+def _reset():
+    """Après un fork, les générations du parent ne concernent pas ce worker."""
+    global _flights, _idempotency
+    _flights = FlightGroup()
+    _idempotency = IdempotencyStore(shared.IDEMPOTENCY_TTL)
+
+os.register_at_fork(after_in_child=_reset)
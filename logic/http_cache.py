@@ -0,0 +1,67 @@
+# logic/http_cache.py
+"""
+http_cache.py
+--------------------------------------------------------------------------------
+Politique de mise en cache HTTP par route.
+
+Problème résolu :
+Toutes les réponses portaient "Cache-Control: no-store" : chaque page
+retéléchargeait tous les fichiers JS/CSS, et /types renvoyait à chaque appel
+un contenu qui ne change qu'avec la configuration des prompts.
+
+Politiques :
+1. Réponses liées à la session ou à l'utilisateur (défaut) :
+   - no-store, posé par app.py sur toute réponse sans Cache-Control
+   - Dont /start, qui réinitialise la conversation en session : ni cache
+     ni revalidation
+2. JSON dérivé de la configuration des prompts (/types) :
+   - ETag = version de la configuration (voir prompt_store.prompts_etag)
+   - no-cache : le navigateur revalide à chaque appel (If-None-Match) et
+     reçoit 304 sans corps tant que la version n'a pas changé
+3. Fichiers statiques :
+   - public, max-age=STATIC_MAX_AGE (SEND_FILE_MAX_AGE_DEFAULT de Flask),
+     puis revalidation par ETag / Last-Modified
+   - Fichiers construits (nom dérivé du contenu, voir assets.py) : un an,
+     immutable, sans revalidation
+"""
+
+from flask import current_app, jsonify, request
+
+from logic.assets import is_fingerprinted
+
+# Défaut : aucune copie conservée (session, données de l'utilisateur)
+NO_STORE = "no-store, no-cache, must-revalidate, private"
+
+# Fichiers dont le nom change avec le contenu
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def conditional_json(payload: dict, etag: str):
+    """
+    Réponse JSON revalidée par ETag : 304 sans corps si le client a déjà
+    cette version (If-None-Match).
+
+    Args:
+        payload (dict): Contenu de la réponse (déterminé par etag)
+        etag (str): Validateur du contenu, sans guillemets
+    """
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def apply_static_policy(response, filename: str):
+    """Cache d'un an pour les fichiers construits (fichiers statiques servis par Flask)."""
+    if response.status_code in (200, 304) and is_fingerprinted(filename):
+        response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+def apply_default_policy(response):
+    """Interdit la mise en cache des réponses qui n'ont pas choisi de politique."""
+    if "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = NO_STORE
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
+    return response
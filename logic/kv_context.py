@@ -0,0 +1,219 @@
+# logic/kv_context.py
+"""
+kv_context.py
+--------------------------------------------------------------------------------
+Réutilisation du contexte déjà évalué par Ollama (cache KV) entre les
+générations d'une même conversation.
+
+Problème résolu :
+Chaque /regen renvoyait le prompt complet à un serveur quelconque : Ollama
+réévaluait tout le prompt (prompt_eval_duration) avant le premier token.
+Les retouches ("plus court", "plus formel") demandaient en plus de renvoyer
+le document précédent.
+
+Fonctionnement :
+1. Contexte d'une conversation :
+   - L'API /api/chat ne renvoie pas de contexte réutilisable : Ollama garde
+     en revanche le cache KV de la dernière séquence de chaque emplacement
+     et reprend le plus long préfixe commun de la requête suivante
+   - On retient donc, par conversation (session["conversation_id"]), le
+     serveur qui a produit le document et les messages exacts envoyés
+   - La régénération et les retouches sont routées vers ce serveur
+     (backends.acquire(prefer=...)) avec le même préfixe de messages :
+     seule la nouvelle consigne est évaluée
+
+2. Mesure :
+   - Le dernier fragment d'Ollama indique prompt_eval_count et
+     prompt_eval_duration
+   - Le coût par token est mesuré sur les évaluations complètes ; le temps
+     gagné est l'écart entre le coût attendu du contexte complet et
+     l'évaluation réellement effectuée
+   - Les totaux sont exposés dans /admin/cache/status
+
+Les contextes sont tenus par processus (par worker Gunicorn), comme les
+générations partagées de dedup.py : une conversation servie par un autre
+worker repart simplement d'une évaluation complète.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import logic.shared as shared
+
+# --------------------------------------------------------------------------------
+# REQUÊTE
+# --------------------------------------------------------------------------------
+
+class KvRequest:
+    """
+    Une génération qui peut reprendre le contexte de la conversation.
+
+    Transmise à ollama_chat_stream(kv=...) : le serveur préféré et les
+    messages qui suivent le prompt en sont tirés, les statistiques du
+    dernier fragment y sont enregistrées (record).
+    """
+
+    def __init__(self, store, key, prompt, history=(), handle=None):
+        self.store = store
+        self.key = key
+        self.prompt = prompt
+        self.history = list(history)
+        self.prefer = handle.backend_url if handle is not None else None
+        # Tokens supposés présents dans le cache KV du serveur préféré
+        if handle is None:
+            self.prefix_tokens = 0
+        elif self.history[:len(handle.history)] == handle.history and self.history:
+            self.prefix_tokens = handle.context_tokens
+        else:
+            self.prefix_tokens = handle.prompt_tokens
+        self.prompt_tokens = handle.prompt_tokens if handle is not None else 0
+        self.backend_url = None
+        self.stats = None
+
+    def record(self, backend_url, chunk):
+        """Statistiques du dernier fragment d'Ollama (serveur qui a répondu)."""
+        self.backend_url = backend_url
+        self.stats = {
+            "prompt_eval_count": chunk.get("prompt_eval_count") or 0,
+            "prompt_eval_duration": (chunk.get("prompt_eval_duration") or 0) / 1e9,
+            "eval_count": chunk.get("eval_count") or 0
+        }
+        self.store.measure(self)
+
+    @property
+    def reused(self):
+        """Vrai si la génération a été servie par le serveur qui détient le contexte."""
+        return self.prefix_tokens > 0 and self.backend_url == self.prefer
+
+    def commit(self, content: str):
+        """Retient le contexte produit par cette génération (document terminé)."""
+        self.store.save(self, content)
+
+class KvHandle:
+    """Contexte retenu d'une conversation."""
+
+    def __init__(self, prompt, backend_url, history, prompt_tokens, context_tokens):
+        self.prompt = prompt
+        self.backend_url = backend_url
+        self.history = history            # Messages après le prompt, réponse comprise
+        self.prompt_tokens = prompt_tokens
+        self.context_tokens = context_tokens
+        self.expires = time.monotonic() + shared.KV_CONTEXT_TTL
+
+    @property
+    def draft(self):
+        """Dernier document produit dans ce contexte."""
+        return self.history[-1]["content"] if self.history else None
+
+# --------------------------------------------------------------------------------
+# CONTEXTES DES CONVERSATIONS
+# --------------------------------------------------------------------------------
+
+class KvContextStore:
+    """Contextes retenus par conversation, avec les totaux du temps gagné."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._handles = OrderedDict()  # conversation -> KvHandle
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reuses = 0
+        self.prompt_eval_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+        self.seconds_per_token = None  # Coût mesuré d'une évaluation complète
+
+    def get(self, key, prompt):
+        """Contexte de la conversation pour ce prompt, ou None (absent, expiré ou prompt modifié)."""
+        if key is None:
+            return None
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                return None
+            if handle.expires <= time.monotonic() or handle.prompt != prompt:
+                del self._handles[key]
+                return None
+            return handle
+
+    def request(self, key, prompt, history=()) -> KvRequest:
+        """Prépare une génération de la conversation key."""
+        handle = self.get(key, prompt) if shared.KV_CONTEXT_REUSE else None
+        return KvRequest(self, key, prompt, history, handle)
+
+    def measure(self, kv: KvRequest):
+        """Comptabilise l'évaluation du prompt et le temps gagné par la reprise du contexte."""
+        evaluated = kv.stats["prompt_eval_count"]
+        duration = kv.stats["prompt_eval_duration"]
+        with self._lock:
+            self.requests += 1
+            self.prompt_eval_seconds += duration
+            if not kv.reused or evaluated >= kv.prefix_tokens:
+                # Évaluation complète : sert d'étalon du coût par token
+                if evaluated and duration:
+                    rate = duration / evaluated
+                    self.seconds_per_token = rate if self.seconds_per_token is None \
+                        else 0.8 * self.seconds_per_token + 0.2 * rate
+                if not kv.prompt_tokens and not kv.history:
+                    kv.prompt_tokens = evaluated
+                return
+            # Préfixe repris : seuls les nouveaux tokens ont été évalués
+            self.reuses += 1
+            self.saved_tokens += kv.prefix_tokens
+            if self.seconds_per_token is not None:
+                expected = (kv.prefix_tokens + evaluated) * self.seconds_per_token
+                self.saved_seconds += max(0.0, expected - duration)
+
+    def save(self, kv: KvRequest, content: str):
+        """Retient le serveur et les messages de la génération terminée."""
+        if kv.key is None or kv.backend_url is None or not shared.KV_CONTEXT_REUSE:
+            return
+        stats = kv.stats or {}
+        history = kv.history + [{"role": "assistant", "content": content}]
+        if kv.reused and stats.get("prompt_eval_count", 0) < kv.prefix_tokens:
+            context_tokens = kv.prefix_tokens + stats.get("prompt_eval_count", 0)
+        else:
+            context_tokens = stats.get("prompt_eval_count", 0)
+        context_tokens += stats.get("eval_count", 0)
+        handle = KvHandle(kv.prompt, kv.backend_url, history, kv.prompt_tokens, context_tokens)
+        with self._lock:
+            self._handles[kv.key] = handle
+            self._handles.move_to_end(kv.key)
+            while len(self._handles) > self.max_entries:
+                self._handles.popitem(last=False)
+
+    def discard(self, key):
+        """Oublie le contexte de la conversation (nouvelle conversation)."""
+        with self._lock:
+            self._handles.pop(key, None)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "enabled": shared.KV_CONTEXT_REUSE,
+                "conversations": len(self._handles),
+                "requests": self.requests,
+                "reuses": self.reuses,
+                "prompt_eval_seconds": round(self.prompt_eval_seconds, 3),
+                "saved_seconds": round(self.saved_seconds, 3),
+                "saved_tokens": self.saved_tokens,
+                "seconds_per_token": self.seconds_per_token
+            }
+
+# --------------------------------------------------------------------------------
+# INSTANCE DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_store = KvContextStore()
+
+def get_kv_contexts() -> KvContextStore:
+    return _store
+
+def _reset():
+    """Après un fork, les contextes du parent ne concernent pas ce worker."""
+    global _store
+    _store = KvContextStore()
+
+os.register_at_fork(after_in_child=_reset)
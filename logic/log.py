@@ -0,0 +1,205 @@
+# logic/log.py
+"""
+log.py
+--------------------------------------------------------------------------------
+Journalisation structurée et non bloquante du module logic.
+
+Problème résolu :
+Les print() du chemin de génération (prompt complet, URL, modèle, erreurs)
+écrivaient de façon synchrone sur la sortie standard à chaque requête, sans
+structure, et recopiaient le contenu des prompts dans les journaux.
+
+Fonctionnement :
+1. Format :
+   - Une ligne JSON par évènement : horodatage, niveau, module, message
+   - Contexte de la requête ajouté automatiquement : request_id
+     (en-tête X-Request-ID ou généré), user_id, email_type
+   - Champs propres à l'évènement passés par extra={...} (durées, serveur...)
+   - LOG_FORMAT=text pour un format lisible en développement
+
+2. Émission non bloquante :
+   - Les évènements sont déposés dans une file bornée (QueueHandler) et
+     écrits par un thread dédié (QueueListener)
+   - File pleine : l'évènement est abandonné plutôt que de bloquer la requête
+
+3. Niveau : LOG_LEVEL (INFO par défaut, DEBUG pour le détail des appels)
+
+4. Prompts (LOG_PROMPTS) :
+   - redact (défaut) : longueur et empreinte seulement
+   - sample : prompt complet pour une fraction LOG_PROMPT_SAMPLE_RATE des appels
+   - full : prompt complet (débogage uniquement)
+"""
+
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import logic.shared as shared
+
+# --------------------------------------------------------------------------------
+# CONTEXTE DE LA REQUÊTE
+# --------------------------------------------------------------------------------
+
+_context = contextvars.ContextVar("log_context", default={})
+
+def bind(**fields):
+    """Ajoute des champs au contexte de la requête en cours (ex. email_type)."""
+    _context.set({**_context.get(), **fields})
+
+def bind_request(request_id=None, user_id=None) -> str:
+    """
+    Démarre le contexte d'une requête.
+
+    Returns:
+        str: L'identifiant de la requête (reçu ou généré)
+    """
+    request_id = (request_id or "")[:64] or uuid.uuid4().hex[:16]
+    _context.set({"request_id": request_id, "user_id": user_id})
+    return request_id
+
+def current_request_id():
+    return _context.get().get("request_id")
+
+class _ContextFilter(logging.Filter):
+    """Copie le contexte dans l'évènement, dans le thread qui l'émet."""
+
+    def filter(self, record):
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+# --------------------------------------------------------------------------------
+# FORMATS
+# --------------------------------------------------------------------------------
+
+# Attributs standard d'un LogRecord : tout le reste vient du contexte ou de extra
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par évènement."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_ATTRIBUTES and value is not None:
+                entry[name] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Format lisible (développement) : message suivi des champs structurés."""
+
+    def format(self, record):
+        fields = " ".join(
+            f"{name}={value}" for name, value in vars(record).items()
+            if name not in _STANDARD_ATTRIBUTES and value is not None
+        )
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += f" [{fields}]"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+# --------------------------------------------------------------------------------
+# ÉMISSION NON BLOQUANTE
+# --------------------------------------------------------------------------------
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Dépose l'évènement dans la file sans jamais attendre (abandon si elle est pleine)."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        """
+        Fige le message et la trace dans le thread émetteur, sans fusionner
+        la trace dans le message (champ "exception" séparé).
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+_handler = None
+_listener = None
+_lock = threading.Lock()
+
+def _start_listener():
+    """Crée la file et le thread d'écriture (au démarrage, et après un fork)."""
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if shared.LOG_FORMAT == "text" else JsonFormatter())
+    _handler.queue = queue.Queue(maxsize=shared.LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+def configure_logging():
+    """
+    Configure le logger "logic" (idempotent) : niveau LOG_LEVEL,
+    file d'attente bornée et thread d'écriture.
+    """
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        _handler = _DroppingQueueHandler(queue.Queue())
+        _handler.addFilter(_ContextFilter())
+        _start_listener()
+
+        logger = logging.getLogger("logic")
+        logger.setLevel(shared.LOG_LEVEL.upper())
+        logger.addHandler(_handler)
+        logger.propagate = False
+
+def _restart_after_fork():
+    """Le thread d'écriture du parent n'existe pas dans un worker : on le recrée."""
+    global _lock
+    _lock = threading.Lock()
+    if _handler is not None:
+        _start_listener()
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+# --------------------------------------------------------------------------------
+# PROMPTS
+# --------------------------------------------------------------------------------
+
+def prompt_fields(prompt: str) -> dict:
+    """
+    Champs de journal d'un prompt selon LOG_PROMPTS : longueur et empreinte,
+    et texte complet si la politique (ou l'échantillonnage) le permet.
+    """
+    fields = {
+        "prompt_chars": len(prompt),
+        "prompt_sha": hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    }
+    policy = shared.LOG_PROMPTS
+    if policy == "full" or (policy == "sample" and random.random() < shared.LOG_PROMPT_SAMPLE_RATE):
+        fields["prompt"] = prompt
+    return fields
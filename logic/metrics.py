@@ -0,0 +1,417 @@
+# logic/metrics.py
+"""
+metrics.py
+--------------------------------------------------------------------------------
+Mesures de latence des générations, agrégées entre les workers Gunicorn.
+
+Problème résolu :
+Aucun chiffre n'était disponible : les statistiques du dernier fragment
+d'Ollama (eval_count, eval_duration, prompt_eval_duration, load_duration)
+étaient ignorées.
+
+Fonctionnement :
+1. Mesure d'une génération (GenerationSample) :
+   - Attente dans la file d'admission
+   - Temps jusqu'au premier token et durée totale, depuis l'admission
+   - Tokens du prompt et de la réponse, débit (tokens/s) mesuré par Ollama
+   - Type d'email, modèle qui a servi (voir routing.py), serveur et issue
+     (ok, error, cancelled)
+
+2. Stockage partagé (SQLite, METRICS_DB_PATH) :
+   - Chaque worker accumule ses mesures en mémoire et les écrit par lots
+     (toutes les METRICS_FLUSH_INTERVAL secondes) : aucune écriture
+     sur le chemin de la génération
+   - generation_sample : mesures brutes conservées METRICS_RETENTION
+     secondes (percentiles de la page d'administration)
+   - generation_total : compteurs et histogrammes cumulés (format Prometheus),
+     incrémentés par tous les workers
+
+3. Exposition :
+   - GET /metrics : format texte Prometheus
+   - GET /admin/metrics : p50 / p95 / p99 par type et par modèle (JSON)
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import logic.shared as shared
+from logic.admission import Overloaded
+from logic.cancellation import GenerationCancelled
+from logic.routing import get_router
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------------
+# MESURE D'UNE GÉNÉRATION
+# --------------------------------------------------------------------------------
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_CANCELLED = "cancelled"
+
+class GenerationSample:
+    """
+    Mesure d'une génération, complétée par l'appelant (file d'attente, issue)
+    et par ollama_client (serveur, premier token, statistiques d'Ollama).
+
+    Usage (l'issue est déduite de l'exception éventuelle) :
+        with GenerationSample(email_type) as sample:
+            ... attente de l'admission ...
+            sample.admitted(ticket.queue_time)
+            for token in ollama_chat_stream(prompt, options, metrics=sample): ...
+    """
+
+    def __init__(self, email_type, model=None):
+        self.email_type = email_type or ""
+        self.model = model or shared.MODEL_NAME
+        self.backend = ""
+        self.queue_time = 0.0
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.total = None
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.tokens_per_second = None
+        self.prompt_eval = None
+        self.load = None
+        self.finished = False
+
+    def admitted(self, queue_time):
+        """Fin de l'attente dans la file : le chronomètre de la génération démarre."""
+        self.queue_time = queue_time
+        self.started = time.perf_counter()
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def record_chunk(self, backend_url, chunk):
+        """Statistiques du dernier fragment d'Ollama."""
+        self.backend = backend_url
+        self.prompt_tokens = chunk.get("prompt_eval_count") or 0
+        self.output_tokens = chunk.get("eval_count") or 0
+        eval_duration = (chunk.get("eval_duration") or 0) / 1e9
+        if self.output_tokens and eval_duration:
+            self.tokens_per_second = self.output_tokens / eval_duration
+        self.prompt_eval = (chunk.get("prompt_eval_duration") or 0) / 1e9
+        self.load = (chunk.get("load_duration") or 0) / 1e9
+
+    def finish(self, outcome=OUTCOME_OK):
+        """Termine la mesure et la transmet au store du processus. Idempotent."""
+        if self.finished:
+            return
+        self.finished = True
+        self.total = time.perf_counter() - self.started
+        if self.tokens_per_second is None and self.output_tokens and self.total:
+            self.tokens_per_second = self.output_tokens / self.total
+        if outcome == OUTCOME_OK:
+            # Durées récentes du modèle : critère de repli sous charge (routing.py)
+            get_router().record(self.model, self.total)
+        get_metrics().record(self, outcome)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.finish()
+        elif isinstance(exc, Overloaded):
+            # Refus de la file d'admission : aucune génération à mesurer
+            self.finished = True
+        elif isinstance(exc, GenerationCancelled) or not isinstance(exc, Exception):
+            # Annulation, ou client parti en cours de flux (GeneratorExit, CancelledError)
+            self.finish(OUTCOME_CANCELLED)
+        else:
+            self.finish(OUTCOME_ERROR)
+        return False
+
+# --------------------------------------------------------------------------------
+# STOCKAGE PARTAGÉ
+# --------------------------------------------------------------------------------
+
+# Bornes des histogrammes Prometheus (secondes, ou tokens/s)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+
+# Histogrammes : nom -> (attribut de la mesure, bornes, description)
+HISTOGRAMS = {
+    "generation_queue_seconds": ("queue_time", LATENCY_BUCKETS, "Attente dans la file d'admission"),
+    "generation_ttft_seconds": ("ttft", LATENCY_BUCKETS, "Temps jusqu'au premier token (depuis l'admission)"),
+    "generation_duration_seconds": ("total", LATENCY_BUCKETS, "Durée totale de la génération (depuis l'admission)"),
+    "generation_tokens_per_second": ("tokens_per_second", RATE_BUCKETS, "Débit de génération mesuré par Ollama")
+}
+
+# Compteurs : nom -> description
+COUNTERS = {
+    "generations_total": "Générations terminées, par issue",
+    "generation_prompt_tokens_total": "Tokens de prompt évalués",
+    "generation_output_tokens_total": "Tokens générés"
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation_sample (
+    ts REAL NOT NULL,
+    email_type TEXT NOT NULL,
+    model TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    queue_s REAL,
+    ttft_s REAL,
+    total_s REAL,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER,
+    tokens_per_s REAL,
+    prompt_eval_s REAL,
+    load_s REAL
+);
+CREATE INDEX IF NOT EXISTS generation_sample_ts ON generation_sample (ts);
+CREATE TABLE IF NOT EXISTS generation_total (
+    metric TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    le TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (metric, labels, le)
+);
+"""
+
+def percentile(values, q):
+    """Percentile q (0-100) par interpolation linéaire, None si aucune valeur."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+class MetricsStore:
+    """Mesures du processus, écrites par lots dans la base SQLite partagée."""
+
+    def __init__(self, path, retention, flush_interval):
+        self.path = path
+        self.retention = retention
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+        self._schema_ready = False
+        self.write_errors = 0
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        if not self._schema_ready:
+            # WAL : les lectures de /metrics ne bloquent pas les écritures des workers
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            self._schema_ready = True
+        return connection
+
+    def record(self, sample: GenerationSample, outcome=OUTCOME_OK):
+        """Ajoute une mesure au lot en attente (écrit par le thread de fond)."""
+        if not shared.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._buffer.append((time.time(), sample, outcome))
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Écrit les mesures en attente : mesures brutes et totaux cumulés."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        rows = []
+        totals = {}
+
+        def add(metric, labels, le, value):
+            key = (metric, json.dumps(labels, sort_keys=True), le)
+            totals[key] = totals.get(key, 0) + value
+
+        for ts, s, outcome in batch:
+            rows.append((
+                ts, s.email_type, s.model, s.backend, outcome, s.queue_time, s.ttft, s.total,
+                s.prompt_tokens, s.output_tokens, s.tokens_per_second, s.prompt_eval, s.load
+            ))
+            labels = {"type": s.email_type, "model": s.model}
+            add("generations_total", {**labels, "backend": s.backend, "outcome": outcome}, "", 1)
+            add("generation_prompt_tokens_total", labels, "", s.prompt_tokens)
+            add("generation_output_tokens_total", labels, "", s.output_tokens)
+            for metric, (attribute, buckets, _) in HISTOGRAMS.items():
+                value = getattr(s, attribute)
+                if value is None:
+                    continue
+                for bound in buckets:
+                    if value <= bound:
+                        add(metric, labels, str(bound), 1)
+                add(metric, labels, "+Inf", 1)
+                add(metric, labels, "sum", value)
+
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO generation_sample VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                    )
+                    connection.executemany(
+                        "INSERT INTO generation_total (metric, labels, le, value) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (metric, labels, le) DO UPDATE SET value = value + excluded.value",
+                        [(*key, value) for key, value in totals.items()]
+                    )
+                    connection.execute(
+                        "DELETE FROM generation_sample WHERE ts < ?", (time.time() - self.retention,)
+                    )
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            # Les mesures sont perdues, la génération n'est jamais affectée
+            self.write_errors += 1
+            logger.warning("Erreur d'écriture des métriques", extra={"error": str(e)})
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    # ---- Lecture ------------------------------------------------------------
+
+    def summary(self, window=None) -> list:
+        """
+        Percentiles par type d'email et par modèle sur la fenêtre (secondes,
+        METRICS_RETENTION par défaut), tous workers confondus.
+        """
+        self.flush()
+        since = time.time() - (window or self.retention)
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT email_type, model, outcome, queue_s, ttft_s, total_s, tokens_per_s, "
+                "prompt_tokens, output_tokens FROM generation_sample WHERE ts >= ?", (since,)
+            ).fetchall()
+        finally:
+            connection.close()
+
+        groups = {}
+        for email_type, model, outcome, queue_s, ttft_s, total_s, rate, prompt_tokens, output_tokens in rows:
+            group = groups.setdefault((email_type, model), {
+                "count": 0, "errors": 0, "cancelled": 0, "queue": [], "ttft": [], "total": [],
+                "tokens_per_second": [], "prompt_tokens": 0, "output_tokens": 0
+            })
+            group["count"] += 1
+            if outcome == OUTCOME_ERROR:
+                group["errors"] += 1
+            elif outcome == OUTCOME_CANCELLED:
+                group["cancelled"] += 1
+            for name, value in (("queue", queue_s), ("ttft", ttft_s), ("total", total_s),
+                                ("tokens_per_second", rate)):
+                if value is not None:
+                    group[name].append(value)
+            group["prompt_tokens"] += prompt_tokens or 0
+            group["output_tokens"] += output_tokens or 0
+
+        summary = []
+        for (email_type, model), group in sorted(groups.items()):
+            entry = {"type": email_type, "model": model}
+            for name in ("count", "errors", "cancelled", "prompt_tokens", "output_tokens"):
+                entry[name] = group[name]
+            for name in ("queue", "ttft", "total", "tokens_per_second"):
+                entry[name] = {
+                    f"p{q}": _round(percentile(group[name], q)) for q in (50, 95, 99)
+                }
+            summary.append(entry)
+        return summary
+
+    def prometheus(self) -> str:
+        """Compteurs et histogrammes cumulés au format texte Prometheus."""
+        self.flush()
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT metric, labels, le, value FROM generation_total ORDER BY metric, labels"
+            ).fetchall()
+        finally:
+            connection.close()
+
+        by_metric = {}
+        for metric, labels, le, value in rows:
+            by_metric.setdefault(metric, []).append((json.loads(labels), le, value))
+
+        lines = []
+        for metric, description in COUNTERS.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for labels, _, value in by_metric.get(metric, ()):
+                lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+        for metric, (_, buckets, description) in HISTOGRAMS.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} histogram")
+            series = {}
+            for labels, le, value in by_metric.get(metric, ()):
+                series.setdefault(json.dumps(labels, sort_keys=True), {})[le] = value
+            for key, values in series.items():
+                labels = json.loads(key)
+                for bound in [str(b) for b in buckets] + ["+Inf"]:
+                    lines.append(f"{metric}_bucket{_labels({**labels, 'le': bound})} "
+                                 f"{_number(values.get(bound, 0))}")
+                lines.append(f"{metric}_sum{_labels(labels)} {_number(values.get('sum', 0))}")
+                lines.append(f"{metric}_count{_labels(labels)} {_number(values.get('+Inf', 0))}")
+        return "\n".join(lines) + "\n"
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def _labels(labels: dict) -> str:
+    """Étiquettes Prometheus, valeurs échappées."""
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+# --------------------------------------------------------------------------------
+# STORE DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_metrics() -> MetricsStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetricsStore(
+                    shared.METRICS_DB_PATH, shared.METRICS_RETENTION, shared.METRICS_FLUSH_INTERVAL
+                )
+    return _store
+
+def _flush_at_exit():
+    if _store is not None:
+        _store.stop()
+
+atexit.register(_flush_at_exit)
+
+def _reset():
+    """Après un fork, le thread d'écriture du parent n'existe pas dans l'enfant."""
+    global _store, _store_lock
+    _store = None
+    _store_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset)
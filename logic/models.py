@@ -17,6 +17,18 @@ Structure de la base de données :
    - Lien avec l'utilisateur (foreign key)
    - Horodatage des messages
    - Distinction user/bot
+   - Statut des générations interrompues (cancelled)
+   - Modèle qui a servi chaque génération (comparaison qualité / latence)
+
+3. Table CachedGeneration (Cache des générations) :
+   - Niveau persistant du cache des générations (voir cache.py)
+   - Partagé entre les workers Gunicorn
+   - Indexé par type d'email pour l'invalidation
+
+4. Table PromptConfig (Configuration des prompts) :
+   - Une ligne par version de la configuration (voir prompt_store.py)
+   - Numéro de version croissant, unique : deux enregistrements
+     concurrents ne peuvent pas créer la même version
 
 Relations :
 - Un User peut avoir plusieurs ChatLog (one-to-many)
@@ -87,6 +99,12 @@ class ChatLog(db.Model):
             - 'bot' : Réponse du chatbot
         message (str) : Contenu du message
         timestamp (datetime) : Date et heure du message (UTC)
+        status (str|None) : Statut d'un message du bot
+            - None : génération complète
+            - 'cancelled' : génération annulée, message partiel
+        model (str|None) : Modèle qui a produit le message du bot
+            (voir routing.py ; None : réponse du cache, génération annulée
+            ou message antérieur à cette colonne)
 
     Relations :
         user : Référence vers l'utilisateur (User)
@@ -105,6 +123,8 @@ class ChatLog(db.Model):
     sender = db.Column(db.String(10), nullable=False)  # 'user' ou 'bot'
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), nullable=True)
+    model = db.Column(db.String(120), nullable=True)
 
     # Définition de la relation avec User
     user = db.relationship(
@@ -115,3 +135,57 @@ class ChatLog(db.Model):
     def __repr__(self):
         """Représentation lisible du message pour le débogage."""
         return f"<ChatLog(user_id={self.user_id}, sender={self.sender}, time={self.timestamp})>"
+
+# --------------------------------------------------------------------------------
+# MODÈLE CACHE DES GÉNÉRATIONS
+# --------------------------------------------------------------------------------
+
+class CachedGeneration(db.Model):
+    """
+    Génération mise en cache, partagée entre les workers (voir cache.py).
+
+    Attributs :
+        key (str) : Empreinte SHA-256 (modèle, prompt, options, version du template)
+        email_type (str) : Type d'email, pour invalider toutes les entrées d'un type
+        model (str) : Modèle ayant produit la génération
+        content (str) : Texte généré
+        created_at (datetime) : Date de mise en cache (UTC), pour l'expiration
+    """
+    __tablename__ = 'generation_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    email_type = db.Column(db.String(120), index=True, nullable=False)
+    model = db.Column(db.String(120), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        """Représentation lisible de l'entrée pour le débogage."""
+        return f"<CachedGeneration(type={self.email_type}, model={self.model}, time={self.created_at})>"
+
+# --------------------------------------------------------------------------------
+# MODÈLE CONFIGURATION DES PROMPTS
+# --------------------------------------------------------------------------------
+
+class PromptConfig(db.Model):
+    """
+    Version de la configuration des prompts (voir prompt_store.py).
+
+    Attributs :
+        version (int) : Numéro de version, attribué par l'application
+            (version de départ + 1) et non auto-incrémenté : la clé primaire
+            refuse le second de deux enregistrements basés sur la même version
+        data (str) : Configuration complète (JSON, même structure que prompts.json)
+        author (str|None) : Administrateur à l'origine de la version
+        created_at (datetime) : Date d'enregistrement (UTC)
+    """
+    __tablename__ = 'prompt_config'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    data = db.Column(db.Text, nullable=False)
+    author = db.Column(db.String(80), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        """Représentation lisible de la version pour le débogage."""
+        return f"<PromptConfig(version={self.version}, author={self.author}, time={self.created_at})>"
@@ -10,8 +10,14 @@ Responsabilités :
    - Traitement des réponses
 
 2. Configuration :
-   - Utilise shared.OLLAMA_URL pour l'endpoint de l'API
-   - Utilise shared.MODEL_NAME pour le modèle à utiliser
+   - Utilise shared.OLLAMA_URL pour le ou les serveurs de l'API
+   - Chaque génération est routée par backends.get_pool() vers le serveur
+     ayant le moins de requêtes en cours
+   - Modèle choisi par routing.py : option "model" du type, MODEL_NAME, ou
+     petit modèle de repli sous charge ; relance sur le petit modèle si la
+     génération échoue avant son premier token
+   - Options par type d'email (prompts.json) transmises à Ollama :
+     num_predict, num_ctx, temperature, stop, keep_alive, model
 
 3. Format des messages :
    - User : Prompt principal avec les instructions
@@ -21,87 +27,834 @@ Responsabilités :
    - Validation des réponses HTTP
    - Nettoyage des prompts et réponses
    - Levée d'exceptions en cas d'erreur API
+
+5. Streaming :
+   - ollama_chat_stream : générateur qui renvoie les tokens dès leur arrivée
+   - ollama_chat : version bloquante qui concatène le flux complet
+
+6. Client HTTP :
+   - Session requests partagée par le processus (pool keep-alive)
+   - Délais distincts : connexion, premier octet, inactivité entre fragments
+   - Session recréée après un fork (workers Gunicorn)
+
+7. Variantes asynchrones (mode ASGI, voir chat_async.py) :
+   - ollama_chat_stream_async / ollama_chat_async
+   - Client httpx partagé par boucle d'évènements
+   - Mêmes délais et même répartition entre serveurs que la version synchrone
+
+8. Maintien du modèle en mémoire (voir warmup.py) :
+   - keep_alive (OLLAMA_KEEP_ALIVE ou option du type) envoyé avec chaque génération
+   - load_duration du dernier fragment : détection des chargements à froid
+
+9. Reprise du contexte (voir kv_context.py) :
+   - kv=KvRequest : messages qui suivent le prompt (document, consigne de
+     retouche) et serveur qui détient déjà le contexte évalué
+   - prompt_eval_count / prompt_eval_duration du dernier fragment transmis à kv
+
+10. Mesures (voir metrics.py) :
+   - metrics=GenerationSample : serveur, premier token et statistiques du
+     dernier fragment (eval_count, eval_duration, prompt_eval_duration...)
+
+11. Journalisation (voir log.py) :
+   - Envoi de la requête en DEBUG (prompt masqué selon LOG_PROMPTS)
+   - Fin de génération en INFO avec les durées et le nombre de tokens
+
+12. Disjoncteur et générations doublées (voir backends.py) :
+   - Tous les circuits ouverts : échec immédiat (BackendsUnavailable)
+   - Premier token plus lent que le percentile OLLAMA_HEDGE_PERCENTILE des
+     délais récents : la génération est doublée vers un second serveur, la
+     première réponse est gardée et l'autre fermée aussitôt, même en attente
+     du premier octet (ce qui l'arrête côté Ollama et libère son serveur)
+   - Seules les statistiques de la requête gardée sont transmises à la
+     mesure (metrics) et au contexte de la conversation (kv)
+
+13. Embeddings (cache sémantique, voir semantic_cache.py) :
+   - ollama_embed : vecteur du texte via /api/embed (EMBEDDING_MODEL)
 """
 
+import os
+import json
+import time
+import queue
+import socket
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import closing
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import logic.shared as shared
-import json
+from logic.backends import get_pool
+from logic.log import prompt_fields
+from logic.routing import get_router
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------------
+# CLIENT HTTP MUTUALISÉ
+# --------------------------------------------------------------------------------
+
+# Session partagée par tous les threads du worker (créée à la demande)
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Requête en cours du thread (génération doublée, voir _Attempt) : sa socket
+# lui est transmise avant l'attente de la réponse, pour pouvoir l'interrompre
+_thread_attempt = threading.local()
+
+class _SocketNotifier:
+    """Transmet la socket de la connexion à la requête doublée du thread."""
+
+    def getresponse(self, *args, **kwargs):
+        attempt = getattr(_thread_attempt, "current", None)
+        if attempt is not None:
+            attempt.attach(self.sock)
+        return super().getresponse(*args, **kwargs)
+
+class _HTTPConnection(_SocketNotifier, HTTPConnection):
+    pass
+
+class _HTTPSConnection(_SocketNotifier, HTTPSConnection):
+    pass
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+class _OllamaAdapter(HTTPAdapter):
+    """Adaptateur dont les connexions peuvent être interrompues depuis un autre thread."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _HTTPConnectionPool,
+            "https": _HTTPSConnectionPool
+        }
+
+def get_http_session() -> requests.Session:
+    """
+    Retourne la session HTTP du processus, en la créant si nécessaire.
+
+    La session conserve les connexions ouvertes (keep-alive) dans un pool
+    dimensionné sur le nombre de threads du worker (OLLAMA_POOL_SIZE).
+    Aucune nouvelle tentative automatique : une génération ne doit pas
+    être relancée silencieusement.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = _OllamaAdapter(
+                    pool_connections=4,
+                    pool_maxsize=shared.OLLAMA_POOL_SIZE,
+                    max_retries=0
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
+
+def _reset_http_session():
+    """
+    Abandonne la session héritée du processus parent.
+
+    Appelé dans le processus enfant après un fork (Gunicorn avec --preload) :
+    les sockets du parent ne doivent jamais être partagées entre workers.
+    """
+    global _http_session, _http_session_lock
+    _http_session = None
+    _http_session_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_http_session)
+
+def _set_read_timeout(response, timeout):
+    """
+    Modifie le délai de lecture d'une réponse déjà ouverte.
+
+    requests n'accepte qu'un seul délai de lecture par requête : on l'utilise
+    pour l'attente du premier octet, puis on le remplace par le délai
+    d'inactivité entre fragments une fois le flux démarré.
+    """
+    try:
+        response.raw.connection.sock.settimeout(timeout)
+    except AttributeError:
+        # Socket indisponible (réponse déjà consommée) : délai inchangé
+        pass
+
+# Clients asynchrones : un par boucle d'évènements (un client httpx ne peut
+# pas être partagé entre plusieurs boucles)
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Retourne le client httpx de la boucle d'évènements courante.
+
+    Les délais de premier octet et d'inactivité sont appliqués par
+    _astream_from_backend : le client ne borne que la connexion.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=shared.OLLAMA_CONNECT_TIMEOUT,
+                read=None,
+                write=shared.OLLAMA_CONNECT_TIMEOUT,
+                pool=None
+            ),
+            limits=httpx.Limits(
+                max_connections=shared.OLLAMA_ASYNC_POOL_SIZE,
+                max_keepalive_connections=shared.OLLAMA_ASYNC_POOL_SIZE
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+# --------------------------------------------------------------------------------
+# MAINTIEN DU MODÈLE EN MÉMOIRE
+# --------------------------------------------------------------------------------
+
+def keep_alive_setting():
+    """
+    Valeur keep_alive envoyée à Ollama : durée ("30m", "2h") ou nombre de
+    secondes (-1 = indéfiniment).
+    """
+    value = shared.OLLAMA_KEEP_ALIVE.strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _chat_payload(prompt: str, options=None, history=(), model=None) -> dict:
+    """
+    Corps de la requête /api/chat.
+    model et keep_alive sont des paramètres de la requête, les autres options
+    (num_predict, num_ctx, temperature, stop) sont des options du modèle.
+    history : messages qui suivent le prompt (retouche d'un document).
+    model : modèle choisi par routing.py (à défaut : option du type ou MODEL_NAME).
+    """
+    options = dict(options or {})
+    keep_alive = options.pop("keep_alive", None)
+    pinned = options.pop("model", None)
+    payload = {
+        "model": model or pinned or shared.MODEL_NAME,
+        "messages": [{"role": "user", "content": prompt}, *history],
+        "keep_alive": keep_alive_setting() if keep_alive is None else keep_alive
+    }
+    if options:
+        payload["options"] = options
+    return payload
+
+def _record_done(pool, backend, chunk, kv=None, metrics=None):
+    """
+    Transmet au pool le temps de chargement du modèle (dernier fragment),
+    à kv les statistiques d'évaluation du prompt et à metrics celles
+    de la génération.
+    """
+    load_duration = chunk.get("load_duration") or 0
+    if pool.record_load(backend, load_duration / 1e9):
+        logger.warning("Chargement à froid du modèle", extra={
+            "backend": backend.url, "load_s": round(load_duration / 1e9, 3)
+        })
+    logger.info("Génération terminée", extra={
+        "backend": backend.url,
+        "model": chunk.get("model"),
+        "prompt_tokens": chunk.get("prompt_eval_count"),
+        "output_tokens": chunk.get("eval_count"),
+        "prompt_eval_s": round((chunk.get("prompt_eval_duration") or 0) / 1e9, 3),
+        "eval_s": round((chunk.get("eval_duration") or 0) / 1e9, 3),
+        "total_s": round((chunk.get("total_duration") or 0) / 1e9, 3)
+    })
+    if kv is not None:
+        kv.record(backend.url, chunk)
+    if metrics is not None:
+        metrics.record_chunk(backend.url, chunk)
+
+def _fallback_route(route, error):
+    """Route de relance sur le petit modèle après l'échec de route."""
+    logger.warning("Relance sur le modèle de repli", extra={
+        "model": route.model, "fallback": route.fallback, "error": str(error)
+    })
+    fallback = route.degrade()
+    get_router().count(fallback)
+    return fallback
 
 # --------------------------------------------------------------------------------
 # APPEL AU MODÈLE OLLAMA
 # --------------------------------------------------------------------------------
 
-def ollama_chat(prompt: str) -> str:
+def ollama_chat_stream(prompt: str, options=None, kv=None, metrics=None):
     """
-    Envoie une requête au modèle Ollama et retourne sa réponse.
+    Envoie une requête au modèle Ollama et renvoie les tokens au fil de l'eau.
 
     Le flux de traitement est le suivant :
     1. Préparation du message utilisateur
-    2. Envoi de la requête à l'API Ollama
-    3. Validation et extraction de la réponse
-    4. Nettoyage et renvoi du texte généré
+    2. Envoi de la requête à l'API Ollama (stream=True)
+    3. Décodage de chaque ligne NDJSON reçue
+    4. Renvoi immédiat du contenu de chaque chunk
+
+    La connexion HTTP est fermée dès que le générateur est fermé, y compris
+    lorsque l'appelant l'abandonne avant la fin (client déconnecté).
 
     Args:
         prompt (str): Le texte du prompt principal
+        options (dict|None): Options de génération du type d'email
+            (num_predict, num_ctx, temperature, stop, keep_alive)
+        kv (KvRequest|None): Contexte de la conversation à reprendre
+            (voir kv_context.py)
+        metrics (GenerationSample|None): Mesure de la génération (voir metrics.py)
 
-    Returns:
-        str: Le texte généré par le modèle, nettoyé des espaces
+    Yields:
+        str: Les fragments de texte générés par le modèle
 
     Raises:
-        requests.exceptions.RequestException: En cas d'erreur de communication
-        ValueError: Si le prompt est vide ou invalide
+        ValueError: Si le prompt est vide ou en cas d'erreur de communication
     """
     # Validation des entrées
     if not prompt or not prompt.strip():
         raise ValueError("Le prompt ne peut pas être vide")
 
-    # Préparation de la requête
-    payload = {
-        "model": shared.MODEL_NAME,
-        "messages": [{"role": "user", "content": prompt}]
-    }
+    pool = get_pool()
+    route = get_router().choose(options)
+    prefer = kv.prefer if kv is not None else None
+    while True:
+        # Préparation de la requête pour le modèle choisi
+        payload = _chat_payload(prompt, options, kv.history if kv is not None else (), route.model)
+        if metrics is not None:
+            metrics.model = route.model
+        produced = False
+        try:
+            for token in _stream_hedged(pool, payload, prompt, kv, metrics, prefer):
+                produced = True
+                yield token
+            return
+        except ValueError as e:
+            # Échec avant le premier token : relance unique sur le petit modèle
+            if produced or route.fallback is None:
+                raise
+            route, prefer = _fallback_route(route, e), None
+
+def _stream_from_backend(pool, backend, payload, prompt, kv=None, metrics=None, attempt=None):
+    """
+    Exécute la requête de génération sur un serveur donné.
+    Les erreurs réseau sont signalées au pool pour écarter les serveurs défaillants.
 
-    print(f"Envoi de la requête à Ollama ({shared.OLLAMA_URL})")
-    print(f"Modèle utilisé: {shared.MODEL_NAME}")
-    print(f"Prompt: {prompt}")
-    
+    attempt : requête d'une génération doublée (voir _Attempt) ; si elle
+    perd, sa socket est fermée depuis un autre thread, sans que le serveur
+    soit compté en échec.
+    """
+    logger.debug("Envoi de la requête à Ollama", extra={
+        "backend": backend.url, "model": payload["model"], **prompt_fields(prompt)
+    })
+
+    response = None
+    streaming = False
+    sent = time.perf_counter()
+    first = True
+    _thread_attempt.current = attempt
     try:
         # Envoi de la requête à l'API avec stream=True
-        response = requests.post(
-            f"{shared.OLLAMA_URL}/api/chat",
+        response = get_http_session().post(
+            f"{backend.url}/api/chat",
             json=payload,
-            stream=True  # Active le streaming
+            stream=True,  # Active le streaming
+            timeout=(shared.OLLAMA_CONNECT_TIMEOUT, shared.OLLAMA_FIRST_BYTE_TIMEOUT)
         )
-        
+
         # Vérification du statut HTTP
         response.raise_for_status()
-        
-        # Accumulation de la réponse complète
-        full_response = ""
+
+        # Le flux a démarré : on passe au délai d'inactivité entre fragments
+        _set_read_timeout(response, shared.OLLAMA_IDLE_TIMEOUT)
+        streaming = True
+
+        # Renvoi de chaque fragment dès sa réception
         for line in response.iter_lines():
-            if line:
-                try:
-                    # Décode chaque ligne JSON
-                    chunk = json.loads(line)
-                    if "message" in chunk and "content" in chunk["message"]:
-                        content = chunk["message"]["content"]
-                        full_response += content
-                except json.JSONDecodeError as e:
-                    print(f"Erreur de décodage JSON pour la ligne: {line}")
-                    continue
-        
-        # Nettoyage et renvoi de la réponse complète
-        return full_response.strip()
-        
+            if not line:
+                continue
+            try:
+                # Décode chaque ligne JSON
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Ligne NDJSON invalide", extra={"backend": backend.url, "line": str(line)[:200]})
+                continue
+            if "message" in chunk and "content" in chunk["message"]:
+                content = chunk["message"]["content"]
+                if content:
+                    if first:
+                        first = False
+                        pool.record_ttft(time.perf_counter() - sent)
+                    if metrics is not None:
+                        metrics.first_token()
+                    yield content
+            if chunk.get("done"):
+                _record_done(pool, backend, chunk, kv, metrics)
+
+        if attempt is None or not attempt.stopped:
+            pool.mark_success(backend)
+
+    except _abandoned(attempt):
+        # Requête perdante fermée volontairement : ni échec du serveur ni avertissement
+        raise ValueError("Génération doublée : requête abandonnée") from None
+
     except requests.exceptions.ConnectionError as e:
-        print(f"Erreur de connexion à Ollama: {str(e)}")
+        pool.mark_failure(backend, e)
+        # requests signale aussi le délai d'inactivité du flux par une ConnectionError
+        if streaming:
+            logger.warning("Flux Ollama interrompu", extra={"backend": backend.url, "error": str(e)})
+            raise ValueError("Le flux Ollama a été interrompu (inactivité ou coupure réseau)")
+        logger.warning("Erreur de connexion à Ollama", extra={"backend": backend.url, "error": str(e)})
         raise ValueError("Impossible de se connecter au serveur Ollama")
-        
+
+    except requests.exceptions.Timeout as e:
+        pool.mark_failure(backend, e)
+        logger.warning("Délai dépassé avec Ollama", extra={"backend": backend.url, "error": str(e)})
+        raise ValueError("Le serveur Ollama ne répond pas (délai dépassé)")
+
     except requests.exceptions.RequestException as e:
-        print(f"Erreur lors de la requête HTTP: {str(e)}")
+        # Une erreur 5xx indique un serveur en difficulté
+        if e.response is not None and e.response.status_code >= 500:
+            pool.mark_failure(backend, e)
+        logger.warning("Erreur lors de la requête HTTP", extra={"backend": backend.url, "error": str(e)})
         raise ValueError(f"Erreur de communication avec Ollama: {str(e)}")
-        
+
     except Exception as e:
-        print(f"Erreur inattendue: {str(e)}")
-        print(f"Type d'erreur: {type(e)}")
+        logger.exception("Erreur inattendue lors de la génération", extra={"backend": backend.url})
         raise ValueError(f"Erreur inattendue lors de la génération: {str(e)}")
+
+    finally:
+        _thread_attempt.current = None
+        if attempt is not None:
+            # La connexion peut retourner au pool : plus question de la fermer
+            attempt.detach()
+        # Rend la connexion au pool (ou la ferme si le flux est interrompu)
+        if response is not None:
+            response.close()
+
+class _Attempt:
+    """
+    Une des requêtes d'une génération doublée.
+
+    Les statistiques de son dernier fragment sont retenues ici (même
+    interface que GenerationSample) et transmises à la génération seulement
+    si elle est gardée (merge). Si elle perd, abandon() ferme sa socket
+    depuis le thread de la requête gardée, même en attente du premier octet.
+    """
+
+    def __init__(self):
+        self.chunk = None  # (serveur, dernier fragment)
+        self._stop = threading.Event()
+        self._sock = None
+        self._lock = threading.Lock()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def attach(self, sock):
+        """Socket de la requête, transmise avant l'attente de la réponse."""
+        with self._lock:
+            self._sock = sock
+            stopped = self.stopped
+        if stopped:
+            _shutdown(sock)
+
+    def detach(self):
+        with self._lock:
+            self._sock = None
+
+    def abandon(self):
+        with self._lock:
+            self._stop.set()
+            sock = self._sock
+        if sock is not None:
+            _shutdown(sock)
+
+    def first_token(self):
+        pass  # Mesuré par l'appelant quand la requête est gardée
+
+    def record_chunk(self, backend_url, chunk):
+        self.chunk = (backend_url, chunk)
+
+    def merge(self, kv=None, metrics=None):
+        """Transmet les statistiques de la requête gardée."""
+        if self.chunk is None:
+            return
+        backend_url, chunk = self.chunk
+        if kv is not None:
+            kv.record(backend_url, chunk)
+        if metrics is not None:
+            metrics.record_chunk(backend_url, chunk)
+
+def _shutdown(sock):
+    """Interrompt une socket, y compris une lecture bloquée dans un autre thread."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Déjà fermée
+
+def _abandoned(attempt):
+    """
+    Exceptions traitées comme un abandon par _stream_from_backend : toutes
+    si la requête doublée a perdu, aucune sinon (évaluée à chaque exception).
+    """
+    return Exception if attempt is not None and attempt.stopped else ()
+
+def _stream_hedged(pool, payload, prompt, kv=None, metrics=None, prefer=None):
+    """
+    Exécute la génération sur un serveur et, si son premier token tarde
+    au-delà de pool.hedge_delay(), en envoie une copie à un second serveur.
+    Les fragments de la première requête qui répond sont renvoyés ; l'autre
+    est fermée aussitôt (voir _Attempt).
+    """
+    delay = pool.hedge_delay()
+    if delay is None:
+        with pool.acquire(prefer=prefer) as backend:
+            yield from _stream_from_backend(pool, backend, payload, prompt, kv, metrics)
+        return
+
+    events = queue.Queue()
+    attempts = []
+
+    def run(index, attempt, prefer=None, exclude=()):
+        try:
+            with pool.acquire(prefer=prefer, exclude=exclude) as backend:
+                events.put((index, "backend", backend))
+                with closing(_stream_from_backend(pool, backend, payload, prompt,
+                                                  metrics=attempt, attempt=attempt)) as tokens:
+                    for token in tokens:
+                        if attempt.stopped:
+                            return
+                        events.put((index, "token", token))
+            events.put((index, "done", None))
+        except Exception as e:
+            events.put((index, "error", e))
+
+    def launch(**kwargs):
+        attempt = _Attempt()
+        attempts.append(attempt)
+        threading.Thread(target=run, args=(len(attempts) - 1, attempt), kwargs=kwargs, daemon=True).start()
+
+    launch(prefer=prefer)
+    deadline = time.monotonic() + delay
+    first_backend = None
+    winner = None
+    failed = 0
+    try:
+        while True:
+            try:
+                timeout = max(0.0, deadline - time.monotonic()) if len(attempts) == 1 else None
+                index, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                # Premier token en retard : copie vers un autre serveur
+                logger.info("Génération doublée", extra={"backend": first_backend.url if first_backend else None,
+                                                         "delay_s": round(delay, 3)})
+                launch(exclude=(first_backend,) if first_backend is not None else ())
+                continue
+            if winner is not None and index != winner:
+                continue
+            if kind == "backend":
+                first_backend = value if index == 0 else first_backend
+            elif kind == "error":
+                # Échec de toutes les requêtes lancées (ou de celle qui a répondu)
+                failed += 1
+                if winner is not None or failed == len(attempts):
+                    raise value
+            else:
+                if winner is None:
+                    winner = index
+                    for i, attempt in enumerate(attempts):
+                        if i != winner:
+                            attempt.abandon()
+                    if len(attempts) > 1:
+                        pool.record_hedge(won=winner != 0)
+                if kind == "done":
+                    attempts[winner].merge(kv, metrics)
+                    return
+                if metrics is not None:
+                    metrics.first_token()
+                yield value
+    finally:
+        # Requêtes encore ouvertes (appelant parti) : fermées immédiatement
+        for attempt in attempts:
+            attempt.abandon()
+
+def ollama_chat(prompt: str, options=None, kv=None) -> str:
+    """
+    Envoie une requête au modèle Ollama et retourne sa réponse complète.
+
+    Version bloquante de ollama_chat_stream : accumule tous les fragments
+    et renvoie le texte une fois la génération terminée.
+
+    Args:
+        prompt (str): Le texte du prompt principal
+        options (dict|None): Options de génération du type d'email
+            (num_predict, num_ctx, temperature, stop, keep_alive)
+
+    Returns:
+        str: Le texte généré par le modèle, nettoyé des espaces
+
+    Raises:
+        ValueError: Si le prompt est vide ou en cas d'erreur de communication
+    """
+    # Accumulation de la réponse complète
+    full_response = "".join(ollama_chat_stream(prompt, options, kv))
+
+    # Nettoyage et renvoi de la réponse complète
+    return full_response.strip()
+
+# --------------------------------------------------------------------------------
+# EMBEDDINGS
+# --------------------------------------------------------------------------------
+
+def ollama_embed(text: str) -> list:
+    """
+    Calcule le vecteur d'un texte avec le modèle d'embeddings local d'Ollama.
+
+    Args:
+        text (str): Le texte à encoder
+
+    Returns:
+        list: Le vecteur (liste de float)
+
+    Raises:
+        ValueError: En cas d'erreur de communication ou de réponse invalide
+    """
+    pool = get_pool()
+    with pool.acquire() as backend:
+        try:
+            response = get_http_session().post(
+                f"{backend.url}/api/embed",
+                json={"model": shared.EMBEDDING_MODEL, "input": text},
+                timeout=(shared.OLLAMA_CONNECT_TIMEOUT, shared.EMBEDDING_TIMEOUT)
+            )
+            response.raise_for_status()
+            embeddings = response.json().get("embeddings") or []
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise ValueError(f"Erreur lors du calcul de l'embedding: {str(e)}")
+    if not embeddings or not embeddings[0]:
+        raise ValueError("Réponse d'embedding vide")
+    return embeddings[0]
+
+# --------------------------------------------------------------------------------
+# APPEL AU MODÈLE OLLAMA (ASYNCIO)
+# --------------------------------------------------------------------------------
+
+async def ollama_chat_stream_async(prompt: str, options=None, kv=None, metrics=None):
+    """
+    Variante asynchrone de ollama_chat_stream.
+
+    Ne bloque aucun thread pendant la génération : un seul processus peut
+    ainsi suivre des centaines de générations simultanées.
+
+    Yields:
+        str: Les fragments de texte générés par le modèle
+
+    Raises:
+        ValueError: Si le prompt est vide ou en cas d'erreur de communication
+    """
+    # Validation des entrées
+    if not prompt or not prompt.strip():
+        raise ValueError("Le prompt ne peut pas être vide")
+
+    pool = get_pool()
+    route = get_router().choose(options)
+    prefer = kv.prefer if kv is not None else None
+    while True:
+        # Préparation de la requête pour le modèle choisi
+        payload = _chat_payload(prompt, options, kv.history if kv is not None else (), route.model)
+        if metrics is not None:
+            metrics.model = route.model
+        produced = False
+        try:
+            async for token in _astream_hedged(pool, payload, prompt, kv, metrics, prefer):
+                produced = True
+                yield token
+            return
+        except ValueError as e:
+            # Échec avant le premier token : relance unique sur le petit modèle
+            if produced or route.fallback is None:
+                raise
+            route, prefer = _fallback_route(route, e), None
+
+async def _astream_from_backend(pool, backend, payload, prompt, kv=None, metrics=None):
+    """
+    Exécute la requête de génération sur un serveur donné (asyncio).
+    Les délais de premier octet et d'inactivité sont appliqués par asyncio.
+    """
+    logger.debug("Envoi de la requête à Ollama", extra={
+        "backend": backend.url, "model": payload["model"], **prompt_fields(prompt)
+    })
+
+    client = get_async_http_client()
+    response = None
+    streaming = False
+    sent = time.perf_counter()
+    first = True
+    try:
+        request = client.build_request("POST", f"{backend.url}/api/chat", json=payload)
+        response = await asyncio.wait_for(
+            client.send(request, stream=True),
+            shared.OLLAMA_FIRST_BYTE_TIMEOUT
+        )
+
+        # Vérification du statut HTTP
+        response.raise_for_status()
+        streaming = True
+
+        # Renvoi de chaque fragment dès sa réception
+        lines = response.aiter_lines()
+        while True:
+            try:
+                line = await asyncio.wait_for(lines.__anext__(), shared.OLLAMA_IDLE_TIMEOUT)
+            except StopAsyncIteration:
+                break
+            if not line:
+                continue
+            try:
+                # Décode chaque ligne JSON
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Ligne NDJSON invalide", extra={"backend": backend.url, "line": str(line)[:200]})
+                continue
+            if "message" in chunk and "content" in chunk["message"]:
+                content = chunk["message"]["content"]
+                if content:
+                    if first:
+                        first = False
+                        pool.record_ttft(time.perf_counter() - sent)
+                    if metrics is not None:
+                        metrics.first_token()
+                    yield content
+            if chunk.get("done"):
+                _record_done(pool, backend, chunk, kv, metrics)
+
+        pool.mark_success(backend)
+
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        pool.mark_failure(backend, e)
+        logger.warning("Erreur de connexion à Ollama", extra={"backend": backend.url, "error": str(e)})
+        raise ValueError("Impossible de se connecter au serveur Ollama")
+
+    except asyncio.TimeoutError as e:
+        pool.mark_failure(backend, e)
+        if streaming:
+            logger.warning("Flux Ollama interrompu : délai d'inactivité dépassé", extra={"backend": backend.url})
+            raise ValueError("Le flux Ollama a été interrompu (inactivité ou coupure réseau)")
+        logger.warning("Délai dépassé avec Ollama : premier octet non reçu", extra={"backend": backend.url})
+        raise ValueError("Le serveur Ollama ne répond pas (délai dépassé)")
+
+    except httpx.HTTPStatusError as e:
+        # Une erreur 5xx indique un serveur en difficulté
+        if e.response.status_code >= 500:
+            pool.mark_failure(backend, e)
+        logger.warning("Erreur lors de la requête HTTP", extra={"backend": backend.url, "error": str(e)})
+        raise ValueError(f"Erreur de communication avec Ollama: {str(e)}")
+
+    except httpx.HTTPError as e:
+        pool.mark_failure(backend, e)
+        logger.warning("Erreur lors de la requête HTTP", extra={"backend": backend.url, "error": str(e)})
+        raise ValueError(f"Erreur de communication avec Ollama: {str(e)}")
+
+    except Exception as e:
+        logger.exception("Erreur inattendue lors de la génération", extra={"backend": backend.url})
+        raise ValueError(f"Erreur inattendue lors de la génération: {str(e)}")
+
+    finally:
+        # Rend la connexion au pool (ou la ferme si le flux est interrompu)
+        if response is not None:
+            await response.aclose()
+
+async def _astream_hedged(pool, payload, prompt, kv=None, metrics=None, prefer=None):
+    """
+    Variante asynchrone de _stream_hedged : la requête perdante est annulée
+    aussitôt, y compris pendant l'attente du premier octet. Chaque requête
+    retient ses statistiques (_Attempt), seules celles de la gardée sont transmises.
+    """
+    delay = pool.hedge_delay()
+    if delay is None:
+        with pool.acquire(prefer=prefer) as backend:
+            async for token in _astream_from_backend(pool, backend, payload, prompt, kv, metrics):
+                yield token
+        return
+
+    events = asyncio.Queue()
+    tasks = []
+    attempts = []
+
+    async def run(index, attempt, prefer=None, exclude=()):
+        try:
+            with pool.acquire(prefer=prefer, exclude=exclude) as backend:
+                events.put_nowait((index, "backend", backend))
+                async for token in _astream_from_backend(pool, backend, payload, prompt, metrics=attempt):
+                    events.put_nowait((index, "token", token))
+            events.put_nowait((index, "done", None))
+        except Exception as e:
+            events.put_nowait((index, "error", e))
+
+    def launch(**kwargs):
+        attempts.append(_Attempt())
+        tasks.append(asyncio.ensure_future(run(len(tasks), attempts[-1], **kwargs)))
+
+    launch(prefer=prefer)
+    deadline = time.monotonic() + delay
+    first_backend = None
+    winner = None
+    failed = 0
+    try:
+        while True:
+            try:
+                if len(tasks) == 1:
+                    timeout = max(0.0, deadline - time.monotonic())
+                    index, kind, value = await asyncio.wait_for(events.get(), timeout)
+                else:
+                    index, kind, value = await events.get()
+            except asyncio.TimeoutError:
+                # Premier token en retard : copie vers un autre serveur
+                logger.info("Génération doublée", extra={"backend": first_backend.url if first_backend else None,
+                                                         "delay_s": round(delay, 3)})
+                launch(exclude=(first_backend,) if first_backend is not None else ())
+                continue
+            if winner is not None and index != winner:
+                continue
+            if kind == "backend":
+                first_backend = value if index == 0 else first_backend
+            elif kind == "error":
+                # Échec de toutes les requêtes lancées (ou de celle qui a répondu)
+                failed += 1
+                if winner is not None or failed == len(tasks):
+                    raise value
+            else:
+                if winner is None:
+                    winner = index
+                    for i, task in enumerate(tasks):
+                        if i != winner:
+                            task.cancel()
+                    if len(tasks) > 1:
+                        pool.record_hedge(won=winner != 0)
+                if kind == "done":
+                    attempts[winner].merge(kv, metrics)
+                    return
+                if metrics is not None:
+                    metrics.first_token()
+                yield value
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def ollama_chat_async(prompt: str, options=None, kv=None) -> str:
+    """
+    Variante asynchrone de ollama_chat : retourne la réponse complète.
+
+    Raises:
+        ValueError: Si le prompt est vide ou en cas d'erreur de communication
+    """
+    parts = [token async for token in ollama_chat_stream_async(prompt, options, kv)]
+    return "".join(parts).strip()
@@ -0,0 +1,150 @@
+# logic/prompt_patch.py
+"""
+prompt_patch.py
+--------------------------------------------------------------------------------
+Application d'une liste d'opérations de type JSON Patch (RFC 6902) à la
+configuration des prompts.
+
+Problème résolu :
+Chaque clic de l'éditeur (ajout d'un type, d'un champ, modification d'un
+prompt...) enregistrait toute la configuration. L'éditeur envoie désormais
+toutes les modifications en attente en une seule requête
+(PATCH /admin/prompts), appliquées ici puis enregistrées en une seule version.
+
+Opérations reconnues :
+- {"op": "add", "path": ..., "value": ...} : ajout (ou remplacement d'une clé
+  d'objet ; "-" en fin de liste pour ajouter à la fin)
+- {"op": "remove", "path": ...} : suppression
+- {"op": "replace", "path": ..., "value": ...} : remplacement d'une valeur existante
+- {"op": "test", "path": ..., "value": ...} : vérifie une valeur (sinon rien n'est appliqué)
+
+Les chemins sont des pointeurs JSON (RFC 6901) : "/prompts/Réunion",
+"/form_fields/Devis/2" ; "~1" désigne "/" et "~0" désigne "~".
+"""
+
+import copy
+
+OPERATIONS = ("add", "remove", "replace", "test")
+
+# --------------------------------------------------------------------------------
+# EXCEPTIONS
+# --------------------------------------------------------------------------------
+
+class PatchError(ValueError):
+    """Opération invalide ou inapplicable : aucune modification n'est retenue."""
+
+# --------------------------------------------------------------------------------
+# POINTEURS JSON
+# --------------------------------------------------------------------------------
+
+def parse_pointer(path) -> list:
+    """Découpe un pointeur JSON en clés ("" désigne le document entier)."""
+    if not isinstance(path, str) or (path and not path.startswith("/")):
+        raise PatchError(f"Chemin invalide : {path!r}")
+    if not path:
+        return []
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+def _index(container: list, key: str, path: str, allow_end=False) -> int:
+    """Position désignée dans une liste ("-" : après le dernier élément)."""
+    if allow_end and key == "-":
+        return len(container)
+    if not key.isdigit() or (len(key) > 1 and key.startswith("0")):
+        raise PatchError(f"Indice de liste invalide dans {path}")
+    index = int(key)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"Indice hors de la liste dans {path}")
+    return index
+
+def _resolve(doc, keys: list, path: str):
+    """Conteneur parent de la cible du pointeur."""
+    node = doc
+    for key in keys:
+        if isinstance(node, dict):
+            if key not in node:
+                raise PatchError(f"Chemin introuvable : {path}")
+            node = node[key]
+        elif isinstance(node, list):
+            node = node[_index(node, key, path)]
+        else:
+            raise PatchError(f"Chemin introuvable : {path}")
+    if not isinstance(node, (dict, list)):
+        raise PatchError(f"Chemin introuvable : {path}")
+    return node
+
+# --------------------------------------------------------------------------------
+# APPLICATION
+# --------------------------------------------------------------------------------
+
+def _apply(doc, operation: dict):
+    """Applique une opération à doc (modifié sur place) et retourne le document."""
+    if not isinstance(operation, dict):
+        raise PatchError("Chaque opération doit être un objet JSON")
+    op = operation.get("op")
+    if op not in OPERATIONS:
+        raise PatchError(f"Opération inconnue : {op!r}")
+    path = operation.get("path")
+    keys = parse_pointer(path)
+    if op != "remove" and "value" not in operation:
+        raise PatchError(f"Valeur manquante pour l'opération {op} sur {path}")
+    value = copy.deepcopy(operation.get("value"))
+
+    if not keys:
+        # Document entier
+        if op == "test":
+            if doc != value:
+                raise PatchError("Test échoué sur la configuration entière")
+            return doc
+        if op == "remove":
+            raise PatchError("Impossible de supprimer la configuration entière")
+        return value
+
+    parent = _resolve(doc, keys[:-1], path)
+    key = keys[-1]
+
+    if isinstance(parent, dict):
+        if op != "add" and key not in parent:
+            raise PatchError(f"Chemin introuvable : {path}")
+        if op == "test":
+            if parent[key] != value:
+                raise PatchError(f"Test échoué sur {path}")
+        elif op == "remove":
+            del parent[key]
+        else:
+            parent[key] = value
+    else:
+        index = _index(parent, key, path, allow_end=(op == "add"))
+        if op == "test":
+            if parent[index] != value:
+                raise PatchError(f"Test échoué sur {path}")
+        elif op == "remove":
+            del parent[index]
+        elif op == "replace":
+            parent[index] = value
+        else:
+            parent.insert(index, value)
+    return doc
+
+def apply_patch(doc, operations) -> dict:
+    """
+    Applique les opérations dans l'ordre, sur une copie de doc.
+
+    Args:
+        doc (dict): Configuration de départ (non modifiée)
+        operations (list): Opérations de type JSON Patch
+
+    Returns:
+        dict: Configuration modifiée
+
+    Raises:
+        PatchError: Dès la première opération invalide ou inapplicable
+    """
+    if not isinstance(operations, list) or not operations:
+        raise PatchError("Le corps de la requête doit être une liste d'opérations non vide")
+    result = copy.deepcopy(doc)
+    for number, operation in enumerate(operations, 1):
+        try:
+            result = _apply(result, operation)
+        except PatchError as e:
+            raise PatchError(f"Opération {number} : {e}") from None
+    return result
@@ -0,0 +1,228 @@
+# logic/prompt_store.py
+"""
+prompt_store.py
+--------------------------------------------------------------------------------
+Configuration des prompts stockée en base, versionnée.
+
+Problème résolu :
+Chaque worker Gunicorn gardait sa copie de prompts.json et la rechargeait en
+surveillant la date de modification du fichier : un stat à chaque appel de
+get_prompts(), une résolution grossière, et deux administrateurs qui
+enregistraient en même temps écrasaient mutuellement leurs modifications.
+
+Fonctionnement :
+1. Stockage (table prompt_config, voir models.py) :
+   - Chaque enregistrement crée une nouvelle version, qui contient la
+     configuration complète, en une seule transaction
+   - La version N+1 ne peut être créée qu'une fois (clé primaire) : un
+     enregistrement basé sur une version dépassée est refusé (PromptConflict)
+     au lieu d'écraser l'autre
+   - Les PROMPT_HISTORY dernières versions sont conservées
+
+2. Synchronisation des workers :
+   - sync_prompts() est appelé avant chaque requête : au plus une requête SQL
+     par PROMPT_SYNC_INTERVAL et par worker (dernière version, sur la clé
+     primaire) ; rechargement seulement si elle a changé
+   - Le worker qui enregistre une version l'installe immédiatement
+   - En mémoire : un seul instantané (configuration, templates compilés,
+     version), remplacé d'un bloc (shared.get_snapshot)
+
+3. Édition concurrente (PATCH /admin/prompts) :
+   - Les opérations de l'éditeur (voir prompt_patch.py) s'appliquent à la
+     version annoncée par l'en-tête If-Match et créent une seule version
+   - La version est exposée comme ETag ("prompts-<version>") ; un If-Match
+     dépassé est refusé (412) au lieu d'écraser les modifications d'un autre
+
+4. prompts.json :
+   - Importé comme version 1 au premier démarrage (table vide)
+   - Export : GET /admin/prompts/export ; import : POST /admin/save
+
+Les fonctions de ce module s'exécutent dans un contexte d'application Flask.
+"""
+
+import json
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+import logic.shared as shared
+from logic.database import db
+from logic.models import PromptConfig
+from logic.prompt_patch import apply_patch
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------------
+# EXCEPTIONS
+# --------------------------------------------------------------------------------
+
+class PromptConflict(Exception):
+    """
+    Enregistrement basé sur une version dépassée de la configuration.
+
+    Attributs :
+        current_version (int) : Dernière version enregistrée
+    """
+
+    def __init__(self, message, current_version):
+        super().__init__(message)
+        self.current_version = current_version
+
+# --------------------------------------------------------------------------------
+# LECTURE
+# --------------------------------------------------------------------------------
+
+# Dernière vérification de la version en base (horloge monotone)
+_last_check = 0.0
+
+def latest_version() -> int:
+    """Numéro de la dernière version enregistrée (0 si la table est vide)."""
+    # SQL direct : appelé sur le chemin de chaque requête, sans coût ORM
+    return db.session.execute(text("SELECT MAX(version) FROM prompt_config")).scalar() or 0
+
+def _load(version):
+    """Installe en mémoire la version enregistrée."""
+    row = db.session.get(PromptConfig, version)
+    data, templates = shared.validate_prompts(json.loads(row.data))
+    shared.install_prompts(data, templates, version)
+    logger.info("Configuration des prompts chargée", extra={"prompts_version": version})
+
+def sync_prompts(force=False):
+    """
+    Recharge la configuration si une autre version a été enregistrée par un
+    autre worker. Au plus une requête SQL par PROMPT_SYNC_INTERVAL
+    (force=True : vérification immédiate).
+    """
+    global _last_check
+    now = time.monotonic()
+    if not force and now - _last_check < shared.PROMPT_SYNC_INTERVAL:
+        return
+    _last_check = now
+    version = latest_version()
+    if version and version != shared.get_prompts_version():
+        _load(version)
+
+def bootstrap_prompts():
+    """
+    Au démarrage : importe prompts.json comme première version si la table
+    est vide, puis installe la dernière version.
+    """
+    if latest_version() == 0:
+        try:
+            save_prompt_config(shared.get_prompts(), expected_version=0, author="prompts.json")
+        except PromptConflict:
+            pass  # Un autre worker a importé le fichier au même moment
+    sync_prompts(force=True)
+
+# --------------------------------------------------------------------------------
+# ÉCRITURE
+# --------------------------------------------------------------------------------
+
+def save_prompt_config(new_data, expected_version=None, author=None) -> int:
+    """
+    Enregistre une nouvelle version de la configuration et l'installe en mémoire.
+
+    Args:
+        new_data (dict): Configuration complète
+        expected_version (int|None): Version sur laquelle portent les
+            modifications (None : version installée dans ce worker)
+        author (str|None): Administrateur à l'origine de la modification
+
+    Returns:
+        int: Numéro de la nouvelle version
+
+    Raises:
+        ValueError: Configuration invalide (rien n'est écrit)
+        PromptConflict: Une autre version a été enregistrée depuis expected_version
+    """
+    if expected_version is None:
+        expected_version = shared.get_prompts_version()
+    try:
+        data, templates = shared.validate_prompts(new_data)
+        current = latest_version()
+        if current != expected_version:
+            raise PromptConflict(
+                "La configuration a été modifiée entre-temps : rechargez la page",
+                current
+            )
+        version = expected_version + 1
+        db.session.add(PromptConfig(
+            version=version,
+            data=json.dumps(data, ensure_ascii=False),
+            author=author
+        ))
+        # Historique borné, dans la même transaction
+        db.session.query(PromptConfig).filter(
+            PromptConfig.version <= version - max(1, shared.PROMPT_HISTORY)
+        ).delete(synchronize_session=False)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Version créée par un autre worker entre la lecture et l'écriture
+            db.session.rollback()
+            raise PromptConflict(
+                "La configuration a été modifiée entre-temps : rechargez la page",
+                latest_version()
+            ) from None
+    except Exception:
+        # Configuration en vigueur passée telle quelle (import de prompts.json) :
+        # en cas d'échec, la dernière version enregistrée est réinstallée
+        if new_data is shared.get_prompts():
+            db.session.rollback()
+            _restore()
+        raise
+
+    shared.install_prompts(data, templates, version)
+    logger.info("Configuration des prompts enregistrée",
+                extra={"prompts_version": version, "author": author})
+    return version
+
+def patch_prompt_config(operations, expected_version, author=None) -> int:
+    """
+    Applique des opérations de type JSON Patch à la version expected_version
+    et enregistre le résultat comme une seule nouvelle version.
+
+    Raises:
+        PatchError: Opération invalide ou inapplicable (rien n'est écrit)
+        ValueError: Configuration obtenue invalide (rien n'est écrit)
+        PromptConflict: expected_version n'est plus la dernière version
+    """
+    # Ce worker peut avoir une version de retard (vérification périodique)
+    if expected_version != shared.get_prompts_version():
+        sync_prompts(force=True)
+    if expected_version != shared.get_prompts_version():
+        raise PromptConflict(
+            "La configuration a été modifiée entre-temps : rechargez la page",
+            shared.get_prompts_version()
+        )
+    new_data = apply_patch(shared.get_prompts(), operations)
+    return save_prompt_config(new_data, expected_version=expected_version, author=author)
+
+def _restore():
+    """Réinstalle la dernière version enregistrée (ou prompts.json si aucune)."""
+    version = latest_version()
+    if version:
+        _load(version)
+    else:
+        shared.load_prompts()
+
+# --------------------------------------------------------------------------------
+# EXPORT ET ETAG
+# --------------------------------------------------------------------------------
+
+def prompts_etag(version=None) -> str:
+    """ETag (sans guillemets) d'une version de la configuration."""
+    return f"prompts-{shared.get_prompts_version() if version is None else version}"
+
+def etag_version(etag: str):
+    """Version désignée par un ETag produit par prompts_etag (None sinon)."""
+    prefix, _, version = etag.partition("-")
+    if prefix != "prompts" or not version.isdigit():
+        return None
+    return int(version)
+
+def export_prompts() -> str:
+    """Configuration installée au format de prompts.json."""
+    return json.dumps(shared.get_prompts(), indent=2, ensure_ascii=False)
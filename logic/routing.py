@@ -0,0 +1,183 @@
+# logic/routing.py
+"""
+routing.py
+--------------------------------------------------------------------------------
+Choix du modèle qui sert chaque génération.
+
+Problème résolu :
+Le passage du modèle de qualité (ex. mannix/hermes-3-llama-3.1-8b) au modèle
+rapide (ex. qwen2.5:0.5b) se faisait en modifiant MODEL_NAME pour toute
+l'application, et une panne du grand modèle faisait échouer les générations.
+
+Politiques (dans l'ordre) :
+1. Modèle imposé : l'option "model" d'un type (page d'administration,
+   prompts.json) est toujours utilisée, même sous charge
+2. Repli sous charge (FALLBACK_MODEL_NAME configuré) :
+   - file d'admission d'au moins FALLBACK_QUEUE_DEPTH générations en attente
+   - ou p95 récent de la durée des générations de MODEL_NAME supérieur à
+     FALLBACK_P95 (fenêtre FALLBACK_P95_WINDOW)
+   La génération part alors sur le petit modèle. Pendant le repli par
+   latence, les durées du grand modèle sortent de la fenêtre : il est de
+   nouveau utilisé au plus tard FALLBACK_P95_WINDOW secondes après
+3. Sinon : MODEL_NAME
+
+Repli sur erreur (FALLBACK_ON_ERROR) :
+   - Une génération qui échoue avant son premier token (serveur injoignable,
+     modèle absent...) est relancée une fois sur le petit modèle
+
+Le modèle qui a réellement servi est renseigné dans la mesure de la
+génération (metrics.py) et enregistré dans ChatLog.model.
+
+Les durées récentes et les compteurs sont tenus par processus, comme la
+file d'admission sur laquelle porte le premier critère.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+import logic.shared as shared
+from logic.admission import get_admission
+
+# Raisons du choix d'un modèle
+REASON_DEFAULT = "default"
+REASON_PINNED = "pinned"
+REASON_QUEUE = "queue"
+REASON_LATENCY = "latency"
+REASON_ERROR = "error"
+
+# --------------------------------------------------------------------------------
+# ROUTE
+# --------------------------------------------------------------------------------
+
+class Route:
+    """
+    Modèle choisi pour une génération.
+
+    Attributs :
+        model (str) : Modèle à interroger
+        reason (str) : Raison du choix (default, pinned, queue, latency, error)
+        fallback (str|None) : Modèle de relance si la génération échoue avant
+            son premier token (None = pas de relance)
+    """
+
+    def __init__(self, model, reason, fallback=None):
+        self.model = model
+        self.reason = reason
+        self.fallback = fallback
+
+    def degrade(self):
+        """Route de relance sur le modèle de repli, après une erreur."""
+        return Route(self.fallback, REASON_ERROR)
+
+# --------------------------------------------------------------------------------
+# ROUTEUR
+# --------------------------------------------------------------------------------
+
+class ModelRouter:
+    """Politique de choix du modèle, avec les durées récentes de chaque modèle."""
+
+    def __init__(self, max_samples=500):
+        self.max_samples = max_samples
+        self._durations = {}  # modèle -> deque[(horodatage, durée)]
+        self._lock = threading.Lock()
+        self._p95_cache = {}  # modèle -> (calculé à, p95)
+        self.routed = {}      # raison -> nombre de générations
+
+    def record(self, model, duration):
+        """Durée d'une génération terminée (appelé par GenerationSample.finish)."""
+        if not model or duration is None:
+            return
+        with self._lock:
+            samples = self._durations.get(model)
+            if samples is None:
+                samples = self._durations[model] = deque(maxlen=self.max_samples)
+            samples.append((time.monotonic(), duration))
+
+    def p95(self, model):
+        """
+        p95 des durées de model sur FALLBACK_P95_WINDOW, ou None si moins
+        de 20 mesures. Recalculé au plus une fois par seconde.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._p95_cache.get(model)
+            if cached is not None and now - cached[0] < 1.0:
+                return cached[1]
+            since = now - shared.FALLBACK_P95_WINDOW
+            durations = sorted(d for ts, d in self._durations.get(model, ()) if ts >= since)
+            value = durations[int(0.95 * (len(durations) - 1))] if len(durations) >= 20 else None
+            self._p95_cache[model] = (now, value)
+            return value
+
+    def choose(self, options=None) -> Route:
+        """
+        Modèle d'une génération selon les options du type (model imposé)
+        et la charge du moment.
+        """
+        fallback = shared.FALLBACK_MODEL_NAME or None
+        pinned = (options or {}).get("model")
+        if pinned:
+            model, reason = pinned, REASON_PINNED
+        else:
+            reason = self._load_reason(fallback)
+            model, reason = (fallback, reason) if reason else (shared.MODEL_NAME, REASON_DEFAULT)
+        route = Route(model, reason, self._error_fallback(model, fallback))
+        self.count(route)
+        return route
+
+    def _load_reason(self, fallback):
+        """Raison de basculer sur le petit modèle, ou None."""
+        if fallback is None or fallback == shared.MODEL_NAME:
+            return None
+        if shared.FALLBACK_QUEUE_DEPTH > 0 and get_admission().queued() >= shared.FALLBACK_QUEUE_DEPTH:
+            return REASON_QUEUE
+        if shared.FALLBACK_P95 > 0:
+            p95 = self.p95(shared.MODEL_NAME)
+            if p95 is not None and p95 >= shared.FALLBACK_P95:
+                return REASON_LATENCY
+        return None
+
+    @staticmethod
+    def _error_fallback(model, fallback):
+        if not shared.FALLBACK_ON_ERROR or fallback is None or fallback == model:
+            return None
+        return fallback
+
+    def count(self, route):
+        with self._lock:
+            self.routed[route.reason] = self.routed.get(route.reason, 0) + 1
+
+    def snapshot(self):
+        models = {shared.MODEL_NAME}
+        if shared.FALLBACK_MODEL_NAME:
+            models.add(shared.FALLBACK_MODEL_NAME)
+        with self._lock:
+            models.update(self._durations)
+            routed = dict(self.routed)
+        return {
+            "model": shared.MODEL_NAME,
+            "fallback_model": shared.FALLBACK_MODEL_NAME or None,
+            "queue_depth_threshold": shared.FALLBACK_QUEUE_DEPTH,
+            "p95_threshold": shared.FALLBACK_P95,
+            "fallback_on_error": shared.FALLBACK_ON_ERROR,
+            "routed": routed,
+            "p95": {model: self.p95(model) for model in sorted(models)}
+        }
+
+# --------------------------------------------------------------------------------
+# ROUTEUR DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_router = ModelRouter()
+
+def get_router() -> ModelRouter:
+    return _router
+
+def _reset():
+    """Après un fork, les durées du parent ne décrivent pas ce worker."""
+    global _router
+    _router = ModelRouter()
+
+os.register_at_fork(after_in_child=_reset)
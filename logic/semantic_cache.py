@@ -0,0 +1,329 @@
+# logic/semantic_cache.py
+"""
+semantic_cache.py
+--------------------------------------------------------------------------------
+Cache sémantique des générations (second niveau, optionnel).
+
+Problème résolu :
+Le cache exact (cache.py) échoue dès que deux demandes diffèrent d'un espace,
+d'une majuscule ou d'une formulation équivalente dans les précisions.
+
+Fonctionnement :
+1. Texte comparé :
+   - L'objet et les précisions de la demande, hors champs "substituables"
+     (SEMANTIC_CACHE_PLACEHOLDERS : destinataire, date, heure)
+   - L'objet porte le sujet de l'email : toujours comparé, jamais substitué
+   - Le template n'est pas encodé : la version du template est vérifiée à part
+   - Mis en minuscules, espaces normalisés
+   - Encodé par le modèle d'embeddings local d'Ollama (ollama_embed)
+
+2. Recherche :
+   - Une matrice NumPy de vecteurs normalisés par type d'email
+   - Similarité cosinus calculée en un seul produit matrice-vecteur
+   - Seules les entrées produites avec la version courante du template comptent
+   - Au-delà de SEMANTIC_CACHE_THRESHOLD, la génération est réutilisée
+
+3. Réutilisation :
+   - Les valeurs des champs substituables de la demande d'origine sont
+     remplacées par celles de la nouvelle demande dans le texte généré
+   - Une valeur qui diffère mais n'apparaît pas telle quelle dans le texte
+     (reformulée par le modèle) ne peut pas être remplacée : l'entrée est
+     écartée plutôt que de renvoyer l'email d'une autre demande
+
+4. Mémoire :
+   - Au plus SEMANTIC_CACHE_SIZE vecteurs par type
+   - Éviction de l'entrée utilisée le moins récemment
+
+5. Compteurs :
+   - Taux de succès, temps de génération économisé, coût des embeddings
+   - Exposés aux admins via /admin/cache
+
+Une erreur d'embedding (modèle absent, délai dépassé) n'empêche jamais la
+génération : elle est comptabilisée et la demande est traitée normalement.
+"""
+
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+import logic.shared as shared
+from logic.ollama_client import ollama_embed
+
+# --------------------------------------------------------------------------------
+# TEXTE COMPARÉ ET SUBSTITUTION
+# --------------------------------------------------------------------------------
+
+# Champs toujours comparés, même s'ils figurent dans SEMANTIC_CACHE_PLACEHOLDERS
+NEVER_SUBSTITUTED = frozenset({"obj"})
+
+def semantic_text(email_type: str, values: dict, placeholders) -> str:
+    """
+    Texte encodé pour la comparaison : les champs non substituables de la
+    demande, en minuscules et espaces normalisés. Le texte du template n'est
+    pas inclus (il est identique pour toutes les demandes d'un même type et
+    écraserait les différences entre précisions).
+    """
+    lines = [
+        f"{name}: {value}"
+        for name, value in sorted(values.items())
+        if name not in placeholders
+    ]
+    text = "\n".join(lines) or email_type
+    return " ".join(text.lower().split())
+
+def substitutable(content: str, old_values: dict, new_values: dict, placeholders) -> bool:
+    """
+    Vrai si chaque champ substituable qui diffère entre les deux demandes
+    apparaît tel quel dans le texte généré (sinon substitute le laisserait
+    en place, avec la valeur de la demande d'origine).
+    """
+    for name in placeholders:
+        old = str(old_values.get(name) or "").strip()
+        new = str(new_values.get(name) or "").strip()
+        if old != new and (not old or old not in content):
+            return False
+    return True
+
+def substitute(content: str, old_values: dict, new_values: dict, placeholders) -> str:
+    """
+    Remplace dans un texte généré les valeurs d'origine des champs
+    substituables par celles de la nouvelle demande (en une seule passe).
+    """
+    replacements = {}
+    for name in placeholders:
+        old = str(old_values.get(name) or "").strip()
+        new = str(new_values.get(name) or "").strip()
+        if old and new and old != new:
+            replacements[old] = new
+    if not replacements:
+        return content
+    # Les valeurs les plus longues d'abord ("12 mars" avant "12")
+    pattern = re.compile("|".join(
+        re.escape(old) for old in sorted(replacements, key=len, reverse=True)
+    ))
+    return pattern.sub(lambda m: replacements[m.group(0)], content)
+
+# --------------------------------------------------------------------------------
+# INDEX D'UN TYPE D'EMAIL
+# --------------------------------------------------------------------------------
+
+class _TypeIndex:
+    """Vecteurs et générations d'un type d'email (tableaux préalloués)."""
+
+    def __init__(self, capacity, dim):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.entries = []  # Une entrée par ligne de la matrice
+
+    @property
+    def size(self):
+        return len(self.entries)
+
+    def similarities(self, vector, version):
+        """Similarité cosinus avec chaque entrée (-1 pour les versions périmées)."""
+        sims = self.vectors[:self.size] @ vector
+        stale = np.fromiter(
+            (entry["version"] != version for entry in self.entries),
+            dtype=bool, count=self.size
+        )
+        sims[stale] = -1.0
+        return sims
+
+# --------------------------------------------------------------------------------
+# CACHE
+# --------------------------------------------------------------------------------
+
+class SemanticCache:
+    """Recherche de générations proches par similarité d'embeddings."""
+
+    def __init__(self, threshold, max_per_type, placeholders, embed=ollama_embed):
+        self.threshold = threshold
+        self.max_per_type = max_per_type
+        self.placeholders = set(placeholders) - NEVER_SUBSTITUTED
+        self._embed = embed
+        self._indexes = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "replacements": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "unsubstitutable": 0,
+            "embed_errors": 0
+        }
+        self.saved_seconds = 0.0
+        self.embed_seconds = 0.0
+        self.embed_calls = 0
+
+    # ---- Embeddings ---------------------------------------------------------
+
+    def embed(self, text: str):
+        """Vecteur normalisé du texte, ou None si le calcul échoue."""
+        started = time.perf_counter()
+        try:
+            vector = np.asarray(self._embed(text), dtype=np.float32)
+        except Exception:
+            with self._lock:
+                self.counters["embed_errors"] += 1
+            return None
+        finally:
+            with self._lock:
+                self.embed_seconds += time.perf_counter() - started
+                self.embed_calls += 1
+        norm = float(np.linalg.norm(vector))
+        if vector.ndim != 1 or norm == 0.0:
+            with self._lock:
+                self.counters["embed_errors"] += 1
+            return None
+        return vector / norm
+
+    def _index(self, email_type, dim, create=False):
+        """Index du type ; recréé si la dimension change (autre modèle)."""
+        index = self._indexes.get(email_type)
+        if index is not None and index.vectors.shape[1] != dim:
+            index = None
+        if index is None and create:
+            index = self._indexes[email_type] = _TypeIndex(self.max_per_type, dim)
+        return index
+
+    def _best_locked(self, index, vector, version):
+        """(ligne, similarité) de l'entrée la plus proche, ou (None, -1)."""
+        if index is None or index.size == 0:
+            return None, -1.0
+        sims = index.similarities(vector, version)
+        row = int(np.argmax(sims))
+        return row, float(sims[row])
+
+    def _reusable_locked(self, index, vector, version, values):
+        """
+        Ligne de l'entrée la plus proche au-delà du seuil dont le texte peut
+        être adapté à la demande (voir substitutable), ou None.
+        """
+        if index is None or index.size == 0:
+            return None
+        sims = index.similarities(vector, version)
+        for row in np.argsort(-sims):
+            if sims[row] < self.threshold:
+                break
+            entry = index.entries[row]
+            if substitutable(entry["content"], entry["values"], values, self.placeholders):
+                return int(row)
+            self.counters["unsubstitutable"] += 1
+        return None
+
+    # ---- Lecture ------------------------------------------------------------
+
+    def lookup(self, email_type, version, vector, values):
+        """
+        Cherche une génération proche et l'adapte à la nouvelle demande.
+
+        Returns:
+            str|None: Le texte réutilisé, ou None si aucune entrée ne dépasse
+            le seuil ou ne peut être adaptée
+        """
+        with self._lock:
+            index = self._index(email_type, vector.shape[0])
+            row = self._reusable_locked(index, vector, version, values)
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            entry = index.entries[row]
+            self._clock += 1
+            index.last_used[row] = self._clock
+            self.counters["hits"] += 1
+            self.saved_seconds += entry["generation_time"]
+        return substitute(entry["content"], entry["values"], values, self.placeholders)
+
+    # ---- Écriture -----------------------------------------------------------
+
+    def store(self, email_type, version, vector, values, content, generation_time):
+        """
+        Enregistre une génération. Une entrée déjà au-delà du seuil est
+        remplacée (régénération), sinon l'entrée la moins récente est évincée
+        quand le type est plein.
+        """
+        if not content:
+            return
+        entry = {
+            "version": version,
+            "values": dict(values),
+            "content": content,
+            "generation_time": generation_time or 0.0
+        }
+        with self._lock:
+            index = self._index(email_type, vector.shape[0], create=True)
+            row, similarity = self._best_locked(index, vector, version)
+            if row is not None and similarity >= self.threshold:
+                index.entries[row] = entry
+                self.counters["replacements"] += 1
+            elif index.size < self.max_per_type:
+                row = index.size
+                index.entries.append(entry)
+            else:
+                row = int(np.argmin(index.last_used))
+                index.entries[row] = entry
+                self.counters["evictions"] += 1
+            index.vectors[row] = vector
+            self._clock += 1
+            index.last_used[row] = self._clock
+            self.counters["stores"] += 1
+
+    # ---- Invalidation -------------------------------------------------------
+
+    def invalidate_type(self, email_type):
+        """Oublie toutes les générations d'un type (prompt modifié)."""
+        with self._lock:
+            index = self._indexes.pop(email_type, None)
+            if index is not None:
+                self.counters["invalidations"] += index.size
+
+    # ---- Inspection ---------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            entries = {t: index.size for t, index in self._indexes.items()}
+            memory = sum(index.vectors.nbytes for index in self._indexes.values())
+            saved, embed_seconds, embed_calls = self.saved_seconds, self.embed_seconds, self.embed_calls
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "enabled": True,
+            "pid": os.getpid(),
+            "model": shared.EMBEDDING_MODEL,
+            "threshold": self.threshold,
+            "max_per_type": self.max_per_type,
+            "entries": entries,
+            "vector_bytes": memory,
+            "hit_rate": round(counters["hits"] / lookups, 3) if lookups else None,
+            "saved_seconds": round(saved, 2),
+            "embed_avg_ms": round(1000 * embed_seconds / embed_calls, 1) if embed_calls else None,
+            **counters
+        }
+
+# --------------------------------------------------------------------------------
+# CACHE DU PROCESSUS
+# --------------------------------------------------------------------------------
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_semantic_cache():
+    """Retourne le cache sémantique du processus, ou None s'il est désactivé."""
+    global _cache
+    if not shared.SEMANTIC_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache(
+                    shared.SEMANTIC_CACHE_THRESHOLD,
+                    shared.SEMANTIC_CACHE_SIZE,
+                    shared.SEMANTIC_CACHE_PLACEHOLDERS
+                )
+    return _cache
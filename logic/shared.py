@@ -14,18 +14,47 @@ Configuration globale :
    - Configurable via la variable d'environnement FLASK_SECRET_KEY
 
 3. Configuration Ollama :
-   - OLLAMA_URL : URL du serveur Ollama (par défaut sur le réseau local)
+   - OLLAMA_URL : URL du ou des serveurs Ollama (séparées par des virgules)
    - MODEL_NAME : Nom du modèle à utiliser (configurable via OLLAMA_MODEL_NAME)
+   - FALLBACK_MODEL_NAME, FALLBACK_* : Petit modèle de repli (charge, erreurs)
+   - OLLAMA_*_TIMEOUT : Délais de connexion, de premier octet et d'inactivité
+   - OLLAMA_POOL_SIZE, OLLAMA_ASYNC_POOL_SIZE : Taille des pools de connexions HTTP
+   - OLLAMA_HEALTH_INTERVAL, OLLAMA_FAILURE_THRESHOLD : Surveillance des serveurs
+   - OLLAMA_CIRCUIT_* : Disjoncteur par serveur (échec immédiat, essai semi-ouvert)
+   - OLLAMA_HEDGE_* : Génération doublée vers un second serveur si le premier token tarde
+   - OLLAMA_KEEP_ALIVE, OLLAMA_WARMUP, OLLAMA_KEEP_WARM_* : Préchargement du modèle
+   - OLLAMA_SLOTS_PER_BACKEND, GUNICORN_WORKERS, GENERATION_QUEUE_* : Contrôle d'admission
+   - GENERATION_CACHE_* : Cache des générations (optionnel)
+   - SEMANTIC_CACHE_*, EMBEDDING_* : Cache sémantique (optionnel)
+   - IDEMPOTENCY_TTL : Conservation des résultats des requêtes rejouées
+   - CANCEL_* : Annulation des générations, tous workers confondus
+   - BULK_* : Génération en masse (publipostage)
+   - MAX_VARIANTS, VARIANT_MIN_TEMPERATURE : Versions alternatives (/regen?n=3)
+   - KV_CONTEXT_* : Reprise du contexte évalué (régénération, retouches)
+   - METRICS_* : Mesures de latence des générations (/metrics)
+   - LOG_* : Journalisation structurée (niveau, format, prompts)
+   - STATIC_MAX_AGE : Mise en cache des fichiers statiques par le navigateur
+   - ASSETS_BUNDLES : Fichiers CSS / JS regroupés et minifiés (build_assets.py)
 
 4. Gestion des prompts :
-   - PROMPTS : Dictionnaire des prompts chargé depuis prompts.json
-   - Fonctions de chargement et mise à jour
+   - get_snapshot() : configuration des prompts en mémoire (prompts.json au
+     démarrage, puis dernière version enregistrée en base), templates
+     compilés et version, publiés ensemble en un seul instantané
+   - get_prompts(), get_template(), get_prompts_version() : accès à
+     l'instantané en vigueur
+   - PROMPT_HISTORY : Versions conservées en base
+   - PROMPT_SYNC_INTERVAL : Délai entre deux vérifications de la version en base
+   - Fonctions de validation, de chargement et mise à jour
+   - Templates compilés une fois par chargement ; leurs placeholders sont
+     vérifiés contre dest, obj et les champs du type
+   - Options de génération par type (num_predict, num_ctx, temperature, stop, keep_alive, model)
    - Structure : {
      "select_type": str,
      "types": list[str],
      "initial": str,
      "form_fields": dict,
-     "prompts": dict
+     "prompts": dict,
+     "options": dict  (optionnel)
    }
 
 5. États de conversation :
@@ -35,6 +64,9 @@ Configuration globale :
 
 import os
 import json
+import string
+from collections import namedtuple
+from types import MappingProxyType
 
 # --------------------------------------------------------------------------------
 # CONFIGURATION DES CHEMINS
@@ -59,69 +91,277 @@ SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "votre_clé_secrète_flask")
 # --------------------------------------------------------------------------------
 
 # URL du serveur Ollama (adapter selon l'environnement)
-OLLAMA_URL = ""
+# Plusieurs serveurs peuvent être indiqués, séparés par des virgules :
+#   OLLAMA_URL="http://ollama-1:11434,http://ollama-2:11434"
+OLLAMA_URL = os.getenv("OLLAMA_URL", "")
 
 # Modèle à utiliser (configurable via variable d'environnement)
 MODEL_NAME = os.getenv("OLLAMA_MODEL_NAME", "qwen2.5:0.5b")
 
+# Routage vers un petit modèle de repli (voir routing.py)
+# - FALLBACK_MODEL_NAME : modèle rapide (ex. "qwen2.5:0.5b"), vide = désactivé
+# - FALLBACK_QUEUE_DEPTH : générations en attente à partir desquelles les
+#   suivantes basculent sur le petit modèle (0 = critère désactivé)
+# - FALLBACK_P95 : p95 récent de la durée des générations de MODEL_NAME
+#   (secondes) à partir duquel on bascule (0 = critère désactivé)
+# - FALLBACK_P95_WINDOW : fenêtre de calcul de ce p95 (secondes)
+# - FALLBACK_ON_ERROR : relance sur le petit modèle une génération qui
+#   échoue avant son premier token
+FALLBACK_MODEL_NAME = os.getenv("OLLAMA_FALLBACK_MODEL_NAME", "")
+FALLBACK_QUEUE_DEPTH = int(os.getenv("FALLBACK_QUEUE_DEPTH", "10"))
+FALLBACK_P95 = float(os.getenv("FALLBACK_P95", "0"))
+FALLBACK_P95_WINDOW = float(os.getenv("FALLBACK_P95_WINDOW", "300"))
+FALLBACK_ON_ERROR = os.getenv("FALLBACK_ON_ERROR", "1") == "1"
+
+# Délais réseau (en secondes) pour les appels à Ollama
+# - CONNECT : établissement de la connexion TCP
+# - FIRST_BYTE : attente du premier octet (inclut le chargement du modèle)
+# - IDLE : silence maximal entre deux fragments du flux
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_FIRST_BYTE_TIMEOUT = float(os.getenv("OLLAMA_FIRST_BYTE_TIMEOUT", "120"))
+OLLAMA_IDLE_TIMEOUT = float(os.getenv("OLLAMA_IDLE_TIMEOUT", "30"))
+
+# Surveillance des serveurs Ollama (voir backends.py)
+# - HEALTH_INTERVAL : intervalle entre deux sondes /api/tags (secondes)
+# - FAILURE_THRESHOLD : échecs consécutifs avant d'écarter un serveur
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))
+
+# Disjoncteur par serveur (voir backends.py)
+# - CIRCUIT_COOLDOWN : durée d'ouverture du circuit avant une génération
+#   d'essai (secondes), doublée à chaque essai manqué
+# - CIRCUIT_MAX_COOLDOWN : durée d'ouverture maximale (secondes)
+OLLAMA_CIRCUIT_COOLDOWN = float(os.getenv("OLLAMA_CIRCUIT_COOLDOWN", "5"))
+OLLAMA_CIRCUIT_MAX_COOLDOWN = float(os.getenv("OLLAMA_CIRCUIT_MAX_COOLDOWN", "60"))
+
+# Générations doublées (hedging, voir ollama_client.py), désactivées par défaut
+# - HEDGE_PERCENTILE : percentile des délais récents avant le premier token
+#   au-delà duquel la génération est doublée vers un second serveur
+#   (ex. 95 ; 0 = désactivé) ; la première réponse est gardée, l'autre annulée
+# - HEDGE_MIN_DELAY : délai minimal avant de doubler (secondes)
+OLLAMA_HEDGE_PERCENTILE = float(os.getenv("OLLAMA_HEDGE_PERCENTILE", "0"))
+OLLAMA_HEDGE_MIN_DELAY = float(os.getenv("OLLAMA_HEDGE_MIN_DELAY", "0.5"))
+
+# Préchargement du modèle (voir warmup.py)
+# - KEEP_ALIVE : durée de maintien en mémoire envoyée à Ollama avec chaque
+#   requête ("30m", "2h", secondes, "-1" = indéfiniment)
+# - WARMUP : précharge MODEL_NAME sur chaque serveur au démarrage
+# - KEEP_WARM_HOURS / DAYS : plage horaire (ex. "8-19") et jours (0 = lundi,
+#   ex. "0-4") du maintien à chaud ; vide = désactivé
+# - KEEP_WARM_INTERVAL : intervalle entre deux rappels (secondes)
+# - COLD_LOAD_THRESHOLD : load_duration (secondes) au-delà de laquelle une
+#   génération est comptée comme un chargement à froid
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") == "1"
+OLLAMA_KEEP_WARM_HOURS = os.getenv("OLLAMA_KEEP_WARM_HOURS", "")
+OLLAMA_KEEP_WARM_DAYS = os.getenv("OLLAMA_KEEP_WARM_DAYS", "0-4")
+OLLAMA_KEEP_WARM_INTERVAL = float(os.getenv("OLLAMA_KEEP_WARM_INTERVAL", "240"))
+OLLAMA_COLD_LOAD_THRESHOLD = float(os.getenv("OLLAMA_COLD_LOAD_THRESHOLD", "0.5"))
+
+# Taille du pool de connexions HTTP vers Ollama
+# Aligné par défaut sur le nombre de threads d'un worker Gunicorn
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", os.getenv("GUNICORN_THREADS", "10")))
+
+# Contrôle d'admission des générations (voir admission.py)
+# - SLOTS_PER_BACKEND : générations simultanées admises par serveur, tous
+#   workers confondus (à aligner sur OLLAMA_NUM_PARALLEL côté Ollama)
+# - GUNICORN_WORKERS : nombre de workers (WEB_CONCURRENCY par défaut, comme
+#   Gunicorn) ; chaque worker admet SLOTS_PER_BACKEND / GUNICORN_WORKERS
+#   générations par serveur (au moins une : avec plus de workers que de
+#   créneaux, la limite est dépassée, voir admission.check_capacity)
+# - QUEUE_MAX : taille maximale de la file d'attente (au-delà : 429)
+# - QUEUE_TIMEOUT : attente maximale dans la file en secondes (au-delà : 503)
+OLLAMA_SLOTS_PER_BACKEND = int(os.getenv("OLLAMA_SLOTS_PER_BACKEND", "4"))
+GUNICORN_WORKERS = max(1, int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+GENERATION_QUEUE_MAX = int(os.getenv("GENERATION_QUEUE_MAX", "50"))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("GENERATION_QUEUE_TIMEOUT", "60"))
+
+# Cache des générations (voir cache.py), désactivé par défaut
+# - ENABLED : active le cache en mémoire (LRU) de chaque worker
+# - SIZE : nombre maximal d'entrées en mémoire
+# - TTL : durée de vie d'une entrée en secondes
+# - PERSISTENT : ajoute un niveau SQLite partagé entre les workers
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "0") == "1"
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "256"))
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", "3600"))
+GENERATION_CACHE_PERSISTENT = os.getenv("GENERATION_CACHE_PERSISTENT", "0") == "1"
+
+# Cache sémantique (voir semantic_cache.py), désactivé par défaut
+# - ENABLED : cherche une génération proche quand le cache exact échoue
+# - THRESHOLD : similarité cosinus minimale pour réutiliser une génération
+# - SIZE : nombre maximal de vecteurs conservés par type d'email
+# - PLACEHOLDERS : champs remplacés dans le texte réutilisé, exclus de la
+#   comparaison : seulement des valeurs recopiées telles quelles par le modèle
+#   (destinataire, date, heure) ; l'objet et les champs libres sont comparés
+# - EMBEDDING_MODEL, EMBEDDING_TIMEOUT : modèle d'embeddings d'Ollama et délai
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "200"))
+SEMANTIC_CACHE_PLACEHOLDERS = [
+    field.strip()
+    for field in os.getenv("SEMANTIC_CACHE_PLACEHOLDERS", "dest,date,heure").split(",")
+    if field.strip()
+]
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "10"))
+
+# Durée de conservation (secondes) des résultats associés à une clé
+# d'idempotence (en-tête Idempotency-Key, voir dedup.py)
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "300"))
+
+# Annulation des générations (voir cancellation.py)
+# - CANCEL_DB_PATH : base SQLite où sont publiées les annulations pour les
+#   autres workers (vide = annulation limitée au worker qui la reçoit)
+# - CANCEL_POLL_INTERVAL : lecture des annulations publiées toutes les N secondes
+# - CANCEL_TTL : conservation des annulations publiées (secondes)
+CANCEL_DB_PATH = os.getenv("CANCEL_DB_PATH", os.path.join(BASE_DIR, "../instance/cancel.db"))
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "0.5"))
+CANCEL_TTL = float(os.getenv("CANCEL_TTL", "60"))
+
+# Génération en masse (publipostage, voir bulk.py)
+# - MAX_ROWS : nombre maximal de lignes par demande
+# - CONCURRENCY : générations simultanées par défaut pour une demande
+# - MAX_CONCURRENCY : plafond du paramètre "concurrency" d'une demande
+# - RETRIES : nouvelles tentatives d'une ligne refusée faute de capacité (429/503)
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "1000"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "16"))
+BULK_RETRIES = int(os.getenv("BULK_RETRIES", "3"))
+
+# Reprise du contexte déjà évalué par Ollama (régénération, retouches,
+# voir kv_context.py). KV_CONTEXT_TTL : durée de conservation (secondes),
+# inutile au-delà du keep_alive du modèle
+KV_CONTEXT_REUSE = os.getenv("KV_CONTEXT_REUSE", "1") == "1"
+KV_CONTEXT_TTL = float(os.getenv("KV_CONTEXT_TTL", "1800"))
+
+# Mesures de latence des générations (voir metrics.py)
+# - METRICS_DB_PATH : base SQLite partagée par les workers
+# - METRICS_RETENTION : conservation des mesures brutes (percentiles, secondes)
+# - METRICS_FLUSH_INTERVAL : écriture par lots toutes les N secondes
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", os.path.join(BASE_DIR, "../instance/metrics.db"))
+METRICS_RETENTION = float(os.getenv("METRICS_RETENTION", "86400"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Jeton exigé par /metrics (Authorization: Bearer ...), vide = réservé aux
+# sessions administrateur
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Journalisation du module logic (voir log.py)
+# - LOG_LEVEL : DEBUG, INFO, WARNING, ERROR
+# - LOG_FORMAT : json (défaut) ou text
+# - LOG_QUEUE_SIZE : évènements en attente d'écriture (au-delà : abandonnés)
+# - LOG_PROMPTS : redact (longueur et empreinte), sample ou full
+# - LOG_PROMPT_SAMPLE_RATE : fraction des prompts journalisés en mode sample
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PROMPTS = os.getenv("LOG_PROMPTS", "redact")
+LOG_PROMPT_SAMPLE_RATE = float(os.getenv("LOG_PROMPT_SAMPLE_RATE", "0.01"))
+
+# Variantes d'une génération (/regen?n=3, voir chat.py)
+# - MAX_VARIANTS : nombre maximal de versions générées en une demande
+# - VARIANT_MIN_TEMPERATURE : température minimale des variantes, pour que
+#   des graines différentes produisent des textes différents
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "4"))
+VARIANT_MIN_TEMPERATURE = float(os.getenv("VARIANT_MIN_TEMPERATURE", "0.7"))
+
+# Taille du pool de connexions du mode asynchrone (ASGI, voir asgi.py)
+# Une connexion par génération en cours : à dimensionner largement
+OLLAMA_ASYNC_POOL_SIZE = int(os.getenv("OLLAMA_ASYNC_POOL_SIZE", "500"))
+
+# Durée de conservation des fichiers statiques par le navigateur (secondes,
+# voir http_cache.py), revalidés ensuite par ETag / Last-Modified.
+# 0 = revalidation à chaque chargement de page
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+
+# Fichiers CSS / JS regroupés par page (voir assets.py), si build_assets.py
+# a été exécuté ; 0 = fichiers sources (mise au point du JavaScript)
+ASSETS_BUNDLES = os.getenv("ASSETS_BUNDLES", "1") == "1"
+
 # --------------------------------------------------------------------------------
 # GESTION DES PROMPTS
 # --------------------------------------------------------------------------------
 
-# Variables globales pour stocker les prompts et le timestamp
-PROMPTS = None
-LAST_MTIME = 0
+# Configuration en mémoire : prompts.json au chargement du module, puis la
+# dernière version enregistrée en base (voir prompt_store.py).
+# Configuration, templates compilés et version forment un seul instantané,
+# remplacé d'un bloc (une affectation) et jamais modifié ensuite : une requête
+# qui lit le même instantané ne mélange jamais deux versions.
+PromptsSnapshot = namedtuple("PromptsSnapshot", ("prompts", "templates", "version"))
+_SNAPSHOT = PromptsSnapshot(None, MappingProxyType({}), 0)  # version 0 = prompts.json
 
-def should_reload_prompts():
-    """Vérifie si le fichier prompts.json a été modifié depuis le dernier chargement"""
-    global LAST_MTIME
-    try:
-        current_mtime = os.path.getmtime(PROMPTS_PATH)
-        if current_mtime > LAST_MTIME:
-            LAST_MTIME = current_mtime
-            return True
-        return False
-    except Exception:
-        return True
+# Versions de la configuration conservées en base (historique des modifications)
+PROMPT_HISTORY = int(os.getenv("PROMPT_HISTORY", "50"))
 
-def get_prompts():
+# Intervalle minimal entre deux vérifications de la version en base, par
+# worker (secondes ; 0 = à chaque requête). Le worker qui enregistre une
+# version l'installe immédiatement, les autres au plus tard après ce délai.
+PROMPT_SYNC_INTERVAL = float(os.getenv("PROMPT_SYNC_INTERVAL", "1"))
+
+# Clés obligatoires de la configuration
+PROMPT_KEYS = ("select_type", "types", "initial", "form_fields", "prompts")
+
+def get_snapshot() -> PromptsSnapshot:
     """
-    Retourne les prompts, en rechargeant si le fichier a été modifié.
-    À utiliser au lieu d'accéder directement à la variable PROMPTS.
+    Retourne l'instantané en vigueur : (prompts, templates, version).
+    À lire une seule fois quand plusieurs éléments doivent concorder
+    (type, template et options d'une génération).
+
+    Aucun accès disque ni base : la configuration est synchronisée avec la
+    dernière version enregistrée une fois par requête (prompt_store.sync_prompts).
     """
-    global PROMPTS
-    if should_reload_prompts():
-        load_prompts()
-    return PROMPTS
+    return _SNAPSHOT
 
-def load_prompts():
+def get_prompts():
+    """Retourne la configuration des prompts en mémoire (à ne pas modifier)."""
+    return _SNAPSHOT.prompts
+
+def get_prompts_version() -> int:
+    """Version installée (0 : prompts.json, pas encore lue depuis la base)."""
+    return _SNAPSHOT.version
+
+def validate_prompts(raw) -> tuple:
     """
-    Charge le fichier prompts.json dans la variable globale PROMPTS.
-    Met aussi à jour le timestamp de dernière modification.
-    
-    Le fichier doit contenir un objet JSON valide avec la structure attendue :
+    Valide une configuration complète et en retourne une copie normalisée.
+
+    Structure attendue :
     {
         "select_type": str,  # Message pour choisir le type d'email
         "types": list[str],  # Liste des types disponibles
         "initial": str,  # Message après choix du type
         "form_fields": dict,  # Champs supplémentaires par type
-        "prompts": dict  # Templates de génération par type
+        "prompts": dict,  # Templates de génération par type
+        "options": dict  # (optionnel) Options de génération par type
     }
-    
+
+    Returns:
+        tuple: (configuration, templates compilés par type)
+
     Raises:
-        FileNotFoundError: Si prompts.json n'existe pas
-        json.JSONDecodeError: Si le fichier n'est pas un JSON valide
-        ValueError: Si la structure n'est pas cohérente
+        ValueError: Si la structure n'est pas cohérente, si une option est
+            invalide ou si un template utilise un champ absent de son type
     """
-    global PROMPTS, LAST_MTIME
-    with open(PROMPTS_PATH, encoding="utf-8") as f:
-        PROMPTS = json.load(f)
-    LAST_MTIME = os.path.getmtime(PROMPTS_PATH)
+    if not isinstance(raw, dict):
+        raise ValueError("La configuration des prompts doit être un objet JSON")
+    missing_keys = [key for key in PROMPT_KEYS if key not in raw]
+    if missing_keys:
+        raise ValueError(f"Clés manquantes dans la configuration : {', '.join(missing_keys)}")
+    # Copie : la configuration installée ne partage rien avec l'appelant
+    data = json.loads(json.dumps(raw, ensure_ascii=False))
+
+    # Types : noms non vides et uniques
+    if not isinstance(data["types"], list) or not all(isinstance(t, str) and t for t in data["types"]):
+        raise ValueError("types doit être une liste de noms non vides")
+    duplicates = {t for t in data["types"] if data["types"].count(t) > 1}
+    if duplicates:
+        raise ValueError(f"Types en double : {', '.join(sorted(duplicates))}")
+    if not isinstance(data["form_fields"], dict) or not isinstance(data["prompts"], dict):
+        raise ValueError("form_fields et prompts doivent être des objets JSON")
 
     # Validation de la cohérence des types
-    types_set = set(PROMPTS["types"])
-    form_fields_set = set(PROMPTS["form_fields"].keys())
-    prompts_set = set(PROMPTS["prompts"].keys())
+    types_set = set(data["types"])
+    form_fields_set = set(data["form_fields"].keys())
+    prompts_set = set(data["prompts"].keys())
     
     # Vérifie que tous les types ont leurs champs et prompts
     if not types_set.issubset(form_fields_set):
@@ -134,31 +374,261 @@ def load_prompts():
         
     # Supprime les types obsolètes
     for obsolete in form_fields_set - types_set:
-        del PROMPTS["form_fields"][obsolete]
+        del data["form_fields"][obsolete]
     for obsolete in prompts_set - types_set:
-        del PROMPTS["prompts"][obsolete]
+        del data["prompts"][obsolete]
+
+    # Champs : identifiant et libellé obligatoires, identifiants uniques par type
+    for email_type, fields in data["form_fields"].items():
+        if not isinstance(fields, list) or not all(
+            isinstance(f, dict) and f.get("id") and f.get("label") for f in fields
+        ):
+            raise ValueError(f"Champs du type « {email_type} » : id et label sont requis")
+        ids = [f["id"] for f in fields]
+        duplicates = {i for i in ids if ids.count(i) > 1}
+        if duplicates:
+            raise ValueError(
+                f"Identifiants de champ en double pour le type « {email_type} » : "
+                + ", ".join(sorted(map(str, duplicates)))
+            )
+
+    # Valide les options de génération (clé optionnelle)
+    options = data.get("options") or {}
+    data["options"] = options
+    for email_type in list(options):
+        if email_type not in types_set:
+            del options[email_type]
+        else:
+            options[email_type] = normalize_generation_options(options[email_type])
 
-def update_prompts(new_data):
+    return data, compile_prompts(data)
+
+def install_prompts(data: dict, templates: dict, version: int):
+    """Remplace la configuration en mémoire (déjà validée par validate_prompts)."""
+    global _SNAPSHOT
+    _SNAPSHOT = PromptsSnapshot(data, MappingProxyType(dict(templates)), version)
+
+def load_prompts():
     """
-    Met à jour les prompts en mémoire et sur le disque.
-    Met aussi à jour le timestamp de dernière modification.
-    
+    Charge le fichier prompts.json en mémoire (configuration de départ,
+    importée en base au premier démarrage : voir prompt_store.py).
+    En cas d'erreur, la configuration précédente reste en place.
+
+    Raises:
+        FileNotFoundError: Si prompts.json n'existe pas
+        json.JSONDecodeError: Si le fichier n'est pas un JSON valide
+        ValueError: Si la structure n'est pas cohérente
+    """
+    with open(PROMPTS_PATH, encoding="utf-8") as f:
+        data, templates = validate_prompts(json.load(f))
+    install_prompts(data, templates, get_prompts_version())
+
+def update_prompts(new_data, expected_version=None, author=None) -> int:
+    """
+    Enregistre une nouvelle version de la configuration en base et
+    l'installe en mémoire (voir prompt_store.save_prompt_config).
+
     Args:
-        new_data (dict): Nouveau dictionnaire de prompts
-            Doit avoir la même structure que le fichier prompts.json
-    
+        new_data (dict): Configuration complète (même structure que prompts.json)
+        expected_version (int|None): Version sur laquelle portent les
+            modifications (None : version en mémoire)
+        author (str|None): Administrateur à l'origine de la modification
+
+    Returns:
+        int: Numéro de la nouvelle version
+
     Raises:
         TypeError: Si new_data n'est pas un dictionnaire
-        IOError: Si l'écriture du fichier échoue
+        ValueError: Si la configuration est invalide (rien n'est alors écrit)
+        PromptConflict: Si une autre version a été enregistrée entre-temps
     """
     if not isinstance(new_data, dict):
         raise TypeError("Les nouveaux prompts doivent être un dictionnaire")
-    
-    global PROMPTS, LAST_MTIME
-    PROMPTS = new_data
-    with open(PROMPTS_PATH, "w", encoding="utf-8") as f:
-        json.dump(PROMPTS, f, indent=2, ensure_ascii=False)
-    LAST_MTIME = os.path.getmtime(PROMPTS_PATH)
+    # prompt_store importe ce module : import au moment de l'appel
+    from logic.prompt_store import save_prompt_config
+    return save_prompt_config(new_data, expected_version, author)
+
+# --------------------------------------------------------------------------------
+# TEMPLATES DE PROMPTS
+# --------------------------------------------------------------------------------
+
+# Champs communs à tous les types (étape STEP_INFO), utilisables dans les templates
+BASE_PROMPT_FIELDS = ("dest", "obj")
+
+_FORMATTER = string.Formatter()
+
+class PromptTemplate:
+    """
+    Template de prompt compilé : les placeholders ({dest}, {date}...) sont
+    analysés une fois, le rendu se limite à une concaténation.
+
+    Attributs :
+        text (str) : Texte du template
+        placeholders (set[str]) : Noms des champs utilisés
+
+    Raises:
+        ValueError: Accolade isolée, placeholder vide ou positionnel ({} ou {0}),
+            ou accès à un attribut / index ({date.year}, {liste[0]})
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.placeholders = set()
+        self._parts = []  # (texte littéral, champ ou None, conversion, format)
+        try:
+            parsed = list(_FORMATTER.parse(text))
+        except ValueError as e:
+            raise ValueError(f"accolades invalides ({e}) ; doublez-les ({{{{ }}}}) pour un texte littéral")
+        for literal, name, spec, conversion in parsed:
+            if name is not None:
+                if not name.isidentifier():
+                    raise ValueError(f"placeholder invalide : {{{name}}}")
+                if spec and "{" in spec:
+                    raise ValueError(f"format imbriqué non pris en charge : {{{name}:{spec}}}")
+                self.placeholders.add(name)
+            self._parts.append((literal, name, conversion, spec))
+
+    def render(self, values: dict) -> str:
+        """
+        Remplace les placeholders par les valeurs (mêmes règles que str.format).
+
+        Raises:
+            ValueError: Si une valeur manque
+        """
+        out = []
+        for literal, name, conversion, spec in self._parts:
+            out.append(literal)
+            if name is None:
+                continue
+            try:
+                value = values[name]
+            except KeyError:
+                raise ValueError(f"Valeur manquante pour le champ {{{name}}}") from None
+            if conversion:
+                value = _FORMATTER.convert_field(value, conversion)
+            out.append(format(value, spec))
+        return "".join(out)
+
+def compile_prompt(email_type: str, text: str, form_fields: list) -> PromptTemplate:
+    """
+    Compile le template d'un type et vérifie que chaque placeholder
+    correspond à dest, obj ou à un champ du formulaire du type.
+
+    Raises:
+        ValueError: Message précis (type, placeholders en cause, champs disponibles)
+    """
+    try:
+        template = PromptTemplate(text or "")
+    except ValueError as e:
+        raise ValueError(f"Prompt du type « {email_type} » invalide : {e}") from None
+    available = set(BASE_PROMPT_FIELDS) | {field["id"] for field in form_fields or []}
+    unknown = sorted(template.placeholders - available)
+    if unknown:
+        raise ValueError(
+            f"Le prompt du type « {email_type} » utilise "
+            + ", ".join(f"{{{name}}}" for name in unknown)
+            + " sans champ correspondant (champs disponibles : "
+            + ", ".join(sorted(available)) + ")"
+        )
+    return template
+
+def compile_prompts(data: dict) -> dict:
+    """Compile les templates de tous les types (ValueError au premier invalide)."""
+    return {
+        email_type: compile_prompt(
+            email_type, data["prompts"].get(email_type, ""), data["form_fields"].get(email_type)
+        )
+        for email_type in data["types"]
+    }
+
+def get_template(email_type: str, snapshot=None) -> PromptTemplate:
+    """
+    Template compilé d'un type, pris dans snapshot (get_snapshot()) pour
+    concorder avec la configuration déjà lue, ou dans l'instantané en vigueur.
+    """
+    return (snapshot or _SNAPSHOT).templates[email_type]
+
+# --------------------------------------------------------------------------------
+# OPTIONS DE GÉNÉRATION PAR TYPE
+# --------------------------------------------------------------------------------
+
+# Options acceptées dans prompts.json (clé "options") et leur type
+# - num_predict : nombre maximal de tokens générés
+# - num_ctx : taille de la fenêtre de contexte
+# - temperature : créativité (0 = déterministe)
+# - stop : séquences qui arrêtent la génération (ex. ligne de signature)
+# - keep_alive : maintien du modèle en mémoire (remplace OLLAMA_KEEP_ALIVE)
+# - model : modèle imposé pour ce type (jamais remplacé sous charge)
+GENERATION_OPTION_TYPES = {
+    "num_predict": int,
+    "num_ctx": int,
+    "temperature": float,
+    "stop": list,
+    "keep_alive": str,
+    "model": str
+}
+
+def normalize_generation_options(raw) -> dict:
+    """
+    Valide et normalise les options de génération d'un type d'email.
+    Les valeurs vides sont ignorées.
+
+    Args:
+        raw (dict|None): Options telles que saisies ou lues dans prompts.json
+
+    Returns:
+        dict: Options prêtes à être transmises à Ollama
+
+    Raises:
+        ValueError: Si une option est inconnue ou invalide
+    """
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError("Les options de génération doivent être un objet JSON")
+
+    options = {}
+    for name, value in raw.items():
+        kind = GENERATION_OPTION_TYPES.get(name)
+        if kind is None:
+            raise ValueError(f"Option de génération inconnue : {name}")
+        if value is None or value == "" or value == []:
+            continue
+
+        if kind is list:
+            values = [value] if isinstance(value, str) else value
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError("L'option stop doit être une liste de textes")
+            values = [v for v in values if v]
+            if values:
+                options[name] = values
+        elif name == "model":
+            text = str(value).strip()
+            if text:
+                options[name] = text
+        elif kind is str:
+            # keep_alive : durée ("10m") ou nombre de secondes (-1 = indéfiniment)
+            text = str(value).strip()
+            try:
+                options[name] = int(text)
+            except ValueError:
+                options[name] = text
+        else:
+            try:
+                number = kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Valeur invalide pour {name} : {value}")
+            if name in ("num_predict", "num_ctx") and number <= 0 and number != -1:
+                raise ValueError(f"{name} doit être positif")
+            if name == "temperature" and not 0 <= number <= 2:
+                raise ValueError("temperature doit être comprise entre 0 et 2")
+            options[name] = number
+    return options
+
+def get_generation_options(email_type: str, snapshot=None) -> dict:
+    """Options de génération d'un type d'email (dictionnaire vide si aucune)."""
+    prompts = (snapshot or _SNAPSHOT).prompts
+    return dict(prompts.get("options", {}).get(email_type) or {})
 
 # Chargement initial des prompts
 load_prompts()
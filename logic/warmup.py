@@ -0,0 +1,367 @@
+# logic/warmup.py
+"""
+warmup.py
+--------------------------------------------------------------------------------
+Préchargement et maintien en mémoire du modèle sur les serveurs Ollama.
+
+Problème résolu :
+Ollama décharge le modèle après une période d'inactivité (keep_alive).
+La première génération suivante subit alors plusieurs secondes de chargement.
+
+Fonctionnement :
+1. Au démarrage (OLLAMA_WARMUP=1) :
+   - MODEL_NAME est préchargé sur chaque serveur configuré, dans un thread
+     de fond pour ne pas retarder le démarrage du worker
+
+2. À chaque génération :
+   - keep_alive (OLLAMA_KEEP_ALIVE) est envoyé à Ollama (voir ollama_client.py)
+   - load_duration est relevé : un chargement à froid est comptabilisé
+
+3. Maintien à chaud (optionnel) :
+   - Pendant la plage OLLAMA_KEEP_WARM_HOURS / OLLAMA_KEEP_WARM_DAYS,
+     un préchargement est renvoyé toutes les OLLAMA_KEEP_WARM_INTERVAL secondes
+     (sans effet si le modèle est déjà chargé, hormis le report de l'expiration)
+   - Plages vérifiées au démarrage : une valeur invalide est journalisée et
+     désactive le maintien à chaud (le préchargement initial a lieu)
+
+4. Un seul worker :
+   - Le préchargement et le maintien à chaud sont confiés au worker qui
+     obtient le verrou instance/warmup.lock (flock, libéré par le système
+     à la mort du processus) ; les autres retentent à chaque intervalle et
+     prennent le relais si ce worker disparaît
+
+5. Administration :
+   - État de résidence via /api/ps, préchargement et déchargement à la demande
+     (voir /admin/model)
+   - Un déchargement suspend le maintien à chaud pour tous les workers
+     (fichier instance/keep_warm.paused) jusqu'au lendemain ou jusqu'au
+     prochain préchargement demandé
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows (développement) : un seul processus
+    fcntl = None
+
+import logic.shared as shared
+from logic.backends import get_pool, model_matches
+from logic.ollama_client import get_http_session, keep_alive_setting
+
+logger = logging.getLogger(__name__)
+
+# Verrou du worker chargé du préchargement, et suspension du maintien à chaud
+WARMUP_LOCK_PATH = os.path.join(shared.BASE_DIR, "../instance/warmup.lock")
+KEEP_WARM_PAUSE_PATH = os.path.join(shared.BASE_DIR, "../instance/keep_warm.paused")
+
+# --------------------------------------------------------------------------------
+# OPÉRATIONS SUR UN SERVEUR
+# --------------------------------------------------------------------------------
+
+def preload_backend(pool, backend, http=None, keep_alive=None) -> float:
+    """
+    Charge MODEL_NAME sur un serveur (requête /api/generate sans prompt).
+
+    Returns:
+        float: Durée de l'appel en secondes (≈ temps de chargement si le modèle
+        n'était pas résident)
+
+    Raises:
+        ValueError: En cas d'erreur de communication
+    """
+    http = http or get_http_session()
+    started = time.perf_counter()
+    try:
+        response = http.post(
+            f"{backend.url}/api/generate",
+            json={
+                "model": pool.model,
+                "keep_alive": keep_alive_setting() if keep_alive is None else keep_alive,
+                "stream": False
+            },
+            timeout=(shared.OLLAMA_CONNECT_TIMEOUT, shared.OLLAMA_FIRST_BYTE_TIMEOUT)
+        )
+        response.raise_for_status()
+        body = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        pool.mark_failure(backend, e)
+        raise ValueError(f"Préchargement impossible sur {backend.url}: {str(e)}")
+    elapsed = time.perf_counter() - started
+    # Préchargement volontaire : ne compte pas comme un chargement à froid subi
+    pool.record_load(backend, (body.get("load_duration") or elapsed * 1e9) / 1e9, count_cold=False)
+    return elapsed
+
+def unload_backend(pool, backend, http=None):
+    """
+    Décharge MODEL_NAME d'un serveur (keep_alive = 0).
+
+    Raises:
+        ValueError: En cas d'erreur de communication
+    """
+    http = http or get_http_session()
+    try:
+        response = http.post(
+            f"{backend.url}/api/generate",
+            json={"model": pool.model, "keep_alive": 0, "stream": False},
+            timeout=(shared.OLLAMA_CONNECT_TIMEOUT, shared.OLLAMA_FIRST_BYTE_TIMEOUT)
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise ValueError(f"Déchargement impossible sur {backend.url}: {str(e)}")
+    backend.model_resident = False
+    backend.resident_until = None
+
+def probe_residency(pool, backend, http=None):
+    """
+    Interroge /api/ps : le modèle est-il chargé en mémoire, et jusqu'à quand ?
+    En cas d'erreur, l'état devient inconnu (None).
+    """
+    http = http or get_http_session()
+    try:
+        response = http.get(
+            f"{backend.url}/api/ps",
+            timeout=(shared.OLLAMA_CONNECT_TIMEOUT, shared.OLLAMA_CONNECT_TIMEOUT)
+        )
+        response.raise_for_status()
+        models = response.json().get("models", [])
+    except (requests.exceptions.RequestException, ValueError):
+        backend.model_resident = None
+        backend.resident_until = None
+        return None
+    loaded = [m for m in models if model_matches(m.get("name", ""), pool.model)]
+    backend.model_resident = bool(loaded)
+    backend.resident_until = loaded[0].get("expires_at") if loaded else None
+    return backend.model_resident
+
+# --------------------------------------------------------------------------------
+# OPÉRATIONS SUR TOUS LES SERVEURS
+# --------------------------------------------------------------------------------
+
+def _for_each_backend(operation) -> list:
+    """Applique une opération à chaque serveur et collecte les résultats."""
+    pool = get_pool()
+    results = []
+    for backend in list(pool.backends):
+        try:
+            value = operation(pool, backend)
+            results.append({"url": backend.url, "success": True, "value": value})
+        except ValueError as e:
+            results.append({"url": backend.url, "success": False, "error": str(e)})
+    return results
+
+def preload_all() -> list:
+    """Précharge le modèle sur tous les serveurs."""
+    return _for_each_backend(preload_backend)
+
+def unload_all() -> list:
+    """Décharge le modèle de tous les serveurs."""
+    return _for_each_backend(unload_backend)
+
+def model_status() -> dict:
+    """État du modèle sur chaque serveur (résidence interrogée à la volée)."""
+    pool = get_pool()
+    for backend in list(pool.backends):
+        probe_residency(pool, backend)
+    backends = [
+        {
+            "url": b.url,
+            "healthy": b.healthy,
+            "model_resident": b.model_resident,
+            "resident_until": b.resident_until,
+            "cold_loads": b.cold_loads,
+            "last_load_duration": b.last_load_duration
+        }
+        for b in pool.backends
+    ]
+    return {
+        "model": pool.model,
+        "pid": os.getpid(),
+        "keep_alive": keep_alive_setting(),
+        "keep_warm": shared.OLLAMA_KEEP_WARM_HOURS or None,
+        "keep_warm_paused": keep_warm_paused(),
+        "cold_loads": sum(b["cold_loads"] for b in backends),
+        "backends": backends
+    }
+
+# --------------------------------------------------------------------------------
+# MAINTIEN À CHAUD
+# --------------------------------------------------------------------------------
+
+def _parse_range(spec: str, low: int, high: int):
+    """
+    "8-19" -> (8, 19) ; "" -> None.
+
+    Raises:
+        ValueError: Si la plage n'est pas "début-fin" avec low <= début <= fin <= high
+    """
+    if not spec or not spec.strip():
+        return None
+    start, _, end = spec.partition("-")
+    try:
+        bounds = int(start), int(end) if end else int(start)
+    except ValueError:
+        raise ValueError(f"Plage invalide : « {spec} » (attendu : début-fin)") from None
+    if not low <= bounds[0] <= bounds[1] <= high:
+        raise ValueError(f"Plage invalide : « {spec} » (bornes entre {low} et {high})")
+    return bounds
+
+def keep_warm_ranges(hours=None, days=None):
+    """
+    Plages horaire et de jours du maintien à chaud ((début, fin) ou None).
+
+    Raises:
+        ValueError: Si OLLAMA_KEEP_WARM_HOURS ou OLLAMA_KEEP_WARM_DAYS est invalide
+    """
+    hour_range = _parse_range(shared.OLLAMA_KEEP_WARM_HOURS if hours is None else hours, 0, 24)
+    day_range = _parse_range(shared.OLLAMA_KEEP_WARM_DAYS if days is None else days, 0, 6)
+    return hour_range, day_range
+
+def in_keep_warm_window(now=None, hours=None, days=None) -> bool:
+    """
+    Indique si le maintien à chaud est actif à cet instant.
+    Heures : début inclus, fin exclue ("8-19" = de 8h00 à 18h59).
+    Jours : bornes incluses, 0 = lundi ("0-4" = du lundi au vendredi).
+    """
+    hour_range, day_range = keep_warm_ranges(hours, days)
+    if hour_range is None:
+        return False
+    now = now or datetime.now()
+    if day_range is not None and not day_range[0] <= now.weekday() <= day_range[1]:
+        return False
+    return hour_range[0] <= now.hour < hour_range[1]
+
+def pause_keep_warm():
+    """Suspend le maintien à chaud jusqu'au lendemain (déchargement demandé)."""
+    try:
+        os.makedirs(os.path.dirname(KEEP_WARM_PAUSE_PATH), exist_ok=True)
+        with open(KEEP_WARM_PAUSE_PATH, "w", encoding="utf-8") as f:
+            f.write(date.today().isoformat())
+    except OSError as e:
+        logger.warning("Suspension du maintien à chaud impossible", extra={"error": str(e)})
+
+def resume_keep_warm():
+    """Reprend le maintien à chaud (préchargement demandé)."""
+    try:
+        os.remove(KEEP_WARM_PAUSE_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Reprise du maintien à chaud impossible", extra={"error": str(e)})
+
+def keep_warm_paused() -> bool:
+    """Maintien à chaud suspendu aujourd'hui (par n'importe quel worker)."""
+    try:
+        with open(KEEP_WARM_PAUSE_PATH, encoding="utf-8") as f:
+            return f.read().strip() == date.today().isoformat()
+    except OSError:
+        return False
+
+# Fichier verrouillé par ce processus, gardé ouvert tant qu'il vit
+_lock_file = None
+
+def _try_lead() -> bool:
+    """Obtient (sans attendre) le rôle de worker chargé du préchargement."""
+    global _lock_file
+    if _lock_file is not None or fcntl is None:
+        return True
+    try:
+        os.makedirs(os.path.dirname(WARMUP_LOCK_PATH), exist_ok=True)
+        lock_file = open(WARMUP_LOCK_PATH, "a")
+    except OSError as e:
+        logger.error("Verrou de préchargement inaccessible", extra={"error": str(e)})
+        return False
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+def _preload(message):
+    """Précharge le modèle sur tous les serveurs et journalise chaque résultat."""
+    for result in preload_all():
+        if result["success"]:
+            logger.info(message, extra={
+                "backend": result["url"], "model": shared.MODEL_NAME, "load_s": round(result["value"], 3)
+            })
+        else:
+            logger.warning("Échec du préchargement", extra={"backend": result["url"], "error": result["error"]})
+
+def _warmup_loop(keep_warm: bool):
+    """
+    Préchargement au démarrage, puis rappels pendant la plage de maintien,
+    dans le seul worker qui détient le verrou.
+    """
+    interval = shared.OLLAMA_KEEP_WARM_INTERVAL
+    while not _try_lead():
+        if not keep_warm:
+            return  # Préchargement déjà assuré par un autre worker
+        # Relais si le worker qui détient le verrou disparaît
+        time.sleep(interval)
+    logger.info("Préchargement du modèle assuré par ce worker", extra={"pid": os.getpid()})
+
+    try:
+        if shared.OLLAMA_WARMUP:
+            _preload("Modèle préchargé")
+    except Exception:
+        logger.exception("Erreur du préchargement")
+    if not keep_warm:
+        return
+    while True:
+        time.sleep(interval)
+        try:
+            if in_keep_warm_window() and not keep_warm_paused():
+                _preload("Modèle maintenu en mémoire")
+        except Exception:
+            logger.exception("Erreur du maintien à chaud")
+
+_started = False
+_started_lock = threading.Lock()
+
+def start_warmup():
+    """
+    Démarre le préchargement en arrière-plan (une seule fois par processus,
+    exécuté par un seul worker : voir _warmup_loop).
+    """
+    global _started
+    if not shared.OLLAMA_URL:
+        return
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+
+    keep_warm = False
+    if shared.OLLAMA_KEEP_WARM_HOURS and shared.OLLAMA_KEEP_WARM_INTERVAL > 0:
+        try:
+            keep_warm_ranges()
+            keep_warm = True
+        except ValueError as e:
+            logger.error("Maintien à chaud désactivé", extra={
+                "error": str(e),
+                "hours": shared.OLLAMA_KEEP_WARM_HOURS,
+                "days": shared.OLLAMA_KEEP_WARM_DAYS
+            })
+    if not shared.OLLAMA_WARMUP and not keep_warm:
+        return
+    threading.Thread(target=_warmup_loop, args=(keep_warm,), name="ollama-warmup", daemon=True).start()
+
+def _reset_warmup():
+    """
+    Après un fork, chaque worker peut relancer le préchargement ; le verrou
+    éventuellement hérité reste celui du parent.
+    """
+    global _started, _started_lock, _lock_file
+    _started = False
+    _started_lock = threading.Lock()
+    _lock_file = None
+
+os.register_at_fork(after_in_child=_reset_warmup)
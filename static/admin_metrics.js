@@ -0,0 +1,65 @@
+/**
+ * Latence des générations
+ * Ce module affiche, depuis la page d'administration, les percentiles
+ * mesurés sur tous les workers (voir /admin/metrics) :
+ * - Attente dans la file, premier token et durée totale (p50 / p95 / p99)
+ * - Débit de génération (tokens/s)
+ */
+
+/**
+ * Formate un triplet de percentiles en secondes
+ * @param {Object} values - {p50, p95, p99}
+ * @returns {string}
+ */
+function formatPercentiles(values) {
+    return ['p50', 'p95', 'p99']
+        .map(p => values[p] === null ? '–' : `${values[p].toFixed(2)} s`)
+        .join(' / ');
+}
+
+/**
+ * Affiche les percentiles par type d'email et par modèle
+ * @param {Object} data - Réponse de /admin/metrics
+ */
+function renderMetrics(data) {
+    const body = document.getElementById('metrics-body');
+    body.innerHTML = '';
+    if (!data.generations.length) {
+        const row = body.insertRow();
+        const cell = row.insertCell();
+        cell.colSpan = 7;
+        cell.textContent = 'Aucune génération sur la période';
+        return;
+    }
+    data.generations.forEach(function(entry) {
+        const row = body.insertRow();
+        const rate = entry.tokens_per_second.p50;
+        const failures = entry.errors || entry.cancelled
+            ? ` (${entry.errors} erreur(s), ${entry.cancelled} annulée(s))`
+            : '';
+        [
+            entry.type,
+            entry.model,
+            `${entry.count}${failures}`,
+            formatPercentiles(entry.queue),
+            formatPercentiles(entry.ttft),
+            formatPercentiles(entry.total),
+            rate === null ? '–' : rate.toFixed(1)
+        ].forEach(function(text) {
+            row.insertCell().textContent = text;
+        });
+    });
+}
+
+/**
+ * Récupère les percentiles auprès du serveur pour la période choisie
+ */
+function refreshMetrics() {
+    const period = document.getElementById('metrics-window').value;
+    fetch(`/admin/metrics?window=${period}`)
+        .then(res => res.json())
+        .then(renderMetrics)
+        .catch(err => showMessage(err, 'error'));
+}
+
+refreshMetrics();
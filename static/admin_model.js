@@ -0,0 +1,65 @@
+/**
+ * Gestion du chargement du modèle sur les serveurs Ollama
+ * Ce module affiche et pilote l'état du modèle depuis la page d'administration :
+ * - Résidence en mémoire sur chaque serveur et expiration
+ * - Nombre de chargements à froid observés
+ * - Préchargement et déchargement à la demande
+ */
+
+/**
+ * Affiche l'état du modèle pour chaque serveur
+ * @param {Object} status - Réponse de /admin/model
+ */
+function renderModelStatus(status) {
+    const list = document.getElementById('model-status');
+    list.innerHTML = '';
+    if (!status.backends.length) {
+        list.innerHTML = '<li>Aucun serveur Ollama configuré</li>';
+        return;
+    }
+    status.backends.forEach(function(backend) {
+        const li = document.createElement('li');
+        let state = 'état inconnu';
+        if (backend.model_resident === true) state = '🟢 chargé';
+        if (backend.model_resident === false) state = '⚪ non chargé';
+        const until = backend.resident_until ? ` jusqu'à ${new Date(backend.resident_until).toLocaleTimeString()}` : '';
+        li.textContent = `${backend.url} : ${status.model} ${state}${until} — chargements à froid : ${backend.cold_loads}`;
+        list.appendChild(li);
+    });
+}
+
+/**
+ * Récupère l'état du modèle auprès du serveur
+ */
+function refreshModelStatus() {
+    fetch('/admin/model')
+        .then(res => res.json())
+        .then(renderModelStatus)
+        .catch(err => showMessage(err, 'error'));
+}
+
+/**
+ * Envoie une action (préchargement ou déchargement) puis actualise l'état
+ * @param {string} url - Endpoint de l'action
+ */
+function modelAction(url) {
+    fetch(url, { method: 'POST' })
+        .then(res => res.json())
+        .then(data => {
+            showMessage(data.message, data.success ? 'success' : 'error');
+            refreshModelStatus();
+        })
+        .catch(err => showMessage(err, 'error'));
+}
+
+function preloadModel() {
+    modelAction('/admin/model/preload');
+}
+
+function unloadModel() {
+    if (confirm('Décharger le modèle ? La prochaine génération subira son chargement.')) {
+        modelAction('/admin/model/unload');
+    }
+}
+
+refreshModelStatus();
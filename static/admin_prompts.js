@@ -4,13 +4,24 @@
  * - Création et suppression des types d'emails
  * - Gestion des champs de formulaire pour chaque type
  * - Édition des prompts associés à chaque type
+ * - Édition des options de génération (limite de tokens, séquences d'arrêt...)
  * - Mise à jour en temps réel de l'interface
+ *
+ * Les modifications sont appliquées localement puis mises en attente : le
+ * bouton « Enregistrer les modifications » les envoie toutes en une seule
+ * requête PATCH /admin/prompts (opérations de type JSON Patch). L'en-tête
+ * If-Match porte l'ETag de la version éditée : si un autre administrateur a
+ * enregistré entre-temps, le serveur refuse (412) au lieu d'écraser.
  */
 
 // Données initiales stockées en mémoire
 // Ces données sont injectées par le template et mises à jour dynamiquement
 let currentType = null;
 
+// Modifications en attente (opérations JSON Patch) et dernière version enregistrée
+let pendingOps = [];
+let savedData = null;
+
 /**
  * Gestion du sélecteur de type d'email
  * - Met à jour le type courant
@@ -28,6 +39,14 @@ document.getElementById('type-select').addEventListener('change', function(e) {
     }
 });
 
+// Avertit avant de quitter la page avec des modifications non enregistrées
+window.addEventListener('beforeunload', function(e) {
+    if (pendingOps.length) {
+        e.preventDefault();
+        e.returnValue = '';
+    }
+});
+
 /**
  * Affiche les données d'un type d'email sélectionné
  * @param {string} type - Le nom du type à afficher
@@ -47,6 +66,160 @@ function showTypeData(type) {
     // Affiche le prompt
     document.getElementById('prompt-text').value = promptsData.prompts[type];
     document.getElementById('prompt-container').style.display = 'block';
+
+    // Affiche les options de génération
+    showOptions((promptsData.options || {})[type] || {});
+    document.getElementById('options-container').style.display = 'block';
+}
+
+/**
+ * Remplit le formulaire des options de génération
+ * @param {Object} options - Options du type (clés absentes = valeur par défaut du modèle)
+ */
+function showOptions(options) {
+    ['num_predict', 'num_ctx', 'temperature', 'keep_alive', 'model'].forEach(function(name) {
+        document.getElementById(`opt-${name}`).value = options[name] ?? '';
+    });
+    document.getElementById('opt-stop').value = (options.stop || []).join('\n');
+}
+
+/**
+ * Réaffiche le sélecteur de types et le type courant à partir de promptsData
+ * (après un enregistrement, une annulation ou un conflit)
+ */
+function renderTypes() {
+    const select = document.getElementById('type-select');
+    select.querySelectorAll('option:not([value=""])').forEach(option => option.remove());
+    promptsData.types.forEach(function(type) {
+        const option = document.createElement('option');
+        option.value = type;
+        option.textContent = type;
+        select.appendChild(option);
+    });
+
+    if (currentType && promptsData.types.includes(currentType)) {
+        select.value = currentType;
+        showTypeData(currentType);
+    } else {
+        currentType = null;
+        select.value = '';
+        hideAllContainers();
+        document.getElementById('delete-type-btn').style.display = 'none';
+    }
+}
+
+/**
+ * Modifications en attente
+ * Fonctions pour appliquer localement, envoyer ou annuler les opérations
+ */
+
+/**
+ * Construit un pointeur JSON (RFC 6901) à partir de ses clés
+ * @param {...(string|number)} keys - Clés successives ("~" et "/" sont échappés)
+ * @returns {string} - Le chemin, ex. "/form_fields/Devis/2"
+ */
+function pointer(...keys) {
+    return keys.map(key => '/' + String(key).replace(/~/g, '~0').replace(/\//g, '~1')).join('');
+}
+
+/**
+ * Applique une opération add / remove / replace à un document (modifié sur place)
+ * @param {Object} doc - Le document
+ * @param {Object} operation - L'opération, construite par ce module
+ */
+function applyOperation(doc, operation) {
+    const keys = operation.path.slice(1).split('/').map(k => k.replace(/~1/g, '/').replace(/~0/g, '~'));
+    const last = keys.pop();
+    const parent = keys.reduce((node, key) => node[key], doc);
+    const value = operation.value === undefined ? undefined : structuredClone(operation.value);
+
+    if (Array.isArray(parent)) {
+        const index = last === '-' ? parent.length : Number(last);
+        if (operation.op === 'remove') parent.splice(index, 1);
+        else if (operation.op === 'replace') parent[index] = value;
+        else parent.splice(index, 0, value);
+    } else if (operation.op === 'remove') {
+        delete parent[last];
+    } else {
+        parent[last] = value;
+    }
+}
+
+/**
+ * Met des opérations en attente après les avoir appliquées aux données affichées
+ * @param {Object[]} operations - Opérations de type JSON Patch
+ */
+function queueOperations(operations) {
+    if (!savedData) savedData = structuredClone(promptsData);
+    operations.forEach(operation => applyOperation(promptsData, operation));
+    pendingOps.push(...operations);
+    updatePendingBar();
+}
+
+/**
+ * Affiche le nombre de modifications en attente et les boutons associés
+ */
+function updatePendingBar() {
+    const bar = document.getElementById('pending-bar');
+    bar.style.display = pendingOps.length ? 'block' : 'none';
+    document.getElementById('pending-count').textContent =
+        `${pendingOps.length} modification(s) non enregistrée(s)`;
+}
+
+/**
+ * Repart d'une version enregistrée (sans modification en attente)
+ * @param {Object} data - Configuration renvoyée par le serveur
+ * @param {string|null} etag - ETag de cette version
+ */
+function resetPromptsData(data, etag) {
+    savedData = structuredClone(data);
+    window.promptsData = structuredClone(data);
+    if (etag) promptsEtag = etag;
+    pendingOps = [];
+    updatePendingBar();
+    renderTypes();
+}
+
+/**
+ * Envoie toutes les modifications en attente en une seule requête
+ * - 200 : nouvelle version enregistrée (données normalisées par le serveur)
+ * - 412 : version dépassée, les modifications sont abandonnées
+ * - autre : modifications refusées, elles restent en attente pour correction
+ */
+function savePendingChanges() {
+    if (!pendingOps.length) return;
+
+    fetch('/admin/prompts', {
+        method: 'PATCH',
+        headers: {
+            'Content-Type': 'application/json-patch+json',
+            'If-Match': promptsEtag
+        },
+        body: JSON.stringify(pendingOps)
+    })
+        .then(res => res.json().then(data => ({ res, data })))
+        .then(({ res, data }) => {
+            if (data.success) {
+                showMessage(data.message, 'success');
+                resetPromptsData(data.prompts, res.headers.get('ETag'));
+            } else if (res.status === 412 && data.prompts) {
+                showMessage(data.message, 'error');
+                resetPromptsData(data.prompts, res.headers.get('ETag'));
+            } else {
+                showMessage(data.message, 'error');
+            }
+        })
+        .catch(err => showMessage(err, 'error'));
+}
+
+/**
+ * Abandonne les modifications en attente (retour à la dernière version enregistrée)
+ */
+function discardPendingChanges() {
+    if (!pendingOps.length || !confirm('Abandonner les modifications non enregistrées ?')) {
+        return;
+    }
+    resetPromptsData(savedData, null);
 }
 
 /**
@@ -71,8 +244,7 @@ function hideAddTypeForm() {
 /**
  * Ajoute un nouveau type d'email
  * - Vérifie les données saisies
- * - Envoie la requête au serveur
- * - Met à jour l'interface et les données en mémoire
+ * - Met l'ajout en attente
  * - Sélectionne automatiquement le nouveau type
  */
 function addType() {
@@ -81,35 +253,22 @@ function addType() {
         showMessage('Le nom du type est requis', 'error');
         return;
     }
+    if (promptsData.types.includes(typeName)) {
+        showMessage('Ce type existe déjà', 'error');
+        return;
+    }
 
-    const data = new URLSearchParams({ type_name: typeName });
-    fetch('/admin/type/add', { method: 'POST', body: data })
-        .then(res => res.json())
-        .then(data => {
-            if (data.success) {
-                showMessage(data.message, 'success');
-                hideAddTypeForm();
-                
-                // Ajoute le nouveau type au menu déroulant
-                const select = document.getElementById('type-select');
-                const option = document.createElement('option');
-                option.value = typeName;
-                option.textContent = typeName;
-                select.appendChild(option);
-                
-                // Met à jour les données en mémoire
-                promptsData.types.push(typeName);
-                promptsData.form_fields[typeName] = [];
-                promptsData.prompts[typeName] = "";
-                
-                // Sélectionne le nouveau type
-                select.value = typeName;
-                showTypeData(typeName);
-            } else {
-                showMessage(data.message, 'error');
-            }
-        })
-        .catch(err => showMessage(err, 'error'));
+    queueOperations([
+        { op: 'add', path: pointer('types', '-'), value: typeName },
+        { op: 'add', path: pointer('form_fields', typeName), value: [] },
+        { op: 'add', path: pointer('prompts', typeName), value: '' }
+    ]);
+    hideAddTypeForm();
+
+    // Sélectionne le nouveau type
+    currentType = typeName;
+    renderTypes();
+    document.getElementById('delete-type-btn').style.display = 'inline-block';
 }
 
 /**
@@ -134,89 +293,58 @@ function hideAddFieldForm() {
 /**
  * Ajoute un nouveau champ au type courant
  * - Vérifie les données saisies
- * - Envoie la requête au serveur
- * - Met à jour l'interface et les données en mémoire
+ * - Met l'ajout en attente et met à jour l'affichage
  */
 function addField() {
     const fieldId = document.getElementById('field-id').value.trim();
     const fieldLabel = document.getElementById('field-label').value.trim();
-    
+
     if (!fieldId || !fieldLabel) {
         showMessage('Tous les champs sont requis', 'error');
         return;
     }
+    if (promptsData.form_fields[currentType].some(f => f.id === fieldId)) {
+        showMessage('Cet ID est déjà utilisé', 'error');
+        return;
+    }
 
-    const data = new URLSearchParams({
-        type_name: currentType,
-        field_id: fieldId,
-        field_label: fieldLabel,
-        field_type: 'text'
-    });
+    const newField = {
+        id: fieldId,
+        label: fieldLabel,
+        type: 'text'
+    };
+    queueOperations([
+        { op: 'add', path: pointer('form_fields', currentType, '-'), value: newField }
+    ]);
+    hideAddFieldForm();
 
-    fetch('/admin/field/add', { method: 'POST', body: data })
-        .then(res => res.json())
-        .then(data => {
-            if (data.success) {
-                showMessage(data.message, 'success');
-                hideAddFieldForm();
-                
-                // Ajoute le nouveau champ à la liste
-                const newField = {
-                    id: fieldId,
-                    label: fieldLabel,
-                    type: 'text'
-                };
-                promptsData.form_fields[currentType].push(newField);
-                
-                // Met à jour l'affichage
-                const fieldList = document.getElementById('field-list');
-                fieldList.appendChild(createFieldElement(newField));
-            } else {
-                showMessage(data.message, 'error');
-            }
-        })
-        .catch(err => showMessage(err, 'error'));
+    // Met à jour l'affichage
+    document.getElementById('field-list').appendChild(createFieldElement(newField));
 }
 
 /**
  * Supprime un champ du type courant
  * @param {string} fieldId - L'identifiant du champ à supprimer
  * - Demande confirmation
- * - Envoie la requête au serveur
- * - Met à jour l'interface et les données en mémoire
+ * - Met la suppression en attente et met à jour l'affichage
  */
 function deleteField(fieldId) {
     if (!confirmDelete('Êtes-vous sûr de vouloir supprimer ce champ ?')) {
         return;
     }
 
-    const data = new URLSearchParams({
-        type_name: currentType,
-        field_id: fieldId
-    });
+    const index = promptsData.form_fields[currentType].findIndex(f => f.id === fieldId);
+    if (index < 0) return;
+    queueOperations([
+        { op: 'remove', path: pointer('form_fields', currentType, index) }
+    ]);
 
-    fetch('/admin/field/delete', { method: 'POST', body: data })
-        .then(res => res.json())
-        .then(data => {
-            if (data.success) {
-                showMessage(data.message, 'success');
-                
-                // Supprime le champ des données en mémoire
-                promptsData.form_fields[currentType] = promptsData.form_fields[currentType].filter(
-                    f => f.id !== fieldId
-                );
-                
-                // Met à jour l'affichage
-                const fieldList = document.getElementById('field-list');
-                const fieldElement = fieldList.querySelector(`[data-field-id="${fieldId}"]`);
-                if (fieldElement) {
-                    fieldElement.remove();
-                }
-            } else {
-                showMessage(data.message, 'error');
-            }
-        })
-        .catch(err => showMessage(err, 'error'));
+    // Met à jour l'affichage
+    const fieldList = document.getElementById('field-list');
+    const fieldElement = fieldList.querySelector(`[data-field-id="${fieldId}"]`);
+    if (fieldElement) {
+        fieldElement.remove();
+    }
 }
 
 /**
@@ -227,8 +355,7 @@ function deleteField(fieldId) {
 /**
  * Met à jour le prompt du type courant
  * - Vérifie que le prompt n'est pas vide
- * - Envoie la requête au serveur
- * - Met à jour les données en mémoire
+ * - Met la modification en attente
  */
 function updatePrompt() {
     const promptText = document.getElementById('prompt-text').value.trim();
@@ -236,66 +363,63 @@ function updatePrompt() {
         showMessage('Le prompt ne peut pas être vide', 'error');
         return;
     }
+    if (promptText === promptsData.prompts[currentType]) return;
 
-    const data = new URLSearchParams({
-        type_name: currentType,
-        prompt_text: promptText
+    queueOperations([
+        { op: 'replace', path: pointer('prompts', currentType), value: promptText }
+    ]);
+}
+
+/**
+ * Met à jour les options de génération du type courant
+ * - Met en attente les valeurs saisies (champ vide = option retirée),
+ *   validées et normalisées par le serveur à l'enregistrement
+ */
+function updateOptions() {
+    const options = {};
+    ['num_predict', 'num_ctx', 'temperature', 'keep_alive', 'model'].forEach(function(name) {
+        const value = document.getElementById(`opt-${name}`).value.trim();
+        if (value) options[name] = value;
     });
+    const stop = document.getElementById('opt-stop').value.split('\n').filter(line => line.trim());
+    if (stop.length) options.stop = stop;
 
-    fetch('/admin/prompt/update', { method: 'POST', body: data })
-        .then(res => res.json())
-        .then(data => {
-            if (data.success) {
-                showMessage(data.message, 'success');
-            } else {
-                showMessage(data.message, 'error');
-            }
-        })
-        .catch(err => showMessage(err, 'error'));
+    if (Object.keys(options).length) {
+        const operations = [{ op: 'add', path: pointer('options', currentType), value: options }];
+        if (!promptsData.options) {
+            operations.unshift({ op: 'add', path: pointer('options'), value: {} });
+        }
+        queueOperations(operations);
+    } else if ((promptsData.options || {})[currentType]) {
+        queueOperations([{ op: 'remove', path: pointer('options', currentType) }]);
+    }
 }
 
 /**
  * Supprime le type d'email courant
  * - Vérifie qu'un type est sélectionné
  * - Demande confirmation
- * - Envoie la requête au serveur
- * - Met à jour l'interface et les données en mémoire
+ * - Met la suppression du type et de ses données en attente
  * - Réinitialise l'interface
  */
 function deleteCurrentType() {
     if (!currentType) return;
-    
-    if (!confirmDelete(`Êtes-vous sûr de vouloir supprimer le type "${currentType}" ? Cette action est irréversible.`)) {
+
+    if (!confirmDelete(`Êtes-vous sûr de vouloir supprimer le type "${currentType}" ?`)) {
         return;
     }
 
-    const data = new URLSearchParams({ type_name: currentType });
-    fetch('/admin/type/delete', { method: 'POST', body: data })
-        .then(res => res.json())
-        .then(data => {
-            if (data.success) {
-                showMessage(data.message, 'success');
-                
-                // Supprime le type des données en mémoire
-                promptsData.types = promptsData.types.filter(t => t !== currentType);
-                delete promptsData.form_fields[currentType];
-                delete promptsData.prompts[currentType];
-                
-                // Met à jour l'interface
-                const select = document.getElementById('type-select');
-                const option = select.querySelector(`option[value="${currentType}"]`);
-                if (option) {
-                    option.remove();
-                }
-                
-                // Réinitialise l'interface
-                currentType = null;
-                select.value = '';
-                hideAllContainers();
-                document.getElementById('delete-type-btn').style.display = 'none';
-            } else {
-                showMessage(data.message, 'error');
-            }
-        })
-        .catch(err => showMessage(err, 'error'));
-} 
\ No newline at end of file
+    const operations = [
+        { op: 'remove', path: pointer('types', promptsData.types.indexOf(currentType)) },
+        { op: 'remove', path: pointer('form_fields', currentType) },
+        { op: 'remove', path: pointer('prompts', currentType) }
+    ];
+    if ((promptsData.options || {})[currentType]) {
+        operations.push({ op: 'remove', path: pointer('options', currentType) });
+    }
+    queueOperations(operations);
+
+    // Réinitialise l'interface
+    currentType = null;
+    renderTypes();
+}
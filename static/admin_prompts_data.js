@@ -25,10 +25,12 @@
  * Initialise les données des prompts dans l'objet window
  * Cette fonction est appelée par le template Jinja2 avec les données
  * @param {Object} data - Les données des prompts structurées comme décrit ci-dessus
+ * @param {string} etag - ETag de la version affichée (en-tête If-Match des modifications)
  */
-function initPromptsData(data) {
+function initPromptsData(data, etag) {
     window.promptsData = data;
+    window.promptsEtag = etag;
 }
 
 // Les données seront injectées par le template
-// initPromptsData({{ prompts_data|tojson|safe }}); 
\ No newline at end of file
+// initPromptsData({{ prompts_data|tojson|safe }}, {{ prompts_etag|tojson|safe }}); 
\ No newline at end of file
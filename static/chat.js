@@ -38,7 +38,7 @@ document.addEventListener("DOMContentLoaded", () => {
    * - Gère les erreurs de manière silencieuse
    */
   function reloadEmailTypes() {
-    return fetch("/get_types")
+    return fetch("/types")
       .then(res => res.json())
       .then(data => {
         const form = document.getElementById("dynamic-form");
@@ -133,9 +133,326 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  /**
+   * Lit la réponse du serveur, qu'elle soit diffusée en NDJSON ou en JSON
+   * @param {Response} res - La réponse renvoyée par fetch
+   * @param {Function} onToken - Appelée pour chaque fragment reçu en streaming
+   * @param {Function} onVariant - Appelée pour chaque fragment d'une version (optionnel)
+   * @returns {Promise<Object>} - Le message final (bot, end, fields...)
+   * - Découpe le flux ligne par ligne au fil de la réception
+   * - Transmet les lignes {"token": ...} à onToken
+   * - Transmet les lignes {"variant": i, "token": ...} à onVariant
+   * - Affiche la position dans la file pour les lignes {"queue": ...}
+   * - Retourne la dernière ligne qui n'est pas un fragment
+   */
+  async function readResponse(res, onToken, onVariant) {
+    const contentType = res.headers.get("Content-Type") || "";
+    if (!contentType.includes("application/x-ndjson") || !res.body) {
+      return res.json();
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let last = {};
+
+    const handleLine = line => {
+      if (!line.trim()) return;
+      const event = JSON.parse(line);
+      if (event.variant !== undefined) {
+        if (onVariant) onVariant(event.variant, event.token);
+      } else if (typeof event.variants === "number") {
+        // Annonce du nombre de versions en début de flux
+      } else if (event.token !== undefined) {
+        onToken(event.token);
+      } else if (event.queue !== undefined) {
+        UI.showQueuePosition(event.queue);
+      } else {
+        last = event;
+      }
+    };
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let index;
+      while ((index = buffer.indexOf("\n")) >= 0) {
+        handleLine(buffer.slice(0, index));
+        buffer = buffer.slice(index + 1);
+      }
+    }
+    handleLine(buffer + decoder.decode());
+    return last;
+  }
+
+  /**
+   * Envoie une requête de génération avec une clé d'idempotence
+   * @param {string} url - La route appelée (/message, /regen)
+   * @param {Object} options - Les options de fetch
+   * @returns {Promise<Response>} - La réponse du serveur
+   * - Une clé unique (Idempotency-Key) est générée pour chaque demande
+   * - En cas d'échec réseau, la requête est renvoyée une fois avec la même clé :
+   *   le serveur renvoie alors le résultat de la première au lieu de regénérer
+   */
+  function fetchIdempotent(url, options = {}) {
+    const key = window.crypto && crypto.randomUUID
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    const send = () => fetch(url, {
+      ...options,
+      headers: { ...(options.headers || {}), "Idempotency-Key": key }
+    });
+    return send().catch(err => {
+      if (!(err instanceof TypeError)) throw err;
+      return send();
+    });
+  }
+
+  /**
+   * Prépare l'affichage progressif d'une réponse du bot
+   * @param {Function} onStart - Appelée avant le premier fragment (optionnel)
+   * @returns {Object} - onToken, finish et started
+   * - Crée la bulle du bot au premier fragment reçu
+   * - Masque l'indicateur de chargement dès le premier token
+   * - Remplace le texte par la version finale (nettoyée) à la fin du flux
+   */
+  function createStreamTarget(onStart) {
+    let msg = null;
+    return {
+      onToken(token) {
+        if (!msg) {
+          UI.showLoading(false);
+          if (onStart) onStart();
+          msg = UI.appendMessage("", "bot");
+        }
+        UI.appendToMessage(msg, token);
+      },
+      finish(text) {
+        if (msg) {
+          msg.textContent = text;
+        } else {
+          UI.appendMessage(text, "bot");
+        }
+      },
+      started() {
+        return msg !== null;
+      }
+    };
+  }
+
+  /**
+   * Prépare l'affichage côte à côte de plusieurs versions
+   * @param {number} count - Nombre de versions demandées
+   * @returns {Object} - onVariant et finish
+   * - Crée une colonne par version au premier fragment reçu
+   * - Remplace chaque colonne par la version finale (nettoyée) à la fin
+   */
+  function createVariantsTarget(count) {
+    let columns = null;
+    const create = () => {
+      UI.showLoading(false);
+      const container = document.createElement("div");
+      container.className = "variants";
+      columns = [];
+      for (let i = 0; i < count; i++) {
+        const msg = document.createElement("div");
+        msg.className = "message bot";
+        container.appendChild(msg);
+        columns.push(msg);
+      }
+      chatBox.appendChild(container);
+    };
+    return {
+      onVariant(index, token) {
+        if (!columns) create();
+        if (columns[index]) UI.appendToMessage(columns[index], token);
+      },
+      finish(res) {
+        if (!res.variants) {
+          UI.appendMessage(res.bot, "bot");
+          return;
+        }
+        if (!columns) create();
+        res.variants.forEach((text, i) => {
+          if (!columns[i]) return;
+          columns[i].textContent = text
+            || (res.errors && res.errors[i] ? "❌ Version indisponible." : "");
+        });
+        chatBox.scrollTop = chatBox.scrollHeight;
+      }
+    };
+  }
+
+  // Requête de génération en cours (AbortController), null sinon
+  let activeGeneration = null;
+
+  // Dernier document affiché (point de départ des retouches)
+  let lastDraft = null;
+
+  /**
+   * Affiche le bouton "Arrêter" pendant une génération
+   * @returns {AbortController} - À transmettre à fetch (signal)
+   * - Demande au serveur d'annuler la génération (POST /cancel) :
+   *   le flux se termine alors par le texte partiel
+   * - Sans fin du flux après 3 secondes, la requête est abandonnée
+   *   (la déconnexion arrête aussi la génération côté serveur)
+   */
+  function startGeneration() {
+    const controller = new AbortController();
+    activeGeneration = controller;
+    headerActions.innerHTML = "";
+
+    const btnStop = document.createElement("button");
+    btnStop.textContent = "Arrêter";
+    btnStop.onclick = () => {
+      btnStop.disabled = true;
+      fetch("/cancel", { method: "POST" })
+        .catch(console.error)
+        .finally(() => {
+          setTimeout(() => {
+            if (activeGeneration === controller) controller.abort();
+          }, 3000);
+        });
+    };
+    headerActions.appendChild(btnStop);
+    return controller;
+  }
+
+  /**
+   * Retire le bouton "Arrêter" une fois la génération terminée
+   */
+  function endGeneration() {
+    if (activeGeneration) {
+      headerActions.innerHTML = "";
+      activeGeneration = null;
+    }
+  }
+
+  /**
+   * Termine l'affichage d'une génération (complète ou annulée)
+   * @param {Object} res - Le message final du serveur
+   * @param {Object} stream - La cible d'affichage progressif
+   * @param {Object} variants - La cible des versions multiples (optionnel)
+   */
+  function finishGeneration(res, stream, variants) {
+    endGeneration();
+    if (res.end && !res.error && !res.cancelled && res.bot) {
+      lastDraft = res.bot;
+    }
+    if (res.variants && variants) {
+      variants.finish(res);
+    } else {
+      stream.finish(res.bot);
+    }
+    if (res.cancelled) {
+      UI.appendMessage("⏹ Génération interrompue.", "bot");
+    }
+  }
+
+  /**
+   * Affiche l'abandon d'une génération (requête annulée côté navigateur)
+   * @param {Error} err - L'erreur renvoyée par fetch
+   * @returns {boolean} - true si l'erreur correspond à un abandon
+   */
+  function handleAbort(err) {
+    if (!err || err.name !== "AbortError") return false;
+    endGeneration();
+    UI.appendMessage("⏹ Génération interrompue.", "bot");
+    renderPostGenerationOptions();
+    return true;
+  }
+
+  // Fermeture de l'onglet : la génération en cours est annulée côté serveur
+  window.addEventListener("pagehide", () => {
+    if (activeGeneration && navigator.sendBeacon) {
+      navigator.sendBeacon("/cancel");
+    }
+  });
+
+  /**
+   * Régénère le document (une ou plusieurs versions)
+   * @param {number} count - Nombre de versions (1 pour une régénération simple)
+   * - Les versions multiples sont affichées côte à côte (/regen?n=...)
+   */
+  function regenerate(count) {
+    const controller = startGeneration();
+    UI.showLoading(true);
+
+    const title = count > 1
+      ? `🔁 ${count} nouvelles versions générées :`
+      : "🔁 Nouvelle version générée :";
+    let announced = false;
+    const announce = () => {
+      if (!announced) UI.appendMessage(title, "bot");
+      announced = true;
+    };
+    const stream = createStreamTarget(announce);
+    const variants = createVariantsTarget(count);
+
+    fetchIdempotent(count > 1 ? `/regen?n=${count}` : "/regen", {
+      headers: { "Accept": "application/x-ndjson" },
+      signal: controller.signal
+    })
+      .then(res => readResponse(res, stream.onToken, (index, token) => {
+        announce();
+        variants.onVariant(index, token);
+      }))
+      .then(res => {
+        announce();
+        finishGeneration(res, stream, variants);
+        renderPostGenerationOptions();
+      })
+      .catch(err => {
+        if (handleAbort(err)) return;
+        endGeneration();
+        UI.appendMessage("❌ Erreur de régénération.", "bot");
+      })
+      .finally(() => {
+        UI.showLoading(false);
+      });
+  }
+
+  /**
+   * Retouche le dernier document ("plus court", "plus formel")
+   * @param {string} instruction - La consigne de retouche
+   * - Le serveur reprend le contexte déjà évalué : seule la consigne est évaluée
+   * - Le document affiché est envoyé au cas où ce contexte n'existe plus
+   */
+  function editDocument(instruction) {
+    const controller = startGeneration();
+    UI.showLoading(true);
+    UI.appendMessage(instruction, "user");
+
+    const stream = createStreamTarget();
+
+    fetchIdempotent("/edit", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "Accept": "application/x-ndjson"
+      },
+      body: JSON.stringify({ instruction, draft: lastDraft }),
+      signal: controller.signal
+    })
+      .then(res => readResponse(res, stream.onToken))
+      .then(res => {
+        finishGeneration(res, stream);
+        renderPostGenerationOptions();
+      })
+      .catch(err => {
+        if (handleAbort(err)) return;
+        endGeneration();
+        UI.appendMessage("❌ Erreur lors de la retouche.", "bot");
+      })
+      .finally(() => {
+        UI.showLoading(false);
+      });
+  }
+
   /**
    * Ajoute les boutons d'action post-génération
-   * (Recommencer et Régénérer)
+   * (Recommencer, Régénérer, 3 versions et retouches)
    * - Crée les boutons avec leurs gestionnaires d'événements
    * - Gère les états de chargement
    * - Met à jour l'interface après chaque action
@@ -167,27 +484,22 @@ document.addEventListener("DOMContentLoaded", () => {
 
     const btnRegenerate = document.createElement("button");
     btnRegenerate.textContent = "Régénérer";
-    btnRegenerate.onclick = () => {
-      headerActions.innerHTML = "";
-      UI.showLoading(true);
+    btnRegenerate.onclick = () => regenerate(1);
 
-      fetch("/regen")
-        .then(res => res.json())
-        .then(res => {
-          UI.appendMessage("🔁 Nouvelle version générée :", "bot");
-          UI.appendMessage(res.bot, "bot");
-          renderPostGenerationOptions();
-        })
-        .catch(err => {
-          UI.appendMessage("❌ Erreur de régénération.", "bot");
-        })
-        .finally(() => {
-          UI.showLoading(false);
-        });
-    };
+    const btnVariants = document.createElement("button");
+    btnVariants.textContent = "3 versions";
+    btnVariants.onclick = () => regenerate(3);
 
     headerActions.appendChild(btnRestart);
     headerActions.appendChild(btnRegenerate);
+    headerActions.appendChild(btnVariants);
+
+    ["Plus court", "Plus formel"].forEach(label => {
+      const btnEdit = document.createElement("button");
+      btnEdit.textContent = label;
+      btnEdit.onclick = () => editDocument(label.toLowerCase());
+      headerActions.appendChild(btnEdit);
+    });
   }
 
   /**
@@ -206,17 +518,27 @@ document.addEventListener("DOMContentLoaded", () => {
     );
     Forms.clearForm();
 
-    fetch("/message", {
+    const stream = createStreamTarget();
+    const variants = createVariantsTarget(payload.n || 1);
+
+    // Seule l'étape des précisions lance la génération : elle peut être arrêtée
+    const controller = payload.details ? startGeneration() : null;
+
+    fetchIdempotent("/message", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(payload)
+      headers: {
+        "Content-Type": "application/json",
+        "Accept": "application/x-ndjson, application/json"
+      },
+      body: JSON.stringify(payload),
+      signal: controller ? controller.signal : undefined
     })
-    .then(res => res.json())
+    .then(res => readResponse(res, stream.onToken, variants.onVariant))
     .then(res => {
       UI.showLoading(false);
 
       const questions = res.fields;
-      UI.appendMessage(res.bot, "bot");
+      finishGeneration(res, stream, variants);
       if (questions) {
         Forms.renderForm(questions);
       } else if (res.end) {
@@ -224,8 +546,10 @@ document.addEventListener("DOMContentLoaded", () => {
       }
     })
     .catch(err => {
-      console.error(err);
       UI.showLoading(false);
+      if (handleAbort(err)) return;
+      endGeneration();
+      console.error(err);
       UI.appendMessage("Erreur réseau, veuillez réessayer.", "bot");
     });
   }
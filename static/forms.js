@@ -48,6 +48,29 @@ function renderForm(fields) {
     form.appendChild(document.createElement("br"));
   });
 
+  // Formulaire de détails (ni type, ni dest/obj) : dernière étape avant la génération
+  const isDetails = fields.length && !["type", "dest", "obj"].includes(fields[0].id);
+
+  // Nombre de versions générées en parallèle (affichées côte à côte)
+  let variants = null;
+  if (isDetails) {
+    const label = document.createElement("label");
+    label.htmlFor = "variants-count";
+    label.textContent = "Nombre de versions";
+    form.appendChild(label);
+
+    variants = document.createElement("select");
+    variants.id = "variants-count";
+    [1, 2, 3].forEach(n => {
+      const o = document.createElement("option");
+      o.value = n;
+      o.textContent = n;
+      variants.appendChild(o);
+    });
+    form.appendChild(variants);
+    form.appendChild(document.createElement("br"));
+  }
+
   const submit = document.createElement("button");
   submit.type = "submit";
   submit.textContent = "Envoyer";
@@ -62,9 +85,9 @@ function renderForm(fields) {
       data[f.id] = document.getElementById(f.id).value.trim();
     });
 
-    // Si c'est un formulaire de détails (ni type, ni dest/obj)
-    if (fields.length && !["type", "dest", "obj"].includes(fields[0].id)) {
-      Chat.sendData({ details: data });
+    if (isDetails) {
+      const count = parseInt(variants.value, 10);
+      Chat.sendData(count > 1 ? { details: data, n: count } : { details: data });
     } else {
       Chat.sendData(data);
     }
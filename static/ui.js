@@ -27,6 +27,7 @@ function createParticle() {
  * Ajoute un nouveau message dans la zone de chat
  * @param {string} text - Le contenu du message
  * @param {string} sender - L'expéditeur ('user' ou 'bot')
+ * @returns {HTMLElement} - L'élément du message (utile pour le streaming)
  */
 function appendMessage(text, sender) {
   const chatBox = document.getElementById("chat-box");
@@ -35,6 +36,18 @@ function appendMessage(text, sender) {
   msg.textContent = text;
   chatBox.appendChild(msg);
   chatBox.scrollTop = chatBox.scrollHeight;
+  return msg;
+}
+
+/**
+ * Ajoute du texte à la fin d'un message existant (réception en streaming)
+ * @param {HTMLElement} msg - L'élément du message à compléter
+ * @param {string} text - Le fragment de texte reçu
+ */
+function appendToMessage(msg, text) {
+  const chatBox = document.getElementById("chat-box");
+  msg.textContent += text;
+  chatBox.scrollTop = chatBox.scrollHeight;
 }
 
 /**
@@ -44,6 +57,26 @@ function appendMessage(text, sender) {
 function showLoading(show = true) {
   const loadingEl = document.getElementById("loading");
   loadingEl.style.display = show ? "block" : "none";
+  if (!show) {
+    showQueuePosition(0);
+  }
+}
+
+/**
+ * Affiche la position de l'utilisateur dans la file de génération
+ * @param {number} position - Position dans la file (0 pour masquer)
+ */
+function showQueuePosition(position) {
+  const loadingEl = document.getElementById("loading");
+  let info = document.getElementById("queue-position");
+  if (!info) {
+    if (!position) return;
+    info = document.createElement("div");
+    info.id = "queue-position";
+    info.className = "queue-position";
+    loadingEl.appendChild(info);
+  }
+  info.textContent = position ? `En file d'attente : position ${position}` : "";
 }
 
 /**
@@ -58,6 +91,8 @@ document.addEventListener("DOMContentLoaded", () => {
 // Export des fonctions pour utilisation dans d'autres modules
 window.UI = {
   appendMessage,
+  appendToMessage,
   showLoading,
+  showQueuePosition,
   createParticle
 }; 
\ No newline at end of file